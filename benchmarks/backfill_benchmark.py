@@ -0,0 +1,144 @@
+"""Throughput and Gmail quota use of rule backfills on the local simulator.
+
+Applies a small rule set to a synthetic mailbox three ways:
+- `per_message`: the live path, i.e. `_process_message_ids` over every message.
+- `backfill`: `Backfill` with concurrent fetches and batched modifies.
+- `backfill_crash`: a backfill cancelled after `--crash-after-pages` pages and
+  resumed by a fresh engine over the same state database.
+
+Reports time, throughput, API calls and quota units per method, and whether
+each run left the mailbox's labels the same as the per-message run.
+
+    python benchmarks/backfill_benchmark.py --messages 5000 --api-latency-ms 20 --quota-share 0.25
+"""
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from gmail_backfill import Backfill, BackfillConfig  # noqa: E402
+from gmail_quota import GmailQuotaLimiter  # noqa: E402
+from gmail_rule_daemon import GmailAutomation, GmailRuleEngine  # noqa: E402
+from gmail_simulator import FakeGmailDatabase, FakeGmailService, SimulatorConfig, StubAIService  # noqa: E402
+from gmail_state_db import GmailStateDatabase  # noqa: E402
+
+RULES = [
+    {'name': 'Promotions', 'conditions': {'From': r'deals@'},
+     'actions': [{'type': 'label', 'value': 'Backfill/Promotions'}, {'type': 'archive'}]},
+    {'name': 'Invoices', 'conditions': {'From': r'invoices@', 'Subject': r'^Invoice'},
+     'actions': [{'type': 'star'}]},
+    {'name': 'Digest', 'conditions': {'From': r'newsletter@'},
+     'actions': [{'type': 'mark_read'}]},
+]
+
+
+def labels_digest(service: FakeGmailService) -> str:
+    digest = hashlib.sha256()
+    for message_id, stored in sorted(service.messages.items()):
+        digest.update(f"{message_id}:{','.join(sorted(stored.message['labelIds']))};".encode())
+    return digest.hexdigest()[:16]
+
+
+def build(args: argparse.Namespace, rules_file: str, state: GmailStateDatabase,
+          service: Optional[FakeGmailService] = None) -> Tuple[FakeGmailService, GmailRuleEngine]:
+    service = service or FakeGmailService(SimulatorConfig(
+        num_messages=args.messages, latency=args.api_latency_ms / 1000,
+        latency_jitter=args.api_latency_ms / 4000, page_size=500))
+    gmail = GmailAutomation(
+        credentials_path='', token_path='', ai_service=StubAIService(), db=FakeGmailDatabase(),
+        quota=GmailQuotaLimiter(units_per_second=args.quota_units_per_second, base_delay=0.05),
+        service=service, state=state)
+    engine = GmailRuleEngine(gmail, rules_file)
+    engine.archive_on_arrival = False
+    return service, engine
+
+
+async def run(name: str, args: argparse.Namespace, rules_file: str) -> Tuple[Dict[str, Any], str]:
+    state = GmailStateDatabase(':memory:')
+    service, engine = build(args, rules_file, state)
+    config = BackfillConfig(quota_share=args.quota_share, concurrency=args.concurrency,
+                            report_every=3600)
+    quotas: List[GmailQuotaLimiter] = [engine.gmail.quota]
+    started = time.perf_counter()
+    resumed_at: Optional[int] = None
+    if name == 'per_message':
+        message_ids = list(reversed(list(service.messages)))
+        with engine.gmail.quota.share(args.quota_share):
+            await engine._process_message_ids(message_ids)
+        progress: Dict[str, Any] = {'listed': len(message_ids)}
+    else:
+        backfill = Backfill(engine, config)
+        if name == 'backfill_crash':
+            task = asyncio.create_task(backfill.run())
+            while backfill.progress.pages < args.crash_after_pages and not task.done():
+                await asyncio.sleep(0.001)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            resumed_at = backfill.progress.listed
+            await engine.gmail.close()
+            # A new process: fresh engine, limiter and ledger over the same state
+            service, engine = build(args, rules_file, state, service)
+            quotas.append(engine.gmail.quota)
+            backfill = Backfill(engine, config)
+        await backfill.run()
+        progress = backfill.report()
+    elapsed = time.perf_counter() - started
+    await engine.gmail.close()
+    state.close()
+    units: Dict[str, int] = {}
+    for quota in quotas:
+        for method, used in quota.units_used.items():
+            units[method] = units.get(method, 0) + used
+    return {
+        'run': name,
+        'seconds': round(elapsed, 3),
+        'messages_per_sec': round(progress['listed'] / elapsed, 1) if elapsed else None,
+        'resumed_after_messages': resumed_at,
+        'api_calls': dict(sorted(service.calls.items())),
+        'quota_units': dict(sorted(units.items())),
+        'quota_units_total': sum(units.values()),
+        'progress': progress,
+    }, labels_digest(service)
+
+
+async def main(args: argparse.Namespace) -> None:
+    logging.getLogger().setLevel(args.log_level)
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+        json.dump(RULES, f)
+    results = []
+    baseline = None
+    try:
+        for name in ('per_message', 'backfill', 'backfill_crash'):
+            result, digest = await run(name, args, f.name)
+            baseline = baseline or digest
+            result['same_labels_as_per_message'] = digest == baseline
+            results.append(result)
+    finally:
+        Path(f.name).unlink()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=5000, help="Synthetic mailbox size")
+    parser.add_argument('--api-latency-ms', type=float, default=5.0)
+    parser.add_argument('--quota-units-per-second', type=float, default=250.0,
+                        help="Gmail per-user quota enforced by the limiter")
+    parser.add_argument('--quota-share', type=float, default=1.0,
+                        help="Share of the quota each run may use")
+    parser.add_argument('--concurrency', type=int, default=10, help="Concurrent fetches per page")
+    parser.add_argument('--crash-after-pages', type=int, default=2,
+                        help="Pages the crash run completes before it is cancelled")
+    parser.add_argument('--log-level', default='WARNING')
+    asyncio.run(main(parser.parse_args()))
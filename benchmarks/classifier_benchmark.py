@@ -0,0 +1,114 @@
+"""Offline accuracy and throughput report for the local archive classifier.
+
+Replays stored LLM archive decisions in order: the model is trained on the
+oldest share of the examples and evaluated on the newest, as it would be in
+the daemon. For each confidence threshold it reports how many messages would
+skip the LLM and how often those local decisions agree with it.
+
+    python benchmarks/classifier_benchmark.py --state-db gmail_daemon_state.db --account default
+    python benchmarks/classifier_benchmark.py --synthetic 5000 --label-noise 0.05
+"""
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+import argparse
+import asyncio
+import base64
+import json
+import random
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from gmail_classifier import ArchiveClassifier, ClassifierConfig, evaluate, train  # noqa: E402
+from gmail_simulator import FakeGmailService, SimulatorConfig, StubAIService  # noqa: E402
+from gmail_state_db import GmailStateDatabase  # noqa: E402
+
+Example = Tuple[Dict[str, Any], bool]
+
+
+@dataclass
+class _Message:
+    content: str
+
+
+def _text(payload: Dict[str, Any]) -> str:
+    for part in [payload, *payload.get('parts', [])]:
+        if part.get('mimeType') == 'text/plain' and 'data' in part.get('body', {}):
+            return base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
+        if 'parts' in part and part is not payload:
+            text = _text(part)
+            if text:
+                return text
+    return ''
+
+
+async def synthetic_examples(count: int, label_noise: float, seed: int) -> List[Example]:
+    """Simulator messages labelled by the stub LLM, with a share of labels flipped"""
+    service = FakeGmailService(SimulatorConfig(num_messages=count, seed=seed))
+    ai = StubAIService()
+    rng = random.Random(seed)
+    examples = []
+    for stored in service.messages.values():
+        payload = stored.message['payload']
+        headers = {h['name']: h['value'] for h in payload['headers']}
+        email_data = {
+            'from': headers.get('From', ''),
+            'subject': headers.get('Subject', ''),
+            'body': _text(payload)[:1000],
+            'has_attachments': payload.get('mimeType') == 'multipart/mixed',
+        }
+        completion = await ai.chat_completion([
+            _Message('You are an email importance analyzer.'), _Message(json.dumps(email_data))])
+        decision = json.loads(completion.response)
+        label = decision['can_archive'] and decision['confidence'] >= 0.8
+        if rng.random() < label_noise:
+            label = not label
+        examples.append((email_data, label))
+    return examples
+
+
+async def stored_examples(path: Path, account: str) -> List[Example]:
+    store = GmailStateDatabase(path)
+    try:
+        rows = await store.archive_examples(account)
+    finally:
+        store.close()
+    return [(row['email_data'], row['can_archive']) for row in rows]
+
+
+async def main(args: argparse.Namespace) -> None:
+    if args.synthetic:
+        examples = await synthetic_examples(args.synthetic, args.label_noise, args.seed)
+    else:
+        examples = await stored_examples(args.state_db, args.account)
+    if len(examples) < 10:
+        sys.exit(f"Only {len(examples)} examples; need at least 10")
+    split = int(len(examples) * args.train_fraction)
+    config = ClassifierConfig()
+    model = ArchiveClassifier(config.n_features, config.learning_rate)
+    started = time.perf_counter()
+    senders = train(model, examples[:split], config.n_features)
+    train_seconds = time.perf_counter() - started
+    report = evaluate(model, examples[split:], config.n_features, senders, args.thresholds)
+    report['training_examples'] = split
+    report['archive_share'] = round(sum(label for _, label in examples) / len(examples), 4)
+    report['updates_per_sec'] = round(split / train_seconds) if train_seconds else None
+    report['model_bytes'] = len(model.to_bytes())
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--state-db', type=Path, default=Path('gmail_daemon_state.db'),
+                        help="Daemon state database holding archive decisions")
+    parser.add_argument('--account', default='default')
+    parser.add_argument('--synthetic', type=int, default=0,
+                        help="Evaluate on this many simulator messages instead of stored decisions")
+    parser.add_argument('--label-noise', type=float, default=0.0,
+                        help="Share of synthetic labels to flip")
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--train-fraction', type=float, default=0.8)
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.8, 0.9, 0.95, 0.99])
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,214 @@
+"""End-to-end throughput benchmark for the rule daemon on the local simulator.
+
+Runs `check_new_emails`, `auto_archive_emails` and `process_unsubscribes`
+against `FakeGmailService` with a `StubAIService`, and reports messages/sec,
+Gmail API calls per message, p50/p99 latency per stage and peak memory.
+
+    python benchmarks/engine_benchmark.py --messages 2000 --api-latency-ms 5 --ai-latency-ms 50
+"""
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List
+import argparse
+import asyncio
+import json
+import logging
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx  # noqa: E402
+
+from gmail_rule_daemon import GmailAutomation, GmailRuleEngine  # noqa: E402
+from gmail_quota import GmailQuotaLimiter  # noqa: E402
+from gmail_ai_scheduler import AIScheduler, AISchedulerConfig  # noqa: E402
+from gmail_simulator import FakeGmailDatabase, FakeGmailService, SimulatorConfig, StubAIService  # noqa: E402
+
+
+class StageTimer:
+    """Collect wall-clock durations per named stage"""
+
+    def __init__(self) -> None:
+        self.samples: Dict[str, List[float]] = {}
+
+    def wrap(self, owner: Any, attribute: str, stage: str) -> None:
+        original = getattr(owner, attribute)
+
+        async def timed(*args: Any, **kwargs: Any) -> Any:
+            started = time.perf_counter()
+            try:
+                return await original(*args, **kwargs)
+            finally:
+                self.samples.setdefault(stage, []).append(
+                    time.perf_counter() - started)
+        setattr(owner, attribute, timed)
+
+    def wrap_api(self, gmail: GmailAutomation) -> None:
+        original = gmail.execute
+
+        async def timed(request: Any, method: str) -> Any:
+            started = time.perf_counter()
+            try:
+                return await original(request, method)
+            finally:
+                self.samples.setdefault(f"api:{method}", []).append(
+                    time.perf_counter() - started)
+        gmail.execute = timed  # type: ignore[method-assign]
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        report = {}
+        for stage, samples in sorted(self.samples.items()):
+            ordered = sorted(samples)
+            report[stage] = {
+                'count': len(ordered),
+                'p50_ms': round(statistics.median(ordered) * 1000, 3),
+                'p99_ms': round(ordered[max(0, int(len(ordered) * 0.99) - 1)] * 1000, 3),
+            }
+        return report
+
+
+_AsyncClient = httpx.AsyncClient
+
+
+def _mock_unsubscribe_client(*args: Any, **kwargs: Any) -> httpx.AsyncClient:
+    """httpx client that answers every unsubscribe request locally"""
+    return _AsyncClient(transport=httpx.MockTransport(
+        lambda request: httpx.Response(200, text="You have been unsubscribed")))
+
+
+def build(args: argparse.Namespace):
+    config = SimulatorConfig(
+        num_messages=args.messages,
+        latency=args.api_latency_ms / 1000,
+        latency_jitter=args.api_latency_ms / 4000,
+        rate_limit_probability=args.rate_limit_probability,
+        campaign_probability=args.campaign_probability,
+        churn_per_list=args.churn,
+    )
+    service = FakeGmailService(config)
+    ai = StubAIService(latency=args.ai_latency_ms / 1000)
+    gmail = GmailAutomation(
+        credentials_path='', token_path='', ai_service=ai, db=FakeGmailDatabase(),
+        quota=GmailQuotaLimiter(units_per_second=args.quota_units_per_second, base_delay=0.05),
+        service=service,
+        ai_scheduler=AIScheduler(ai, AISchedulerConfig(
+            max_in_flight=args.ai_max_in_flight, tokens_per_minute=args.ai_tokens_per_minute)))
+    if args.no_campaign_dedup:
+        gmail.campaigns = None
+    engine = GmailRuleEngine(gmail, args.rules_file)
+    engine.archive_on_arrival = not args.no_archive_on_arrival
+    timer = StageTimer()
+    timer.wrap_api(gmail)
+    timer.wrap(engine, 'check_blocked_sender', 'block_check')
+    timer.wrap(engine, '_should_auto_archive', 'archive_check')
+    timer.wrap(engine, 'apply_actions', 'rule_actions')
+    timer.wrap(gmail, 'find_unsubscribe_link', 'unsubscribe_detect')
+    timer.wrap(gmail, 'apply_label', 'apply_label')
+    timer.wrap(ai, 'chat_completion', 'ai_call')
+    return service, ai, engine, timer
+
+
+async def run_scenario(
+    name: str,
+    args: argparse.Namespace,
+    run: Callable[[GmailRuleEngine], Awaitable[Any]],
+    count_messages: Callable[[FakeGmailService], int]
+) -> Dict[str, Any]:
+    service, ai, engine, timer = build(args)
+    expected = count_messages(service)
+    if args.tracemalloc:
+        tracemalloc.start()
+    started = time.perf_counter()
+    result = await run(engine)
+    elapsed = time.perf_counter() - started
+    processed = result if isinstance(result, int) else expected
+    report: Dict[str, Any] = {
+        'scenario': name,
+        'messages': processed,
+        'seconds': round(elapsed, 3),
+        'messages_per_sec': round(processed / elapsed, 1) if elapsed else None,
+        'api_calls': sum(service.calls.values()),
+        'api_calls_per_message': round(sum(service.calls.values()) / processed, 2) if processed else None,
+        'rate_limited': sum(service.rate_limited.values()),
+        'ai_calls': ai.calls,
+        'ai_prompt_tokens': ai.prompt_tokens,
+        'prompt_compression': engine.gmail.compressor.report(),
+        # Replies, forwards and reports still queued when processing finished
+        'outbox': await engine.gmail.state.outbound_counts(engine.gmail.account),
+        'stages': timer.report(),
+        # ru_maxrss is KiB on Linux and bytes on macOS
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss /
+                             (1024 if sys.platform != 'darwin' else 1024 * 1024), 1),
+    }
+    if args.tracemalloc:
+        report['traced_peak_mb'] = round(
+            tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1)
+        tracemalloc.stop()
+    await engine.gmail.close()
+    return report
+
+
+async def check_new_emails(engine: GmailRuleEngine) -> int:
+    engine.last_check_time = '1970-01-01T00:00:00'
+    return await engine.check_new_emails()
+
+
+def inbox_count(service: FakeGmailService) -> int:
+    return sum('INBOX' in s.message['labelIds'] for s in service.messages.values())
+
+
+async def main(args: argparse.Namespace) -> None:
+    logging.getLogger().setLevel(args.log_level)
+    # process_unsubscribes follows unsubscribe links; keep that off the network
+    httpx.AsyncClient = _mock_unsubscribe_client  # type: ignore[misc]
+    scenarios = {
+        'check_new_emails': (check_new_emails, inbox_count),
+        'auto_archive_emails': (
+            lambda engine: engine.gmail.auto_archive_emails(
+                max_emails=args.batch_size),
+            lambda service: min(args.batch_size, inbox_count(service))),
+        'process_unsubscribes': (
+            lambda engine: engine.gmail.process_unsubscribes(
+                'CATEGORY_PROMOTIONS', max_emails=args.batch_size),
+            lambda service: min(args.batch_size, sum(
+                'CATEGORY_PROMOTIONS' in s.message['labelIds'] for s in service.messages.values()))),
+    }
+    results = []
+    for name in args.scenarios:
+        run, count = scenarios[name]
+        results.append(await run_scenario(name, args, run, count))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=1000,
+                        help="Synthetic mailbox size")
+    parser.add_argument('--batch-size', type=int, default=100,
+                        help="max_emails for archive and unsubscribe sweeps")
+    parser.add_argument('--api-latency-ms', type=float, default=0.0)
+    parser.add_argument('--ai-latency-ms', type=float, default=0.0)
+    parser.add_argument('--rate-limit-probability', type=float, default=0.0)
+    parser.add_argument('--ai-max-in-flight', type=int, default=AISchedulerConfig.max_in_flight)
+    parser.add_argument('--ai-tokens-per-minute', type=float, default=AISchedulerConfig.tokens_per_minute,
+                        help="Token budget enforced by the AI scheduler")
+    parser.add_argument('--quota-units-per-second', type=float, default=250.0,
+                        help="Gmail per-user quota enforced by the limiter")
+    parser.add_argument('--churn', type=int, default=0,
+                        help="Label changes applied per messages.list call")
+    parser.add_argument('--campaign-probability', type=float, default=0.0,
+                        help="Share of bulk mail that is a personalized copy of a campaign")
+    parser.add_argument('--no-campaign-dedup', action='store_true',
+                        help="Ask the AI about every campaign copy instead of reusing results")
+    parser.add_argument('--rules-file', default='email_rules.json')
+    parser.add_argument('--scenarios', nargs='+', default=['check_new_emails', 'auto_archive_emails', 'process_unsubscribes'],
+                        choices=['check_new_emails', 'auto_archive_emails', 'process_unsubscribes'])
+    parser.add_argument('--no-archive-on-arrival', action='store_true',
+                        help="Skip the per-message AI archive check so header-only rules use metadata fetches")
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help="Also report Python heap peak per scenario (slower)")
+    parser.add_argument('--log-level', default='WARNING')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,136 @@
+"""Memory and CPU per message: raw API responses versus `GmailMessage` records.
+
+Fetches a page of full messages from the simulator, each JSON-decoded fresh
+the way a transport returns it, and measures with tracemalloc how much
+memory a page of them retains:
+- `response`: the response dicts, as the processing path used to hold them.
+- `record`: `GmailMessage` records built from the responses, which are then dropped.
+- `record_decoded`: the same records after every body has been read.
+
+Also times the per-message work of the old path (the header dict built
+separately by the block check, rule matching and archive check, plus the
+body decode) against building a record and reading its body.
+
+    python benchmarks/message_benchmark.py --messages 500 --extra-headers 25
+"""
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+import argparse
+import base64
+import gc
+import json
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from gmail_message import GmailMessage  # noqa: E402
+from gmail_simulator import FakeGmailService, SimulatorConfig  # noqa: E402
+
+
+def fetch_page(service: FakeGmailService, extra_headers: int) -> List[str]:
+    """Serialized responses; each is decoded fresh, as a transport hands them back"""
+    page = []
+    for stored in service.messages.values():
+        message = stored.message
+        if extra_headers:
+            # Real mail also carries Received, DKIM and ARC trace headers
+            trace = [{'name': 'Received' if n % 3 == 0 else f"X-Trace-{n % 12}",
+                      'value': f"from relay{n}.example.net by mx.example.com; {'x' * 60}"}
+                     for n in range(extra_headers)]
+            message = {**message, 'payload': {
+                **message['payload'], 'headers': trace + message['payload']['headers']}}
+        page.append(json.dumps(message))
+    return page
+
+
+def retained(build: Callable[[], Any]) -> int:
+    """Bytes still allocated by what `build` returns"""
+    gc.collect()
+    tracemalloc.start()
+    kept = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size
+
+
+def old_path(response: Dict[str, Any]) -> int:
+    payload = response['payload']
+    size = 0
+    # block check, rule matching and archive check each rebuilt the headers
+    for _ in range(3):
+        headers = {h['name']: h['value'] for h in payload['headers']}
+        size += len(headers)
+    if 'data' in payload['body']:
+        size += len(base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8'))
+    else:
+        for part in payload.get('parts', []):
+            if part.get('mimeType') == 'text/plain' and 'data' in part['body']:
+                size += len(base64.urlsafe_b64decode(part['body']['data']).decode('utf-8'))
+                break
+    return size
+
+
+def new_path(response: Dict[str, Any]) -> int:
+    message = GmailMessage(response)
+    part = message.text_part()
+    return len(message.headers) + (len(part.text()) if part else 0)
+
+
+def timed(work: Callable[[Dict[str, Any]], int], raw: List[str], repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        responses = [json.loads(r) for r in raw]
+        started = time.perf_counter()
+        for response in responses:
+            work(response)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main(args: argparse.Namespace) -> None:
+    service = FakeGmailService(SimulatorConfig(
+        num_messages=args.messages, attachment_probability=args.attachment_probability))
+    raw = fetch_page(service, args.extra_headers)
+
+    def records() -> List[GmailMessage]:
+        return [GmailMessage(json.loads(r)) for r in raw]
+
+    def decoded() -> List[GmailMessage]:
+        page = records()
+        for message in page:
+            part = message.text_part()
+            if part is not None:
+                part.text()
+        return page
+
+    sizes = {
+        'response': retained(lambda: [json.loads(r) for r in raw]),
+        'record': retained(records),
+        'record_decoded': retained(decoded),
+    }
+    old_seconds = timed(old_path, raw, args.repeat)
+    new_seconds = timed(new_path, raw, args.repeat)
+    print(json.dumps({
+        'messages': len(raw),
+        'json_bytes_per_message': round(sum(map(len, raw)) / len(raw)),
+        'retained_bytes_per_message': {name: round(size / len(raw)) for name, size in sizes.items()},
+        'record_vs_response': round(sizes['record_decoded'] / sizes['response'], 3),
+        'us_per_message': {
+            'response': round(old_seconds / len(raw) * 1e6, 1),
+            'record': round(new_seconds / len(raw) * 1e6, 1),
+        },
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=500, help="Messages in the page")
+    parser.add_argument('--attachment-probability', type=float, default=SimulatorConfig.attachment_probability)
+    parser.add_argument('--extra-headers', type=int, default=0,
+                        help="Trace headers added to each message; real mail has 20 or more")
+    parser.add_argument('--repeat', type=int, default=5, help="Timing runs; the best is reported")
+    main(parser.parse_args())
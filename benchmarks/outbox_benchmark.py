@@ -0,0 +1,104 @@
+"""Outbox recovery after a restart: rows saved by a previous run get sent.
+
+The first run leaves replies in the outbox table of a state database file
+the way a crash or shutdown does: `pending`, some waiting for a retry,
+plus one `sending` row that was in flight. A second `GmailAutomation`
+then starts on the same file, nothing new is enqueued, and the engine
+runs its first poll over an empty mailbox. Reports how long the saved
+rows took to drain and the final status counts.
+
+Exits with status 1 unless every pending row was sent without a new
+enqueue, and the interrupted row was marked failed rather than resent.
+
+    python benchmarks/outbox_benchmark.py --rows 20
+"""
+from pathlib import Path
+from typing import Any, Dict
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from gmail_outbox import Outbox, OutboxConfig, build_message, encode_message  # noqa: E402
+from gmail_quota import GmailQuotaLimiter  # noqa: E402
+from gmail_rule_daemon import GmailAutomation, GmailRuleEngine  # noqa: E402
+from gmail_simulator import FakeGmailDatabase, FakeGmailService, SimulatorConfig, StubAIService  # noqa: E402
+from gmail_state_db import GmailStateDatabase  # noqa: E402
+
+
+async def first_run(path: Path, rows: int) -> None:
+    """Leave rows queued as a run that stopped before sending them would"""
+    state = GmailStateDatabase(path)
+    for index in range(rows):
+        raw = encode_message(build_message('someone@example.com', f"Re: {index}", 'Thanks'))
+        await state.enqueue_outbound('default', f"reply:saved-{index}", 'reply', raw, None, False)
+    # Every third row already failed once and is due for its retry
+    await state.pool.write(lambda conn: conn.execute(
+        "UPDATE outbox SET attempts = 1, next_attempt_at = ? "
+        "WHERE account = 'default' AND CAST(SUBSTR(dedup_key, 13) AS INTEGER) % 3 = 0",
+        (time.time(),)))
+    raw = encode_message(build_message('someone@example.com', 'Re: in flight', 'Thanks'))
+    await state.enqueue_outbound('default', 'reply:in-flight', 'reply', raw, None, False)
+    await state.pool.write(lambda conn: conn.execute(
+        "UPDATE outbox SET status = 'sending' WHERE dedup_key = 'reply:in-flight'"))
+    state.close()
+
+
+async def restart(args: argparse.Namespace, path: Path) -> Dict[str, Any]:
+    service = FakeGmailService(SimulatorConfig(num_messages=0))
+    state = GmailStateDatabase(path)
+    gmail = GmailAutomation(
+        credentials_path='', token_path='', ai_service=StubAIService(), db=FakeGmailDatabase(),
+        service=service, state=state,
+        quota=GmailQuotaLimiter(units_per_second=args.quota_units_per_second, base_delay=0.05))
+    gmail.outbox = Outbox(gmail, OutboxConfig(sends_per_minute=args.sends_per_minute, burst=args.burst))
+    engine = GmailRuleEngine(gmail, args.rules_file)
+    started = time.perf_counter()
+    await engine.check_new_emails()
+    counts: Dict[str, int] = {}
+    while time.perf_counter() - started < args.timeout:
+        counts = await state.outbound_counts('default')
+        if not counts.get('pending') and not counts.get('sending'):
+            break
+        await asyncio.sleep(0.01)
+    drained = time.perf_counter() - started
+    await gmail.close()
+    state.close()
+    return {
+        'drain_seconds': round(drained, 3),
+        'messages_sent': service.calls.get('messages.send', 0),
+        'outbox': counts,
+    }
+
+
+async def main(args: argparse.Namespace) -> int:
+    logging.getLogger().setLevel(args.log_level)
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / 'gmail_daemon_state.db'
+        await first_run(path, args.rows)
+        report = await restart(args, path)
+    report['saved_rows'] = args.rows
+    print(json.dumps(report, indent=2))
+    ok = (report['messages_sent'] == args.rows and report['outbox'].get('sent') == args.rows
+          and report['outbox'].get('failed') == 1)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20, help="Replies left pending by the first run")
+    parser.add_argument('--sends-per-minute', type=float, default=6000.0,
+                        help="Outbox send rate; the default keeps the run short")
+    parser.add_argument('--burst', type=int, default=20)
+    parser.add_argument('--quota-units-per-second', type=float, default=10_000.0,
+                        help="Gmail per-user quota enforced by the limiter; messages.send costs 100")
+    parser.add_argument('--timeout', type=float, default=30.0,
+                        help="Seconds to wait for the saved rows to drain")
+    parser.add_argument('--rules-file', default='email_rules.json')
+    parser.add_argument('--log-level', default='WARNING')
+    sys.exit(asyncio.run(main(parser.parse_args())))
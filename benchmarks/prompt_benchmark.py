@@ -0,0 +1,109 @@
+"""Bytes and tokens saved by prompt compression, per task.
+
+Compresses every message of an mbox (or a synthetic corpus of newsletters,
+reply chains and notifications) for each AI task, and reports input and
+output sizes, the share of tokens saved and the time per message.
+
+    python benchmarks/prompt_benchmark.py --synthetic 2000
+    python benchmarks/prompt_benchmark.py --mbox ~/Takeout/Mail/All\\ mail.mbox --limit 5000
+"""
+from email import policy
+from pathlib import Path
+from typing import Iterator, List, Tuple
+import argparse
+import email
+import json
+import mailbox
+import random
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from gmail_prompt_compression import DEFAULT_BUDGETS, TOKENIZER, PromptCompressor  # noqa: E402
+
+# (body, is_html)
+Body = Tuple[str, bool]
+
+_WORDS = ("meeting project invoice update offer sale account review schedule report "
+          "please team thanks today order shipping delivery weekly team launch").split()
+
+
+def _sentence(rng: random.Random, words: int = 14) -> str:
+    return ' '.join(rng.choice(_WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def synthetic_bodies(count: int, seed: int) -> Iterator[Body]:
+    """Newsletters with CSS, pixels and footers; reply chains with quotes and signatures"""
+    rng = random.Random(seed)
+    for index in range(count):
+        kind = index % 3
+        domain = f"sender{rng.randrange(40)}.example.com"
+        if kind == 0:
+            links = ''.join(
+                f'<a href="https://click.{domain}/track/{rng.getrandbits(128):032x}?utm_source=email'
+                f'&utm_campaign={rng.getrandbits(64):016x}">{_sentence(rng, 3)}</a><br>' for _ in range(6))
+            yield (f"<html><head><style>{'td { padding: 4px; font-family: Arial; } ' * 30}</style></head>"
+                   f"<body><table><tr><td><p>{_sentence(rng)} {_sentence(rng)}</p>{links}</td></tr></table>"
+                   f'<img src="https://{domain}/open/{rng.getrandbits(96):024x}.gif" width="1" height="1">'
+                   f"<p>You are receiving this email because you subscribed at {domain}. "
+                   f"Our mailing address is 1 Example Street, Springfield.</p>"
+                   f'<p><a href="https://{domain}/unsubscribe?u={index}">Unsubscribe</a></p></body></html>', True)
+        elif kind == 1:
+            quoted = '\n'.join(f"> {_sentence(rng)}" for _ in range(rng.randint(10, 40)))
+            yield (f"Hi,\n\n{_sentence(rng)} {_sentence(rng)}\n\n{_sentence(rng)}\n\n"
+                   f"Thanks,\nAlex\n-- \nAlex Example | Product Lead | +1 555 0100\n"
+                   f"This email and any attachments are confidential and intended solely for the addressee.\n\n"
+                   f"On Mon, 1 Jan 2024 at 10:00, Sam <sam@{domain}> wrote:\n{quoted}\n", False)
+        else:
+            yield (f"Your order #{rng.randrange(10 ** 6)} has shipped.\n\n\n\n"
+                   f"Track it at https://{domain}/orders/track?id={rng.getrandbits(160):040x}&ref=email\n\n"
+                   f"{_sentence(rng)}\n\n"
+                   f"This is an automated message from {domain}. Please do not reply to this email address.\n", False)
+
+
+def mbox_bodies(path: Path, limit: int) -> Iterator[Body]:
+    messages = mailbox.mbox(path, factory=lambda f: email.message_from_binary_file(f, policy=policy.default))
+    for count, message in enumerate(messages):
+        if count >= limit:
+            return
+        part = message.get_body(preferencelist=('plain', 'html'))
+        if part is None:
+            continue
+        try:
+            yield part.get_content(), part.get_content_subtype() == 'html'
+        except (LookupError, UnicodeDecodeError):
+            continue
+
+
+def main(args: argparse.Namespace) -> None:
+    if args.mbox:
+        bodies: List[Body] = list(mbox_bodies(args.mbox, args.limit))
+    else:
+        bodies = list(synthetic_bodies(args.synthetic, args.seed))
+    compressor = PromptCompressor()
+    seconds = {}
+    for task in DEFAULT_BUDGETS:
+        keep_links = task == 'unsubscribe_detect'
+        started = time.perf_counter()
+        for body, is_html in bodies:
+            compressor.compress(task, body, html=is_html, keep_links=keep_links)
+        seconds[task] = time.perf_counter() - started
+    report = compressor.report()
+    for task, stats in report.items():
+        stats['us_per_message'] = round(1e6 * seconds[task] / len(bodies), 1) if bodies else None
+    print(json.dumps({
+        'messages': len(bodies),
+        'tokenizer': TOKENIZER,
+        'tasks': report,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mbox', type=Path, default=None, help="Compress the messages of this mbox")
+    parser.add_argument('--limit', type=int, default=5000, help="Messages read from --mbox")
+    parser.add_argument('--synthetic', type=int, default=1500,
+                        help="Synthetic messages to compress without --mbox")
+    parser.add_argument('--seed', type=int, default=7)
+    main(parser.parse_args())
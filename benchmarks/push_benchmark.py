@@ -0,0 +1,150 @@
+"""Latency from a Pub/Sub push to the rule engine processing the new mail.
+
+Starts a `PushListener` on a local port, with a verification token, in
+front of a `GmailRuleEngine` over the simulator. Each round delivers new
+messages to the simulated mailbox and publishes the mailbox's history ID
+through `LocalPubSubPublisher`, the way Pub/Sub would. It then waits
+until every delivered message has been processed. Reports:
+- `ack_ms`: until the listener answers the push request.
+- `processed_ms`: until the last delivered message has been processed.
+- the status a push with the wrong token gets, which must be 403 and
+  must not reach the engine.
+
+Exits with status 1 if a push is rejected, a delivered message is not
+processed, or the wrong token is accepted.
+
+    python benchmarks/push_benchmark.py --rounds 50 --messages-per-push 3 --api-latency-ms 5
+"""
+from pathlib import Path
+from typing import Any, Dict, List, Set
+import argparse
+import asyncio
+import json
+import logging
+import socket
+import statistics
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from gmail_message import GmailMessage  # noqa: E402
+from gmail_push import PUSH_PATH, GmailNotification, LocalPubSubPublisher, PushConfig, PushListener  # noqa: E402
+from gmail_quota import GmailQuotaLimiter  # noqa: E402
+from gmail_rule_daemon import GmailAutomation, GmailRuleEngine  # noqa: E402
+from gmail_simulator import FakeGmailDatabase, FakeGmailService, SimulatorConfig, StubAIService  # noqa: E402
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    return {
+        'p50_ms': round(statistics.median(ordered) * 1000, 2),
+        'p99_ms': round(ordered[max(0, int(len(ordered) * 0.99) - 1)] * 1000, 2),
+        'max_ms': round(ordered[-1] * 1000, 2),
+    }
+
+
+async def main(args: argparse.Namespace) -> int:
+    logging.getLogger().setLevel(args.log_level)
+    service = FakeGmailService(SimulatorConfig(
+        num_messages=args.mailbox, latency=args.api_latency_ms / 1000))
+    gmail = GmailAutomation(
+        credentials_path='', token_path='', ai_service=StubAIService(latency=args.ai_latency_ms / 1000),
+        db=FakeGmailDatabase(), service=service,
+        quota=GmailQuotaLimiter(units_per_second=args.quota_units_per_second, base_delay=0.05))
+    engine = GmailRuleEngine(gmail, args.rules_file)
+    await engine.start_push()
+
+    processed: Set[str] = set()
+    changed = asyncio.Event()
+    original = engine.process_message
+
+    async def record(message: GmailMessage) -> None:
+        await original(message)
+        processed.add(message.id)
+        changed.set()
+    engine.process_message = record  # type: ignore[method-assign]
+
+    handled = 0
+
+    async def handle(notification: GmailNotification) -> None:
+        nonlocal handled
+        handled += 1
+        await engine.process_history(notification.history_id)
+
+    token = 'local-token'
+    config = PushConfig(port=free_port(), verification_token=token)
+    listener = PushListener(config, handle)
+    await listener.start()
+    endpoint = f"http://{config.host}:{config.port}{PUSH_PATH}"
+    publisher = LocalPubSubPublisher(endpoint, token)
+
+    acks: List[float] = []
+    latencies: List[float] = []
+    rejected = 0
+    missed = 0
+    try:
+        for _ in range(args.rounds):
+            delivered = set(service.deliver(args.messages_per_push))
+            started = time.perf_counter()
+            status = await publisher.publish('me@example.com', service.history_id)
+            acks.append(time.perf_counter() - started)
+            if status != 204:
+                rejected += 1
+                continue
+            try:
+                while not delivered <= processed:
+                    changed.clear()
+                    await asyncio.wait_for(changed.wait(), timeout=args.timeout)
+            except asyncio.TimeoutError:
+                missed += len(delivered - processed)
+                continue
+            latencies.append(time.perf_counter() - started)
+
+        handled_before = handled
+        service.deliver(1)
+        bad_status = await LocalPubSubPublisher(endpoint, 'wrong-token').publish(
+            'me@example.com', service.history_id)
+        # Give a wrongly accepted push the chance to reach the handler
+        await asyncio.sleep(0.2)
+        bad_token_reached_engine = handled > handled_before
+    finally:
+        await listener.stop()
+        await gmail.close()
+
+    report: Dict[str, Any] = {
+        'rounds': args.rounds,
+        'messages_per_push': args.messages_per_push,
+        'ack': percentiles(acks),
+        'processed': percentiles(latencies) if latencies else None,
+        'rejected_pushes': rejected,
+        'unprocessed_messages': missed,
+        'bad_token_status': bad_status,
+        'bad_token_reached_engine': bad_token_reached_engine,
+    }
+    print(json.dumps(report, indent=2))
+    ok = not rejected and not missed and bad_status == 403 and not bad_token_reached_engine
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=50, help="Pushes to publish")
+    parser.add_argument('--messages-per-push', type=int, default=3,
+                        help="Messages delivered to the mailbox before each push")
+    parser.add_argument('--mailbox', type=int, default=100, help="Messages already in the mailbox")
+    parser.add_argument('--api-latency-ms', type=float, default=0.0)
+    parser.add_argument('--ai-latency-ms', type=float, default=0.0)
+    parser.add_argument('--quota-units-per-second', type=float, default=10_000.0,
+                        help="Gmail per-user quota enforced by the limiter")
+    parser.add_argument('--timeout', type=float, default=30.0,
+                        help="Seconds to wait for a push's messages to be processed")
+    parser.add_argument('--rules-file', default='email_rules.json')
+    parser.add_argument('--log-level', default='WARNING')
+    sys.exit(asyncio.run(main(parser.parse_args())))
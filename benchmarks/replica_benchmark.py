@@ -0,0 +1,125 @@
+"""Two daemon replicas polling one mailbox, with and without shared state.
+
+Each replica has its own `GmailAutomation`, rule engine and in-memory state
+database, as it would on its own host, and both run `check_new_emails`
+over the same `FakeGmailService` at the same time:
+- `local`: each replica keeps its caches and ledger to itself.
+- `shared`: both use a `RedisSharedState` over one `FakeRedis`.
+
+Reports the messages each replica processed, how many were processed by
+both, and the `labels.list` and AI calls made in total. A second poll after
+new mail arrives shows the warm caches.
+
+    python benchmarks/replica_benchmark.py --messages 500 --replicas 2
+"""
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from gmail_ai_scheduler import AIScheduler, AISchedulerConfig  # noqa: E402
+from gmail_message import GmailMessage  # noqa: E402
+from gmail_quota import GmailQuotaLimiter  # noqa: E402
+from gmail_rule_daemon import GmailAutomation, GmailRuleEngine  # noqa: E402
+from gmail_shared_state import RedisSharedState  # noqa: E402
+from gmail_simulator import FakeGmailDatabase, FakeGmailService, FakeRedis, SimulatorConfig, StubAIService  # noqa: E402
+
+
+def build_replica(
+    args: argparse.Namespace,
+    service: FakeGmailService,
+    ai: StubAIService,
+    redis: Optional[FakeRedis],
+    processed: Set[str]
+) -> GmailRuleEngine:
+    shared = RedisSharedState(redis) if redis is not None else None
+    gmail = GmailAutomation(
+        credentials_path='', token_path='', ai_service=ai, db=FakeGmailDatabase(),
+        quota=GmailQuotaLimiter(units_per_second=args.quota_units_per_second, base_delay=0.05),
+        service=service, shared=shared,
+        ai_scheduler=AIScheduler(ai, AISchedulerConfig(
+            max_in_flight=args.ai_max_in_flight, tokens_per_minute=args.ai_tokens_per_minute)))
+    engine = GmailRuleEngine(gmail, args.rules_file)
+    engine.last_check_time = '1970-01-01T00:00:00'
+    original = engine.process_message
+
+    async def record(message: GmailMessage) -> None:
+        processed.add(message.id)
+        await original(message)
+    engine.process_message = record  # type: ignore[method-assign]
+    return engine
+
+
+async def poll(engines: List[GmailRuleEngine], service: FakeGmailService, ai: StubAIService,
+               processed: List[Set[str]]) -> Dict[str, Any]:
+    service.reset_counters()
+    calls_before = ai.calls
+    for ids in processed:
+        ids.clear()
+    started = time.perf_counter()
+    await asyncio.gather(*(engine.check_new_emails() for engine in engines))
+    elapsed = time.perf_counter() - started
+    seen: Set[str] = set()
+    duplicates = 0
+    for ids in processed:
+        duplicates += len(ids & seen)
+        seen |= ids
+    return {
+        'seconds': round(elapsed, 3),
+        'processed_per_replica': [len(ids) for ids in processed],
+        'distinct_messages': len(seen),
+        'processed_more_than_once': duplicates,
+        'labels_list_calls': service.calls.get('labels.list', 0),
+        'api_calls': sum(service.calls.values()),
+        'ai_calls': ai.calls - calls_before,
+    }
+
+
+async def run(args: argparse.Namespace, mode: str) -> Dict[str, Any]:
+    service = FakeGmailService(SimulatorConfig(
+        num_messages=args.messages, latency=args.api_latency_ms / 1000,
+        campaign_probability=args.campaign_probability))
+    ai = StubAIService(latency=args.ai_latency_ms / 1000)
+    redis = FakeRedis() if mode == 'shared' else None
+    processed: List[Set[str]] = [set() for _ in range(args.replicas)]
+    engines = [build_replica(args, service, ai, redis, ids) for ids in processed]
+    cold = await poll(engines, service, ai, processed)
+    service.deliver(args.new_messages)
+    warm = await poll(engines, service, ai, processed)
+    for engine in engines:
+        await engine.gmail.close()
+    report = {'mode': mode, 'cold': cold, 'warm': warm}
+    if redis is not None:
+        report['redis_round_trips'] = redis.round_trips
+    return report
+
+
+async def main(args: argparse.Namespace) -> None:
+    logging.getLogger().setLevel(args.log_level)
+    print(json.dumps([await run(args, mode) for mode in ('local', 'shared')], indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=500, help="Synthetic mailbox size")
+    parser.add_argument('--new-messages', type=int, default=50,
+                        help="Mail delivered between the cold and the warm poll")
+    parser.add_argument('--replicas', type=int, default=2)
+    parser.add_argument('--api-latency-ms', type=float, default=2.0)
+    parser.add_argument('--ai-latency-ms', type=float, default=5.0)
+    parser.add_argument('--ai-max-in-flight', type=int, default=AISchedulerConfig.max_in_flight)
+    parser.add_argument('--ai-tokens-per-minute', type=float, default=AISchedulerConfig.tokens_per_minute,
+                        help="Token budget enforced by each replica's AI scheduler")
+    parser.add_argument('--campaign-probability', type=float, default=0.0,
+                        help="Share of bulk mail that is a personalized copy of a campaign")
+    parser.add_argument('--quota-units-per-second', type=float, default=10_000.0,
+                        help="Gmail per-user quota enforced by each replica's limiter")
+    parser.add_argument('--rules-file', default='email_rules.json')
+    parser.add_argument('--log-level', default='WARNING')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,130 @@
+"""Cost and latency of tiered model routing on the local simulator.
+
+Runs `auto_archive_emails` and `process_unsubscribes` twice: once with every
+task sent to the large model and once with the routes in `--routes`, where the
+local tier is a `LocalModelServer` speaking the Ollama protocol. Reports calls,
+latency, escalations and estimated cost per tier for each run.
+
+    python benchmarks/routing_benchmark.py --messages 1000 --large-latency-ms 400 --local-latency-ms 30
+    python benchmarks/routing_benchmark.py --local-down
+"""
+from pathlib import Path
+from typing import Any, Dict
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx  # noqa: E402
+
+from gmail_rule_daemon import GmailAutomation  # noqa: E402
+from gmail_model_router import LocalModelServer, ModelRouter, default_routing_config, load_routing_config  # noqa: E402
+from gmail_quota import GmailQuotaLimiter  # noqa: E402
+from gmail_simulator import FakeGmailDatabase, FakeGmailService, SimulatorConfig, StubAIService  # noqa: E402
+
+_AsyncClient = httpx.AsyncClient
+
+
+def _mock_unsubscribe_client(*args: Any, **kwargs: Any) -> httpx.AsyncClient:
+    """httpx client that answers every unsubscribe request locally"""
+    return _AsyncClient(transport=httpx.MockTransport(
+        lambda request: httpx.Response(200, text="You have been unsubscribed")))
+
+
+def local_answerer(args: argparse.Namespace):
+    """Stub answers degraded like a small model: some uncertain, some not JSON"""
+    stub = StubAIService(seed=args.seed)
+    rng = random.Random(args.seed)
+
+    async def answer(system: str, prompt: str) -> str:
+        response = stub._answer(system, prompt)
+        roll = rng.random()
+        if roll < args.local_garble_rate:
+            return "Sure! Here is my analysis: " + response[:40]
+        if roll < args.local_garble_rate + args.local_uncertain_rate:
+            try:
+                decision = json.loads(response)
+            except json.JSONDecodeError:
+                return response
+            decision['confidence'] = 0.5
+            return json.dumps(decision)
+        return response
+    return answer
+
+
+async def run(name: str, args: argparse.Namespace, tiered: bool) -> Dict[str, Any]:
+    service = FakeGmailService(SimulatorConfig(num_messages=args.messages, seed=args.seed))
+    large = StubAIService(latency=args.large_latency_ms / 1000, seed=args.seed)
+    server = None
+    if tiered:
+        config = load_routing_config(args.routes)
+        server = LocalModelServer(local_answerer(args), latency=args.local_latency_ms / 1000)
+        await server.start()
+        for tier in config.tiers.values():
+            if tier.provider == 'ollama':
+                # A port nothing listens on stands in for a stopped Ollama
+                tier.url = 'http://127.0.0.1:9/api/generate' if args.local_down else server.url
+        router = ModelRouter.build(config, lambda model: large)
+    else:
+        router = ModelRouter(default_routing_config(), {'large': large})
+        # Price the baseline like the routed run's large tier
+        router.config.tiers['large'].cost_per_1k_tokens = \
+            load_routing_config(args.routes).tiers['large'].cost_per_1k_tokens
+    gmail = GmailAutomation(
+        credentials_path='', token_path='', ai_service=large, db=FakeGmailDatabase(),
+        quota=GmailQuotaLimiter(units_per_second=args.quota_units_per_second, base_delay=0.05),
+        service=service, ai_router=router)
+    # process_unsubscribes follows unsubscribe links; keep that off the network.
+    # Patched after the router is built so the local tier keeps a real client.
+    httpx.AsyncClient = _mock_unsubscribe_client  # type: ignore[misc]
+    started = time.perf_counter()
+    try:
+        await gmail.auto_archive_emails(max_emails=args.batch_size)
+        await gmail.process_unsubscribes('CATEGORY_PROMOTIONS', max_emails=args.batch_size)
+    finally:
+        elapsed = time.perf_counter() - started
+        httpx.AsyncClient = _AsyncClient  # type: ignore[misc]
+        await gmail.close()
+        await router.close()
+        if server:
+            await server.stop()
+    tiers = router.report()
+    return {
+        'run': name,
+        'seconds': round(elapsed, 3),
+        'large_calls': large.calls,
+        'cost_usd': round(sum(tier['cost_usd'] for tier in tiers.values()), 4),
+        'tiers': tiers,
+    }
+
+
+async def main(args: argparse.Namespace) -> None:
+    logging.getLogger().setLevel(args.log_level)
+    results = [await run('large_only', args, tiered=False),
+               await run('tiered', args, tiered=True)]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=1000, help="Synthetic mailbox size")
+    parser.add_argument('--batch-size', type=int, default=200,
+                        help="max_emails for archive and unsubscribe sweeps")
+    parser.add_argument('--routes', type=Path, default=Path('scripts/model_routes.example.json'))
+    parser.add_argument('--large-latency-ms', type=float, default=400.0)
+    parser.add_argument('--local-latency-ms', type=float, default=30.0)
+    parser.add_argument('--local-uncertain-rate', type=float, default=0.1,
+                        help="Share of local answers given with low confidence")
+    parser.add_argument('--local-garble-rate', type=float, default=0.05,
+                        help="Share of local answers that are not valid JSON")
+    parser.add_argument('--local-down', action='store_true',
+                        help="Point the local tier at a closed port to exercise the fallback")
+    parser.add_argument('--quota-units-per-second', type=float, default=250.0)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--log-level', default='WARNING')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,115 @@
+"""Throughput of message-sharded workers against the number of workers.
+
+Mirrors `--workers N --shard-by message`: N spawned processes each run a
+`GmailRuleEngine` that owns one message-ID hash range of the same mailbox.
+Each worker builds the simulated mailbox from the same seed, so all of
+them see the same messages, and processes the ones its shard owns. The
+report gives the wall time from the common start signal until the last
+worker finishes, the total messages/sec and the speedup over one worker.
+
+With API and AI latency the work is mostly waiting, so it scales past the
+number of CPUs; with no latency it is bounded by the CPUs available. Each
+worker has its own AI scheduler, as supervisor workers do, so with the
+default token budget one worker is limited by its budget rather than by
+the work; raise `--ai-tokens-per-minute` to measure the workers alone.
+
+    python benchmarks/shard_benchmark.py --messages 1000 --workers 1 2 4 --api-latency-ms 5
+"""
+from pathlib import Path
+from typing import Any, Dict, List
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from gmail_ai_scheduler import AISchedulerConfig  # noqa: E402
+
+
+def _worker(args: Dict[str, Any], index: int, count: int, ready: Any, start: Any, results: Any) -> None:
+    sys.path.insert(0, str(ROOT))
+    from gmail_ai_scheduler import AIScheduler
+    from gmail_quota import GmailQuotaLimiter
+    from gmail_rule_daemon import GmailAutomation, GmailRuleEngine
+    from gmail_simulator import FakeGmailDatabase, FakeGmailService, SimulatorConfig, StubAIService
+    # Importing the daemon configures logging; quiet it again in this process
+    logging.getLogger().setLevel(args['log_level'])
+
+    async def run() -> Dict[str, Any]:
+        service = FakeGmailService(SimulatorConfig(
+            num_messages=args['messages'], latency=args['api_latency_ms'] / 1000))
+        ai = StubAIService(latency=args['ai_latency_ms'] / 1000)
+        gmail = GmailAutomation(
+            credentials_path='', token_path='', ai_service=ai, db=FakeGmailDatabase(), service=service,
+            quota=GmailQuotaLimiter(units_per_second=args['quota_units_per_second'], base_delay=0.05),
+            ai_scheduler=AIScheduler(ai, AISchedulerConfig(
+                max_in_flight=args['ai_max_in_flight'], tokens_per_minute=args['ai_tokens_per_minute'])))
+        engine = GmailRuleEngine(gmail, args['rules_file'], shard=(index, count))
+        message_ids = [m for m, s in service.messages.items() if 'INBOX' in s.message['labelIds']]
+        ready.put(index)
+        start.wait()
+        started = time.time()
+        processed = await engine._process_message_ids(message_ids)
+        finished = time.time()
+        await gmail.close()
+        return {'processed': processed, 'started': started, 'finished': finished}
+
+    results.put(asyncio.run(run()))
+
+
+def measure(args: argparse.Namespace, workers: int) -> Dict[str, Any]:
+    ctx = multiprocessing.get_context('spawn')
+    ready = ctx.Queue()
+    start = ctx.Event()
+    results = ctx.Queue()
+    processes = [ctx.Process(target=_worker, args=(vars(args), i, workers, ready, start, results))
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+    # Imports and mailbox generation are not timed
+    for _ in processes:
+        ready.get()
+    start.set()
+    runs: List[Dict[str, Any]] = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    seconds = max(r['finished'] for r in runs) - min(r['started'] for r in runs)
+    processed = sum(r['processed'] for r in runs)
+    return {
+        'workers': workers,
+        'messages': processed,
+        'per_worker': [r['processed'] for r in runs],
+        'seconds': round(seconds, 3),
+        'messages_per_sec': round(processed / seconds, 1) if seconds else None,
+    }
+
+
+def main(args: argparse.Namespace) -> None:
+    results = [measure(args, workers) for workers in args.workers]
+    baseline = results[0]['messages_per_sec']
+    for result in results:
+        result['speedup'] = round(result['messages_per_sec'] / baseline, 2) if baseline else None
+    print(json.dumps({'cpus': os.cpu_count(), 'results': results}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=1000, help="Synthetic mailbox size")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4],
+                        help="Worker counts to measure; the first is the speedup baseline")
+    parser.add_argument('--api-latency-ms', type=float, default=5.0)
+    parser.add_argument('--ai-latency-ms', type=float, default=20.0)
+    parser.add_argument('--ai-max-in-flight', type=int, default=AISchedulerConfig.max_in_flight)
+    parser.add_argument('--ai-tokens-per-minute', type=float, default=AISchedulerConfig.tokens_per_minute,
+                        help="Token budget enforced by each worker's AI scheduler")
+    parser.add_argument('--quota-units-per-second', type=float, default=10_000.0,
+                        help="Gmail per-user quota enforced by each worker's limiter")
+    parser.add_argument('--rules-file', default='email_rules.json')
+    parser.add_argument('--log-level', default='WARNING')
+    main(parser.parse_args())
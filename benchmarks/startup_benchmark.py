@@ -0,0 +1,175 @@
+"""Import time, service build time and first-poll latency of a cold daemon start.
+
+Every measurement runs in a fresh interpreter, because a warm one has the
+modules and the discovery document cached already:
+- `import`: `python -X importtime -c "import gmail_rule_daemon"`, reporting
+  the total, the slowest direct imports and which optional dependencies were
+  left for first use. `import_eager` first imports everything the daemon used
+  to load at module level, for comparison.
+- `first_tick`: process start to the end of the first `check_new_emails`
+  over a simulated mailbox, split into import, setup and poll.
+- `discovery_build` and `discovery_cached`: building the Gmail service with
+  `googleapiclient.discovery.build` versus from the cached discovery document.
+
+    python benchmarks/startup_benchmark.py --repeat 5 --messages 50
+"""
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# What gmail_rule_daemon imported at module level before these became lazy
+EAGER_MODULES = [
+    'bs4', 'fpdf', 'httpx', 'email_validator', 'langchain.output_parsers', 'langchain.prompts',
+    'google_auth_oauthlib.flow', 'google.auth.transport.requests', 'googleapiclient.discovery',
+]
+
+
+def child_env() -> Dict[str, str]:
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(ROOT), env.get('PYTHONPATH')]))
+    return env
+
+
+def parse_importtime(stderr: str, module: str) -> Tuple[Dict[str, float], Dict[str, float]]:
+    """Cumulative seconds of every top-level import, and of `module`'s direct imports.
+
+    `-X importtime` prints a module after everything it imports, indented one
+    level deeper, so `module`'s direct imports are the depth-1 lines since the
+    previous top-level line.
+    """
+    top: Dict[str, float] = {}
+    children: Dict[str, float] = {}
+    pending: Dict[str, float] = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 1:
+            pending[name.strip()] = int(cumulative) / 1e6
+        elif depth == 0:
+            top[name.strip()] = int(cumulative) / 1e6
+            if name.strip() == module:
+                children = pending
+            pending = {}
+    return top, children
+
+
+def measure_import(args: argparse.Namespace, eager: bool) -> Dict[str, Any]:
+    roots = (EAGER_MODULES if eager else []) + ['gmail_rule_daemon']
+    code = (''.join(f"import {module}; " for module in roots) +
+            f"import sys, json; print(json.dumps([m for m in {EAGER_MODULES!r} if m in sys.modules]))")
+    totals: List[float] = []
+    imports: Dict[str, List[float]] = {}
+    loaded: List[str] = []
+    for _ in range(args.repeat):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT, env=child_env(),
+            capture_output=True, text=True, check=True)
+        top, children = parse_importtime(result.stderr, 'gmail_rule_daemon')
+        totals.append(sum(top.get(root, 0.0) for root in roots))
+        for name in roots[:-1]:
+            imports.setdefault(name, []).append(top.get(name, 0.0))
+        for name, value in children.items():
+            imports.setdefault(name, []).append(value)
+        loaded = json.loads(result.stdout.strip().splitlines()[-1])
+    slowest = sorted(((name, statistics.median(times)) for name, times in imports.items()),
+                     key=lambda item: -item[1])[:args.top]
+    return {
+        'run': 'import_eager' if eager else 'import',
+        'import_seconds': round(statistics.median(totals), 3),
+        'slowest_imports_ms': {name: round(seconds * 1000, 1) for name, seconds in slowest},
+        'optional_modules_loaded': loaded,
+        'optional_modules_deferred': [m for m in EAGER_MODULES if m not in loaded],
+    }
+
+
+def run_child(args: argparse.Namespace, mode: str, *extra: str, repeat: Optional[int] = None) -> Dict[str, Any]:
+    runs = []
+    for _ in range(args.repeat if repeat is None else repeat):
+        result = subprocess.run(
+            [sys.executable, __file__, '--child', mode, '--messages', str(args.messages),
+             '--quota-units-per-second', str(args.quota_units_per_second), *extra],
+            cwd=ROOT, env=child_env(), capture_output=True, text=True, check=True)
+        runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return {'run': mode, **{key: round(statistics.median(run[key] for run in runs), 4) for key in runs[0]}}
+
+
+async def child_first_tick(args: argparse.Namespace) -> Dict[str, float]:
+    started = time.perf_counter()
+    from gmail_quota import GmailQuotaLimiter
+    from gmail_rule_daemon import GmailAutomation, GmailRuleEngine
+    from gmail_simulator import FakeGmailDatabase, FakeGmailService, SimulatorConfig, StubAIService
+    imported = time.perf_counter()
+    gmail = GmailAutomation(
+        credentials_path='', token_path='', ai_service=StubAIService(), db=FakeGmailDatabase(),
+        quota=GmailQuotaLimiter(units_per_second=args.quota_units_per_second, base_delay=0.05),
+        service=FakeGmailService(SimulatorConfig(num_messages=args.messages)))
+    engine = GmailRuleEngine(gmail, 'email_rules.json')
+    engine.last_check_time = '1970-01-01T00:00:00'
+    ready = time.perf_counter()
+    await engine.check_new_emails()
+    polled = time.perf_counter()
+    await gmail.close()
+    return {'import_seconds': imported - started, 'setup_seconds': ready - imported,
+            'poll_seconds': polled - ready, 'first_tick_seconds': polled - started}
+
+
+def child_discovery(args: argparse.Namespace) -> Dict[str, float]:
+    started = time.perf_counter()
+    from google.auth.credentials import AnonymousCredentials
+    from gmail_discovery import build_gmail_service
+    imported = time.perf_counter()
+    if args.child == 'discovery_build':
+        from googleapiclient.discovery import build
+        # static_discovery=False downloads the document, as googleapiclient < 2.0 always did
+        build('gmail', 'v1', credentials=AnonymousCredentials(), static_discovery=not args.download)
+    else:
+        build_gmail_service(AnonymousCredentials(), Path(args.discovery_cache))
+    built = time.perf_counter()
+    return {'import_seconds': imported - started, 'build_seconds': built - imported,
+            'total_seconds': built - started}
+
+
+def main(args: argparse.Namespace) -> None:
+    if args.child == 'first_tick':
+        print(json.dumps(asyncio.run(child_first_tick(args))))
+        return
+    if args.child:
+        print(json.dumps(child_discovery(args)))
+        return
+    results = [measure_import(args, eager=True), measure_import(args, eager=False),
+               run_child(args, 'first_tick'),
+               run_child(args, 'discovery_build', *(['--download'] if args.download else []))]
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ['--discovery-cache', str(Path(directory) / 'gmail_discovery_v1.json')]
+        # The first start fills the cache; report the starts after it
+        run_child(args, 'discovery_cached', *cache, repeat=1)
+        results.append(run_child(args, 'discovery_cached', *cache))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help="Fresh processes per measurement")
+    parser.add_argument('--messages', type=int, default=50,
+                        help="Simulated messages waiting for the first poll")
+    parser.add_argument('--quota-units-per-second', type=float, default=250.0,
+                        help="Gmail per-user quota enforced by the limiter during the first poll")
+    parser.add_argument('--top', type=int, default=10, help="Slowest direct imports to report")
+    parser.add_argument('--download', action='store_true',
+                        help="Have discovery_build download the document instead of reading the bundled copy")
+    parser.add_argument('--child', choices=['first_tick', 'discovery_build', 'discovery_cached'],
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--discovery-cache', default='', help=argparse.SUPPRESS)
+    main(parser.parse_args())
@@ -0,0 +1,138 @@
+"""Benchmark the Gmail transports against a local mock Gmail server.
+
+Starts an HTTP/1.1 keep-alive server that answers `messages.list` and
+`messages.get` like Gmail (with optional per-request latency), then fetches the
+same messages through the googleapiclient discovery transport and the async
+httpx transport, both routed through `GmailQuotaLimiter`.
+
+    python benchmarks/transport_benchmark.py --messages 500 --latency-ms 20 --concurrency 16
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List
+import argparse
+import asyncio
+import base64
+import json
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httplib2  # noqa: E402
+from googleapiclient.discovery import build  # noqa: E402
+
+from gmail_async_transport import AsyncGmailService  # noqa: E402
+from gmail_quota import GmailQuotaLimiter  # noqa: E402
+
+
+def _mock_message(message_id: str) -> Dict[str, Any]:
+    body = base64.urlsafe_b64encode(
+        f"Hello from message {message_id}\n".encode('utf-8') * 40).decode('ascii')
+    return {
+        'id': message_id,
+        'threadId': message_id,
+        'labelIds': ['INBOX', 'UNREAD'],
+        'internalDate': str(int(time.time() * 1000)),
+        'payload': {
+            'mimeType': 'text/plain',
+            'headers': [
+                {'name': 'From', 'value': 'Sender <sender@example.com>'},
+                {'name': 'Subject', 'value': f"Message {message_id}"},
+            ],
+            'body': {'size': len(body), 'data': body},
+        },
+    }
+
+
+def start_mock_gmail(num_messages: int, latency: float) -> ThreadingHTTPServer:
+    """Serve a minimal Gmail REST API on a free local port"""
+    ids = [f"{i:016x}" for i in range(num_messages)]
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+        def do_GET(self) -> None:
+            if latency:
+                time.sleep(latency)
+            path = self.path.split('?', 1)[0]
+            prefix = '/gmail/v1/users/me/messages'
+            if path == prefix:
+                payload: Dict[str, Any] = {
+                    'messages': [{'id': i, 'threadId': i} for i in ids]}
+            elif path.startswith(prefix + '/'):
+                payload = _mock_message(path[len(prefix) + 1:])
+            else:
+                self.send_error(404)
+                return
+            data = json.dumps(payload).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def run_transport(service: Any, concurrency: int) -> Dict[str, Any]:
+    quota = GmailQuotaLimiter(units_per_second=1_000_000)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+
+    async def fetch(message_id: str) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            await quota.execute(service.users().messages().get(
+                userId='me', id=message_id, format='full'), 'messages.get')
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    listing = await quota.execute(
+        service.users().messages().list(userId='me'), 'messages.list')
+    await asyncio.gather(*(fetch(m['id']) for m in listing['messages']))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'messages': len(latencies),
+        'seconds': round(elapsed, 3),
+        'messages_per_sec': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 2),
+        'p99_ms': round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+    }
+
+
+async def main(args: argparse.Namespace) -> None:
+    server = start_mock_gmail(args.messages, args.latency_ms / 1000)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/"
+    results = {}
+    try:
+        discovery = build('gmail', 'v1', http=httplib2.Http(), static_discovery=True,
+                          client_options={'api_endpoint': base_url})
+        results['discovery'] = await run_transport(discovery, args.concurrency)
+
+        async_service = AsyncGmailService(None, base_url=base_url)
+        try:
+            results['httpx'] = await run_transport(async_service, args.concurrency)
+            results['httpx']['http2'] = async_service.http2
+        finally:
+            await async_service.aclose()
+    finally:
+        server.shutdown()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--latency-ms', type=float, default=10.0)
+    parser.add_argument('--concurrency', type=int, default=16)
+    asyncio.run(main(parser.parse_args()))
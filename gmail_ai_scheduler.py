@@ -0,0 +1,227 @@
+"""Central scheduler for AI service calls.
+
+Every `chat_completion` made by the daemon goes through `AIScheduler`:
+- Requests are queued by priority. It uses the same priority context as
+  `GmailQuotaLimiter`, so calls made inside batch jobs automatically queue
+  behind rule processing.
+- A global in-flight cap applies, and batch work may only use a share of the
+  slots, so an archive sweep cannot starve real-time rules.
+- An estimated tokens-per-minute budget applies. It is corrected with
+  reported usage when the service returns it.
+- A request whose messages match one already queued or running shares its
+  result instead of calling the service again.
+- When every caller waiting on a request is cancelled, the queued or running
+  call is cancelled too. Requests still queued after their `timeout` fail
+  with `StaleRequestError`.
+"""
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import hashlib
+import heapq
+import itertools
+import logging
+import time
+
+from gmail_metrics import METRICS
+from gmail_quota import PRIORITY_BATCH, TokenBucket, current_priority
+
+
+class StaleRequestError(Exception):
+    """Raised when a request waited in the queue past its timeout"""
+
+
+@dataclass
+class AISchedulerConfig:
+    max_in_flight: int = 4
+    # In-flight slots batch-priority requests may occupy
+    batch_slots: int = 2
+    tokens_per_minute: float = 90_000
+    # Completion tokens assumed for a request until the service reports usage
+    completion_token_estimate: int = 300
+
+
+@dataclass
+class _Request:
+    key: str
+    task: str
+    messages: List[Any]
+    priority: int
+    tokens: int
+    deadline: Optional[float]
+    future: 'asyncio.Future[Any]'
+    waiters: int = 1
+    runner: Optional['asyncio.Task[None]'] = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+def request_key(messages: List[Any]) -> str:
+    digest = hashlib.sha256()
+    for message in messages:
+        digest.update(f"{message.role}\0{message.content}\0".encode('utf-8'))
+    return digest.hexdigest()
+
+
+class AIScheduler:
+    """Prioritised, rate-limited and coalescing front end for an AI service"""
+
+    def __init__(self, ai_service: Any, config: Optional[AISchedulerConfig] = None):
+        self.ai_service = ai_service
+        self.config = config or AISchedulerConfig()
+        self.bucket = TokenBucket(
+            self.config.tokens_per_minute / 60, self.config.tokens_per_minute)
+        self._requests: Dict[str, _Request] = {}
+        self._queue: List[Tuple[int, int, _Request]] = []
+        self._sequence = itertools.count()
+        self._in_flight = 0
+        self._batch_in_flight = 0
+        self._wake = asyncio.Event()
+        self._dispatcher: Optional['asyncio.Task[None]'] = None
+
+    async def complete(
+        self,
+        task: str,
+        messages: List[Any],
+        priority: Optional[int] = None,
+        timeout: Optional[float] = None
+    ) -> Any:
+        """Run `ai_service.chat_completion(messages=...)` under the scheduler's limits"""
+        if priority is None:
+            priority = current_priority()
+        key = request_key(messages)
+        request = self._requests.get(key)
+        if request is not None:
+            request.waiters += 1
+            METRICS.inc('llm_coalesced', task=task)
+            if priority < request.priority and request.runner is None:
+                # An interactive caller joined a queued batch request; move it up
+                request.priority = priority
+                heapq.heappush(self._queue, (priority, next(self._sequence), request))
+                self._wake.set()
+        else:
+            tokens = sum(len(m.content) for m in messages) // 4 + \
+                self.config.completion_token_estimate
+            request = _Request(
+                key=key, task=task, messages=messages, priority=priority,
+                tokens=min(tokens, int(self.bucket.capacity)),
+                deadline=time.monotonic() + timeout if timeout is not None else None,
+                future=asyncio.get_running_loop().create_future())
+            self._requests[key] = request
+            heapq.heappush(self._queue, (priority, next(self._sequence), request))
+            self._start()
+            self._wake.set()
+        try:
+            return await asyncio.shield(request.future)
+        except asyncio.CancelledError:
+            request.waiters -= 1
+            if request.waiters == 0:
+                self._abandon(request)
+            raise
+
+    def _start(self) -> None:
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch(), name='ai-scheduler')
+
+    def _abandon(self, request: _Request) -> None:
+        """Drop a request nobody is waiting for any more"""
+        if self._requests.get(request.key) is request:
+            del self._requests[request.key]
+        if request.runner is not None:
+            request.runner.cancel()
+        if not request.future.done():
+            request.future.cancel()
+        METRICS.inc('llm_cancelled', task=request.task)
+
+    def _next(self) -> Optional[_Request]:
+        """Pop the best runnable request, discarding finished and superseded entries"""
+        while self._queue:
+            priority, _, request = self._queue[0]
+            if request.future.done() or request.runner is not None or priority != request.priority:
+                heapq.heappop(self._queue)
+                continue
+            if request.deadline is not None and time.monotonic() > request.deadline:
+                heapq.heappop(self._queue)
+                self._requests.pop(request.key, None)
+                request.future.set_exception(StaleRequestError(
+                    f"{request.task} request waited {time.monotonic() - request.enqueued_at:.1f}s"))
+                METRICS.inc('llm_stale', task=request.task)
+                continue
+            return request
+        return None
+
+    async def _dispatch(self) -> None:
+        while True:
+            self._wake.clear()
+            delay: Optional[float] = None
+            while self._in_flight < self.config.max_in_flight:
+                request = self._next()
+                if request is None:
+                    break
+                if request.priority >= PRIORITY_BATCH and self._batch_in_flight >= self.config.batch_slots:
+                    break
+                delay = self.bucket.try_take(request.tokens)
+                if delay > 0:
+                    break
+                heapq.heappop(self._queue)
+                self._in_flight += 1
+                if request.priority >= PRIORITY_BATCH:
+                    self._batch_in_flight += 1
+                METRICS.observe('llm_queue_seconds', time.monotonic() - request.enqueued_at,
+                                task=request.task)
+                request.runner = asyncio.create_task(
+                    self._run(request), name=f"ai:{request.task}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run(self, request: _Request) -> None:
+        try:
+            completion = await self.ai_service.chat_completion(messages=request.messages)
+            actual = (getattr(completion, 'prompt_tokens', None) or 0) + \
+                (getattr(completion, 'completion_tokens', None) or 0)
+            if actual:
+                # Settle the estimate against the reported usage
+                self.bucket.tokens -= actual - request.tokens
+            if not request.future.done():
+                request.future.set_result(completion)
+        except asyncio.CancelledError:
+            if not request.future.done():
+                request.future.cancel()
+        except Exception as e:
+            if not request.future.done():
+                request.future.set_exception(e)
+        finally:
+            self._in_flight -= 1
+            if request.priority >= PRIORITY_BATCH:
+                self._batch_in_flight -= 1
+            if self._requests.get(request.key) is request:
+                del self._requests[request.key]
+            self._wake.set()
+
+    def cancel_pending(self, min_priority: int = PRIORITY_BATCH) -> int:
+        """Cancel queued (not yet running) requests at `min_priority` or lower"""
+        cancelled = 0
+        for _, _, request in self._queue:
+            if request.runner is None and not request.future.done() and request.priority >= min_priority:
+                self._requests.pop(request.key, None)
+                request.future.cancel()
+                cancelled += 1
+        if cancelled:
+            logging.info(f"Cancelled {cancelled} queued AI requests")
+        return cancelled
+
+    async def close(self) -> None:
+        self.cancel_pending(min_priority=0)
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'queued': sum(1 for r in self._requests.values() if r.runner is None),
+            'in_flight': self._in_flight,
+            'batch_in_flight': self._batch_in_flight,
+            'token_headroom': self.bucket.available() / self.bucket.capacity,
+        }
@@ -0,0 +1,186 @@
+"""Incremental archive report for `auto_archive_emails` sweeps.
+
+Rows are added one message at a time. The builder keeps only per-sender and
+per-domain counters plus the top kept messages by importance, so memory grows
+with the number of distinct senders rather than with the sweep. The report
+body lists the top N senders and domains with totals. When an attachment is
+requested, each row is also streamed to a temporary CSV or HTML file as it
+arrives.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from email.utils import parseaddr
+from typing import IO, Any, Dict, List, Optional, Tuple
+import csv
+import hashlib
+import heapq
+import html
+import io
+import tempfile
+
+from gmail_outbox import Attachment
+
+REPORT_ATTACHMENTS = ('csv', 'html')
+
+_CSV_FIELDS = ['message_id', 'action', 'from', 'domain', 'subject', 'importance', 'reason', 'summary']
+
+
+@dataclass
+class ArchiveReportConfig:
+    # Senders and domains listed per section before the remainder is summed up
+    top_n: int = 20
+    # Kept messages listed with their summaries, most important first
+    top_kept: int = 25
+    # 'csv' or 'html' to attach every row, None for the summary only
+    attachment: Optional[str] = None
+    # Rows past this size are left out of the attachment and counted instead
+    max_attachment_bytes: int = 10 * 1024 * 1024
+
+
+def sender_domain(sender: str) -> str:
+    address = parseaddr(sender)[1] or sender
+    return address.rpartition('@')[2].lower() or '(unknown)'
+
+
+def _top_lines(counts: Dict[str, int], top_n: int) -> List[str]:
+    ranked = sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))
+    lines = [f"  {count:6d}  {name}" for name, count in ranked[:top_n]]
+    rest = ranked[top_n:]
+    if rest:
+        lines.append(
+            f"  {sum(count for _, count in rest):6d}  ({len(rest)} more)")
+    return lines
+
+
+class ArchiveReportBuilder:
+    """Accumulate archive decisions and render a bounded report"""
+
+    def __init__(self, config: Optional[ArchiveReportConfig] = None):
+        self.config = config or ArchiveReportConfig()
+        if self.config.attachment not in (None, *REPORT_ATTACHMENTS):
+            raise ValueError(f"Unknown report attachment: {self.config.attachment}")
+        self.started_at = datetime.now()
+        self.archived = 0
+        self.kept = 0
+        self.archived_by_sender: Dict[str, int] = {}
+        self.archived_by_domain: Dict[str, int] = {}
+        self.kept_by_sender: Dict[str, int] = {}
+        self._domains: Dict[str, str] = {}
+        # Min-heap of (importance, sequence, row) holding the most important kept messages
+        self._top_kept: List[Tuple[float, int, Dict[str, str]]] = []
+        # XOR of per-message digests identifies the reported set in any order
+        self._digest = 0
+        self._file: Optional[IO[str]] = None
+        self._csv: Any = None
+        # Approximate attachment size; tell() on a text file is too slow to call per row
+        self._attachment_size = 0
+        self.rows_omitted = 0
+
+    @property
+    def total(self) -> int:
+        return self.archived + self.kept
+
+    @property
+    def dedup_key(self) -> str:
+        return f"{self._digest:064x}"[:32]
+
+    def add(
+        self,
+        message_id: str,
+        sender: str,
+        subject: str,
+        archived: bool,
+        reason: str,
+        importance: float,
+        summary: Optional[str] = None
+    ) -> None:
+        self._digest ^= int.from_bytes(
+            hashlib.sha256(message_id.encode('utf-8')).digest(), 'big')
+        # Sweeps repeat the same few senders, and parseaddr is slow
+        domain = self._domains.get(sender)
+        if domain is None:
+            domain = self._domains[sender] = sender_domain(sender)
+        if archived:
+            self.archived += 1
+            self.archived_by_sender[sender] = self.archived_by_sender.get(sender, 0) + 1
+            self.archived_by_domain[domain] = self.archived_by_domain.get(domain, 0) + 1
+        else:
+            self.kept += 1
+            self.kept_by_sender[sender] = self.kept_by_sender.get(sender, 0) + 1
+            entry = (importance, self.kept, {
+                'from': sender, 'subject': subject, 'reason': reason, 'summary': summary or ''})
+            if len(self._top_kept) < self.config.top_kept:
+                heapq.heappush(self._top_kept, entry)
+            else:
+                heapq.heappushpop(self._top_kept, entry)
+        if self.config.attachment:
+            self._write_row([message_id, 'archived' if archived else 'kept', sender, domain,
+                             subject, f"{importance:.2f}", reason, summary or ''])
+
+    def _write_row(self, row: List[str]) -> None:
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(mode='w+', encoding='utf-8', newline='')
+            if self.config.attachment == 'csv':
+                self._csv = csv.writer(self._file)
+                self._csv.writerow(_CSV_FIELDS)
+            else:
+                self._file.write('<table border="1"><tr>' + ''.join(
+                    f"<th>{field}</th>" for field in _CSV_FIELDS) + '</tr>\n')
+        if self._attachment_size >= self.config.max_attachment_bytes:
+            self.rows_omitted += 1
+            return
+        self._attachment_size += sum(len(value) for value in row) + 9 * len(row)
+        if self._csv is not None:
+            self._csv.writerow(row)
+        else:
+            self._file.write('<tr>' + ''.join(
+                f"<td>{html.escape(value)}</td>" for value in row) + '</tr>\n')
+
+    def subject(self) -> str:
+        return (f"Email Archive Report - {self.started_at.strftime('%Y-%m-%d')}: "
+                f"{self.archived} archived, {self.kept} kept")
+
+    def render(self) -> str:
+        """Plain-text report body; its size depends on `top_n`, not the sweep size"""
+        out = io.StringIO()
+        out.write(f"Email Archive Report - {self.started_at.strftime('%Y-%m-%d %H:%M')}\n\n")
+        out.write(f"Archived {self.archived} of {self.total} emails from "
+                  f"{len(self.archived_by_sender)} senders\n")
+        out.write(f"{'=' * 50}\n")
+        out.write("Top senders:\n")
+        out.writelines(f"{line}\n" for line in _top_lines(self.archived_by_sender, self.config.top_n))
+        out.write("Top domains:\n")
+        out.writelines(f"{line}\n" for line in _top_lines(self.archived_by_domain, self.config.top_n))
+
+        out.write(f"\nKept {self.kept} emails from {len(self.kept_by_sender)} senders\n")
+        out.write(f"{'=' * 50}\n")
+        for _, _, email in sorted(self._top_kept, key=lambda entry: (-entry[0], entry[1])):
+            out.write(f"\nFrom: {email['from']}\nSubject: {email['subject']}\n")
+            if email['summary']:
+                out.write(f"Summary: {email['summary']}\n")
+            out.write(f"Reason: {email['reason']}\n")
+        if self.kept > len(self._top_kept):
+            out.write(f"\n...and {self.kept - len(self._top_kept)} more kept emails\n")
+
+        if self._file is not None:
+            out.write(f"\nEvery email is listed in the attached {str(self.config.attachment).upper()} file")
+            if self.rows_omitted:
+                out.write(f" ({self.rows_omitted} rows omitted to limit its size)")
+            out.write(".\n")
+        return out.getvalue()
+
+    def attachments(self) -> List[Attachment]:
+        if self._file is None:
+            return []
+        self._file.seek(0)
+        content = self._file.read()
+        stamp = self.started_at.strftime('%Y%m%d_%H%M')
+        if self.config.attachment == 'csv':
+            return [(f"archive_report_{stamp}.csv", content.encode('utf-8'), 'text/csv')]
+        document = f"<html><body>{content}</table></body></html>"
+        return [(f"archive_report_{stamp}.html", document.encode('utf-8'), 'text/html')]
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,218 @@
+"""Async Gmail transport built on httpx.
+
+`googleapiclient` requests block the event loop in `.execute()`. This module
+implements the subset of the Gmail REST API the daemon uses behind the same
+`service.users().messages().get(...)` call shape, but its requests expose
+`execute_async()` and share one pooled, keep-alive `httpx.AsyncClient`
+(HTTP/2 when the `h2` package is installed). Credentials are the ones produced
+by `GoogleServiceAuth` and are refreshed in a worker thread when they expire.
+
+httpx, httplib2 and google-auth's transport are imported when a service is
+created or first needs them, so the daemon can import the transport constants
+without loading them.
+"""
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+import asyncio
+import importlib.util
+import json
+
+from googleapiclient.errors import HttpError
+
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
+
+GMAIL_API_ROOT = 'https://gmail.googleapis.com/'
+
+TRANSPORT_DISCOVERY = 'discovery'
+TRANSPORT_HTTPX = 'httpx'
+TRANSPORTS = (TRANSPORT_DISCOVERY, TRANSPORT_HTTPX)
+
+
+class AsyncGmailRequest:
+    """A prepared Gmail API call; await `execute_async()` to run it"""
+
+    def __init__(
+        self,
+        service: 'AsyncGmailService',
+        http_method: str,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        body: Optional[Dict[str, Any]] = None
+    ):
+        self.service = service
+        self.http_method = http_method
+        self.path = path
+        # Drop unset optional parameters, as googleapiclient does
+        self.params = {k: v for k, v in (params or {}).items() if v is not None}
+        self.body = body
+
+    async def execute_async(self) -> Any:
+        return await self.service.send(self)
+
+    def execute(self) -> Any:
+        raise RuntimeError(
+            "AsyncGmailRequest must be awaited with execute_async()")
+
+
+class _Resource:
+    def __init__(self, service: 'AsyncGmailService', user_id: str = 'me'):
+        self._service = service
+        self._user_id = user_id
+
+    def _request(self, http_method: str, user_id: str, path: str,
+                 params: Optional[Dict[str, Any]] = None,
+                 body: Optional[Dict[str, Any]] = None) -> AsyncGmailRequest:
+        return AsyncGmailRequest(
+            self._service, http_method, f"gmail/v1/users/{user_id}/{path}", params, body)
+
+
+class _Attachments(_Resource):
+    def get(self, userId: str, messageId: str, id: str) -> AsyncGmailRequest:
+        return self._request('GET', userId, f"messages/{messageId}/attachments/{id}")
+
+
+class _Messages(_Resource):
+    def get(self, userId: str, id: str, format: Optional[str] = None,
+            metadataHeaders: Optional[List[str]] = None) -> AsyncGmailRequest:
+        return self._request('GET', userId, f"messages/{id}",
+                             {'format': format, 'metadataHeaders': metadataHeaders})
+
+    def list(self, userId: str, q: Optional[str] = None, labelIds: Optional[List[str]] = None,
+             maxResults: Optional[int] = None, pageToken: Optional[str] = None,
+             includeSpamTrash: Optional[bool] = None) -> AsyncGmailRequest:
+        return self._request('GET', userId, 'messages', {
+            'q': q, 'labelIds': labelIds, 'maxResults': maxResults,
+            'pageToken': pageToken, 'includeSpamTrash': includeSpamTrash})
+
+    def modify(self, userId: str, id: str, body: Dict[str, Any]) -> AsyncGmailRequest:
+        return self._request('POST', userId, f"messages/{id}/modify", body=body)
+
+    def batchModify(self, userId: str, body: Dict[str, Any]) -> AsyncGmailRequest:
+        return self._request('POST', userId, 'messages/batchModify', body=body)
+
+    def send(self, userId: str, body: Dict[str, Any]) -> AsyncGmailRequest:
+        return self._request('POST', userId, 'messages/send', body=body)
+
+    def trash(self, userId: str, id: str) -> AsyncGmailRequest:
+        return self._request('POST', userId, f"messages/{id}/trash")
+
+    def attachments(self) -> _Attachments:
+        return _Attachments(self._service)
+
+
+class _Labels(_Resource):
+    def list(self, userId: str) -> AsyncGmailRequest:
+        return self._request('GET', userId, 'labels')
+
+    def create(self, userId: str, body: Dict[str, Any]) -> AsyncGmailRequest:
+        return self._request('POST', userId, 'labels', body=body)
+
+
+class _Threads(_Resource):
+    def get(self, userId: str, id: str, format: Optional[str] = None) -> AsyncGmailRequest:
+        return self._request('GET', userId, f"threads/{id}", {'format': format})
+
+
+class _Drafts(_Resource):
+    def create(self, userId: str, body: Dict[str, Any]) -> AsyncGmailRequest:
+        return self._request('POST', userId, 'drafts', body=body)
+
+
+class _History(_Resource):
+    def list(self, userId: str, startHistoryId: Any, historyTypes: Optional[List[str]] = None,
+             labelId: Optional[str] = None, pageToken: Optional[str] = None,
+             maxResults: Optional[int] = None) -> AsyncGmailRequest:
+        return self._request('GET', userId, 'history', {
+            'startHistoryId': startHistoryId, 'historyTypes': historyTypes,
+            'labelId': labelId, 'pageToken': pageToken, 'maxResults': maxResults})
+
+
+class _Users(_Resource):
+    def messages(self) -> _Messages:
+        return _Messages(self._service)
+
+    def labels(self) -> _Labels:
+        return _Labels(self._service)
+
+    def threads(self) -> _Threads:
+        return _Threads(self._service)
+
+    def drafts(self) -> _Drafts:
+        return _Drafts(self._service)
+
+    def history(self) -> _History:
+        return _History(self._service)
+
+    def getProfile(self, userId: str) -> AsyncGmailRequest:
+        return self._request('GET', userId, 'profile')
+
+    def watch(self, userId: str, body: Dict[str, Any]) -> AsyncGmailRequest:
+        return self._request('POST', userId, 'watch', body=body)
+
+
+class AsyncGmailService:
+    """Gmail service whose requests run on a shared pooled httpx.AsyncClient"""
+
+    def __init__(
+        self,
+        credentials: Optional['Credentials'],
+        base_url: str = GMAIL_API_ROOT,
+        max_connections: int = 20,
+        keepalive_expiry: float = 60.0,
+        timeout: float = 30.0
+    ):
+        import httpx
+        self.credentials = credentials
+        self.base_url = base_url
+        # HTTP/2 needs the optional `h2` package; fall back to pooled HTTP/1.1
+        self.http2 = importlib.util.find_spec('h2') is not None
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            http2=self.http2,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=keepalive_expiry
+            )
+        )
+        self._refresh_lock = asyncio.Lock()
+
+    def users(self) -> _Users:
+        return _Users(self)
+
+    async def _auth_headers(self) -> Dict[str, str]:
+        headers: Dict[str, str] = {}
+        if self.credentials is None:
+            return headers
+        if not self.credentials.valid:
+            async with self._refresh_lock:
+                if not self.credentials.valid:
+                    from google.auth.transport.requests import Request
+                    # google-auth refresh is blocking; keep it off the event loop
+                    await asyncio.to_thread(self.credentials.refresh, Request())
+        self.credentials.apply(headers)
+        return headers
+
+    async def send(self, request: AsyncGmailRequest) -> Any:
+        response = await self._client.request(
+            request.http_method,
+            request.path,
+            params=request.params,
+            json=request.body,
+            headers=await self._auth_headers()
+        )
+        if response.status_code >= 400:
+            # Raise the same error type as googleapiclient so callers and retries work unchanged
+            import httplib2
+            raise HttpError(
+                httplib2.Response({'status': response.status_code}),
+                response.content,
+                uri=str(response.url)
+            )
+        if not response.content:
+            return {}
+        return json.loads(response.content)
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
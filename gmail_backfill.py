@@ -0,0 +1,325 @@
+"""Apply the rules to mail that arrived before the daemon started watching.
+
+`GmailRuleEngine` only processes new mail, so a rule added today never
+touches the existing archive. `Backfill` walks every message matching a
+search query and/or label IDs, one `messages.list` page at a time, and runs
+the block list and the rules over each page:
+
+- A page's messages are fetched concurrently, with `format='metadata'` unless a
+  body pattern needs the full message.
+- Label, archive, mark-read and star actions are grouped by the labels they
+  change and applied with `messages.batchModify`. Deletes and forwards go
+  through `apply_nl_rule_actions` one message at a time.
+- Every call runs at batch priority and within `quota_share` of the account's
+  Gmail quota, so the live daemon sharing the limiter keeps the rest.
+
+After each page the next page token and running totals are checkpointed in
+`GmailStateDatabase`, and a restarted backfill resumes on the page it was on.
+Messages are claimed in the engine's processed ledger before anything is done
+to them, so that page is not applied twice, and mail the live daemon already
+handled under the current rules is skipped. Deletes and forwards that fail are
+checkpointed with the page and retried at the start of the next runs, up to
+`action_attempts` times. Backfills never ask the AI whether to archive; the
+scheduled auto-archive sweep does that.
+"""
+from dataclasses import asdict, dataclass, field
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple
+import asyncio
+import hashlib
+import json
+import logging
+import time
+
+from googleapiclient.errors import HttpError
+
+from gmail_metrics import METRICS
+from gmail_quota import PRIORITY_BATCH
+from gmail_supervisor import owns_message
+
+from gmail_message import GmailMessage
+from gmail_rules import EmailRule
+
+if TYPE_CHECKING:
+    from gmail_rule_daemon import GmailRuleEngine
+
+# Rule actions that only add or remove labels, as (labels added, labels removed)
+LABEL_ACTIONS: Dict[str, Tuple[List[str], List[str]]] = {
+    'archive': ([], ['INBOX']),
+    'markRead': ([], ['UNREAD']),
+    'star': (['STARRED'], []),
+}
+
+
+@dataclass
+class BackfillConfig:
+    # Gmail search query, e.g. 'before:2024/01/01'; empty walks the whole mailbox
+    query: str = ''
+    # Only walk messages carrying all of these label IDs
+    label_ids: List[str] = field(default_factory=list)
+    # Names of the rules to apply; empty applies every rule
+    rules: List[str] = field(default_factory=list)
+    # messages.list page size, at most 500
+    page_size: int = 500
+    # Share of the account's Gmail quota the backfill may use
+    quota_share: float = 0.25
+    # Concurrent messages.get calls per page
+    concurrency: int = 10
+    # Seconds between progress reports
+    report_every: float = 30.0
+    # Runs that try a message's failed delete or forward actions before giving up
+    action_attempts: int = 3
+
+    def __post_init__(self) -> None:
+        if not 0.0 < self.quota_share <= 1.0:
+            raise ValueError("quota_share must be in (0, 1]")
+        if not 1 <= self.page_size <= 500:
+            raise ValueError("page_size must be between 1 and 500")
+
+    def job_id(self, rules_version: str) -> str:
+        """Stable ID of this walk; editing the rules starts a new one"""
+        key = json.dumps([self.query, sorted(self.label_ids), sorted(self.rules), rules_version])
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+
+@dataclass
+class BackfillProgress:
+    # Token of the next page to list; None before the first page and after the last
+    page_token: Optional[str] = None
+    pages: int = 0
+    listed: int = 0
+    # Messages the rules ran on
+    processed: int = 0
+    # Messages owned by another shard or already in the ledger
+    skipped: int = 0
+    # Messages matched by at least one rule or the block list
+    matched: int = 0
+    # Messages changed through messages.batchModify
+    modified: int = 0
+    # Size of the walk as estimated by Gmail, for the ETA
+    estimated_total: Optional[int] = None
+    # Time spent across all runs of this job
+    elapsed_seconds: float = 0.0
+    done: bool = False
+    # Message ID -> {'actions': actions that failed, 'attempts': runs that tried them}
+    failed: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+
+
+class Backfill:
+    """Resumable walk applying one engine's rules to existing mail"""
+
+    def __init__(self, engine: 'GmailRuleEngine', config: Optional[BackfillConfig] = None):
+        self.engine = engine
+        self.gmail = engine.gmail
+        self.config = config or BackfillConfig()
+        self.key = f"backfill:{self.config.job_id(engine.rules_version)}"
+        if engine.shard is not None:
+            self.key += f":{engine.shard[0]}/{engine.shard[1]}"
+        self.rules: List[EmailRule] = [
+            rule for rule in engine.rules
+            if not self.config.rules or rule.name in self.config.rules]
+        missing = set(self.config.rules) - {rule.name for rule in self.rules}
+        if missing:
+            logging.warning(f"Backfill rules not found in {engine.rules_file}: {sorted(missing)}")
+        self.progress = BackfillProgress()
+        self._label_ids: Dict[str, str] = {}
+        # Listing rate of the current run, for throughput and ETA
+        self._run_started = time.monotonic()
+        self._run_listed = 0
+        self._last_report = 0.0
+
+    async def run(self) -> BackfillProgress:
+        """Walk from the last checkpoint to the end of the query"""
+        saved = await self.engine.state.get_state(self.engine.account, self.key)
+        if saved:
+            self.progress = BackfillProgress(**json.loads(saved))
+        if self.progress.done and not self.progress.failed:
+            logging.debug(f"Backfill {self.key} for {self.engine.account} already complete")
+            return self.progress
+        if self.progress.pages and not self.progress.done:
+            logging.info(
+                f"Resuming backfill {self.key} for {self.engine.account} after "
+                f"{self.progress.pages} pages ({self.progress.listed} messages)")
+        quota = self.gmail.quota
+        with quota.priority(PRIORITY_BATCH), quota.share(self.config.quota_share):
+            if self.progress.failed:
+                await self._retry_failed()
+                if self.progress.done:
+                    return self.progress
+            fetch_args = await self.engine._plan_fetch(self.rules, archive=False)
+            if self.progress.estimated_total is None and not self.config.query and not self.config.label_ids:
+                profile = await self.gmail.execute(
+                    self.gmail.service.users().getProfile(userId='me'), 'getProfile')
+                self.progress.estimated_total = int(profile.get('messagesTotal', 0)) or None
+            elapsed_before = self.progress.elapsed_seconds
+            self._run_started = time.monotonic()
+            self._run_listed = self.progress.listed
+            while not self.progress.done:
+                response = await self._list_page()
+                if self.progress.estimated_total is None:
+                    self.progress.estimated_total = response.get('resultSizeEstimate')
+                message_ids = [m['id'] for m in response.get('messages', [])]
+                await self._process_page(message_ids, fetch_args)
+                self.progress.pages += 1
+                self.progress.listed += len(message_ids)
+                self.progress.page_token = response.get('nextPageToken')
+                self.progress.done = not self.progress.page_token
+                self.progress.elapsed_seconds = elapsed_before + time.monotonic() - self._run_started
+                await self.engine.state.set_state(
+                    self.engine.account, self.key, json.dumps(asdict(self.progress)))
+                METRICS.inc('backfill_messages', len(message_ids), account=self.engine.account)
+                if self.progress.done or time.monotonic() - self._last_report >= self.config.report_every:
+                    self._log_progress()
+        return self.progress
+
+    async def _list_page(self) -> Dict[str, Any]:
+        args: Dict[str, Any] = {'userId': 'me', 'maxResults': self.config.page_size}
+        if self.config.query:
+            args['q'] = self.config.query
+        if self.config.label_ids:
+            args['labelIds'] = self.config.label_ids
+        try:
+            return await self.gmail.execute(self.gmail.service.users().messages().list(
+                pageToken=self.progress.page_token, **args), 'messages.list')
+        except HttpError as error:
+            if error.resp.status != 400 or self.progress.page_token is None:
+                raise
+            # Page tokens don't last forever; the ledger skips what was already done
+            logging.warning(f"Backfill {self.key} page token rejected, restarting from the first page")
+            self.progress.page_token = None
+            return await self.gmail.execute(self.gmail.service.users().messages().list(**args), 'messages.list')
+
+    async def _fetch(self, message_ids: List[str], fetch_args: Dict[str, Any]) -> List[GmailMessage]:
+        semaphore = asyncio.Semaphore(self.config.concurrency)
+
+        async def fetch(message_id: str) -> Optional[GmailMessage]:
+            async with semaphore:
+                try:
+                    with METRICS.span('fetch', format=fetch_args['format']):
+                        return GmailMessage(await self.gmail.execute(
+                            self.gmail.service.users().messages().get(
+                                userId='me', id=message_id, **fetch_args), 'messages.get'))
+                except HttpError as error:
+                    # Deleted between listing and fetching
+                    if error.resp.status == 404:
+                        return None
+                    raise
+
+        messages = await asyncio.gather(*(fetch(m) for m in message_ids))
+        return [m for m in messages if m is not None]
+
+    async def _label_id(self, label_name: str) -> str:
+        if label_name not in self._label_ids:
+            self._label_ids[label_name] = await self.gmail.label_id(label_name)
+        return self._label_ids[label_name]
+
+    async def _process_page(self, message_ids: List[str], fetch_args: Dict[str, Any]) -> None:
+        owned = [m for m in message_ids if owns_message(m, self.engine.shard)]
+        # Messages another replica has locked are skipped like processed ones
+        unseen = await self.engine.ledger.claim(await self.engine.ledger.filter_unseen(owned))
+        self.progress.skipped += len(message_ids) - len(unseen)
+        # (labels added, labels removed) -> messages getting that change
+        changes: Dict[Tuple[Tuple[str, ...], Tuple[str, ...]], List[str]] = {}
+        other_actions: List[Tuple[str, List[Dict[str, Any]]]] = []
+        try:
+            for message in await self._fetch(unseen, fetch_args) if unseen else []:
+                self.progress.processed += 1
+                added, removed, actions = await self._plan_actions(message)
+                if added or removed or actions:
+                    self.progress.matched += 1
+                if added or removed:
+                    changes.setdefault((tuple(sorted(added)), tuple(sorted(removed))), []).append(message.id)
+                if actions:
+                    other_actions.append((message.id, actions))
+            # Adding and removing labels is idempotent, so these are safe to repeat
+            for (added, removed), ids in changes.items():
+                await self.gmail.batch_modify(ids, list(added), list(removed))
+                self.progress.modified += len(ids)
+        except BaseException:
+            # Including cancellation on shutdown: nothing irreversible has happened yet
+            await self.engine.ledger.release(unseen)
+            raise
+        for index, (message_id, actions) in enumerate(other_actions):
+            try:
+                await self._apply_actions(message_id, actions)
+            except BaseException:
+                # The page isn't checkpointed, so it is listed again on resume; release what
+                # wasn't done for it to be redone then. Forwards repeated for the interrupted
+                # message are deduplicated by the outbox.
+                await self.engine.ledger.release(
+                    [m for m, _ in other_actions[:index] if m in self.progress.failed]
+                    + [m for m, _ in other_actions[index:]])
+                raise
+
+    async def _apply_actions(self, message_id: str, actions: List[Dict[str, Any]]) -> None:
+        """Apply one message's other actions, keeping the failed ones for the next run"""
+        failed = await self.gmail.apply_nl_rule_actions(message_id, actions)
+        earlier = self.progress.failed.pop(message_id, None)
+        if not failed:
+            return
+        attempts = (earlier['attempts'] if earlier else 0) + 1
+        if attempts < self.config.action_attempts:
+            self.progress.failed[message_id] = {'actions': failed, 'attempts': attempts}
+        else:
+            METRICS.inc('backfill_failed_actions', len(failed), account=self.engine.account)
+            logging.error(
+                f"Backfill {self.key} gave up on {len(failed)} actions for {message_id} "
+                f"after {attempts} attempts")
+
+    async def _retry_failed(self) -> None:
+        """Retry the actions that failed in earlier runs"""
+        logging.info(
+            f"Backfill {self.key} retrying failed actions for {len(self.progress.failed)} messages")
+        for message_id, entry in list(self.progress.failed.items()):
+            await self._apply_actions(message_id, entry['actions'])
+        await self.engine.state.set_state(
+            self.engine.account, self.key, json.dumps(asdict(self.progress)))
+
+    async def _plan_actions(self, message: GmailMessage) -> Tuple[Set[str], Set[str], List[Dict[str, Any]]]:
+        """Labels to add and remove, and the other actions, for one message"""
+        added: Set[str] = set()
+        removed: Set[str] = set()
+        actions: List[Dict[str, Any]] = []
+        if await self.engine.check_blocked_sender(message):
+            added.add(await self._label_id('Blocked'))
+            return added, removed, actions
+        for rule in self.engine.match_rules(message.headers, self.rules):
+            METRICS.inc('rules_matched', rule=rule.name)
+            for action in self.engine.normalize_actions(rule.actions):
+                action_type = action.get('type')
+                if action_type == 'label':
+                    added.add(await self._label_id(action['value']))
+                elif action_type in LABEL_ACTIONS:
+                    add, remove = LABEL_ACTIONS[action_type]
+                    added.update(add)
+                    removed.update(remove)
+                else:
+                    actions.append(action)
+        return added, removed, actions
+
+    def report(self) -> Dict[str, Any]:
+        """Progress with the current run's throughput and the estimated time left"""
+        run_seconds = time.monotonic() - self._run_started
+        rate = (self.progress.listed - self._run_listed) / run_seconds if run_seconds > 0 else 0.0
+        remaining = None
+        if self.progress.estimated_total is not None:
+            remaining = max(0, self.progress.estimated_total - self.progress.listed)
+        return {
+            **asdict(self.progress),
+            'messages_per_second': round(rate, 1),
+            'percent': round(100 * self.progress.listed / self.progress.estimated_total, 1)
+            if self.progress.estimated_total else None,
+            'eta_seconds': 0.0 if self.progress.done else
+            round(remaining / rate, 1) if remaining is not None and rate > 0 else None,
+        }
+
+    def _log_progress(self) -> None:
+        self._last_report = time.monotonic()
+        report = self.report()
+        total = report['estimated_total'] or '?'
+        eta = f"{report['eta_seconds']:.0f}s" if report['eta_seconds'] is not None else 'unknown'
+        logging.info(
+            f"Backfill {self.engine.account}: {report['listed']}/{total} messages "
+            f"({report['percent'] if report['percent'] is not None else '?'}%), "
+            f"{report['matched']} matched, {report['modified']} modified, "
+            f"{report['messages_per_second']} msg/s, ETA {eta}"
+            + (" - complete" if report['done'] else ''))
@@ -0,0 +1,201 @@
+"""Near-duplicate detection for bulk mail campaigns.
+
+Bulk senders deliver thousands of copies of one email that differ only in
+personalization: names, order numbers and tracking links. Each message's
+subject and body are normalized, with tags, URLs, addresses and anything
+containing digits removed. The text is cut into word shingles and hashed
+into a 64-bit SimHash. Copies of a campaign land within a few bits of
+each other.
+
+Fingerprints are indexed per sender address with LSH banding. The 64 bits
+are split into `bands` bands, and two fingerprints within `max_distance`
+bits must agree on at least one band when `max_distance < bands`. A lookup
+therefore only compares against campaigns sharing a band.
+
+Once one member of a campaign has an archive decision or an unsubscribe
+result, later members reuse it instead of asking the LLM again. Campaigns
+are stored in `GmailStateDatabase`. A sender's campaigns are loaded the
+first time that sender is seen, and the band index is rebuilt in memory.
+"""
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Tuple
+import functools
+import hashlib
+import re
+import time
+
+from gmail_classifier import sender_address
+from gmail_state_db import GmailStateDatabase
+
+_TAG_RE = re.compile(r'<style\b.*?</style>|<script\b.*?</script>|<[^>]+>', re.IGNORECASE | re.DOTALL)
+_ENTITY_RE = re.compile(r'&#?\w+;')
+# Whole tokens holding a URL, an address or a digit: links, order numbers, dates
+_PERSONAL_RE = re.compile(r'(?<!\S)[^\s\d@:]*(?:://|@|\d)\S*')
+_WORD_RE = re.compile(r'[a-z]{2,}')
+_MULTIPLIER = 0x9E3779B97F4A7C15
+_MIX = 0xBF58476D1CE4E5B9
+
+
+@dataclass
+class CampaignConfig:
+    # Fingerprints this many bits apart or closer belong to one campaign
+    max_distance: int = 7
+    # LSH bands over the 64-bit fingerprint; must exceed max_distance and divide 64
+    bands: int = 8
+    shingle_size: int = 3
+    # Bodies with fewer words are too short to fingerprint reliably
+    min_words: int = 12
+    # Inherited archive decisions expire, so a sender's change of tone is noticed
+    decision_ttl_seconds: float = 30 * 86400
+    # Senders whose campaigns are kept in memory
+    max_senders: int = 5_000
+
+    def __post_init__(self) -> None:
+        if 64 % self.bands or self.max_distance >= self.bands:
+            raise ValueError("bands must divide 64 and exceed max_distance")
+
+
+@dataclass
+class Campaign:
+    sender: str
+    # SimHash of the first member
+    fingerprint: int
+    members: int = 0
+    # JSON of the LLM archive decision and when it was made
+    archive_decision: Optional[str] = None
+    decided_at: Optional[float] = None
+    # Whether the unsubscribe detector ran, and what it found
+    unsubscribe_checked: bool = False
+    unsubscribe_link: Optional[str] = None
+    unsubscribe_location: Optional[str] = None
+    unsubscribed: bool = False
+    last_seen: float = field(default_factory=time.time)
+
+
+def normalize_words(subject: str, body: str) -> List[str]:
+    """Words of the subject and body with markup and personalized tokens removed"""
+    text = _ENTITY_RE.sub(' ', _TAG_RE.sub(' ', f"{subject}\n{body}")).lower()
+    return _WORD_RE.findall(_PERSONAL_RE.sub(' ', text))
+
+
+@functools.lru_cache(maxsize=100_000)
+def _word_hash(word: str) -> int:
+    return int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def simhash(words: List[str], shingle_size: int = 3) -> int:
+    """64-bit SimHash over word shingles"""
+    import numpy as np
+    hashes = np.fromiter((_word_hash(word) for word in words), dtype=np.uint64, count=len(words))
+    count = max(1, len(words) - shingle_size + 1)
+    # Combine each run of word hashes into a shingle hash, then mix its bits
+    shingles = hashes[:count].copy()
+    for offset in range(1, min(shingle_size, len(words))):
+        shingles = shingles * np.uint64(_MULTIPLIER) ^ hashes[offset:offset + count]
+    shingles = np.unique(shingles)
+    shingles ^= shingles >> np.uint64(31)
+    shingles *= np.uint64(_MIX)
+    shingles ^= shingles >> np.uint64(29)
+    ones = np.unpackbits(shingles.astype('<u8').view(np.uint8), bitorder='little') \
+        .reshape(-1, 64).sum(axis=0)
+    bits = (ones * 2 > len(shingles)).astype(np.uint8)
+    return int(np.packbits(bits, bitorder='little').view('<u8')[0])
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+class CampaignIndex:
+    """Per-account campaign clusters with inherited LLM results"""
+
+    def __init__(self, store: GmailStateDatabase, account: str, config: Optional[CampaignConfig] = None):
+        self.store = store
+        self.account = account
+        self.config = config or CampaignConfig()
+        self._band_bits = 64 // self.config.bands
+        # sender -> (campaigns by fingerprint, band key -> fingerprints), least recently used first
+        self._senders: 'OrderedDict[str, Tuple[Dict[int, Campaign], Dict[Tuple[int, int], List[int]]]]' = \
+            OrderedDict()
+
+    def _band_keys(self, fingerprint: int) -> List[Tuple[int, int]]:
+        mask = (1 << self._band_bits) - 1
+        return [(band, (fingerprint >> (band * self._band_bits)) & mask)
+                for band in range(self.config.bands)]
+
+    def _add(self, bands: Dict[Tuple[int, int], List[int]], fingerprint: int) -> None:
+        for key in self._band_keys(fingerprint):
+            bands.setdefault(key, []).append(fingerprint)
+
+    async def _load(self, sender: str) -> Tuple[Dict[int, Campaign], Dict[Tuple[int, int], List[int]]]:
+        if sender in self._senders:
+            self._senders.move_to_end(sender)
+            return self._senders[sender]
+        campaigns: Dict[int, Campaign] = {}
+        bands: Dict[Tuple[int, int], List[int]] = {}
+        for row in await self.store.sender_campaigns(self.account, sender):
+            campaign = Campaign(**row)
+            campaigns[campaign.fingerprint] = campaign
+            self._add(bands, campaign.fingerprint)
+        self._senders[sender] = (campaigns, bands)
+        if len(self._senders) > self.config.max_senders:
+            self._senders.popitem(last=False)
+        return campaigns, bands
+
+    async def match(self, sender: str, subject: str, body: str) -> Optional[Campaign]:
+        """The campaign this message belongs to, starting a new one if needed.
+
+        Returns None when the body is too short to fingerprint.
+        """
+        words = normalize_words(subject, body)
+        if len(words) < self.config.min_words:
+            return None
+        fingerprint = simhash(words, self.config.shingle_size)
+        address = sender_address(sender)
+        campaigns, bands = await self._load(address)
+        best: Optional[Campaign] = None
+        best_distance = self.config.max_distance + 1
+        for key in self._band_keys(fingerprint):
+            for candidate in bands.get(key, ()):
+                distance = hamming(fingerprint, candidate)
+                if distance < best_distance:
+                    best, best_distance = campaigns[candidate], distance
+        if best is None:
+            best = campaigns[fingerprint] = Campaign(sender=address, fingerprint=fingerprint)
+            self._add(bands, fingerprint)
+        best.members += 1
+        best.last_seen = time.time()
+        await self.store.save_campaign(self.account, asdict(best))
+        return best
+
+    def archive_decision(self, campaign: Campaign) -> Optional[str]:
+        """The campaign's archive decision JSON, unless missing or expired"""
+        if campaign.archive_decision is None or campaign.decided_at is None:
+            return None
+        if time.time() - campaign.decided_at > self.config.decision_ttl_seconds:
+            return None
+        return campaign.archive_decision
+
+    async def record_archive_decision(self, campaign: Campaign, decision: str) -> None:
+        campaign.archive_decision = decision
+        campaign.decided_at = time.time()
+        await self.store.save_campaign(self.account, asdict(campaign))
+
+    async def record_unsubscribe(self, campaign: Campaign, link: Optional[str], location: Optional[str]) -> None:
+        campaign.unsubscribe_checked = True
+        campaign.unsubscribe_link = link
+        campaign.unsubscribe_location = location
+        await self.store.save_campaign(self.account, asdict(campaign))
+
+    async def is_unsubscribed(self, sender: str, link: str) -> bool:
+        """Whether `link` already unsubscribed one of the sender's campaigns"""
+        campaigns, _ = await self._load(sender_address(sender))
+        return any(c.unsubscribed and c.unsubscribe_link == link for c in campaigns.values())
+
+    async def mark_unsubscribed(self, sender: str, link: str) -> None:
+        campaigns, _ = await self._load(sender_address(sender))
+        for campaign in campaigns.values():
+            if campaign.unsubscribe_link == link and not campaign.unsubscribed:
+                campaign.unsubscribed = True
+                await self.store.save_campaign(self.account, asdict(campaign))
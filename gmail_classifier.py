@@ -0,0 +1,323 @@
+"""Local pre-classifier for auto-archive decisions.
+
+Every LLM archive decision is stored as a training example and fed to an
+online logistic regression. Sparse features are hashed tokens from the
+sender, subject and body; dense features are the sender's archive history.
+Once enough examples are seen, a message whose predicted archive probability
+is beyond the configured threshold is decided locally in microseconds. Only
+uncertain messages still go to the LLM, and those answers keep training the
+model.
+
+By default the model runs in shadow mode: it learns and its decisions are
+compared with the LLM's in metrics and logs, but never acted on. A mailbox
+switches to local decisions with `--local-classifier on` once the shadow
+numbers show it agrees with the LLM.
+"""
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import copy
+import io
+import logging
+import math
+import re
+import time
+import zlib
+
+from gmail_state_db import GmailStateDatabase
+
+if TYPE_CHECKING:
+    import numpy as np
+
+_TOKEN_RE = re.compile(r'[a-z0-9]{2,}')
+_ADDRESS_RE = re.compile(r'<([^<>@\s]+@[^<>\s]+)>')
+
+CLASSIFIER_OFF = 'off'
+# Learn and compare with the LLM, without acting on local decisions
+CLASSIFIER_SHADOW = 'shadow'
+CLASSIFIER_ON = 'on'
+CLASSIFIER_MODES = (CLASSIFIER_OFF, CLASSIFIER_SHADOW, CLASSIFIER_ON)
+
+# log1p(archived), log1p(kept), smoothed archive rate
+N_DENSE = 3
+
+# Sparse features for one message: (hashed indices, values)
+Features = Tuple['np.ndarray', 'np.ndarray']
+
+
+@dataclass
+class ClassifierConfig:
+    # Decide locally when P(archive) >= threshold or <= 1 - threshold
+    threshold: float = 0.95
+    # Only compare local decisions with the LLM's; every message still goes to the LLM
+    shadow: bool = False
+    # LLM decisions to learn from before any local decision is made
+    min_examples: int = 200
+    # Hashed feature space size (a power of two)
+    n_features: int = 2 ** 18
+    learning_rate: float = 0.5
+    # Persist the model after this many updates
+    save_every: int = 50
+    # Training examples kept per account
+    max_examples: int = 50_000
+
+    def __post_init__(self) -> None:
+        if not 0.5 < self.threshold <= 1.0:
+            raise ValueError("threshold must be in (0.5, 1.0]")
+        if self.n_features & (self.n_features - 1):
+            raise ValueError("n_features must be a power of two")
+
+
+def sender_address(sender: str) -> str:
+    match = _ADDRESS_RE.search(sender)
+    return (match.group(1) if match else sender).strip().lower()
+
+
+def hash_features(email_data: Dict[str, Any], n_features: int) -> Features:
+    """Hashed tokens from the fields `_get_archive_decision` sees"""
+    import numpy as np
+    mask = n_features - 1
+    address = sender_address(email_data.get('from', ''))
+    tokens = [f"from:{address}", f"domain:{address.rpartition('@')[2]}",
+              f"attachments:{bool(email_data.get('has_attachments'))}"]
+    values = [1.0, 1.0, 1.0]
+    for prefix, field in (('s', 'subject'), ('b', 'body')):
+        words = set(_TOKEN_RE.findall((email_data.get(field) or '').lower()))
+        if words:
+            # Each text field contributes a unit-length vector regardless of its length
+            weight = 1.0 / math.sqrt(len(words))
+            tokens.extend(f"{prefix}:{word}" for word in words)
+            values.extend([weight] * len(words))
+    indices = np.fromiter(
+        (zlib.crc32(token.encode('utf-8')) & mask for token in tokens),
+        dtype=np.int64, count=len(tokens))
+    return indices, np.array(values)
+
+
+def sender_features(archived: int, kept: int) -> 'np.ndarray':
+    import numpy as np
+    return np.array([
+        math.log1p(archived),
+        math.log1p(kept),
+        (archived + 1) / (archived + kept + 2) - 0.5,
+    ])
+
+
+class ArchiveClassifier:
+    """Logistic regression over hashed sparse plus dense features, trained with AdaGrad"""
+
+    def __init__(self, n_features: int = 2 ** 18, learning_rate: float = 0.5):
+        import numpy as np
+        self.n_features = n_features
+        self.learning_rate = learning_rate
+        self.weights = np.zeros(n_features + N_DENSE)
+        # Per-weight sums of squared gradients, so rare tokens still learn quickly
+        self.grad_squares = np.full(n_features + N_DENSE, 1e-8)
+        self.bias = 0.0
+        self.bias_grad_squares = 1e-8
+        self.updates = 0
+
+    def _margin(self, features: Features, dense: 'np.ndarray') -> float:
+        indices, values = features
+        return float(self.weights[indices] @ values
+                     + self.weights[self.n_features:] @ dense + self.bias)
+
+    def predict_proba(self, features: Features, dense: 'np.ndarray') -> float:
+        """P(archive) for one message"""
+        margin = max(-30.0, min(30.0, self._margin(features, dense)))
+        return 1.0 / (1.0 + math.exp(-margin))
+
+    def partial_fit(self, features: Features, dense: 'np.ndarray', label: bool) -> None:
+        import numpy as np
+        error = self.predict_proba(features, dense) - float(label)
+        indices = np.concatenate([features[0], np.arange(
+            self.n_features, self.n_features + N_DENSE)])
+        gradient = error * np.concatenate([features[1], dense])
+        # Hash collisions repeat an index, so accumulate rather than assign
+        np.add.at(self.grad_squares, indices, gradient ** 2)
+        np.add.at(self.weights, indices,
+                  -self.learning_rate * gradient / np.sqrt(self.grad_squares[indices]))
+        self.bias_grad_squares += error ** 2
+        self.bias -= self.learning_rate * error / math.sqrt(self.bias_grad_squares)
+        self.updates += 1
+
+    def snapshot(self) -> 'ArchiveClassifier':
+        """Copy that later updates to this model don't change"""
+        model = copy.copy(self)
+        model.weights = self.weights.copy()
+        model.grad_squares = self.grad_squares.copy()
+        return model
+
+    def to_bytes(self) -> bytes:
+        import numpy as np
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, weights=self.weights, grad_squares=self.grad_squares,
+                            bias=np.array([self.bias, self.bias_grad_squares, self.updates]))
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes, learning_rate: float = 0.5) -> 'ArchiveClassifier':
+        import numpy as np
+        arrays = np.load(io.BytesIO(data))
+        model = cls(len(arrays['weights']) - N_DENSE, learning_rate)
+        model.weights = arrays['weights']
+        model.grad_squares = arrays['grad_squares']
+        model.bias, model.bias_grad_squares, updates = arrays['bias'].tolist()
+        model.updates = int(updates)
+        return model
+
+
+class LocalArchiveModel:
+    """Per-account classifier that learns from LLM decisions and answers confident cases"""
+
+    def __init__(self, store: GmailStateDatabase, account: str, config: Optional[ClassifierConfig] = None):
+        self.store = store
+        self.account = account
+        self.config = config or ClassifierConfig()
+        self.model = ArchiveClassifier(self.config.n_features, self.config.learning_rate)
+        # sender address -> [archived, kept]
+        self.senders: Dict[str, List[int]] = {}
+        self.examples = 0
+        self._loaded = False
+        # Held while loading, so decide() and learn() wait for the trained model
+        self._load_lock = asyncio.Lock()
+        self._unsaved = 0
+
+    async def load(self) -> None:
+        """Restore the saved model, or train one from stored examples"""
+        if self._loaded:
+            return
+        async with self._load_lock:
+            if not self._loaded:
+                self._loaded = True
+                await self._load()
+
+    async def _load(self) -> None:
+        saved = await self.store.get_archive_model(self.account)
+        if saved is not None:
+            self.model = await asyncio.to_thread(
+                ArchiveClassifier.from_bytes, saved, self.config.learning_rate)
+            if self.model.n_features != self.config.n_features:
+                logging.info("Archive classifier feature size changed, retraining")
+                saved = None
+        if saved is None:
+            self.model = ArchiveClassifier(self.config.n_features, self.config.learning_rate)
+        for sender, archived, kept in await self.store.archive_sender_counts(self.account):
+            self.senders[sender] = [archived, kept]
+        self.examples = sum(archived + kept for archived, kept in self.senders.values())
+        if saved is None and self.examples:
+            rows = await self.store.archive_examples(self.account)
+            # Replaying up to max_examples takes seconds, so it runs off the event loop
+            # on a fresh model that replaces the current one when done
+            model = ArchiveClassifier(self.config.n_features, self.config.learning_rate)
+            await asyncio.to_thread(
+                train, model, [(row['email_data'], row['can_archive']) for row in rows],
+                self.config.n_features)
+            self.model = model
+            await self.save()
+            logging.info(f"Trained archive classifier for {self.account} on {len(rows)} examples")
+
+    def _dense(self, address: str) -> 'np.ndarray':
+        archived, kept = self.senders.get(address, (0, 0))
+        return sender_features(archived, kept)
+
+    def predict(self, email_data: Dict[str, Any]) -> float:
+        """P(archive) for a message"""
+        return self.model.predict_proba(
+            hash_features(email_data, self.config.n_features),
+            self._dense(sender_address(email_data.get('from', ''))))
+
+    async def decide(self, email_data: Dict[str, Any]) -> Optional[Tuple[bool, float]]:
+        """(can_archive, probability) when confident enough, otherwise None"""
+        await self.load()
+        if self.examples < self.config.min_examples:
+            return None
+        probability = self.predict(email_data)
+        if probability >= self.config.threshold:
+            return True, probability
+        if probability <= 1.0 - self.config.threshold:
+            return False, probability
+        return None
+
+    async def learn(self, message_id: str, email_data: Dict[str, Any], can_archive: bool, confidence: float) -> None:
+        """Record an LLM decision and update the model with it"""
+        await self.load()
+        address = sender_address(email_data.get('from', ''))
+        # Sender history as it was before this decision, matching what predict() sees
+        self.model.partial_fit(
+            hash_features(email_data, self.config.n_features), self._dense(address), can_archive)
+        counts = self.senders.setdefault(address, [0, 0])
+        counts[0 if can_archive else 1] += 1
+        self.examples += 1
+        await self.store.insert_archive_example(
+            self.account, message_id, address, email_data, can_archive, confidence)
+        self._unsaved += 1
+        if self._unsaved >= self.config.save_every:
+            await self.save()
+
+    async def save(self) -> None:
+        self._unsaved = 0
+        # Compressing a trained model's weights takes a few hundred milliseconds, so it runs off
+        # the event loop, on a copy that learn() can't change underneath it
+        data = await asyncio.to_thread(self.model.snapshot().to_bytes)
+        await self.store.save_archive_model(self.account, data)
+        removed = await self.store.prune_archive_examples(self.account, self.config.max_examples)
+        if removed:
+            logging.info(f"Pruned {removed} archive classifier examples")
+
+
+def train(
+    model: ArchiveClassifier,
+    examples: Iterable[Tuple[Dict[str, Any], bool]],
+    n_features: int,
+    senders: Optional[Dict[str, List[int]]] = None
+) -> Dict[str, List[int]]:
+    """Replay examples in order, as the daemon would have seen them; returns sender counts"""
+    senders = {} if senders is None else senders
+    for email_data, label in examples:
+        address = sender_address(email_data.get('from', ''))
+        counts = senders.setdefault(address, [0, 0])
+        model.partial_fit(hash_features(email_data, n_features),
+                          sender_features(*counts), label)
+        counts[0 if label else 1] += 1
+    return senders
+
+
+def evaluate(
+    model: ArchiveClassifier,
+    examples: List[Tuple[Dict[str, Any], bool]],
+    n_features: int,
+    senders: Dict[str, List[int]],
+    thresholds: Iterable[float]
+) -> Dict[str, Any]:
+    """Accuracy, coverage and throughput of local decisions on held-out examples"""
+    import numpy as np
+    started = time.perf_counter()
+    probabilities = np.array([
+        model.predict_proba(hash_features(email_data, n_features),
+                            sender_features(*senders.get(sender_address(email_data.get('from', '')), (0, 0))))
+        for email_data, _ in examples])
+    seconds = time.perf_counter() - started
+    labels = np.array([label for _, label in examples], dtype=bool)
+    report: Dict[str, Any] = {
+        'examples': len(examples),
+        'accuracy_at_0.5': round(float(np.mean((probabilities >= 0.5) == labels)), 4) if len(examples) else None,
+        'predictions_per_sec': round(len(examples) / seconds) if seconds else None,
+        'us_per_prediction': round(1e6 * seconds / len(examples), 1) if len(examples) else None,
+        'thresholds': [],
+    }
+    for threshold in thresholds:
+        archive = probabilities >= threshold
+        keep = probabilities <= 1.0 - threshold
+        local = archive | keep
+        correct = (archive & labels) | (keep & ~labels)
+        report['thresholds'].append({
+            'threshold': threshold,
+            # Share of messages that would skip the LLM
+            'coverage': round(float(local.mean()), 4) if len(examples) else None,
+            'accuracy': round(float(correct.sum() / local.sum()), 4) if local.any() else None,
+            # Important mail archived without asking the LLM, the costly mistake
+            'wrongly_archived': int((archive & ~labels).sum()),
+            'wrongly_kept': int((keep & labels).sum()),
+        })
+    return report
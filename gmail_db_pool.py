@@ -0,0 +1,269 @@
+"""Async-safe database access for the Gmail rule daemon.
+
+`SQLitePool` gives coroutines non-blocking access to a SQLite file:
+- WAL journaling, so readers never wait for the writer.
+- A dedicated writer thread that commits every write queued while the
+  previous transaction was running as one transaction.
+- A small pool of reader threads, each with its own connection.
+- A statement cache sized for the daemon's fixed SQL strings.
+
+`AsyncGmailDatabase` wraps the synchronous `GmailDatabase` from
+`auto_file_sorter`, whose internals this package does not control. It
+confines the wrapped database to one worker thread and caches the lookups
+made for every message.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+import asyncio
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+from gmail_shared_state import SharedState
+
+T = TypeVar('T')
+
+# Shared counter bumped whenever any replica adds a blocked sender
+BLOCKED_VERSION_KEY = 'blocked_senders:version'
+
+_Job = Tuple[Callable[[sqlite3.Connection], Any], asyncio.Future, asyncio.AbstractEventLoop]
+
+
+def _resolve(future: asyncio.Future, result: Any, error: Optional[BaseException]) -> None:
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class SQLitePool:
+    """WAL-mode SQLite with one batching writer thread and a reader pool"""
+
+    def __init__(self, db_path: str, readers: int = 4, busy_timeout: float = 5.0, cached_statements: int = 256):
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        # Every ':memory:' connection is a separate database, so all access goes through the writer
+        self.readers = 0 if db_path == ':memory:' else readers
+        self._writer_conn = self._connect()
+        if self.readers:
+            self._writer_conn.execute("PRAGMA journal_mode=WAL")
+        self._queue: 'queue.Queue[Optional[_Job]]' = queue.Queue()
+        self._writer = threading.Thread(
+            target=self._write_loop, name='sqlite-writer', daemon=True)
+        self._local = threading.local()
+        self._reader_conns: List[sqlite3.Connection] = []
+        self._reader_lock = threading.Lock()
+        self._reader_pool = ThreadPoolExecutor(
+            max_workers=self.readers, thread_name_prefix='sqlite-reader') if self.readers else None
+        self._closed = False
+        self._started = False
+
+    def _connect(self) -> sqlite3.Connection:
+        # Transactions are managed explicitly, so use autocommit mode
+        conn = sqlite3.connect(
+            self.db_path, timeout=self.busy_timeout, isolation_level=None,
+            check_same_thread=False, cached_statements=self.cached_statements)
+        conn.row_factory = sqlite3.Row
+        # WAL only needs fsync at checkpoints; a power loss can drop the last commits but not corrupt
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def execute_script(self, script: str) -> None:
+        """Run DDL synchronously on the writer connection before the pool is used"""
+        if self._started:
+            raise RuntimeError("execute_script must run before the first read or write")
+        self._writer_conn.executescript(script)
+
+    def _start(self) -> None:
+        if not self._started:
+            self._started = True
+            self._writer.start()
+
+    async def write(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        """Run `fn(conn)` on the writer thread inside a batched transaction"""
+        if self._closed:
+            raise RuntimeError("SQLitePool is closed")
+        self._start()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put((fn, future, loop))
+        return await future
+
+    async def read(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        """Run `fn(conn)` on a reader thread"""
+        if self._reader_pool is None:
+            return await self.write(fn)
+        if self._closed:
+            raise RuntimeError("SQLitePool is closed")
+        return await asyncio.get_running_loop().run_in_executor(self._reader_pool, self._read, fn)
+
+    def _read(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            with self._reader_lock:
+                self._reader_conns.append(conn)
+        return fn(conn)
+
+    def _write_loop(self) -> None:
+        conn = self._writer_conn
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            batch = [job]
+            stopping = False
+            # Whatever queued up during the last commit goes into this transaction
+            while True:
+                try:
+                    queued = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if queued is None:
+                    stopping = True
+                    break
+                batch.append(queued)
+            self._run_batch(conn, batch)
+            if stopping:
+                break
+
+    def _run_batch(self, conn: sqlite3.Connection, batch: List[_Job]) -> None:
+        outcomes: List[Tuple[Any, Optional[BaseException]]] = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, _, _ in batch:
+                # A failing job only rolls back its own savepoint
+                conn.execute("SAVEPOINT job")
+                try:
+                    outcomes.append((fn(conn), None))
+                    conn.execute("RELEASE job")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO job")
+                    conn.execute("RELEASE job")
+                    outcomes.append((None, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            logging.error(f"SQLite write batch of {len(batch)} failed: {e}")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            outcomes = [(None, e)] * len(batch)
+        for (_, future, loop), (result, error) in zip(batch, outcomes):
+            loop.call_soon_threadsafe(_resolve, future, result, error)
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        if self._started:
+            self._queue.put(None)
+            self._writer.join()
+        if self._reader_pool is not None:
+            self._reader_pool.shutdown(wait=True)
+        for conn in self._reader_conns:
+            conn.close()
+        self._writer_conn.close()
+
+
+class AsyncGmailDatabase:
+    """Coroutine interface to `GmailDatabase`.
+
+    With `factory`, the database is created and used only on a dedicated
+    thread, so slow queries never block the event loop. An existing `db`
+    instance runs inline instead, because the thread that created its
+    connection is unknown. Blocked senders and natural-language rules are
+    read for every message, so they are cached for `cache_ttl` seconds and
+    invalidated by writes made through this object. With a distributed
+    `shared` state, adding a blocked sender also bumps a version counter
+    there, and every replica drops its cached list when the version moves.
+    """
+
+    def __init__(
+        self,
+        db: Any = None,
+        factory: Optional[Callable[[], Any]] = None,
+        cache_ttl: float = 30.0,
+        shared: Optional[SharedState] = None
+    ):
+        if (db is None) == (factory is None):
+            raise ValueError("Pass exactly one of db or factory")
+        self.cache_ttl = cache_ttl
+        self._executor: Optional[ThreadPoolExecutor] = None
+        if factory is not None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='gmail-db')
+            db = self._executor.submit(factory).result()
+        self.db = db
+        self._cache: Dict[str, Tuple[float, Any]] = {}
+        self.shared = shared
+        # Blocked-sender version the cached list was read at
+        self._blocked_version: Optional[str] = None
+
+    async def _call(self, fn: Callable[..., T], *args: Any) -> T:
+        if self._executor is None:
+            return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def _cached(self, key: str, fn: Callable[[], T]) -> T:
+        cached = self._cache.get(key)
+        if cached is not None and time.monotonic() - cached[0] < self.cache_ttl:
+            return cached[1]
+        value = await self._call(fn)
+        self._cache[key] = (time.monotonic(), value)
+        return value
+
+    async def create_blocked_sender(self, pattern: str, pattern_type: str) -> Optional[int]:
+        self._cache.pop('blocked_senders', None)
+        rule_id = await self._call(self.db.create_blocked_sender, pattern, pattern_type)
+        if self.shared is not None:
+            try:
+                await self.shared.incr(BLOCKED_VERSION_KEY)
+            except Exception as e:
+                logging.warning(f"Could not announce new blocked sender to other replicas: {e}")
+        return rule_id
+
+    async def get_all_blocked_senders(self) -> List[Dict[str, Any]]:
+        if self.shared is not None:
+            version = await self.shared.get(BLOCKED_VERSION_KEY)
+            if version != self._blocked_version:
+                self._cache.pop('blocked_senders', None)
+                self._blocked_version = version
+        return await self._cached('blocked_senders', self.db.get_all_blocked_senders)
+
+    async def create_nl_rule(self, rule: str, actions: List[Dict[str, Any]]) -> Optional[int]:
+        self._cache.pop('nl_rules', None)
+        return await self._call(self.db.create_nl_rule, rule, actions)
+
+    async def get_all_nl_rules(self) -> List[Dict[str, Any]]:
+        return await self._cached('nl_rules', self.db.get_all_nl_rules)
+
+    async def get_nl_rule(self, rule_id: int) -> Optional[Dict[str, Any]]:
+        return await self._call(self.db.get_nl_rule, rule_id)
+
+    async def get_nl_rules(self, rule_ids: List[Any]) -> List[Dict[str, Any]]:
+        """Fetch several rules with one hop to the database thread, in `rule_ids` order"""
+        listed = {str(rule['id']): rule for rule in await self.get_all_nl_rules()
+                  if 'actions' in rule}
+        if all(str(rule_id) in listed for rule_id in rule_ids):
+            return [listed[str(rule_id)] for rule_id in rule_ids]
+
+        def fetch() -> List[Dict[str, Any]]:
+            rules = []
+            for rule_id in rule_ids:
+                rule = listed.get(str(rule_id)) or self.db.get_nl_rule(rule_id)
+                if rule:
+                    rules.append(rule)
+            return rules
+        return await self._call(fetch)
+
+    async def create_label_with_uri(self, label: str, uri: Optional[str]) -> Optional[int]:
+        return await self._call(self.db.create_label_with_uri, label, uri)
+
+    async def close(self) -> None:
+        await self._call(self.db.close)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
@@ -0,0 +1,67 @@
+"""Build the discovery-based Gmail service without a network round trip.
+
+`googleapiclient.discovery.build('gmail', 'v1')` has to find the discovery
+document on every start. Client versions before 2.0 download it, and later
+ones read the copy bundled with the package. `build_gmail_service` keeps the
+document in a local cache file instead. The first start fills that file from
+the bundled copy, or from the network when there is none. After that, every
+process reads it once and builds each account's service from the same text
+with `build_from_document`.
+
+`googleapiclient.discovery` itself is only imported when a service is built,
+so CLI commands and workers that never touch Gmail don't pay for it.
+"""
+from pathlib import Path
+from typing import Any, Optional
+import logging
+import os
+import urllib.request
+
+DEFAULT_DISCOVERY_CACHE = Path('gmail_discovery_v1.json')
+DISCOVERY_URL = 'https://gmail.googleapis.com/$discovery/rest?version=v1'
+
+_document: Optional[str] = None
+
+
+def _bundled_document() -> Optional[str]:
+    try:
+        from googleapiclient.discovery_cache import get_static_doc
+    except ImportError:
+        # googleapiclient < 2.0 ships no documents
+        return None
+    return get_static_doc('gmail', 'v1')
+
+
+def _download_document() -> str:
+    logging.info(f"Downloading the Gmail discovery document from {DISCOVERY_URL}")
+    with urllib.request.urlopen(DISCOVERY_URL, timeout=30) as response:
+        return response.read().decode('utf-8')
+
+
+def discovery_document(cache_path: Path = DEFAULT_DISCOVERY_CACHE) -> str:
+    """The Gmail v1 discovery document, read at most once per process"""
+    global _document
+    if _document is not None:
+        return _document
+    try:
+        _document = cache_path.read_text(encoding='utf-8')
+        return _document
+    except OSError:
+        pass
+    document = _bundled_document() or _download_document()
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # Write then rename, so a concurrently starting worker never reads half a file
+        partial = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+        partial.write_text(document, encoding='utf-8')
+        os.replace(partial, cache_path)
+    except OSError as e:
+        logging.warning(f"Could not cache the Gmail discovery document at {cache_path}: {e}")
+    _document = document
+    return document
+
+
+def build_gmail_service(credentials: Any, cache_path: Path = DEFAULT_DISCOVERY_CACHE) -> Any:
+    """googleapiclient Gmail service built from the cached discovery document"""
+    from googleapiclient.discovery import build_from_document
+    return build_from_document(discovery_document(cache_path), credentials=credentials)
@@ -0,0 +1,118 @@
+"""Compact messages for the processing path.
+
+A `messages.get` response is a tree of dicts and lists: headers as
+`{'name', 'value'}` dicts, and base64 body data nested under
+`payload.parts[].body`. `GmailMessage(response)` walks it once. It keeps the
+headers as a name -> value dict with interned names, the label IDs, the
+text body parts and descriptors of the attachments, and nothing else. The
+response itself can be dropped straight away.
+
+Text parts keep their base64 data until it is first needed. It is then
+decoded to bytes and the encoded string is released. A message that never
+has its body read never decodes it, and a decoded one no longer holds both
+forms. Attachment data is never kept; descriptors carry the attachment ID
+for `messages.attachments.get`.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import base64
+import sys
+
+
+class BodyPart:
+    """A text part whose data is decoded on first access"""
+
+    __slots__ = ('mime_type', '_encoded', '_data')
+
+    def __init__(self, mime_type: str, encoded: str):
+        self.mime_type = sys.intern(mime_type)
+        self._encoded: Optional[str] = encoded
+        self._data: Optional[bytes] = None
+
+    @property
+    def data(self) -> bytes:
+        if self._data is None:
+            self._data = base64.urlsafe_b64decode(self._encoded or '')
+            self._encoded = None
+        return self._data
+
+    def text(self) -> str:
+        return self.data.decode('utf-8')
+
+
+class AttachmentInfo:
+    """A named part, without its data"""
+
+    __slots__ = ('filename', 'mime_type', 'attachment_id', 'size')
+
+    def __init__(self, filename: str, mime_type: str, attachment_id: Optional[str], size: int):
+        self.filename = filename
+        self.mime_type = sys.intern(mime_type)
+        self.attachment_id = attachment_id
+        self.size = size
+
+
+class GmailMessage:
+    """The parts of a Gmail message that rules, block patterns and AI prompts use"""
+
+    __slots__ = ('id', 'thread_id', 'label_ids', 'internal_date', 'headers',
+                 'body', 'parts', 'attachments', 'full')
+
+    id: str
+    thread_id: str
+    label_ids: Tuple[str, ...]
+    # Milliseconds since the epoch
+    internal_date: int
+    headers: Dict[str, str]
+    # The payload's own data, for single-part messages
+    body: Optional[BodyPart]
+    # Text parts nested anywhere in a multipart message, depth first
+    parts: Tuple[BodyPart, ...]
+    attachments: Tuple[AttachmentInfo, ...]
+    # False for metadata and minimal responses, which have no body
+    full: bool
+
+    def __init__(self, message: Dict[str, Any]):
+        self.id = message['id']
+        self.load(message)
+
+    def load(self, message: Dict[str, Any]) -> None:
+        """Replace this record's fields with those of a `messages.get` response"""
+        payload = message.get('payload', {})
+        self.thread_id = message.get('threadId', self.id)
+        self.label_ids = tuple(map(sys.intern, message.get('labelIds', ())))
+        self.internal_date = int(message.get('internalDate', 0))
+        # Like dict(), a repeated header keeps its last value
+        self.headers = {sys.intern(h['name']): h['value'] for h in payload.get('headers', ())}
+        self.full = 'body' in payload
+        self.body = None
+        parts: List[BodyPart] = []
+        attachments: List[AttachmentInfo] = []
+        if self.full:
+            if 'data' in payload['body'] and not payload.get('filename'):
+                self.body = BodyPart(payload.get('mimeType', ''), payload['body']['data'])
+            for part in payload.get('parts', ()):
+                _collect(part, parts, attachments)
+        self.parts = tuple(parts)
+        self.attachments = tuple(attachments)
+
+    @property
+    def has_attachments(self) -> bool:
+        return bool(self.attachments)
+
+    def text_part(self) -> Optional[BodyPart]:
+        """The single-part body, or else the first text/plain part"""
+        if self.body is not None:
+            return self.body
+        return next((part for part in self.parts if part.mime_type == 'text/plain'), None)
+
+
+def _collect(part: Dict[str, Any], parts: List[BodyPart], attachments: List[AttachmentInfo]) -> None:
+    body = part.get('body', {})
+    mime_type = part.get('mimeType', '')
+    if part.get('filename'):
+        attachments.append(AttachmentInfo(
+            part['filename'], mime_type, body.get('attachmentId'), body.get('size', 0)))
+    elif 'data' in body and mime_type.startswith('text/'):
+        parts.append(BodyPart(mime_type, body['data']))
+    for child in part.get('parts', ()):
+        _collect(child, parts, attachments)
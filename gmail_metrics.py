@@ -0,0 +1,209 @@
+"""Lightweight metrics for the Gmail rule daemon.
+
+`METRICS` collects counters and timing histograms. Timing spans are taken with
+`METRICS.span('fetch')`; when metrics are disabled `span()` returns a shared
+no-op object, so instrumented code pays only an attribute check. Metrics are
+exposed as Prometheus text on a local HTTP endpoint (`MetricsServer`) and/or
+written periodically as JSON (`write_json`).
+"""
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+import asyncio
+import bisect
+import json
+import logging
+import os
+import time
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class _Histogram:
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(DEFAULT_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(DEFAULT_BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class _Span:
+    __slots__ = ('_metrics', '_name', '_labels', '_started')
+
+    def __init__(self, metrics: 'Metrics', name: str, labels: Dict[str, Any]):
+        self._metrics = metrics
+        self._name = name
+        self._labels = labels
+        self._started = 0.0
+
+    def __enter__(self) -> '_Span':
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        self._metrics.observe(
+            'stage_seconds', time.perf_counter() - self._started, stage=self._name, **self._labels)
+        if exc_type is not None:
+            self._metrics.inc('errors', stage=self._name)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> '_NoopSpan':
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Metrics:
+    """Process-wide counters and histograms"""
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.counters: Dict[str, Dict[LabelKey, float]] = {}
+        self.histograms: Dict[str, Dict[LabelKey, _Histogram]] = {}
+        self.started_at = time.time()
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def span(self, name: str, **labels: Any) -> Any:
+        """Context manager timing a stage into the `stage_seconds` histogram"""
+        if not self.enabled:
+            return _NOOP_SPAN
+        return _Span(self, name, labels)
+
+    def inc(self, name: str, value: float = 1.0, **labels: Any) -> None:
+        if not self.enabled:
+            return
+        series = self.counters.setdefault(name, {})
+        key = _label_key(labels)
+        series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        if not self.enabled:
+            return
+        series = self.histograms.setdefault(name, {})
+        key = _label_key(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = _Histogram()
+        histogram.observe(value)
+
+    def render_prometheus(self) -> str:
+        """Render all series in the Prometheus text exposition format"""
+        def fmt(labels: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+            pairs = list(labels) + ([extra] if extra else [])
+            if not pairs:
+                return ''
+            return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+        lines = []
+        for name, series in sorted(self.counters.items()):
+            lines.append(f"# TYPE gmail_daemon_{name}_total counter")
+            for labels, value in sorted(series.items()):
+                lines.append(
+                    f"gmail_daemon_{name}_total{fmt(labels)} {value:g}")
+        for name, series in sorted(self.histograms.items()):
+            lines.append(f"# TYPE gmail_daemon_{name} histogram")
+            for labels, histogram in sorted(series.items()):
+                cumulative = 0
+                for bound, count in zip(DEFAULT_BUCKETS + (float('inf'),), histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else f"{bound:g}"
+                    lines.append(
+                        f"gmail_daemon_{name}_bucket{fmt(labels, ('le', le))} {cumulative}")
+                lines.append(
+                    f"gmail_daemon_{name}_sum{fmt(labels)} {histogram.total:.6f}")
+                lines.append(
+                    f"gmail_daemon_{name}_count{fmt(labels)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> Dict[str, Any]:
+        """JSON-serialisable view with counters and per-series count/mean/sum"""
+        def name_of(labels: LabelKey) -> str:
+            return ','.join(f"{k}={v}" for k, v in labels) or 'all'
+
+        return {
+            'uptime_seconds': round(time.time() - self.started_at, 1),
+            'counters': {
+                name: {name_of(k): v for k, v in series.items()}
+                for name, series in self.counters.items()
+            },
+            'histograms': {
+                name: {
+                    name_of(k): {
+                        'count': h.count,
+                        'sum': round(h.total, 6),
+                        'mean': round(h.total / h.count, 6) if h.count else 0.0,
+                    }
+                    for k, h in series.items()
+                }
+                for name, series in self.histograms.items()
+            },
+        }
+
+    def write_json(self, path: Path) -> None:
+        """Atomically write the current snapshot to `path`"""
+        tmp_path = path.with_suffix(path.suffix + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmp_path, path)
+
+
+METRICS = Metrics()
+
+
+class MetricsServer:
+    """Serve `GET /metrics` in Prometheus text format on a local port"""
+
+    def __init__(self, metrics: Metrics, host: str = '127.0.0.1', port: int = 9464):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logging.info(
+            f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = (await reader.readline()).decode('latin-1')
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            if request_line.startswith('GET /metrics'):
+                body = self.metrics.render_prometheus().encode('utf-8')
+                status = '200 OK'
+            else:
+                body = b''
+                status = '404 Not Found'
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('ascii') + body)
+            await writer.drain()
+        finally:
+            writer.close()
@@ -0,0 +1,174 @@
+"""Local metadata mirror of a Gmail mailbox.
+
+`MailboxMirror` copies ID, thread, selected headers, labels, size, date and an
+attachment flag for every message into `GmailStateDatabase`, then keeps it in
+step with `history.list`. Searches that only need metadata (`save_attachments`,
+`print_to_pdf`, folder sweeps, reports) are answered from SQLite, and Gmail is
+only asked for message content.
+"""
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set
+import asyncio
+import logging
+import time
+
+from googleapiclient.errors import HttpError
+
+if TYPE_CHECKING:
+    from gmail_rule_daemon import GmailAutomation
+
+MIRROR_HEADERS = ['From', 'To', 'Cc', 'Subject', 'Date', 'List-Unsubscribe']
+
+HISTORY_TYPES = ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved']
+
+
+def mirror_row(message: Dict[str, Any]) -> Dict[str, Any]:
+    """Flatten a `format='metadata'` message into a mirror row"""
+    headers = {h['name']: h['value'] for h in message['payload'].get('headers', [])}
+    return {
+        'message_id': message['id'],
+        'thread_id': message['threadId'],
+        'sender': headers.get('From', ''),
+        'subject': headers.get('Subject', ''),
+        'snippet': message.get('snippet', ''),
+        'headers': headers,
+        'internal_date': int(message['internalDate']) / 1000,
+        'size_estimate': int(message.get('sizeEstimate', 0)),
+        # Metadata responses have no parts; a multipart/mixed root is the usual attachment signal
+        'has_attachments': message['payload'].get('mimeType') == 'multipart/mixed',
+        'label_ids': message.get('labelIds', []),
+    }
+
+
+class MailboxMirror:
+    """Keep one mailbox's metadata mirrored locally"""
+
+    def __init__(self, gmail: 'GmailAutomation', max_staleness: float = 60.0, concurrency: int = 10):
+        self.gmail = gmail
+        self.state = gmail.state
+        self.account = gmail.account
+        # Local queries first catch up with history if the last sync is older than this
+        self.max_staleness = max_staleness
+        self.concurrency = concurrency
+        self._lock = asyncio.Lock()
+        self._synced_at = 0.0
+
+    async def history_id(self) -> Optional[int]:
+        """History ID the mirror is synced to, None before the first full sync"""
+        saved = await self.state.get_state(self.account, 'mirror_history_id')
+        return int(saved) if saved else None
+
+    async def ensure_fresh(self) -> bool:
+        """Catch up if stale; returns whether local queries can be answered"""
+        if await self.history_id() is None:
+            return False
+        if time.monotonic() - self._synced_at > self.max_staleness:
+            try:
+                await self.sync()
+            except HttpError as error:
+                logging.error(f"Mirror sync failed, using Gmail search: {error}")
+                return False
+        return True
+
+    async def sync(self) -> None:
+        """Run a full sync the first time, incremental history syncs afterwards"""
+        async with self._lock:
+            history_id = await self.history_id()
+            if history_id is not None:
+                await self._sync_history(history_id)
+            else:
+                await self._sync_full()
+            self._synced_at = time.monotonic()
+
+    async def _sync_full(self) -> None:
+        started = time.perf_counter()
+        # Take the history baseline first so changes during the listing are replayed later
+        profile = await self.gmail.execute(
+            self.gmail.service.users().getProfile(userId='me'), 'getProfile')
+        listed: List[str] = []
+        page_token = None
+        while True:
+            response = await self.gmail.execute(self.gmail.service.users().messages().list(
+                userId='me', maxResults=500, pageToken=page_token), 'messages.list')
+            listed.extend(m['id'] for m in response.get('messages', []))
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+        mirrored = set(await self.state.mirrored_ids(self.account))
+        await self._fetch_and_store([m for m in listed if m not in mirrored])
+        gone = list(mirrored - set(listed))
+        if gone:
+            await self.state.delete_mirror(self.account, gone)
+        await self.state.set_state(self.account, 'mirror_history_id', profile['historyId'])
+        logging.info(
+            f"Mirrored {len(listed)} messages for {self.account} in {time.perf_counter() - started:.1f}s")
+
+    async def _sync_history(self, history_id: int) -> None:
+        added: List[str] = []
+        deleted: Set[str] = set()
+        labels: Dict[str, List[str]] = {}
+        page_token = None
+        try:
+            while True:
+                response = await self.gmail.execute(self.gmail.service.users().history().list(
+                    userId='me',
+                    startHistoryId=history_id,
+                    historyTypes=HISTORY_TYPES,
+                    pageToken=page_token
+                ), 'history.list')
+                for record in response.get('history', []):
+                    for change in record.get('messagesAdded', []):
+                        added.append(change['message']['id'])
+                    for change in record.get('messagesDeleted', []):
+                        deleted.add(change['message']['id'])
+                    # Label changes carry the message's complete label set; keep the latest
+                    for kind in ('labelsAdded', 'labelsRemoved'):
+                        for change in record.get(kind, []):
+                            labels[change['message']['id']] = change['message'].get('labelIds', [])
+                page_token = response.get('nextPageToken')
+                if not page_token:
+                    break
+        except HttpError as error:
+            if error.resp.status != 404:
+                raise
+            logging.warning(
+                f"Mirror history {history_id} expired for {self.account}, resyncing")
+            await self.state.delete_mirror(self.account)
+            await self._sync_full()
+            return
+
+        if deleted:
+            await self.state.delete_mirror(self.account, list(deleted))
+        new_ids = [m for m in dict.fromkeys(added) if m not in deleted]
+        await self._fetch_and_store(new_ids)
+        fetched = set(new_ids)
+        # Fetched messages already have current labels; only mirrored ones need updating
+        mirrored = set(await self.state.mirrored_ids(self.account)) if labels else set()
+        updates = {m: label_ids for m, label_ids in labels.items()
+                   if m in mirrored and m not in deleted and m not in fetched}
+        if updates:
+            await self.state.set_mirror_labels(self.account, updates)
+        await self.state.set_state(self.account, 'mirror_history_id', str(response['historyId']))
+        logging.debug(
+            f"Mirror sync: {len(new_ids)} added, {len(deleted)} deleted, {len(updates)} relabelled")
+
+    async def _fetch_and_store(self, message_ids: List[str]) -> None:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(message_id: str) -> Optional[Dict[str, Any]]:
+            async with semaphore:
+                try:
+                    return await self.gmail.execute(self.gmail.service.users().messages().get(
+                        userId='me', id=message_id, format='metadata',
+                        metadataHeaders=MIRROR_HEADERS), 'messages.get')
+                except HttpError as error:
+                    # Deleted between listing and fetching
+                    if error.resp.status == 404:
+                        return None
+                    raise
+
+        # Store in chunks so an interrupted first sync keeps its progress
+        for start in range(0, len(message_ids), 500):
+            chunk = message_ids[start:start + 500]
+            messages = await asyncio.gather(*(fetch(m) for m in chunk))
+            await self.state.upsert_mirror(
+                self.account, [mirror_row(m) for m in messages if m is not None])
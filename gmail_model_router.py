@@ -0,0 +1,351 @@
+"""Per-task routing of AI calls across model tiers.
+
+Each task (`archive_decision`, `unsubscribe_detect`, ...) has an ordered
+list of tiers. Cheap JSON tasks try a small local Ollama model first and
+escalate to the next tier in any of these cases:
+- the answer does not parse as JSON;
+- a required key is missing;
+- the reported confidence is below the route's threshold;
+- the tier fails.
+A tier that cannot be reached is skipped for `breaker_seconds`, so a stopped
+Ollama costs one failed call rather than one per message. Each tier has its
+own `AIScheduler` because each backend has its own concurrency and token
+limits. Calls, latency, escalations and estimated cost are counted per tier.
+
+`LocalModelServer` speaks the Ollama `/api/generate` protocol with canned
+answers, so routing can be exercised offline.
+"""
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import json
+import logging
+import re
+import sys
+import time
+
+from gmail_ai_scheduler import AIScheduler, AISchedulerConfig
+from gmail_metrics import METRICS
+
+PROVIDER_AI_SERVICE = 'ai_service'
+PROVIDER_OLLAMA = 'ollama'
+
+_FENCE_RE = re.compile(r'^\s*```(?:json)?\s*|\s*```\s*$')
+
+
+@dataclass
+class ModelTier:
+    provider: str = PROVIDER_AI_SERVICE
+    model: str = 'gpt-4'
+    # Ollama generate endpoint, for provider 'ollama'
+    url: Optional[str] = None
+    # Blended USD per 1,000 prompt and completion tokens
+    cost_per_1k_tokens: float = 0.0
+    max_in_flight: int = 4
+    tokens_per_minute: float = 90_000
+    timeout: float = 60.0
+
+
+@dataclass
+class TaskRoute:
+    tiers: List[str]
+    # Escalate when the answer's 'confidence' is below this
+    min_confidence: Optional[float] = None
+    # Escalate when the JSON answer lacks any of these keys
+    required_keys: List[str] = field(default_factory=list)
+
+
+@dataclass
+class RoutingConfig:
+    tiers: Dict[str, ModelTier]
+    routes: Dict[str, TaskRoute]
+    # Tier for tasks without a route
+    default_tier: str
+
+
+def default_routing_config(model: str = 'gpt-4') -> RoutingConfig:
+    """A single tier answering every task, matching the daemon without a routes file"""
+    return RoutingConfig(tiers={'large': ModelTier(model=model)}, routes={}, default_tier='large')
+
+
+def load_routing_config(path: Path) -> RoutingConfig:
+    with open(path, 'r') as f:
+        data = json.load(f)
+    config = RoutingConfig(
+        tiers={name: ModelTier(**tier) for name, tier in data['tiers'].items()},
+        routes={task: TaskRoute(**route) for task, route in data.get('routes', {}).items()},
+        default_tier=data['default_tier'])
+    for task, route in config.routes.items():
+        unknown = [tier for tier in route.tiers if tier not in config.tiers]
+        if unknown or not route.tiers:
+            raise ValueError(f"Route for {task} has unknown or no tiers: {unknown}")
+    if config.default_tier not in config.tiers:
+        raise ValueError(f"Unknown default tier: {config.default_tier}")
+    return config
+
+
+def parse_json_response(text: Optional[str]) -> Optional[Dict[str, Any]]:
+    """JSON object in a model answer, or None if it is not one"""
+    try:
+        value = json.loads(text or '')
+    except json.JSONDecodeError:
+        return None
+    return value if isinstance(value, dict) else None
+
+
+def escalation_reason(route: TaskRoute, response: Optional[str]) -> Optional[str]:
+    """Why an answer is not good enough to keep, or None to accept it"""
+    if route.min_confidence is None and not route.required_keys:
+        return None
+    parsed = parse_json_response(response)
+    if parsed is None:
+        return 'invalid_json'
+    if any(key not in parsed for key in route.required_keys):
+        return 'missing_keys'
+    if route.min_confidence is not None:
+        try:
+            if float(parsed.get('confidence') or 0.0) < route.min_confidence:
+                return 'low_confidence'
+        except (TypeError, ValueError):
+            return 'invalid_json'
+    return None
+
+
+def tier_unreachable(error: BaseException) -> bool:
+    """Whether a tier failed to answer at all, rather than answered with an error"""
+    # httpx is only loaded once an Ollama tier exists; without it no error can be one of its
+    httpx = sys.modules.get('httpx')
+    return httpx is not None and isinstance(error, (httpx.TransportError, httpx.HTTPStatusError))
+
+
+@dataclass
+class ModelCompletion:
+    response: str
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+
+
+class OllamaService:
+    """`chat_completion` over Ollama's `/api/generate` endpoint"""
+
+    def __init__(self, url: str, model: str, timeout: float = 60.0):
+        import httpx
+        self.url = url
+        self.model = model
+        self._client = httpx.AsyncClient(timeout=timeout)
+
+    async def chat_completion(self, messages: List[Any], **kwargs: Any) -> ModelCompletion:
+        system = '\n\n'.join(m.content for m in messages if m.role == 'system')
+        prompt = '\n\n'.join(m.content for m in messages if m.role != 'system')
+        response = await self._client.post(self.url, json={
+            'model': self.model,
+            'system': system,
+            'prompt': prompt,
+            'stream': False,
+        })
+        response.raise_for_status()
+        body = response.json()
+        return ModelCompletion(
+            # Small models often wrap JSON in a code fence the daemon's parsers reject
+            response=_FENCE_RE.sub('', body.get('response', '')),
+            prompt_tokens=body.get('prompt_eval_count'),
+            completion_tokens=body.get('eval_count'))
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+
+@dataclass
+class TierStats:
+    calls: int = 0
+    errors: int = 0
+    escalations: int = 0
+    seconds: float = 0.0
+    tokens: int = 0
+    cost_usd: float = 0.0
+
+
+class ModelRouter:
+    """Send each task to its cheapest adequate tier"""
+
+    def __init__(
+        self,
+        config: RoutingConfig,
+        services: Dict[str, Any],
+        schedulers: Optional[Dict[str, AIScheduler]] = None,
+        breaker_seconds: float = 60.0
+    ):
+        self.config = config
+        self.services = services
+        self.schedulers = schedulers or {
+            name: AIScheduler(services[name], AISchedulerConfig(
+                max_in_flight=tier.max_in_flight,
+                batch_slots=max(1, tier.max_in_flight // 2),
+                tokens_per_minute=tier.tokens_per_minute))
+            for name, tier in config.tiers.items()
+        }
+        self.breaker_seconds = breaker_seconds
+        self.stats: Dict[str, TierStats] = {name: TierStats() for name in config.tiers}
+        self._down_until: Dict[str, float] = {}
+
+    @classmethod
+    def build(cls, config: RoutingConfig, ai_service_factory: Callable[[str], Any]) -> 'ModelRouter':
+        """Create each tier's backend: Ollama over HTTP, or the AI service for the tier's model"""
+        services = {}
+        for name, tier in config.tiers.items():
+            if tier.provider == PROVIDER_OLLAMA:
+                if not tier.url:
+                    raise ValueError(f"Ollama tier {name} needs a url")
+                services[name] = OllamaService(tier.url, tier.model, tier.timeout)
+            elif tier.provider == PROVIDER_AI_SERVICE:
+                services[name] = ai_service_factory(tier.model)
+            else:
+                raise ValueError(f"Unknown provider for tier {name}: {tier.provider}")
+        return cls(config, services)
+
+    @classmethod
+    def single(cls, ai_service: Any, scheduler: Optional[AIScheduler] = None) -> 'ModelRouter':
+        """Route everything to one service, optionally through an existing scheduler"""
+        return cls(default_routing_config(), {'large': ai_service},
+                   schedulers={'large': scheduler or AIScheduler(ai_service)})
+
+    @property
+    def default_scheduler(self) -> AIScheduler:
+        return self.schedulers[self.config.default_tier]
+
+    def route(self, task: str) -> TaskRoute:
+        return self.config.routes.get(task) or TaskRoute(tiers=[self.config.default_tier])
+
+    async def complete(self, task: str, messages: List[Any]) -> Any:
+        route = self.route(task)
+        now = time.monotonic()
+        tiers = [tier for tier in route.tiers if self._down_until.get(tier, 0.0) <= now]
+        # The last tier is always tried, even while its breaker is open
+        if not tiers or tiers[-1] != route.tiers[-1]:
+            tiers.append(route.tiers[-1])
+        for position, tier in enumerate(tiers):
+            last = position == len(tiers) - 1
+            stats = self.stats[tier]
+            started = time.perf_counter()
+            try:
+                completion = await self.schedulers[tier].complete(task, messages)
+            except Exception as e:
+                stats.errors += 1
+                METRICS.inc('ai_tier_errors', tier=tier, task=task)
+                if last:
+                    raise
+                if tier_unreachable(e):
+                    self._down_until[tier] = time.monotonic() + self.breaker_seconds
+                    logging.warning(
+                        f"Model tier {tier} unavailable, skipping it for {self.breaker_seconds:.0f}s: {e}")
+                stats.escalations += 1
+                METRICS.inc('ai_escalations', tier=tier, task=task, reason='error')
+                continue
+            self._record(tier, task, messages, completion, time.perf_counter() - started)
+            if last:
+                return completion
+            reason = escalation_reason(route, getattr(completion, 'response', None))
+            if reason is None:
+                return completion
+            stats.escalations += 1
+            METRICS.inc('ai_escalations', tier=tier, task=task, reason=reason)
+            logging.debug(f"Escalating {task} from {tier}: {reason}")
+        raise RuntimeError(f"No model tier answered {task}")
+
+    def _record(self, tier: str, task: str, messages: List[Any], completion: Any, seconds: float) -> None:
+        # ~4 characters per token when the backend reports no usage
+        tokens = (getattr(completion, 'prompt_tokens', None) or sum(len(m.content) for m in messages) // 4) + \
+            (getattr(completion, 'completion_tokens', None) or len(getattr(completion, 'response', '') or '') // 4)
+        cost = tokens * self.config.tiers[tier].cost_per_1k_tokens / 1000
+        stats = self.stats[tier]
+        stats.calls += 1
+        stats.seconds += seconds
+        stats.tokens += tokens
+        stats.cost_usd += cost
+        METRICS.inc('ai_tier_calls', tier=tier, task=task)
+        METRICS.observe('ai_tier_seconds', seconds, tier=tier, task=task)
+        METRICS.inc('ai_tier_cost_usd', cost, tier=tier, task=task)
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        return {name: {**asdict(stats), 'seconds': round(stats.seconds, 3),
+                       'cost_usd': round(stats.cost_usd, 4)}
+                for name, stats in self.stats.items()}
+
+    async def close(self) -> None:
+        for scheduler in self.schedulers.values():
+            await scheduler.close()
+        for service in self.services.values():
+            if isinstance(service, OllamaService):
+                await service.aclose()
+
+
+class LocalModelServer:
+    """Offline stand-in for an Ollama server.
+
+    Answers `POST /api/generate` with `answer(system, prompt)` after
+    `latency` seconds, reporting token counts like Ollama does.
+    """
+
+    def __init__(
+        self,
+        answer: Callable[[str, str], Awaitable[str]],
+        host: str = '127.0.0.1',
+        port: int = 0,
+        latency: float = 0.0
+    ):
+        self.answer = answer
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.requests = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}/api/generate"
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        # Port 0 picks a free port
+        self.port = self._server.sockets[0].getsockname()[1]
+        logging.info(f"Local model server listening on {self.url}")
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = (await reader.readline()).decode('latin-1')
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1')
+                if line in ('\r\n', '\n', ''):
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            if not request_line.startswith('POST /api/generate'):
+                status, payload = '404 Not Found', {'error': 'not found'}
+            else:
+                self.requests += 1
+                request = json.loads(body)
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                response = await self.answer(request.get('system', ''), request.get('prompt', ''))
+                status, payload = '200 OK', {
+                    'model': request.get('model'),
+                    'response': response,
+                    'done': True,
+                    'prompt_eval_count': (len(request.get('system', '')) + len(request.get('prompt', ''))) // 4,
+                    'eval_count': len(response) // 4,
+                }
+            data = json.dumps(payload).encode('utf-8')
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode('ascii') + data)
+            await writer.drain()
+        finally:
+            writer.close()
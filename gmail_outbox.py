@@ -0,0 +1,250 @@
+"""Persistent outbound queue for replies, forwards and reports.
+
+Rule processing only builds the message and calls `Outbox.enqueue`, which
+writes it to the `outbox` table of `GmailStateDatabase` and returns. A
+background task claims due messages in batches and sends them at batch
+priority, behind a token bucket that keeps the mailbox under Gmail's sending
+limits. The sender starts with the first `enqueue`, or with `resume` for
+messages a previous run left queued. Every message has a dedup key, so a
+forward re-queued after a restart or a repeated rule match is sent once.
+Rate-limit and server errors are retried with exponential backoff; other
+errors fail the message.
+
+Claimed rows record the claiming process. Message-shard workers share one
+account's rows, so a starting outbox only fails the in-flight sends of
+processes that are no longer running, never those of a live worker.
+"""
+from dataclasses import dataclass
+from email.message import EmailMessage
+from email.policy import SMTP
+from email.utils import formatdate, make_msgid
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+import asyncio
+import base64
+import logging
+import os
+import random
+import socket
+import time
+
+from gmail_quota import PRIORITY_BATCH, TokenBucket, is_retryable
+
+if TYPE_CHECKING:
+    from gmail_rule_daemon import GmailAutomation
+
+# (filename, content, MIME type) of an attachment
+Attachment = Tuple[str, bytes, str]
+
+
+def build_message(
+    to: str,
+    subject: str,
+    body: str,
+    in_reply_to: Optional[str] = None,
+    references: Optional[str] = None,
+    attachments: Optional[List[Attachment]] = None
+) -> EmailMessage:
+    """Build a properly encoded message; Gmail fills in From for the sending user"""
+    message = EmailMessage()
+    message['To'] = to
+    message['Subject'] = subject
+    message['Date'] = formatdate(localtime=True)
+    message['Message-ID'] = make_msgid()
+    if in_reply_to:
+        message['In-Reply-To'] = in_reply_to
+        message['References'] = f"{references} {in_reply_to}" if references else in_reply_to
+    message.set_content(body)
+    for filename, content, mime_type in attachments or []:
+        maintype, _, subtype = mime_type.partition('/')
+        message.add_attachment(content, maintype=maintype,
+                               subtype=subtype, filename=filename)
+    return message
+
+
+def encode_message(message: EmailMessage) -> str:
+    """base64url encoding expected in the Gmail API `raw` field"""
+    return base64.urlsafe_b64encode(message.as_bytes(policy=SMTP)).decode('ascii')
+
+
+@dataclass
+class OutboxConfig:
+    # Messages claimed and sent concurrently per round
+    batch_size: int = 10
+    # Consumer Gmail accounts may send about 500 messages a day
+    sends_per_minute: float = 20.0
+    burst: int = 5
+    max_attempts: int = 5
+    retry_base_seconds: float = 60.0
+    retry_max_seconds: float = 3600.0
+    # Seconds between checks for retries when nothing is enqueued
+    idle_seconds: float = 60.0
+    # Sent and failed rows (and so their dedup keys) are kept this long
+    retention_days: float = 30
+
+
+def owner_running(owner: str) -> bool:
+    """Whether the 'host:pid' process that claimed outbox rows may still be sending them"""
+    host, _, pid = owner.rpartition(':')
+    if host != socket.gethostname():
+        # Processes on other hosts can't be checked; their rows are left to them
+        return True
+    if int(pid) == os.getpid():
+        # Only one outbox per account runs in a process, so these rows belong to an earlier one
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running, as another user
+        return True
+    # A reused PID keeps the rows in flight until that process exits too
+    return True
+
+
+class Outbox:
+    """Background sender for one mailbox"""
+
+    def __init__(self, gmail: 'GmailAutomation', config: Optional[OutboxConfig] = None):
+        self.gmail = gmail
+        self.state = gmail.state
+        self.account = gmail.account
+        self.config = config or OutboxConfig()
+        self.bucket = TokenBucket(self.config.sends_per_minute / 60, self.config.burst)
+        self._wake = asyncio.Event()
+        self._task: Optional['asyncio.Task[None]'] = None
+        self._stopping = False
+        self._recovered = False
+        # Recorded on claimed rows; the same form as RedisSharedState.owner
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    async def enqueue(
+        self,
+        kind: str,
+        dedup_key: str,
+        message: EmailMessage,
+        thread_id: Optional[str] = None,
+        draft: bool = False
+    ) -> bool:
+        """Persist `message` for sending (or drafting); False if already queued"""
+        queued = await self.state.enqueue_outbound(
+            self.account, dedup_key, kind, encode_message(message), thread_id, draft)
+        if queued:
+            self.start()
+            self._wake.set()
+        else:
+            logging.info(f"Skipped duplicate outbound {kind} {dedup_key}")
+        return queued
+
+    async def resume(self) -> bool:
+        """Start the sender for rows saved by a previous run, returning whether there were any"""
+        counts = await self.state.outbound_counts(self.account)
+        # 'sending' rows were interrupted; the first flush marks them failed
+        if not counts.get('pending') and not counts.get('sending'):
+            return False
+        logging.info(f"Resuming outbox for {self.account}: {counts.get('pending', 0)} messages waiting")
+        self.start()
+        return True
+
+    def start(self) -> None:
+        """Start the background sender if it is not running"""
+        if not self._stopping and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(
+                self._run(), name=f"outbox:{self.account}")
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            self._wake.clear()
+            try:
+                if await self.flush():
+                    continue
+                next_at = await self.state.next_outbound_at(self.account)
+            except Exception as e:
+                logging.error(f"Error sending outbound mail for {self.account}: {e}")
+                next_at = None
+            delay = self.config.idle_seconds if next_at is None else min(
+                self.config.idle_seconds, max(0.0, next_at - time.time()))
+            if self._stopping:
+                break
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def flush(self) -> int:
+        """Send one batch of due messages, returning how many were attempted"""
+        if not self._recovered:
+            self._recovered = True
+            gone = [owner for owner in await self.state.sending_owners(self.account)
+                    if owner is None or not owner_running(owner)]
+            interrupted = await self.state.fail_interrupted_outbound(self.account, gone) if gone else 0
+            if interrupted:
+                logging.warning(
+                    f"{interrupted} outbound messages were in flight when their process stopped; "
+                    f"marked failed rather than risking duplicates")
+        rows = await self.state.claim_outbound(self.account, self.config.batch_size, self.owner)
+        if not rows:
+            return 0
+        results = await asyncio.gather(
+            *(self._send(row) for row in rows), return_exceptions=True)
+
+        sent: Dict[str, str] = {}
+        retry: Dict[str, Tuple[float, str]] = {}
+        failed: Dict[str, str] = {}
+        for row, result in zip(rows, results):
+            key = row['dedup_key']
+            if not isinstance(result, BaseException):
+                sent[key] = result
+            elif is_retryable(result) and row['attempts'] + 1 < self.config.max_attempts:
+                retry[key] = (time.time() + self._backoff(row['attempts']), str(result))
+                logging.warning(
+                    f"Outbound {row['kind']} {key} failed, retry {row['attempts'] + 1}: {result}")
+            else:
+                failed[key] = str(result)
+                logging.error(f"Outbound {row['kind']} {key} failed: {result}")
+        await self.state.finish_outbound(self.account, sent, retry, failed)
+        logging.info(
+            f"Outbox {self.account}: {len(sent)} sent, {len(retry)} to retry, {len(failed)} failed")
+        return len(rows)
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.config.retry_max_seconds,
+                    self.config.retry_base_seconds * 2 ** attempts)
+        return random.uniform(delay / 2, delay)
+
+    async def _send(self, row: Dict[str, Any]) -> str:
+        while True:
+            wait = self.bucket.try_take(1)
+            if wait == 0.0:
+                break
+            await asyncio.sleep(wait)
+        message: Dict[str, Any] = {'raw': row['raw']}
+        if row['thread_id']:
+            message['threadId'] = row['thread_id']
+        with self.gmail.quota.priority(PRIORITY_BATCH):
+            if row['draft']:
+                response = await self.gmail.execute(self.gmail.service.users().drafts().create(
+                    userId='me', body={'message': message}), 'drafts.create')
+            else:
+                response = await self.gmail.execute(self.gmail.service.users().messages().send(
+                    userId='me', body=message), 'messages.send')
+        return response['id']
+
+    async def prune(self) -> int:
+        removed = await self.state.prune_outbound(self.config.retention_days * 86400)
+        if removed:
+            logging.info(f"Pruned {removed} finished outbound messages")
+        return removed
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """Send what is already due, then stop the background sender"""
+        self._stopping = True
+        if self._task is None:
+            return
+        # Let the current round finish so no message is left marked in flight
+        self._wake.set()
+        try:
+            await asyncio.wait_for(self._task, timeout=timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Outbox for {self.account} did not stop within {timeout}s")
+        self._task = None
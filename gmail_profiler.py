@@ -0,0 +1,171 @@
+"""On-demand sampling profiler for daemon ticks.
+
+`PROFILER.arm(ticks)` (triggered by SIGUSR1 or a supervisor `profile` command)
+profiles the next N ticks: polls, push notifications and scheduled jobs. An interval timer samples the event loop's
+stack every few milliseconds and prefixes each stack with the asyncio task that
+was running, so time spent in e.g. `BeautifulSoup` construction or the
+`re.search` calls in `check_blocked_sender` is attributed to the poll that
+caused it. In `cpu` mode samples are only taken while the process is on CPU;
+`wall` mode also shows time blocked in I/O. The daemon's event loop must run on
+the main thread, which is where Python delivers signals. Results are written in the
+collapsed-stack format used by flamegraph.pl and speedscope, and the top
+functions are logged.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from types import FrameType
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import logging
+import signal
+import time
+
+PROFILE_MODES = ('wall', 'cpu')
+
+
+@dataclass
+class ProfilerConfig:
+    output_dir: Path = Path('profiles')
+    mode: str = 'wall'
+    ticks: int = 5
+    # Seconds between stack samples
+    interval: float = 0.005
+    top_n: int = 15
+
+
+def _frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+
+class _Sampler:
+    """Sample the main thread's stack from an interval-timer signal.
+
+    A sampling thread could only run when the event loop releases the GIL,
+    which biases every sample towards `select()`. The timer signal handler
+    instead runs on the loop thread at the next bytecode boundary and sees the
+    interrupted frame directly. `ITIMER_PROF` only counts CPU time, while
+    `ITIMER_REAL` also samples the loop while it is waiting on I/O.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, mode: str, interval: float):
+        self.loop = loop
+        self.mode = mode
+        self.interval = interval
+        self.stacks: Dict[str, int] = {}
+        self.samples = 0
+        self._timer, self._signal = (signal.ITIMER_PROF, signal.SIGPROF) if mode == 'cpu' else (
+            signal.ITIMER_REAL, signal.SIGALRM)
+        self._previous_handler: Any = None
+
+    def start(self) -> None:
+        self._previous_handler = signal.signal(self._signal, self._sample)
+        signal.setitimer(self._timer, self.interval, self.interval)
+
+    def stop(self) -> None:
+        signal.setitimer(self._timer, 0)
+        signal.signal(self._signal, self._previous_handler or signal.SIG_DFL)
+
+    def _sample(self, signum: int, frame: Optional[FrameType]) -> None:
+        stack: List[str] = []
+        while frame is not None:
+            stack.append(_frame_label(frame))
+            frame = frame.f_back
+        task = asyncio.current_task(self.loop)
+        stack.append(f"task:{task.get_name()}" if task else "task:<none>")
+        key = ';'.join(reversed(stack))
+        self.stacks[key] = self.stacks.get(key, 0) + 1
+        self.samples += 1
+
+
+class TickProfiler:
+    """Profile the next N ticks when armed"""
+
+    def __init__(self, config: Optional[ProfilerConfig] = None):
+        self.config = config or ProfilerConfig()
+        self._pending_ticks = 0
+        self._active = 0
+        self._sampler: Optional[_Sampler] = None
+        self._mode = self.config.mode
+        self._started_at = 0.0
+
+    def arm(self, ticks: Optional[int] = None, mode: Optional[str] = None) -> None:
+        """Profile the next `ticks` ticks (safe to call from a signal handler)"""
+        if mode is not None and mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode: {mode}")
+        self._mode = mode or self.config.mode
+        self._pending_ticks = ticks or self.config.ticks
+        logging.info(
+            f"Profiling the next {self._pending_ticks} ticks ({self._mode})")
+
+    def install_signal_handler(self, sig: int = signal.SIGUSR1) -> None:
+        """Arm the profiler whenever the process receives `sig`"""
+        asyncio.get_running_loop().add_signal_handler(sig, self.arm)
+
+    def wrap(self, tick: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        """Wrap a tick coroutine function so armed ticks are profiled"""
+        async def profiled_tick(*args: Any, **kwargs: Any) -> Any:
+            if self._pending_ticks <= 0:
+                return await tick(*args, **kwargs)
+            self._pending_ticks -= 1
+            self._start()
+            try:
+                return await tick(*args, **kwargs)
+            finally:
+                self._finish_tick()
+        return profiled_tick
+
+    def _start(self) -> None:
+        self._active += 1
+        if self._sampler is None:
+            self._started_at = time.monotonic()
+            self._sampler = _Sampler(
+                asyncio.get_running_loop(), self._mode, self.config.interval)
+            self._sampler.start()
+
+    def _finish_tick(self) -> None:
+        self._active -= 1
+        if self._active > 0 or self._pending_ticks > 0 or self._sampler is None:
+            return
+        sampler = self._sampler
+        self._sampler = None
+        sampler.stop()
+        self._write(sampler, time.monotonic() - self._started_at)
+
+    def _write(self, sampler: _Sampler, seconds: float) -> None:
+        if not sampler.samples:
+            logging.info("Profile captured no samples")
+            return
+        self.config.output_dir.mkdir(parents=True, exist_ok=True)
+        path = self.config.output_dir / \
+            f"ticks_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{sampler.mode}.folded"
+        with open(path, 'w') as f:
+            for stack, count in sorted(sampler.stacks.items()):
+                f.write(f"{stack} {count}\n")
+        logging.info(
+            f"Wrote {sampler.mode} profile of {seconds:.1f}s ({sampler.samples} samples) to {path}")
+        for line in summarize(sampler.stacks, self.config.top_n):
+            logging.info(line)
+
+
+def summarize(stacks: Dict[str, int], top_n: int = 15) -> List[str]:
+    """Top functions by self and inclusive sample share"""
+    total = sum(stacks.values())
+    self_counts: Dict[str, int] = {}
+    inclusive: Dict[str, int] = {}
+    for stack, count in stacks.items():
+        frames = [f for f in stack.split(';') if not f.startswith('task:')]
+        if not frames:
+            continue
+        self_counts[frames[-1]] = self_counts.get(frames[-1], 0) + count
+        for frame in set(frames):
+            inclusive[frame] = inclusive.get(frame, 0) + count
+    lines = [f"Top {top_n} functions by self time ({total} samples):"]
+    for frame, count in sorted(self_counts.items(), key=lambda kv: -kv[1])[:top_n]:
+        lines.append(
+            f"  {100 * count / total:5.1f}% self {100 * inclusive[frame] / total:5.1f}% total  {frame}")
+    return lines
+
+
+PROFILER = TickProfiler()
@@ -0,0 +1,235 @@
+"""Shrink email content before it is sent to a model.
+
+`PromptCompressor.compress(task, text)` applies these steps in order:
+1. Converts HTML to text, dropping `<head>`, CSS, scripts and tracking
+   pixels.
+2. Cuts quoted reply chains and signatures.
+3. Shortens long URLs to their host.
+4. Collapses whitespace runs.
+5. Drops lines repeated within the message, and boilerplate lines that
+   have already been seen in many other messages.
+6. Trims the result to the task's token budget, keeping the start and the
+   end of the message.
+
+Links that look like unsubscribe links are never shortened or dropped,
+because `find_unsubscribe_link` has to return them verbatim. Tokens are
+counted with tiktoken when it is installed, and otherwise estimated at
+about four characters per token. Bytes and tokens before and after are
+counted per task.
+"""
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import re
+
+from gmail_metrics import METRICS
+
+try:
+    import tiktoken
+    _ENCODING: Any = tiktoken.get_encoding('cl100k_base')
+except ImportError:
+    _ENCODING = None
+
+# Whether token counts are exact or the characters-per-token estimate
+TOKENIZER = 'tiktoken' if _ENCODING is not None else 'estimate'
+
+CHARS_PER_TOKEN = 4
+
+# Token budget for the email content of each task's prompt
+DEFAULT_BUDGETS = {
+    'summarize': 1500,
+    'auto_reply': 1500,
+    'unsubscribe_detect': 600,
+    'nl_rule_match': 800,
+    'archive_decision': 300,
+}
+
+_BLOCK_TAGS = ['p', 'div', 'tr', 'li', 'table', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote']
+_HTML_RE = re.compile(r'<(?:html|body|div|p|br|table|span|a)\b', re.IGNORECASE)
+_UNSUBSCRIBE_RE = re.compile(r'unsubscribe|opt[-_ ]?out|email[-_ ]?preferences', re.IGNORECASE)
+_URL_RE = re.compile(r'https?://[^\s<>"\')\]]+')
+# "On Mon, 1 Jan 2024 at 10:00, Alice <a@example.com> wrote:" and Outlook headers
+_QUOTE_HEADER_RE = re.compile(
+    r'^(?:On .{0,200}wrote:\s*$|-{2,}\s*Original Message\s*-{2,}|_{10,}\s*$|From: .+\n(?:Sent|Date): )',
+    re.MULTILINE)
+_SIGNATURE_RE = re.compile(
+    r'^(?:-- ?$|Sent from my \w+|Get Outlook for \w+)', re.MULTILINE | re.IGNORECASE)
+_BLANK_LINES_RE = re.compile(r'\n\s*\n\s*')
+_SPACES_RE = re.compile(r'[ \t\u00a0\u200b\u200c\u200d\ufeff]+')
+
+
+@dataclass
+class CompressionConfig:
+    budgets: Dict[str, int] = field(default_factory=lambda: dict(DEFAULT_BUDGETS))
+    # Budget for tasks missing from `budgets`
+    default_budget: int = 1500
+    # URLs longer than this are replaced by their host, unless they look like unsubscribe links
+    max_url_chars: int = 60
+    # A line seen in more than this many messages is treated as boilerplate
+    boilerplate_after: int = 3
+    # Line fingerprints remembered for boilerplate detection
+    max_fingerprints: int = 20_000
+
+
+@dataclass
+class TaskCompressionStats:
+    calls: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    tokens_in: int = 0
+    tokens_out: int = 0
+
+
+def count_tokens(text: str) -> int:
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate_tokens(text: str, budget: int, tail_share: float = 0.25) -> str:
+    """Trim `text` to `budget` tokens, keeping the start and a share of the end"""
+    if count_tokens(text) <= budget:
+        return text
+    tail = int(budget * tail_share)
+    head = budget - tail
+    if _ENCODING is not None:
+        tokens = _ENCODING.encode(text, disallowed_special=())
+        return (_ENCODING.decode(tokens[:head]) + "\n[...]\n" +
+                (_ENCODING.decode(tokens[-tail:]) if tail else ''))
+    return (text[:head * CHARS_PER_TOKEN] + "\n[...]\n" +
+            (text[-tail * CHARS_PER_TOKEN:] if tail else ''))
+
+
+def _fingerprint(text: str) -> bytes:
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest()
+
+
+def looks_like_html(text: str) -> bool:
+    return bool(_HTML_RE.search(text[:2000]))
+
+
+def html_to_text(html: str, keep_links: bool = False) -> str:
+    """Visible text of an HTML body; with `keep_links`, anchors become `text <url>`"""
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+    for tag in soup(['head', 'style', 'script', 'noscript', 'title', 'meta']):
+        tag.decompose()
+    for img in soup.find_all('img'):
+        # Tracking pixels and images carry no text; keep any meaningful alt text
+        alt = (img.get('alt') or '').strip()
+        img.replace_with(f" {alt} " if alt else ' ')
+    if keep_links:
+        for anchor in soup.find_all('a', href=True):
+            anchor.replace_with(f" {anchor.get_text(' ', strip=True)} <{anchor['href']}> ")
+    for br in soup.find_all('br'):
+        br.replace_with('\n')
+    # Inline tags stay on one line; block tags end one
+    for block in soup.find_all(_BLOCK_TAGS):
+        block.append('\n')
+    return soup.get_text()
+
+
+def strip_quoted(text: str) -> str:
+    """Drop quoted replies: `>` lines and everything after a reply header"""
+    match = _QUOTE_HEADER_RE.search(text)
+    if match and match.start() > 0:
+        text = text[:match.start()]
+    return '\n'.join(line for line in text.split('\n') if not line.lstrip().startswith('>'))
+
+
+def strip_signature(text: str) -> str:
+    match = _SIGNATURE_RE.search(text)
+    # A "signature" at the very top is more likely content
+    return text[:match.start()] if match and match.start() > 0 else text
+
+
+def shorten_urls(text: str, max_chars: int) -> str:
+    def shorten(match: 're.Match[str]') -> str:
+        url = match.group(0)
+        if len(url) <= max_chars or _UNSUBSCRIBE_RE.search(url):
+            return url
+        return f"{url.split('/', 3)[2]}/…"
+    return _URL_RE.sub(shorten, text)
+
+
+def collapse_whitespace(text: str) -> str:
+    lines = (_SPACES_RE.sub(' ', line).strip() for line in text.split('\n'))
+    return _BLANK_LINES_RE.sub('\n\n', '\n'.join(lines)).strip()
+
+
+class PromptCompressor:
+    """Compress email content per task and count what was saved"""
+
+    def __init__(self, config: Optional[CompressionConfig] = None):
+        self.config = config or CompressionConfig()
+        self.stats: Dict[str, TaskCompressionStats] = {}
+        # line fingerprint -> (messages it appeared in, last message), least recently seen first
+        self._seen: 'OrderedDict[bytes, Tuple[int, bytes]]' = OrderedDict()
+
+    def budget(self, task: str) -> int:
+        return self.config.budgets.get(task, self.config.default_budget)
+
+    def compress(self, task: str, text: str, html: Optional[bool] = None, keep_links: bool = False) -> str:
+        """Compressed `text` for `task`'s prompt.
+
+        `html` defaults to sniffing the content. `keep_links` keeps link
+        targets in converted HTML and leaves footers, signatures and
+        boilerplate in place, for tasks that look for links there.
+        """
+        original = text or ''
+        if html is None:
+            html = looks_like_html(original)
+        text = html_to_text(original, keep_links) if html else original
+        if not keep_links:
+            text = strip_signature(strip_quoted(text))
+        text = collapse_whitespace(shorten_urls(text, self.config.max_url_chars))
+        text = self._dedup_lines(text, _fingerprint(original), drop_boilerplate=not keep_links)
+        text = truncate_tokens(text, self.budget(task))
+        self._record(task, original, text)
+        return text
+
+    def _dedup_lines(self, text: str, message: bytes, drop_boilerplate: bool) -> str:
+        kept: List[str] = []
+        in_message = set()
+        for line in text.split('\n'):
+            # Short lines ("Hi Bob,", "Thanks") repeat for reasons other than boilerplate
+            if len(line) < 40:
+                kept.append(line)
+                continue
+            key = _fingerprint(line.lower())
+            if key in in_message:
+                continue
+            in_message.add(key)
+            seen, last = self._seen.pop(key, (0, b''))
+            if last != message:
+                # The same message compressed for another task does not count again
+                seen += 1
+            self._seen[key] = (seen, message)
+            if len(self._seen) > self.config.max_fingerprints:
+                self._seen.popitem(last=False)
+            if drop_boilerplate and seen > self.config.boilerplate_after and \
+                    not _UNSUBSCRIBE_RE.search(line):
+                continue
+            kept.append(line)
+        return collapse_whitespace('\n'.join(kept))
+
+    def _record(self, task: str, original: str, compressed: str) -> None:
+        stats = self.stats.setdefault(task, TaskCompressionStats())
+        bytes_in, bytes_out = len(original.encode('utf-8')), len(compressed.encode('utf-8'))
+        tokens_in, tokens_out = count_tokens(original), count_tokens(compressed)
+        stats.calls += 1
+        stats.bytes_in += bytes_in
+        stats.bytes_out += bytes_out
+        stats.tokens_in += tokens_in
+        stats.tokens_out += tokens_out
+        METRICS.inc('prompt_bytes_saved', bytes_in - bytes_out, task=task)
+        METRICS.inc('prompt_tokens_saved', tokens_in - tokens_out, task=task)
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        """Per-task totals with the share of tokens saved"""
+        return {
+            task: {**asdict(stats), 'tokens_saved_pct': round(
+                100 * (1 - stats.tokens_out / stats.tokens_in), 1) if stats.tokens_in else 0.0}
+            for task, stats in sorted(self.stats.items())
+        }
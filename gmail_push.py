@@ -0,0 +1,162 @@
+"""Push ingestion of Gmail watch notifications for the rule daemon.
+
+Gmail `users.watch` publishes a Pub/Sub message containing the mailbox address
+and its latest history ID whenever the mailbox changes. `PushListener` accepts
+those notifications either as Pub/Sub push requests on a local HTTP endpoint
+(the same `/webhooks/gmail/subscription` route the web app exposes) or directly
+on an in-process queue, and hands the history IDs to the rule engine.
+`LocalPubSubPublisher` is a stand-in for Pub/Sub used for local testing.
+"""
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional
+from urllib.parse import parse_qs, urlsplit
+import asyncio
+import base64
+import json
+import logging
+
+PUSH_PATH = '/webhooks/gmail/subscription'
+
+
+@dataclass(frozen=True)
+class GmailNotification:
+    email_address: str
+    history_id: int
+
+
+def decode_push_envelope(payload: Dict[str, Any]) -> GmailNotification:
+    """Decode a Pub/Sub push envelope carrying a Gmail watch notification"""
+    data = json.loads(base64.b64decode(payload['message']['data']))
+    return GmailNotification(
+        email_address=data['emailAddress'],
+        history_id=int(data['historyId'])
+    )
+
+
+def encode_push_envelope(notification: GmailNotification, message_id: str = '1') -> Dict[str, Any]:
+    """Build the Pub/Sub push envelope Gmail would deliver for a notification"""
+    data = json.dumps({
+        'emailAddress': notification.email_address,
+        'historyId': notification.history_id
+    }).encode('utf-8')
+    return {
+        'message': {
+            'data': base64.b64encode(data).decode('ascii'),
+            'messageId': message_id,
+        },
+        'subscription': 'projects/local/subscriptions/gmail-push',
+    }
+
+
+@dataclass
+class PushConfig:
+    host: str = '127.0.0.1'
+    port: int = 8085
+    # Pub/Sub topic passed to users.watch; None when notifications come from elsewhere
+    topic_name: Optional[str] = None
+    # Shared secret expected as ?token=... on push requests
+    verification_token: Optional[str] = None
+    # Safety-net poll interval while push is active
+    fallback_poll_seconds: float = 900.0
+
+
+class PushListener:
+    """Receive Gmail notifications over HTTP or a local queue and dispatch them"""
+
+    def __init__(
+        self,
+        config: PushConfig,
+        handler: Callable[[GmailNotification], Awaitable[None]]
+    ):
+        self.config = config
+        self.handler = handler
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._consumer: Optional[asyncio.Task] = None
+
+    def submit(self, notification: GmailNotification) -> None:
+        """Enqueue a notification directly (local queue ingestion)"""
+        self.queue.put_nowait(notification)
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.config.host, self.config.port)
+        self._consumer = asyncio.create_task(self._consume())
+        logging.info(
+            f"Listening for Gmail push notifications on http://{self.config.host}:{self.config.port}{PUSH_PATH}")
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._consumer:
+            self._consumer.cancel()
+            await asyncio.gather(self._consumer, return_exceptions=True)
+
+    async def _consume(self) -> None:
+        while True:
+            notification = await self.queue.get()
+            # Coalesce a burst: only the newest history ID per mailbox matters
+            latest = {notification.email_address: notification}
+            while not self.queue.empty():
+                queued = self.queue.get_nowait()
+                current = latest.get(queued.email_address)
+                if current is None or queued.history_id > current.history_id:
+                    latest[queued.email_address] = queued
+            for pending in latest.values():
+                try:
+                    await self.handler(pending)
+                except Exception as e:
+                    logging.error(
+                        f"Error handling push notification {pending}: {e}")
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        status = '204 No Content'
+        try:
+            request_line = (await reader.readline()).decode('latin-1').strip()
+            method, target, _ = request_line.split(' ', 2)
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1')
+                if line in ('\r\n', '\n', ''):
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+            url = urlsplit(target)
+            token = parse_qs(url.query).get('token', [None])[0]
+            if method != 'POST' or url.path != PUSH_PATH:
+                status = '404 Not Found'
+            elif self.config.verification_token and token != self.config.verification_token:
+                status = '403 Forbidden'
+            else:
+                self.submit(decode_push_envelope(json.loads(body)))
+        except (ValueError, KeyError, json.JSONDecodeError, asyncio.IncompleteReadError) as e:
+            # Acknowledge malformed messages anyway so Pub/Sub does not redeliver them forever
+            logging.error(f"Malformed push notification: {e}")
+        finally:
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode('ascii'))
+            await writer.drain()
+            writer.close()
+
+
+class LocalPubSubPublisher:
+    """Stand-in for Pub/Sub that pushes Gmail notifications to a local listener"""
+
+    def __init__(self, endpoint: str, verification_token: Optional[str] = None):
+        self.endpoint = endpoint
+        self.verification_token = verification_token
+        self._message_id = 0
+
+    async def publish(self, email_address: str, history_id: int) -> int:
+        """POST a notification envelope and return the HTTP status code"""
+        import httpx
+        self._message_id += 1
+        envelope = encode_push_envelope(
+            GmailNotification(email_address, history_id), str(self._message_id))
+        params = {'token': self.verification_token} if self.verification_token else None
+        async with httpx.AsyncClient() as client:
+            response = await client.post(self.endpoint, json=envelope, params=params)
+        return response.status_code
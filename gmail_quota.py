@@ -0,0 +1,240 @@
+"""Quota-aware rate limiting and retries for Gmail API calls.
+
+Gmail charges each call a number of quota units per user (250 units/second by
+default). `GmailQuotaLimiter` meters every call through a token bucket sized to
+that budget, retries rate-limit, server and network errors with exponential
+backoff and full jitter, and lets batch jobs yield to interactive rule processing by
+keeping a share of the bucket in reserve for interactive calls. Long jobs can
+also be capped at a fixed share of the quota with `GmailQuotaLimiter.share`.
+
+A send that failed with a server or network error may still have been
+delivered, so `messages.send` and `drafts.create` are only retried here after
+rate limits; the outbox retries the rest under its deduplication key.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional
+import asyncio
+import logging
+import random
+import socket
+import sys
+import time
+
+from googleapiclient.errors import HttpError
+
+# https://developers.google.com/gmail/api/reference/quota
+GMAIL_QUOTA_UNITS: Dict[str, int] = {
+    'getProfile': 1,
+    'watch': 100,
+    'drafts.create': 10,
+    'history.list': 2,
+    'labels.create': 5,
+    'labels.get': 1,
+    'labels.list': 1,
+    'messages.attachments.get': 5,
+    'messages.batchModify': 50,
+    'messages.get': 5,
+    'messages.list': 5,
+    'messages.modify': 5,
+    'messages.send': 100,
+    'messages.trash': 5,
+    'threads.get': 10,
+}
+DEFAULT_QUOTA_UNITS = 5
+
+# Per-user budget; processes sharing a mailbox split it between them
+GMAIL_UNITS_PER_SECOND = 250.0
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+RETRYABLE_403_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+# Connection resets, refused connections and timeouts of either transport
+RETRYABLE_NETWORK_ERRORS = (ConnectionError, TimeoutError, socket.timeout)
+
+# Calls that must not be repeated when they may already have taken effect
+NON_IDEMPOTENT_METHODS = ('messages.send', 'drafts.create')
+
+_current_priority: ContextVar[int] = ContextVar(
+    'gmail_quota_priority', default=PRIORITY_INTERACTIVE)
+_current_share: ContextVar[Optional['TokenBucket']] = ContextVar(
+    'gmail_quota_share', default=None)
+
+
+def current_priority() -> int:
+    """Priority set by the innermost `GmailQuotaLimiter.priority` context"""
+    return _current_priority.get()
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether a Gmail error is a rate limit, transient server failure or network error"""
+    if not isinstance(error, HttpError):
+        return is_network_error(error)
+    status = error.resp.status
+    if status in RETRYABLE_STATUS:
+        return True
+    return status == 403 and any(
+        reason in str(error) for reason in RETRYABLE_403_REASONS)
+
+
+def is_network_error(error: BaseException) -> bool:
+    if isinstance(error, RETRYABLE_NETWORK_ERRORS):
+        return True
+    # Only the httpx transport raises these, and it has imported httpx by then
+    httpx = sys.modules.get('httpx')
+    return httpx is not None and isinstance(error, httpx.TransportError)
+
+
+def is_rate_limit(error: BaseException) -> bool:
+    """Whether Gmail refused the call for quota, so it certainly did not take effect"""
+    return isinstance(error, HttpError) and is_retryable(error) and error.resp.status in (403, 429)
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate` tokens per second"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens +
+                          (now - self._updated) * self.rate)
+        self._updated = now
+
+    def available(self) -> float:
+        self._refill()
+        return self.tokens
+
+    def try_take(self, amount: float, reserve: float = 0.0) -> float:
+        """Take tokens if `reserve` would remain; otherwise return seconds to wait"""
+        self._refill()
+        if self.tokens - amount >= reserve:
+            self.tokens -= amount
+            return 0.0
+        return (amount + reserve - self.tokens) / self.rate
+
+    def drain(self) -> None:
+        """Empty the bucket, e.g. after the server reported a rate limit"""
+        self._refill()
+        self.tokens = 0.0
+
+
+class GmailQuotaLimiter:
+    """Central wrapper that meters, throttles and retries Gmail API calls"""
+
+    def __init__(
+        self,
+        units_per_second: float = GMAIL_UNITS_PER_SECOND,
+        burst_seconds: float = 1.0,
+        batch_reserve: float = 0.3,
+        max_retries: int = 5,
+        base_delay: float = 1.0,
+        max_delay: float = 64.0
+    ):
+        self.bucket = TokenBucket(
+            units_per_second, units_per_second * burst_seconds)
+        # Share of the bucket batch calls must leave for interactive calls
+        self.batch_reserve = batch_reserve
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.units_used: Dict[str, int] = {}
+        self.calls: Dict[str, int] = {}
+        self.retries: Dict[str, int] = {}
+
+    @staticmethod
+    def cost(method: str) -> int:
+        return GMAIL_QUOTA_UNITS.get(method, DEFAULT_QUOTA_UNITS)
+
+    @contextmanager
+    def priority(self, priority: int) -> Iterator[None]:
+        """Run all calls made in this context (and its tasks) at `priority`"""
+        token = _current_priority.set(priority)
+        try:
+            yield
+        finally:
+            _current_priority.reset(token)
+
+    @contextmanager
+    def share(self, fraction: float) -> Iterator[None]:
+        """Cap all calls made in this context (and its tasks) at `fraction` of the quota"""
+        if not 0.0 < fraction <= 1.0:
+            raise ValueError("Quota share must be in (0, 1]")
+        # Large enough for the most expensive call, or it could never be paid
+        capacity = max(self.bucket.capacity * fraction, max(GMAIL_QUOTA_UNITS.values()))
+        token = _current_share.set(TokenBucket(self.bucket.rate * fraction, capacity))
+        try:
+            yield
+        finally:
+            _current_share.reset(token)
+
+    def headroom(self) -> float:
+        """Fraction (0.0-1.0) of the per-user quota currently available"""
+        return self.bucket.available() / self.bucket.capacity
+
+    async def acquire(self, method: str, priority: Optional[int] = None) -> None:
+        """Wait until the bucket can pay for a call to `method`"""
+        if priority is None:
+            priority = _current_priority.get()
+        units = self.cost(method)
+        reserve = self.bucket.capacity * \
+            self.batch_reserve if priority == PRIORITY_BATCH else 0.0
+        # Never require more than a full bucket, or expensive calls would wait forever
+        reserve = min(reserve, max(0.0, self.bucket.capacity - units))
+        share = _current_share.get()
+        if share is not None:
+            while True:
+                wait = share.try_take(units)
+                if wait == 0.0:
+                    break
+                await asyncio.sleep(wait)
+        while True:
+            wait = self.bucket.try_take(units, reserve)
+            if wait == 0.0:
+                break
+            await asyncio.sleep(wait)
+        self.units_used[method] = self.units_used.get(method, 0) + units
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def execute(self, request: Any, method: str, priority: Optional[int] = None) -> Any:
+        """Execute a Gmail request under the quota, retrying transient failures"""
+        attempt = 0
+        while True:
+            await self.acquire(method, priority)
+            try:
+                if hasattr(request, 'execute_async'):
+                    return await request.execute_async()
+                return request.execute()
+            except Exception as error:
+                if not is_retryable(error) or attempt >= self.max_retries:
+                    raise
+                if is_rate_limit(error):
+                    # Everyone backs off, not just this caller
+                    self.bucket.drain()
+                elif method in NON_IDEMPOTENT_METHODS:
+                    # May have been delivered; the outbox decides whether to send again
+                    raise
+                delay = self._backoff(attempt)
+                attempt += 1
+                self.retries[method] = self.retries.get(method, 0) + 1
+                reason = error.resp.status if isinstance(error, HttpError) else type(error).__name__
+                logging.warning(
+                    f"Gmail {method} failed with {reason}, retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'headroom': self.headroom(),
+            'calls': dict(self.calls),
+            'units_used': dict(self.units_used),
+            'retries': dict(self.retries),
+        }
@@ -1,21 +1,17 @@
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
+import argparse
+import asyncio
 import base64
 import os
 import re
 import logging
 from pathlib import Path
-from typing import List, Optional, Set, BinaryIO, Any, Dict, Callable, Tuple
-from bs4 import BeautifulSoup
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build, Resource
+from typing import TYPE_CHECKING, List, Optional, Set, BinaryIO, Any, Dict, Callable, Tuple, cast
 from googleapiclient.errors import HttpError
-import fpdf
 import time
 import json
-import httpx
+import hashlib
 import csv
 from urllib.parse import urlparse
 from abc import ABC, abstractmethod
@@ -25,32 +21,47 @@ from ai_service import AIService, ChatCompletionMessageInput
 from auto_file_sorter.logging.logging_config import configure_logging
 from auto_file_sorter.auth_base import GoogleServiceAuth
 from auto_file_sorter.db.gmail_db import GmailDatabase
-from langchain.output_parsers import ResponseSchema, StructuredOutputParser
-from langchain.prompts import PromptTemplate
 from auto_file_sorter.models.unsubscribe_link import UnsubscribeLinkOutput
-from email_validator import validate_email, EmailNotValidError
 from auto_file_sorter.models.archive_decision import ArchiveDecisionOutput
+from gmail_supervisor import AccountConfig, ShardSupervisor, load_accounts, owns_message
+from gmail_scheduler import AdaptiveInterval, DaemonScheduler, ScheduledJob
+from gmail_push import GmailNotification, PushConfig, PushListener
+from gmail_quota import GMAIL_UNITS_PER_SECOND, GmailQuotaLimiter, PRIORITY_BATCH
+from gmail_async_transport import AsyncGmailService, TRANSPORT_DISCOVERY, TRANSPORT_HTTPX, TRANSPORTS
+from gmail_discovery import DEFAULT_DISCOVERY_CACHE, build_gmail_service
+from gmail_metrics import METRICS, MetricsServer
+from gmail_profiler import PROFILER, PROFILE_MODES, ProfilerConfig
+from gmail_state_db import DEFAULT_STATE_PATH, GmailStateDatabase, ProcessedLedger
+from gmail_db_pool import AsyncGmailDatabase
+from gmail_outbox import Outbox, OutboxConfig, build_message
+from gmail_archive_report import REPORT_ATTACHMENTS, ArchiveReportBuilder, ArchiveReportConfig
+from gmail_classifier import CLASSIFIER_MODES, CLASSIFIER_OFF, CLASSIFIER_SHADOW, ClassifierConfig, LocalArchiveModel
+from gmail_ai_scheduler import AIScheduler
+from gmail_model_router import ModelCompletion, ModelRouter, load_routing_config
+from gmail_mirror import MailboxMirror
+from gmail_prompt_compression import PromptCompressor
+from gmail_campaigns import Campaign, CampaignIndex
+from gmail_backfill import Backfill, BackfillConfig
+from gmail_rules import EmailRule, blocking_pattern, match_rules, needs_body
+from gmail_message import GmailMessage
+from gmail_shared_state import AI_DECISION_TTL, LABEL_TTL, RedisSharedState, SharedState
+
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
+    from langchain.output_parsers import StructuredOutputParser
 
 configure_logging()
 
 
-@dataclass
+@dataclass(frozen=True)
 class UnreadTracker:
+    message_id: str
     sender: str
     subject: str
     timestamp: datetime
     days_unread: int
 
 
-@dataclass
-class EmailRule:
-    name: str
-    # e.g., {'from': 'example@gmail.com', 'subject': '.*invoice.*'}
-    conditions: Dict[str, str]
-    # e.g., [{'type': 'label', 'value': 'Invoices'}, {'type': 'save_attachment'}]
-    actions: List[Dict[str, Any]]
-
-
 @dataclass
 class GmailFilterSize:
     greaterThan: bool
@@ -87,14 +98,30 @@ class GmailFilter:
     action: GmailFilterAction = field(default_factory=GmailFilterAction)
 
 
-# Define response schemas
+# Archive decisions below this confidence keep the email
+ARCHIVE_MIN_CONFIDENCE = 0.8
+
+# Campaigns with no new mail for this long are forgotten
+CAMPAIGN_RETENTION_SECONDS = 180 * 86400
+
+# IDs the first message shard listed for the others are kept this long
+SHARD_LISTING_RETENTION_SECONDS = 86400
+
+# Most message IDs Gmail accepts in one messages.batchModify
+BATCH_MODIFY_LIMIT = 1000
+
+# Tasks whose answer depends only on the prompt, so identical prompts share it
+CACHED_AI_TASKS = ('archive_decision', 'unsubscribe_detect', 'nl_rule_match')
+
+# Define response schemas, as `ResponseSchema` arguments so langchain is only
+# imported once natural language rules are used
 NL_RULE_SCHEMAS = [
-    ResponseSchema(
+    dict(
         name="id",
         description="List of rule IDs that match the email content",
         type="list"
     ),
-    ResponseSchema(
+    dict(
         name="name",
         description="Name of the matched rule",
         type="string"
@@ -115,30 +142,190 @@ class GmailAutomation(GoogleServiceAuth):
             'https://www.googleapis.com/auth/gmail.settings.sharing'
         ]
 
-    def __init__(self, credentials_path: str, token_path: str, ai_service: AIService, db: GmailDatabase):
-        """Initialize Gmail automation with OAuth2 credentials and AI service"""
+    def __init__(
+        self,
+        credentials_path: str,
+        token_path: str,
+        ai_service: AIService,
+        db: Any,
+        quota: Optional[GmailQuotaLimiter] = None,
+        transport: str = TRANSPORT_DISCOVERY,
+        service: Optional[GmailServiceProtocol] = None,
+        state: Optional[GmailStateDatabase] = None,
+        account: str = 'default',
+        ai_scheduler: Optional[AIScheduler] = None,
+        ai_router: Optional[ModelRouter] = None,
+        compressor: Optional[PromptCompressor] = None,
+        discovery_cache: Path = DEFAULT_DISCOVERY_CACHE,
+        shared: Optional[SharedState] = None
+    ):
+        """Initialize Gmail automation with OAuth2 credentials and AI service
+
+        Pass `service` (e.g. the local simulator) to skip OAuth entirely.
+        `db` is an `AsyncGmailDatabase`; a plain `GmailDatabase` is wrapped
+        and runs inline on the event loop. `state` holds daemon bookkeeping for `account`; it defaults to an
+        in-memory store that is lost on exit. Pass a shared `ai_scheduler` so
+        all accounts share one set of AI concurrency and token limits, or a
+        shared `ai_router` to send each task to its own model tiers. Email
+        content is shrunk by `compressor` before it is put in a prompt.
+        The discovery transport is built from the document cached at
+        `discovery_cache` instead of fetching it on every start. Label IDs
+        and AI decisions are cached in `shared`, which defaults to this
+        process; pass a `RedisSharedState` to share them between replicas.
+        """
         super().__init__(credentials_path, token_path)
+        if transport not in TRANSPORTS:
+            raise ValueError(f"Unknown Gmail transport: {transport}")
+        self.transport = transport
         self.ai_service = ai_service
-        self.unread_tracking: Set[UnreadTracker] = set()
-        self.db = db
-        self.authenticate()
-        # Initialize the parser
-        self.nl_rule_parser = StructuredOutputParser.from_response_schemas(
-            NL_RULE_SCHEMAS)
-
-    def _build_service(self, credentials: Credentials) -> GmailServiceProtocol:
-        """Build the Gmail API service"""
-        service = build('gmail', 'v1', credentials=credentials)
+        self._owns_ai_scheduler = ai_scheduler is None and ai_router is None
+        self.ai_scheduler = ai_scheduler or (
+            ai_router.default_scheduler if ai_router else AIScheduler(ai_service))
+        self.ai_router = ai_router or ModelRouter.single(ai_service, self.ai_scheduler)
+        self.compressor = compressor or PromptCompressor()
+        self.db = db if isinstance(db, AsyncGmailDatabase) else AsyncGmailDatabase(db=db)
+        self._owns_state = state is None
+        self.state = state or GmailStateDatabase(':memory:')
+        self.account = account
+        self._owns_shared = shared is None
+        self.shared = shared or SharedState()
+        # Near-duplicate bulk mail reuses LLM results; set to None to disable
+        self.campaigns: Optional[CampaignIndex] = CampaignIndex(self.state, account)
+        # Local metadata mirror, enabled with enable_mirror()
+        self.mirror: Optional[MailboxMirror] = None
+        # Gmail quota is per user, so each mailbox gets its own limiter
+        self.quota = quota or GmailQuotaLimiter()
+        # Replies, forwards and reports are sent in the background
+        self.outbox = Outbox(self)
+        self._own_address: Optional[str] = None
+        self.archive_report = ArchiveReportConfig()
+        # Local archive pre-classifier, enabled with enable_archive_model()
+        self.archive_model: Optional[LocalArchiveModel] = None
+        self.discovery_cache = discovery_cache
+        if service is not None:
+            self.service = service
+        else:
+            self.authenticate()
+        self._nl_rule_parser: Optional['StructuredOutputParser'] = None
+
+    @property
+    def nl_rule_parser(self) -> 'StructuredOutputParser':
+        """Output parser for natural language rule matches, built on first use"""
+        if self._nl_rule_parser is None:
+            from langchain.output_parsers import ResponseSchema, StructuredOutputParser
+            self._nl_rule_parser = StructuredOutputParser.from_response_schemas(
+                [ResponseSchema(**schema) for schema in NL_RULE_SCHEMAS])
+        return self._nl_rule_parser
+
+    def _build_service(self, credentials: 'Credentials') -> GmailServiceProtocol:
+        """Build the Gmail API service from the locally cached discovery document"""
+        if self.transport == TRANSPORT_HTTPX:
+            return cast(GmailServiceProtocol, AsyncGmailService(credentials))
+        service = build_gmail_service(credentials, self.discovery_cache)
         assert isinstance(service, GmailServiceProtocol)
         return service
 
+    def enable_archive_model(self, config: Optional[ClassifierConfig] = None) -> LocalArchiveModel:
+        """Decide confident auto-archive cases locally, learning from LLM decisions"""
+        if self.archive_model is None:
+            self.archive_model = LocalArchiveModel(self.state, self.account, config)
+        return self.archive_model
+
+    def enable_mirror(self) -> MailboxMirror:
+        """Answer metadata searches from a local mirror once it has synced"""
+        if self.mirror is None:
+            self.mirror = MailboxMirror(self)
+        return self.mirror
+
+    async def _find_message_ids(
+        self,
+        local_query: Dict[str, Any],
+        max_results: Optional[int] = None,
+        **list_kwargs: Any
+    ) -> List[str]:
+        """IDs for a search, from the mirror when it is in sync and Gmail otherwise.
+
+        `local_query` holds `GmailStateDatabase.search_mirror` filters and
+        `list_kwargs` the equivalent `messages.list` arguments.
+        """
+        if self.mirror is not None and await self.mirror.ensure_fresh():
+            METRICS.inc('mirror_queries')
+            with METRICS.span('mirror_query'):
+                rows = await self.state.search_mirror(
+                    self.account, limit=max_results, **local_query)
+            return [row['message_id'] for row in rows]
+        if max_results is not None:
+            list_kwargs['maxResults'] = max_results
+        messages = await self.execute(self.service.users().messages().list(
+            userId='me', **list_kwargs), 'messages.list')
+        return [message['id'] for message in messages.get('messages', [])]
+
+    async def close(self) -> None:
+        """Release transport resources such as pooled connections"""
+        await self.outbox.close()
+        if self.archive_model is not None:
+            await self.archive_model.save()
+        if self._owns_ai_scheduler:
+            await self.ai_scheduler.close()
+        if isinstance(self.service, AsyncGmailService):
+            await self.service.aclose()
+        if self._owns_state:
+            self.state.close()
+        if self._owns_shared:
+            await self.shared.close()
+
+    async def own_address(self) -> str:
+        """Email address of the authenticated mailbox"""
+        if self._own_address is None:
+            profile = await self.execute(
+                self.service.users().getProfile(userId='me'), 'getProfile')
+            self._own_address = profile['emailAddress']
+        return self._own_address
+
+    async def execute(self, request: Any, method: str) -> Any:
+        """Execute a Gmail API request through the quota limiter with retries"""
+        METRICS.inc('api_calls', method=method)
+        try:
+            with METRICS.span('api', method=method):
+                return await self.quota.execute(request, method)
+        except HttpError as error:
+            METRICS.inc('api_errors', method=method, status=error.resp.status)
+            raise
+
+    async def chat_completion(self, task: str, messages: List[ChatCompletionMessageInput]) -> Any:
+        """Call the model tiers routed for `task`, recording latency and token counts"""
+        cache_key = None
+        if task in CACHED_AI_TASKS:
+            digest = hashlib.sha256(json.dumps(
+                [[m.role, m.content] for m in messages]).encode('utf-8')).hexdigest()
+            cache_key = f"ai:{task}:{digest}"
+            cached = await self.shared.get(cache_key)
+            if cached is not None:
+                METRICS.inc('cache_hits', cache='ai_decision', task=task)
+                return ModelCompletion(response=cached)
+        METRICS.inc('llm_calls', task=task)
+        with METRICS.span('ai_call', task=task):
+            completion = await self.ai_router.complete(task, messages)
+        if cache_key is not None and completion.response:
+            await self.shared.set(cache_key, completion.response, AI_DECISION_TTL)
+        if METRICS.enabled:
+            # Rough estimate (~4 characters per token) when the service reports no usage
+            prompt_tokens = getattr(completion, 'prompt_tokens', None) or sum(
+                len(m.content) for m in messages) // 4
+            completion_tokens = getattr(completion, 'completion_tokens', None) or len(
+                completion.response or '') // 4
+            METRICS.inc('llm_tokens', prompt_tokens, task=task, kind='prompt')
+            METRICS.inc('llm_tokens', completion_tokens,
+                        task=task, kind='completion')
+        return completion
+
     async def summarize_email(self, message_id: str) -> str:
         """Summarize email content using AI service"""
         try:
             # Get email content
-            message = self.service.users().messages().get(
+            message = await self.execute(self.service.users().messages().get(
                 # TODO: Fix this linter error
-                userId='me', id=message_id, format='full').execute()
+                userId='me', id=message_id, format='full'), 'messages.get')
 
             # Extract email body
             body = ""
@@ -153,12 +340,12 @@ class GmailAutomation(GoogleServiceAuth):
                 body = ""
                 return ""
 
-            # Clean HTML if present
-            soup = BeautifulSoup(body, 'html.parser')
-            clean_text = soup.get_text()
+            # Strip HTML, quoted replies and boilerplate, and fit the token budget
+            clean_text = self.compressor.compress('summarize', body)
 
             # Get summary using AI service
-            completion = await self.ai_service.chat_completion(
+            completion = await self.chat_completion(
+                task='summarize',
                 messages=[
                     ChatCompletionMessageInput(
                         role="system",
@@ -181,25 +368,19 @@ class GmailAutomation(GoogleServiceAuth):
         """Generate and send an automatic reply using AI"""
         try:
             # Get the original message details
-            msg = self.service.users().messages().get(
-                userId='me', id=message_id).execute()
-            thread_id = msg['threadId']
+            message = await self.execute(self.service.users().messages().get(
+                userId='me', id=message_id, format='full'), 'messages.get')
+            thread_id = message['threadId']
 
             # Create reply message
-            message = self.service.users().messages().get(
-                userId='me', id=message_id, format='full').execute()
-            headers = message['payload']['headers']
-            subject = next(h['value']
-                           for h in headers if h['name'] == 'Subject')
-            from_email = next(h['value']
-                              for h in headers if h['name'] == 'From')
-
-            subject = f"Message ID: {message_id} [NO SUBJECT]"
-            if 'subject' in message['payload']:
-                subject = message['payload']['subject']
-            else:
-                logging.warning(
-                    f"No subject found in message payload.")
+            headers = {h['name'].lower(): h['value']
+                       for h in message['payload']['headers']}
+            from_email = headers.get('reply-to') or headers.get('from', '')
+
+            subject = headers.get('subject')
+            if not subject:
+                subject = f"Message ID: {message_id} [NO SUBJECT]"
+                logging.warning("No subject found in message payload.")
 
             # Get email body for context
             if 'data' in message['payload']['body']:
@@ -215,12 +396,12 @@ class GmailAutomation(GoogleServiceAuth):
                     f"No body found in message payload with subject: {subject}. Returning early.")
                 return
 
-            # Clean HTML
-            soup = BeautifulSoup(body, 'html.parser')
-            clean_text = soup.get_text()
+            # Strip HTML, quoted replies and boilerplate, and fit the token budget
+            clean_text = self.compressor.compress('auto_reply', body)
 
             # Generate reply using AI
-            completion = await self.ai_service.chat_completion(
+            completion = await self.chat_completion(
+                task='auto_reply',
                 messages=[
                     ChatCompletionMessageInput(
                         role="system",
@@ -236,73 +417,76 @@ class GmailAutomation(GoogleServiceAuth):
 
             reply_text = completion.response
 
-            reply_message = f"""From: me
-To: {from_email}
-Subject: Re: {subject}
-
-{reply_text}"""
-
-            # Encode and send the reply
-            encoded_message = base64.urlsafe_b64encode(
-                reply_message.encode('utf-8')).decode('utf-8')
+            reply_message = build_message(
+                to=from_email,
+                subject=subject if subject.lower().startswith('re:') else f"Re: {subject}",
+                body=reply_text,
+                in_reply_to=headers.get('message-id'),
+                references=headers.get('references')
+            )
 
-            if send_immediately:
-                self.service.users().messages().send(
-                    userId='me',
-                    body={
-                        'raw': encoded_message,
-                        'threadId': thread_id
-                    }
-                ).execute()
+            # Queue the reply; the outbox sends or drafts it in the background
+            if await self.outbox.enqueue(
+                    'reply', f"reply:{message_id}", reply_message,
+                    thread_id=thread_id, draft=not send_immediately):
                 logging.info(
-                    f"Sent reply to message {message_id} with subject {subject}")
-            else:
-                self.service.users().drafts().create(
-                    userId='me',
-                    body={
-                        'message': {
-                            'raw': encoded_message,
-                            'threadId': thread_id
-                        }
-                    }
-                ).execute()
-                logging.info(
-                    f"Drafted reply to message {message_id} with subject {subject}")
+                    f"Queued {'reply' if send_immediately else 'draft reply'} to message {message_id} with subject {subject}")
 
         except HttpError as error:
             logging.error(f'An error occurred: {error}')
 
+    async def label_id(self, label_name: str) -> str:
+        """ID of the user label named `label_name`, creating the label if it doesn't exist"""
+        cache_key = f"label:{self.account}:{label_name}"
+        cached = await self.shared.get(cache_key)
+        if cached is not None:
+            METRICS.inc('cache_hits', cache='label_id')
+            return cached
+        labels = await self.execute(self.service.users().labels().list(userId='me'), 'labels.list')
+        for label in labels['labels']:
+            if label['name'] == label_name:
+                await self.shared.set(cache_key, label['id'], LABEL_TTL)
+                return label['id']
+        label_body = {
+            'name': label_name,
+            'labelListVisibility': 'labelShow',
+            'messageListVisibility': 'show'
+        }
+        created_label = await self.execute(self.service.users().labels().create(
+            userId='me', body=label_body), 'labels.create')
+        await self.shared.set(cache_key, created_label['id'], LABEL_TTL)
+        return created_label['id']
+
     async def apply_label(self, message_ids: List[str], label_name: str) -> None:
         """Apply a label to specified messages"""
         try:
-            # Create label if it doesn't exist
-            labels = self.service.users().labels().list(userId='me').execute()
-            label_id = None
-
-            for label in labels['labels']:
-                if label['name'] == label_name:
-                    label_id = label['id']
-                    break
-
-            if not label_id:
-                label_body = {
-                    'name': label_name,
-                    'labelListVisibility': 'labelShow',
-                    'messageListVisibility': 'show'
-                }
-                created_label = self.service.users().labels().create(
-                    userId='me', body=label_body).execute()
-                label_id = created_label['id']
-
-            body = {'addLabelIds': [label_id], 'removeLabelIds': []}
-            self.service.users().messages().batchModify(
-                userId='me', body=body, ids=message_ids).execute()
-            logging.info(
+            label_id = await self.label_id(label_name)
+            await self.batch_modify(message_ids, add_label_ids=[label_id])
+            logging.debug(
                 f"Applied label {label_name} to messages {message_ids}")
 
         except HttpError as error:
+            if error.resp.status in (400, 404):
+                # The cached ID may belong to a label deleted since; look it up again next time
+                await self.shared.delete(f"label:{self.account}:{label_name}")
             logging.error(f'An error occurred: {error}')
 
+    async def batch_modify(
+        self,
+        message_ids: List[str],
+        add_label_ids: Optional[List[str]] = None,
+        remove_label_ids: Optional[List[str]] = None
+    ) -> None:
+        """Add and remove labels on any number of messages, 1000 per request"""
+        for start in range(0, len(message_ids), BATCH_MODIFY_LIMIT):
+            body = {
+                'ids': message_ids[start:start + BATCH_MODIFY_LIMIT],
+                'addLabelIds': add_label_ids or [],
+                'removeLabelIds': remove_label_ids or [],
+            }
+            await self.execute(self.service.users().messages().batchModify(
+                userId='me', body=body), 'messages.batchModify')
+
     async def save_attachments(
         self,
         sender_pattern: str,
@@ -313,23 +497,22 @@ Subject: Re: {subject}
         try:
             query = f"from:({sender_pattern}) subject:({
                 subject_pattern}) has:attachment"
-            messages = self.service.users().messages().list(
-                userId='me', q=query).execute()
+            message_ids = await self._find_message_ids(
+                {'sender': sender_pattern, 'subject': subject_pattern,
+                    'has_attachments': True},
+                q=query)
 
-            if 'messages' not in messages:
-                return
-
-            for message in messages['messages']:
-                msg = self.service.users().messages().get(
-                    userId='me', id=message['id']).execute()
+            for message_id in message_ids:
+                msg = await self.execute(self.service.users().messages().get(
+                    userId='me', id=message_id), 'messages.get')
 
                 if 'parts' in msg['payload']:
                     for part in msg['payload']['parts']:
                         if 'filename' in part and part['filename']:
                             attachment_id = part['body']['attachmentId']
-                            attachment = self.service.users().messages().attachments().get(
-                                userId='me', messageId=message['id'], id=attachment_id
-                            ).execute()
+                            attachment = await self.execute(self.service.users().messages().attachments().get(
+                                userId='me', messageId=message_id, id=attachment_id
+                            ), 'messages.attachments.get')
 
                             file_data = base64.urlsafe_b64decode(
                                 attachment['data'].encode('UTF-8'))
@@ -338,7 +521,7 @@ Subject: Re: {subject}
                             with open(filepath, 'wb') as f:
                                 f.write(file_data)
                             logging.info(
-                                f"Saved attachment {part['filename']} from message {message['id']}")
+                                f"Saved attachment {part['filename']} from message {message_id}")
 
         except HttpError as error:
             logging.error(f'An error occurred: {error}')
@@ -350,22 +533,21 @@ Subject: Re: {subject}
         output_path: Path = Path("email_pdfs")
     ) -> None:
         """logging.error matching emails to PDF"""
+        import fpdf
+        from bs4 import BeautifulSoup
         try:
             output_path.mkdir(exist_ok=True)
 
-            messages = self.service.users().messages().list(
-                userId='me', q=f"subject:({subject_pattern})").execute()
-
-            if 'messages' not in messages:
-                return
+            message_ids = await self._find_message_ids(
+                {'subject': subject_pattern}, q=f"subject:({subject_pattern})")
 
-            for message in messages['messages']:
-                msg = self.service.users().messages().get(
-                    userId='me', id=message['id'], format='full').execute()
+            for message_id in message_ids:
+                msg = await self.execute(self.service.users().messages().get(
+                    userId='me', id=message_id, format='full'), 'messages.get')
 
                 if include_thread:
-                    thread = self.service.users().threads().get(
-                        userId='me', id=msg['threadId']).execute()
+                    thread = await self.execute(self.service.users().threads().get(
+                        userId='me', id=msg['threadId']), 'threads.get')
                     messages_in_thread = thread['messages']
                 else:
                     messages_in_thread = [msg]
@@ -406,52 +588,77 @@ Subject: Re: {subject}
                 pdf_path = output_path / f"email_{timestamp}.pdf"
                 pdf.output(str(pdf_path))
                 logging.info(
-                    f"Saved email to PDF: {pdf_path} from subject: {subject_pattern} on email {message['id']}")
+                    f"Saved email to PDF: {pdf_path} from subject: {subject_pattern} on email {message_id}")
 
         except HttpError as error:
             logging.error(f'An error occurred: {error}')
 
     async def track_unread_emails(self) -> None:
-        """Track emails that remain unread"""
-        try:
-            messages = self.service.users().messages().list(
-                userId='me', q='is:unread').execute()
-
-            if 'messages' not in messages:
-                return
+        """Sync the persistent unread tracker with the mailbox's unread messages.
 
-            for message in messages['messages']:
-                msg = self.service.users().messages().get(
-                    userId='me', id=message['id']).execute()
-
-                headers = msg['payload']['headers']
-                subject = next(h['value']
-                               for h in headers if h['name'] == 'Subject')
-                sender = next(h['value']
-                              for h in headers if h['name'] == 'From')
-                internal_date = int(msg['internalDate']) / 1000
-                timestamp = datetime.fromtimestamp(internal_date)
-
-                days_unread = (datetime.now() - timestamp).days
-
-                tracker = UnreadTracker(
-                    sender=sender,
-                    subject=subject,
-                    timestamp=timestamp,
-                    days_unread=days_unread
-                )
+        Only messages that became unread since the last run are fetched, and
+        only their From/Subject headers; messages that were read or deleted
+        are dropped from the tracker.
+        """
+        try:
+            unread_ids: List[str] = []
+            page_token = None
+            while True:
+                messages = await self.execute(self.service.users().messages().list(
+                    userId='me', q='is:unread', maxResults=500, pageToken=page_token), 'messages.list')
+                unread_ids.extend(m['id'] for m in messages.get('messages', []))
+                page_token = messages.get('nextPageToken')
+                if not page_token:
+                    break
 
-                self.unread_tracking.add(tracker)
-                logging.info(
-                    f"Tracked unread email: {tracker} added to in-memory tracker Set()")
+            tracked = set(await self.state.unread_ids(self.account))
+            current = set(unread_ids)
+            no_longer_unread = list(tracked - current)
+            if no_longer_unread:
+                await self.state.delete_unread(self.account, no_longer_unread)
+
+            rows = []
+            for message_id in unread_ids:
+                if message_id in tracked:
+                    continue
+                msg = await self.execute(self.service.users().messages().get(
+                    userId='me', id=message_id, format='metadata',
+                    metadataHeaders=['From', 'Subject']), 'messages.get')
+                headers = {h['name']: h['value']
+                           for h in msg['payload']['headers']}
+                rows.append((message_id, headers.get('From', ''),
+                             headers.get('Subject', ''), int(msg['internalDate']) / 1000))
+            await self.state.insert_unread(self.account, rows)
+            logging.debug(
+                f"Unread tracker: {len(rows)} added, {len(no_longer_unread)} removed, {len(current)} total")
 
         except HttpError as error:
             logging.error(f'An error occurred: {error}')
 
+    async def get_unread_trackers(self, min_days: int = 0) -> List[UnreadTracker]:
+        """Tracked unread messages at least `min_days` old, oldest first"""
+        return [
+            UnreadTracker(
+                message_id=row['message_id'],
+                sender=row['sender'],
+                subject=row['subject'],
+                timestamp=datetime.fromtimestamp(row['received_at']),
+                days_unread=row['days_unread']
+            )
+            for row in await self.state.get_unread(self.account, min_days)
+        ]
+
+    async def unread_report(self, top_senders: int = 20) -> Dict[str, Any]:
+        """Aggregate unread counts per sender and per age bucket"""
+        return {
+            'by_sender': await self.state.unread_by_sender(self.account, top_senders),
+            'by_age': await self.state.unread_by_age(self.account),
+        }
+
     async def list_folders(self) -> List[Dict[str, str]]:
         """List all folders/labels in the mailbox"""
         try:
-            results = self.service.users().labels().list(userId='me').execute()
+            results = await self.execute(self.service.users().labels().list(userId='me'), 'labels.list')
             return results.get('labels', [])
         except HttpError as error:
             logging.error(f'Error listing folders: {error}')
@@ -465,8 +672,8 @@ Subject: Re: {subject}
                 'labelListVisibility': 'labelShow',
                 'messageListVisibility': 'show'
             }
-            created_label = self.service.users().labels().create(
-                userId='me', body=label_body).execute()
+            created_label = await self.execute(self.service.users().labels().create(
+                userId='me', body=label_body), 'labels.create')
             return created_label['id']
         except HttpError as error:
             logging.error(f'Error creating folder {folder_name}: {error}')
@@ -477,12 +684,13 @@ Subject: Re: {subject}
         Block a specific email address
         Returns (success, message)
         """
+        from email_validator import validate_email, EmailNotValidError
         try:
             # Validate email format
             validate_email(sender_email)
 
             # Add to database
-            rule_id = self.db.create_blocked_sender(sender_email, "email")
+            rule_id = await self.db.create_blocked_sender(sender_email, "email")
             if rule_id:
                 logging.info(f"Blocked sender: {sender_email}")
                 return True, f"Successfully blocked {sender_email}"
@@ -514,7 +722,7 @@ Subject: Re: {subject}
             pattern = f".*@{re.escape(domain_name)}$"
 
             # Add to database
-            rule_id = self.db.create_blocked_sender(pattern, "pattern")
+            rule_id = await self.db.create_blocked_sender(pattern, "pattern")
             if rule_id:
                 logging.info(f"Blocked domain: {domain_name}")
                 return True, f"Successfully blocked domain {domain_name}"
@@ -540,7 +748,7 @@ Subject: Re: {subject}
                 return False, error_msg
 
             # Add to database
-            rule_id = self.db.create_blocked_sender(
+            rule_id = await self.db.create_blocked_sender(
                 body_pattern, "body_pattern")
             if rule_id:
                 logging.info(f"Blocked body pattern: {body_pattern}")
@@ -555,8 +763,8 @@ Subject: Re: {subject}
     async def find_unsubscribe_link(self, message_id: str) -> Tuple[Optional[str], Optional[str]]:
         """Find unsubscribe link in email headers or body using AI"""
         try:
-            message = self.service.users().messages().get(
-                userId='me', id=message_id, format='full').execute()
+            message = await self.execute(self.service.users().messages().get(
+                userId='me', id=message_id, format='full'), 'messages.get')
 
             # Extract email data
             headers = {h['name']: h['value']
@@ -579,6 +787,13 @@ Subject: Re: {subject}
                         body_text = base64.urlsafe_b64decode(
                             part['body']['data']).decode('utf-8')
 
+            # Copies of one campaign share an unsubscribe link
+            campaign = await self.campaigns.match(
+                from_email, subject, body_text or body_html) if self.campaigns else None
+            if campaign is not None and campaign.unsubscribe_checked:
+                METRICS.inc('campaign_inherited', task='unsubscribe_detect')
+                return campaign.unsubscribe_link, campaign.unsubscribe_location
+
             # Create email data structure for AI
             email_data = {
                 "headers": {
@@ -586,16 +801,17 @@ Subject: Re: {subject}
                     "from": from_email,
                     "list_unsubscribe": headers.get('List-Unsubscribe', '')
                 },
-                "body_html": body_html,
-                "body_text": body_text
+                # Links are kept verbatim; everything else is compressed
+                "body": self.compressor.compress(
+                    'unsubscribe_detect', body_html or body_text, html=bool(body_html), keep_links=True)
             }
 
             # Create system prompt
             system_prompt = """You are an unsubscribe link detector. Analyze the email and find any unsubscribe links.
             Rules:
             1. First check the List-Unsubscribe header - this is the most reliable source
-            2. If no header, look for links in the HTML that contain words like 'unsubscribe', 'opt-out', etc.
-            3. For HTML links, provide the CSS selector path to locate the link
+            2. If no header, look for links in the body, shown as `text <url>`, that contain words like 'unsubscribe', 'opt-out', etc.
+            3. For body links, give the link text as the location
             4. Never hallucinate or create links - only return real links found in the email
             5. Assign a confidence score (0.0-1.0) based on how certain you are it's an unsubscribe link
             6. Explain your reasoning
@@ -603,13 +819,14 @@ Subject: Re: {subject}
             Return your findings in the following JSON format:
             {
                 "link": "the unsubscribe URL or null if none found",
-                "location": "header" or "CSS selector path",
+                "location": "header" or the link text,
                 "confidence": float between 0.0 and 1.0,
                 "reason": "explanation of your decision"
             }"""
 
             # Get AI analysis
-            completion = await self.ai_service.chat_completion(
+            completion = await self.chat_completion(
+                task='unsubscribe_detect',
                 messages=[
                     ChatCompletionMessageInput(
                         role="system",
@@ -617,7 +834,7 @@ Subject: Re: {subject}
                     ),
                     ChatCompletionMessageInput(
                         role="user",
-                        content=json.dumps(email_data, indent=2)
+                        content=json.dumps(email_data)
                     )
                 ]
             )
@@ -630,12 +847,15 @@ Subject: Re: {subject}
                     logging.info(f"Found unsubscribe link with confidence {
                                  result.confidence}: {result.link}")
                     logging.info(f"Reason: {result.reason}")
-                    return result.link, result.location
+                    link, location = result.link, result.location
                 else:
                     if result.reason:
                         logging.info(f"No reliable unsubscribe link found: {
                                      result.reason}")
-                    return None, None
+                    link, location = None, None
+                if campaign is not None:
+                    await self.campaigns.record_unsubscribe(campaign, link, location)
+                return link, location
 
             except Exception as e:
                 logging.error(f"Error parsing AI response: {e}")
@@ -648,6 +868,7 @@ Subject: Re: {subject}
 
     async def process_unsubscribes(self, folder_name: str, max_emails: int = 100) -> None:
         """Process emails in a folder to find and act on unsubscribe links"""
+        import httpx
         try:
             # Create to_unsubscribe folder if it doesn't exist
             to_unsubscribe_id = await self.create_folder('to_unsubscribe')
@@ -661,10 +882,10 @@ Subject: Re: {subject}
                 return
 
             # Get messages in folder
-            messages = self.service.users().messages().list(
-                userId='me', labelIds=[folder_id], maxResults=max_emails).execute()
+            message_ids = await self._find_message_ids(
+                {'label_ids': [folder_id]}, max_results=max_emails, labelIds=[folder_id])
 
-            if 'messages' not in messages:
+            if not message_ids:
                 return
 
             # Prepare CSV file
@@ -677,9 +898,11 @@ Subject: Re: {subject}
                     writer.writeheader()
 
             async with httpx.AsyncClient() as client:
-                for message in messages['messages']:
-                    msg = self.service.users().messages().get(
-                        userId='me', id=message['id'], format='full').execute()
+                for message_id in message_ids:
+                    # find_unsubscribe_link fetches the body itself
+                    msg = await self.execute(self.service.users().messages().get(
+                        userId='me', id=message_id, format='metadata',
+                        metadataHeaders=['From']), 'messages.get')
 
                     # Get sender email
                     headers = {h['name']: h['value']
@@ -695,7 +918,12 @@ Subject: Re: {subject}
                         '@')[-1] if '@' in sender_email else ''
 
                     # Find unsubscribe link
-                    unsubscribe_url, source = await self.find_unsubscribe_link(message['id'])
+                    unsubscribe_url, source = await self.find_unsubscribe_link(message_id)
+
+                    if unsubscribe_url and self.campaigns and \
+                            await self.campaigns.is_unsubscribed(sender_email, unsubscribe_url):
+                        logging.debug(f'Already unsubscribed from this campaign of {sender_email}')
+                        continue
 
                     if unsubscribe_url:
                         # Log the information
@@ -721,15 +949,17 @@ Subject: Re: {subject}
                                 }
                                 # Add rule to rules file
                                 self._add_rule_to_file(rule)
+                                if self.campaigns:
+                                    await self.campaigns.mark_unsubscribed(sender_email, unsubscribe_url)
                             else:
                                 # Move to to_unsubscribe folder for manual review
-                                await self.apply_label([message['id']], 'to_unsubscribe')
+                                await self.apply_label([message_id], 'to_unsubscribe')
                                 logging.info(f'Moved email from {
                                              sender_email} to to_unsubscribe folder')
                         except Exception as e:
                             logging.error(f'Error unsubscribing from {
                                           sender_email}: {e}')
-                            await self.apply_label([message['id']], 'to_unsubscribe')
+                            await self.apply_label([message_id], 'to_unsubscribe')
 
         except Exception as e:
             logging.error(f'Error processing unsubscribes: {e}')
@@ -769,12 +999,12 @@ Subject: Re: {subject}
                 return False, "Label is empty after sanitization"
 
             # Check if label already exists in Gmail
-            existing_labels = self.service.users().labels().list(userId='me').execute()
+            existing_labels = await self.execute(self.service.users().labels().list(userId='me'), 'labels.list')
             for existing in existing_labels.get('labels', []):
                 if existing['name'].lower() == sanitized_label.lower():
                     # Label exists, store in local db if not already there
                     try:
-                        self.db.create_label_with_uri(
+                        await self.db.create_label_with_uri(
                             sanitized_label,
                             existing.get('id')  # Gmail API uses id as URI
                         )
@@ -791,13 +1021,13 @@ Subject: Re: {subject}
             }
 
             try:
-                created_label = self.service.users().labels().create(
+                created_label = await self.execute(self.service.users().labels().create(
                     userId='me',
                     body=label_body
-                ).execute()
+                ), 'labels.create')
 
                 # Store in local database
-                label_id = self.db.create_label_with_uri(
+                label_id = await self.db.create_label_with_uri(
                     sanitized_label,
                     created_label.get('id')  # Gmail API uses id as URI
                 )
@@ -836,7 +1066,7 @@ Subject: Re: {subject}
                     return False, f"Invalid action type: {action.get('type')}"
 
             # Add rule to database
-            rule_id = self.db.create_nl_rule(rule, actions)
+            rule_id = await self.db.create_nl_rule(rule, actions)
             if rule_id is None:
                 return False, "Failed to create rule in database"
 
@@ -854,7 +1084,7 @@ Subject: Re: {subject}
         """
         try:
             # Get all rules from database
-            rules = self.db.get_all_nl_rules()
+            rules = await self.db.get_all_nl_rules()
             if not rules:
                 return None
 
@@ -875,13 +1105,15 @@ Subject: Re: {subject}
             """
 
             # Create prompt template for LangChain
+            from langchain.prompts import PromptTemplate
             prompt = PromptTemplate(
                 input_variables=["email_content"],
                 template=system_prompt + "\nEmail content: {email_content}"
             )
 
             # Get AI response
-            completion = await self.ai_service.chat_completion(
+            completion = await self.chat_completion(
+                task='nl_rule_match',
                 messages=[
                     ChatCompletionMessageInput(
                         role="system",
@@ -889,7 +1121,7 @@ Subject: Re: {subject}
                     ),
                     ChatCompletionMessageInput(
                         role="user",
-                        content=email_content
+                        content=self.compressor.compress('nl_rule_match', email_content)
                     )
                 ]
             )
@@ -897,15 +1129,8 @@ Subject: Re: {subject}
             # Parse response to get matching rule IDs
             try:
                 output = self.nl_rule_parser.parse(completion.response)
-                matching_rules = []
-
-                # Get actions for matching rules
-                for rule_id in output['id']:
-                    rule = self.db.get_nl_rule(rule_id)
-                    if rule:
-                        matching_rules.append(rule)
-
-                return matching_rules
+                # Get actions for all matching rules in one database call
+                return await self.db.get_nl_rules(output['id'])
 
             except Exception as e:
                 logging.error(f"Error parsing AI response: {e}")
@@ -915,8 +1140,10 @@ Subject: Re: {subject}
             logging.error(f"Error processing natural language rules: {e}")
             return None
 
-    async def apply_nl_rule_actions(self, message_id: str, actions: List[Dict[str, Any]]) -> None:
-        """Apply the actions from a natural language rule
+    async def apply_nl_rule_actions(self, message_id: str, actions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Apply the actions from a natural language rule, returning the ones that failed
+
+        A failed action is logged and the remaining actions still run.
         ### Example usage: (Apply multiple actions to a message)
         ```python
         actions = [
@@ -928,37 +1155,42 @@ Subject: Re: {subject}
         ```
         """
         # TODO: Call this based on db stored filters that match emails and then apply the rules defined on the filters from the database.
+        failed: List[Dict[str, Any]] = []
         for action in actions:
             action_type = action.get('type')
+            METRICS.inc('actions', type=action_type)
             try:
-                if action_type == 'label':
-                    await self.apply_label([message_id], action['value'])
-                elif action_type == 'archive':
-                    await self._archive_message(message_id)
-                elif action_type == 'delete':
-                    await self._delete_message(message_id)
-                elif action_type == 'markRead':
-                    await self._mark_as_read(message_id)
-                elif action_type == 'star':
-                    await self._star_message(message_id)
-                elif action_type == 'forward':
-                    await self._forward_message(message_id, action.get('to'))
-                else:
-                    logging.warning(f"Unknown action type: {action_type}")
+                with METRICS.span('action_apply', type=action_type):
+                    if action_type == 'label':
+                        await self.apply_label([message_id], action['value'])
+                    elif action_type == 'archive':
+                        await self._archive_message(message_id)
+                    elif action_type == 'delete':
+                        await self._delete_message(message_id)
+                    elif action_type == 'markRead':
+                        await self._mark_as_read(message_id)
+                    elif action_type == 'star':
+                        await self._star_message(message_id)
+                    elif action_type == 'forward':
+                        await self._forward_message(message_id, action.get('to'))
+                    else:
+                        logging.warning(f"Unknown action type: {action_type}")
             except Exception as e:
                 logging.error(f"Error applying action {action_type}: {e}")
+                failed.append(action)
+        return failed
 
     async def _archive_message(self, message_id: str) -> None:
         """Remove INBOX label to archive message"""
         try:
-            self.service.users().messages().modify(
+            await self.execute(self.service.users().messages().modify(
                 userId='me',
                 id=message_id,
                 body={
                     'removeLabelIds': ['INBOX']
                 }
-            ).execute()
-            logging.info(f"Archived message: {message_id}")
+            ), 'messages.modify')
+            logging.debug(f"Archived message: {message_id}")
         except HttpError as e:
             logging.error(f"Error archiving message {message_id}: {e}")
             raise
@@ -966,11 +1198,11 @@ Subject: Re: {subject}
     async def _delete_message(self, message_id: str) -> None:
         """Move message to trash"""
         try:
-            self.service.users().messages().trash(
+            await self.execute(self.service.users().messages().trash(
                 userId='me',
                 id=message_id
-            ).execute()
-            logging.info(f"Deleted message: {message_id}")
+            ), 'messages.trash')
+            logging.debug(f"Deleted message: {message_id}")
         except HttpError as e:
             logging.error(f"Error deleting message {message_id}: {e}")
             raise
@@ -978,14 +1210,14 @@ Subject: Re: {subject}
     async def _mark_as_read(self, message_id: str) -> None:
         """Remove UNREAD label from message"""
         try:
-            self.service.users().messages().modify(
+            await self.execute(self.service.users().messages().modify(
                 userId='me',
                 id=message_id,
                 body={
                     'removeLabelIds': ['UNREAD']
                 }
-            ).execute()
-            logging.info(f"Marked message as read: {message_id}")
+            ), 'messages.modify')
+            logging.debug(f"Marked message as read: {message_id}")
         except HttpError as e:
             logging.error(f"Error marking message {message_id} as read: {e}")
             raise
@@ -993,14 +1225,14 @@ Subject: Re: {subject}
     async def _star_message(self, message_id: str) -> None:
         """Add STARRED label to message"""
         try:
-            self.service.users().messages().modify(
+            await self.execute(self.service.users().messages().modify(
                 userId='me',
                 id=message_id,
                 body={
                     'addLabelIds': ['STARRED']
                 }
-            ).execute()
-            logging.info(f"Starred message: {message_id}")
+            ), 'messages.modify')
+            logging.debug(f"Starred message: {message_id}")
         except HttpError as e:
             logging.error(f"Error starring message {message_id}: {e}")
             raise
@@ -1013,11 +1245,11 @@ Subject: Re: {subject}
 
         try:
             # Get original message
-            message = self.service.users().messages().get(
+            message = await self.execute(self.service.users().messages().get(
                 userId='me',
                 id=message_id,
                 format='full'
-            ).execute()
+            ), 'messages.get')
 
             # Extract headers
             headers = {h['name']: h['value']
@@ -1037,28 +1269,17 @@ Subject: Re: {subject}
                 body = ""
 
             # Create forward message
-            forward_message = f"""
-From: me
-To: {to_email}
-Subject: Fwd: {subject}
-
----------- Forwarded message ---------
-From: {from_email}
-Subject: {subject}
-
-{body}
-"""
-            # Encode and send
-            encoded_message = base64.urlsafe_b64encode(
-                forward_message.encode('utf-8')).decode('utf-8')
-
-            self.service.users().messages().send(
-                userId='me',
-                body={
-                    'raw': encoded_message
-                }
-            ).execute()
-            logging.info(f"Forwarded message {message_id} to {to_email}")
+            forward_message = build_message(
+                to=to_email,
+                subject=f"Fwd: {subject}",
+                body=f"---------- Forwarded message ---------\n"
+                     f"From: {from_email}\n"
+                     f"Subject: {subject}\n\n"
+                     f"{body}"
+            )
+            if await self.outbox.enqueue(
+                    'forward', f"forward:{message_id}:{to_email.lower()}", forward_message):
+                logging.info(f"Queued forward of message {message_id} to {to_email}")
 
         except HttpError as e:
             logging.error(f"Error forwarding message {message_id}: {e}")
@@ -1068,34 +1289,28 @@ Subject: {subject}
         """
         Automatically archive non-important emails and generate a report
         """
+        report: Optional[ArchiveReportBuilder] = None
         try:
             # Get unprocessed emails
-            messages = self.service.users().messages().list(
+            messages = await self.execute(self.service.users().messages().list(
                 userId='me',
                 q='in:inbox -label:auto_archived',
                 maxResults=max_emails
-            ).execute()
+            ), 'messages.list')
 
             if 'messages' not in messages:
                 return
 
-            archived_emails = []
-            kept_emails = []
+            report = ArchiveReportBuilder(self.archive_report)
 
             for message in messages['messages']:
-                msg = self.service.users().messages().get(
+                msg = GmailMessage(await self.execute(self.service.users().messages().get(
                     userId='me', id=message['id'], format='full'
-                ).execute()
+                ), 'messages.get'))
 
                 # Extract email data
-                headers = {h['name']: h['value']
-                           for h in message['payload']['headers']}
-                subject = headers.get('Subject', '')
-                from_email = headers.get('From', '')
-                has_attachments = any(
-                    'filename' in part for part in msg['payload'].get('parts', [])
-                    if 'filename' in part
-                )
+                subject = msg.headers.get('Subject', '')
+                from_email = msg.headers.get('From', '')
 
                 # Get email body
                 body = self._get_message_body(msg) or ""
@@ -1104,46 +1319,80 @@ Subject: {subject}
                 email_data = {
                     "from": from_email,
                     "subject": subject,
-                    "body": body[:1000],  # First 1000 chars for context
-                    "has_attachments": has_attachments,
+                    # Compressed to the task's token budget
+                    "body": self.compressor.compress('archive_decision', body),
+                    "has_attachments": msg.has_attachments,
                     "date": datetime.fromtimestamp(
-                        int(msg['internalDate']) / 1000
+                        msg.internal_date / 1000
                     ).isoformat()
                 }
 
-                # Get AI decision
-                decision = await self._get_archive_decision(email_data)
+                # Get AI decision, reusing one made for the same campaign
+                campaign = await self.campaigns.match(
+                    from_email, subject, body) if self.campaigns else None
+                decision = await self._get_archive_decision(email_data, message['id'], campaign)
 
-                if decision.can_archive and decision.confidence >= 0.8:
+                archived = decision.can_archive and decision.confidence >= ARCHIVE_MIN_CONFIDENCE
+                if archived:
                     # Archive the email
                     await self._archive_message(message['id'])
                     # Add auto_archived label
                     await self.apply_label([message['id']], 'auto_archived')
 
-                    archived_emails.append({
-                        'from': from_email,
-                        'subject': subject,
-                        'reason': decision.reason,
-                        'importance': decision.importance_score
-                    })
-                else:
-                    kept_emails.append({
-                        'from': from_email,
-                        'subject': subject,
-                        'reason': decision.reason,
-                        'importance': decision.importance_score,
-                        'summary': decision.summary
-                    })
+                report.add(
+                    message['id'], from_email, subject, archived,
+                    decision.reason, decision.importance_score, decision.summary)
 
             # Generate and send report
-            if archived_emails or kept_emails:
-                await self._send_archive_report(archived_emails, kept_emails)
+            if report.total:
+                await self._send_archive_report(report)
 
         except Exception as e:
             logging.error(f"Error in auto_archive_emails: {e}")
+        finally:
+            if report is not None:
+                report.close()
 
-    async def _get_archive_decision(self, email_data: Dict[str, Any]) -> ArchiveDecisionOutput:
-        """Get AI decision on whether to archive an email"""
+    def _get_message_body(self, message: GmailMessage) -> Optional[str]:
+        """Extract message body"""
+        with METRICS.span('decode'):
+            part = message.text_part()
+            try:
+                return part.text() if part is not None else None
+            except Exception as e:
+                logging.error(f'Error getting message body: {e}')
+                return None
+
+    async def _get_archive_decision(
+        self,
+        email_data: Dict[str, Any],
+        message_id: Optional[str] = None,
+        campaign: Optional[Campaign] = None
+    ) -> ArchiveDecisionOutput:
+        """Get AI decision on whether to archive an email
+
+        A message of a `campaign` that already has a decision reuses it.
+        With `archive_model` enabled, confident cases are decided locally
+        and every LLM decision for `message_id` is used to train it. In
+        shadow mode the local decision is only compared with the LLM's.
+        """
+        inherited = self.campaigns.archive_decision(campaign) if self.campaigns and campaign else None
+        if inherited is not None:
+            METRICS.inc('campaign_inherited', task='archive_decision')
+            return ArchiveDecisionOutput.parse_raw(inherited)
+        local: Optional[Tuple[bool, float]] = None
+        if self.archive_model is not None:
+            with METRICS.span('archive_classifier'):
+                local = await self.archive_model.decide(email_data)
+            if local is not None and not self.archive_model.config.shadow:
+                can_archive, probability = local
+                METRICS.inc('archive_local_decisions', archived=can_archive)
+                return ArchiveDecisionOutput(
+                    can_archive=can_archive,
+                    confidence=probability if can_archive else 1.0 - probability,
+                    reason=f"Local classifier: P(archive)={probability:.3f}",
+                    importance_score=1.0 - probability
+                )
         system_prompt = """You are an email importance analyzer. Determine if an email can be safely archived based on these rules:
 
         Can be archived if:
@@ -1170,7 +1419,8 @@ Subject: {subject}
         }"""
 
         try:
-            completion = await self.ai_service.chat_completion(
+            completion = await self.chat_completion(
+                task='archive_decision',
                 messages=[
                     ChatCompletionMessageInput(
                         role="system",
@@ -1178,12 +1428,12 @@ Subject: {subject}
                     ),
                     ChatCompletionMessageInput(
                         role="user",
-                        content=json.dumps(email_data, indent=2)
+                        content=json.dumps(email_data)
                     )
                 ]
             )
 
-            return ArchiveDecisionOutput.parse_raw(completion.response)
+            decision = ArchiveDecisionOutput.parse_raw(completion.response)
 
         except Exception as e:
             logging.error(f"Error getting archive decision: {e}")
@@ -1195,62 +1445,74 @@ Subject: {subject}
                 importance_score=0.5
             )
 
-    async def _send_archive_report(self, archived: List[Dict], kept: List[Dict]) -> None:
+        if self.campaigns is not None and campaign is not None:
+            await self.campaigns.record_archive_decision(campaign, decision.json())
+        if self.archive_model is not None:
+            archive = decision.can_archive and decision.confidence >= ARCHIVE_MIN_CONFIDENCE
+            if local is not None:
+                # Shadow mode: how often the local decision would have matched the LLM's
+                METRICS.inc('archive_shadow_decisions', archived=local[0], agreed=local[0] == archive)
+                if local[0] != archive:
+                    logging.info(
+                        f"Local classifier would have {'archived' if local[0] else 'kept'} {message_id} "
+                        f"(P(archive)={local[1]:.3f}); the LLM decided otherwise")
+            if message_id is not None:
+                await self.archive_model.learn(message_id, email_data, archive, decision.confidence)
+        return decision
+
+    async def _send_archive_report(self, report: ArchiveReportBuilder) -> None:
         """Send a report of archived and kept emails"""
         try:
-            # Create report content
-            report = f"""Email Archive Report - {datetime.now().strftime('%Y-%m-%d %H:%M')}
-
-Archived Emails ({len(archived)}):
-{'=' * 50}
-"""
-            for email in archived:
-                report += f"\nFrom: {email['from']}\nSubject: {
-                    email['subject']}\nReason: {email['reason']}\n"
-
-            report += f"""\n\nKept Emails ({len(kept)}):
-{'=' * 50}
-"""
-            for email in kept:
-                report += f"\nFrom: {email['from']
-                                     }\nSubject: {email['subject']}\n"
-                if email['summary']:
-                    report += f"Summary: {email['summary']}\n"
-                report += f"Reason: {email['reason']}\n"
-
-            # Create message
-            message = f"""From: me
-To: me
-Subject: Email Archive Report - {datetime.now().strftime('%Y-%m-%d')}
-
-{report}
-"""
-            # Encode and send
-            encoded_message = base64.urlsafe_b64encode(
-                message.encode('utf-8')
-            ).decode('utf-8')
-
-            self.service.users().messages().send(
-                userId='me',
-                body={'raw': encoded_message}
-            ).execute()
-
-            logging.info("Sent archive report")
+            message = build_message(
+                to=await self.own_address(),
+                subject=report.subject(),
+                body=report.render(),
+                attachments=report.attachments()
+            )
+            # The same set of messages is only ever reported once
+            if await self.outbox.enqueue('archive_report', f"archive_report:{report.dedup_key}", message):
+                logging.info(
+                    f"Queued archive report for {report.archived} archived and {report.kept} kept emails")
 
         except Exception as e:
             logging.error(f"Error sending archive report: {e}")
 
 
 class GmailRuleEngine:
-    def __init__(self, gmail_automation: GmailAutomation, rules_file: str):
+    def __init__(
+        self,
+        gmail_automation: GmailAutomation,
+        rules_file: str,
+        shard: Optional[Tuple[int, int]] = None,
+        state: Optional[GmailStateDatabase] = None,
+        account: Optional[str] = None
+    ):
         self.gmail = gmail_automation
         self.rules_file = rules_file
+        # (index, count) of the message-ID hash range owned by this engine, None for all
+        self.shard = shard
+        self.account = account or gmail_automation.account
+        self.state = state or gmail_automation.state
         self.rules: List[EmailRule] = []
+        self.rules_version = ''
+        # Overridden by the persisted cursors in restore_state()
         self.last_check_time = datetime.now().isoformat()
-        self.last_archive_time = datetime.now()
-        # Run auto-archive every 4 hours
+        # Intervals of the auto-archive and unread-tracking jobs
         self.archive_interval = timedelta(hours=4)
+        self.unread_tracking_interval = timedelta(hours=1)
+        # Ask the AI whether each new message can be archived; this needs the
+        # full body of every message, so turning it off lets header-only rule
+        # sets run on metadata fetches
+        self.archive_on_arrival = True
+        # Push ingestion state, set by start_push()
+        self.email_address: Optional[str] = None
+        self.last_history_id: Optional[int] = None
+        self._state_restored = False
         self.load_rules()
+        # Shared by push and polling so overlapping windows don't re-run rules
+        self.ledger = ProcessedLedger(
+            self.state, self.account, self.rules_version,
+            locks=gmail_automation.shared if gmail_automation.shared.distributed else None)
 
     def load_rules(self) -> None:
         """Load rules from JSON file"""
@@ -1262,123 +1524,340 @@ class GmailRuleEngine:
                     f"Loaded {len(self.rules)} rules from {self.rules_file}")
         except FileNotFoundError:
             logging.warning(f"Rules file not found: {self.rules_file}")
+            rules_data = []
             self.rules = []
+        # Editing the rules file starts a new ledger so existing mail is re-evaluated
+        self.rules_version = hashlib.sha256(
+            json.dumps(rules_data, sort_keys=True).encode('utf-8')).hexdigest()[:16]
 
-    async def run_scheduled_tasks(self) -> None:
-        """Run scheduled tasks like auto-archiving"""
-        try:
-            current_time = datetime.now()
-
-            # Check if it's time to run auto-archive
-            if current_time - self.last_archive_time >= self.archive_interval:
-                logging.info("Running scheduled auto-archive")
-                await self.gmail.auto_archive_emails(max_emails=100)
-                self.last_archive_time = current_time
+    @property
+    def owns_scheduled_tasks(self) -> bool:
+        """Only the first shard of a mailbox runs mailbox-wide scheduled tasks"""
+        return self.shard is None or self.shard[0] == 0
 
-        except Exception as e:
-            logging.error(f"Error in scheduled tasks: {e}")
+    def scheduled_jobs(self) -> List[ScheduledJob]:
+        """Heavy mailbox-wide jobs to run on their own timers, independently of polling"""
+        if not self.owns_scheduled_tasks:
+            return []
+        return [
+            ScheduledJob(
+                name='auto_archive',
+                func=lambda: self._run_as_batch(
+                    lambda: self.gmail.auto_archive_emails(max_emails=100)),
+                interval_seconds=self.archive_interval.total_seconds()
+            ),
+            ScheduledJob(
+                name='track_unread',
+                func=lambda: self._run_as_batch(self.gmail.track_unread_emails),
+                interval_seconds=self.unread_tracking_interval.total_seconds(),
+                # Missed unread snapshots are not worth replaying
+                catch_up='skip'
+            ),
+            *([ScheduledJob(
+                name='sync_mirror',
+                func=lambda: self._run_as_batch(self.gmail.mirror.sync),
+                interval_seconds=300,
+                catch_up='skip'
+            )] if self.gmail.mirror else []),
+            ScheduledJob(
+                name='prune_ledger',
+                func=self._prune_ledger,
+                interval_seconds=timedelta(days=1).total_seconds(),
+                catch_up='skip'
+            ),
+        ]
 
-    async def process_message(self, message: Dict[str, Any]) -> None:
+    async def _prune_ledger(self) -> None:
+        await self.ledger.prune()
+        await self.gmail.outbox.prune()
+        removed = await self.state.prune_campaigns(CAMPAIGN_RETENTION_SECONDS)
+        if removed:
+            logging.info(f"Pruned {removed} campaigns with no recent mail")
+        if self.shard is not None:
+            await self.state.prune_listings(SHARD_LISTING_RETENTION_SECONDS)
+
+    def _state_key(self, name: str) -> str:
+        """State key for a cursor; message-shard workers of one account each keep their own"""
+        if self.shard is None:
+            return name
+        return f"{name}:{self.shard[0]}/{self.shard[1]}"
+
+    async def _get_cursor(self, name: str) -> Optional[str]:
+        saved = await self.state.get_state(self.account, self._state_key(name))
+        if saved is None and self.shard is not None:
+            # A shard's first start continues from the unsharded cursor
+            saved = await self.state.get_state(self.account, name)
+        return saved
+
+    async def restore_state(self) -> None:
+        """Load the persisted polling and history cursors once, and resume the outbox"""
+        if self._state_restored:
+            return
+        self._state_restored = True
+        # Replies and forwards queued before a restart would otherwise wait for the next enqueue
+        await self.gmail.outbox.resume()
+        saved_check_time = await self._get_cursor('last_check_time')
+        if saved_check_time:
+            self.last_check_time = saved_check_time
+        saved_history_id = await self._get_cursor('last_history_id')
+        if saved_history_id and self.last_history_id is None:
+            self.last_history_id = int(saved_history_id)
+
+    async def _run_as_batch(self, job: Callable[[], Any]) -> None:
+        """Run a background job at batch priority so it yields Gmail quota to rule processing"""
+        with self.gmail.quota.priority(PRIORITY_BATCH):
+            await job()
+
+    async def process_message(self, message: GmailMessage) -> None:
         """Process a single message against all rules"""
         try:
             # First check if sender is blocked
-            if await self.check_blocked_sender(message):
-                await self.gmail.apply_label([message['id']], 'Blocked')
+            with METRICS.span('block_check'):
+                blocked = await self.check_blocked_sender(message)
+            if blocked:
+                await self.gmail.apply_label([message.id], 'Blocked')
                 logging.info(f"Blocked message {
-                             message['id']} from blocked sender")
+                             message.id} from blocked sender")
                 return
 
-            headers = {h['name']: h['value']
-                       for h in message['payload']['headers']}
-
             # Check for auto-archive conditions first
-            if await self._should_auto_archive(message):
+            if self.archive_on_arrival and await self._should_auto_archive(message):
                 await self.gmail.auto_archive_emails(max_emails=1)
                 return
 
             # Continue with regular rule processing
-            for rule in self.rules:
-                matches = True
-                for field, pattern in rule.conditions.items():
-                    if field in headers:
-                        if not re.search(pattern, headers[field], re.IGNORECASE):
-                            matches = False
-                            break
-                    else:
-                        matches = False
-                        break
+            with METRICS.span('rule_match'):
+                matched_rules = self.match_rules(message.headers)
 
-                if matches:
-                    await self.apply_actions(message['id'], rule.actions)
-                    logging.info(f"Applied rule '{
-                                 rule.name}' to message {message['id']}")
+            for rule in matched_rules:
+                METRICS.inc('rules_matched', rule=rule.name)
+                await self.apply_actions(message.id, rule.actions)
+                logging.debug(f"Applied rule '{
+                              rule.name}' to message {message.id}")
 
         except Exception as e:
+            METRICS.inc('errors', stage='process_message')
             logging.error(f"Error processing message: {e}")
 
-    async def _should_auto_archive(self, message: Dict[str, Any]) -> bool:
+    def match_rules(self, headers: Dict[str, str], rules: Optional[List[EmailRule]] = None) -> List[EmailRule]:
+        """Rules (all loaded rules by default) whose conditions all match `headers`"""
+        return match_rules(self.rules if rules is None else rules, headers)
+
+    async def _should_auto_archive(self, message: GmailMessage) -> bool:
         """Check if message meets auto-archive criteria"""
         try:
-            headers = {h['name']: h['value']
-                       for h in message['payload']['headers']}
-            from_email = headers.get('From', '')
-            subject = headers.get('Subject', '')
+            message = await self._ensure_full(message)
+            from_email = message.headers.get('From', '')
+            subject = message.headers.get('Subject', '')
             body = self._get_message_body(message) or ""
 
             # Create email context for AI
             email_data = {
                 "from": from_email,
                 "subject": subject,
-                "body": body[:1000],
-                "has_attachments": self._has_attachments(message)
+                "body": self.gmail.compressor.compress('archive_decision', body),
+                "has_attachments": message.has_attachments
             }
 
-            # Get AI decision
-            decision = await self.gmail._get_archive_decision(email_data)
-            return decision.can_archive and decision.confidence >= 0.8
+            # Get AI decision, reusing one made for the same campaign
+            campaigns = self.gmail.campaigns
+            campaign = await campaigns.match(from_email, subject, body) if campaigns else None
+            decision = await self.gmail._get_archive_decision(email_data, message.id, campaign)
+            return decision.can_archive and decision.confidence >= ARCHIVE_MIN_CONFIDENCE
 
         except Exception as e:
             logging.error(f"Error checking auto-archive criteria: {e}")
             return False
 
-    def _has_attachments(self, message: Dict[str, Any]) -> bool:
-        """Check if message has attachments"""
-        try:
-            return any(
-                'filename' in part
-                for part in message['payload'].get('parts', [])
-                if 'filename' in part
-            )
-        except Exception:
-            return False
+    async def apply_actions(self, message_id: str, actions: List[Dict[str, Any]]) -> None:
+        """Apply the actions of a matched email_rules.json rule"""
+        await self.gmail.apply_nl_rule_actions(message_id, self.normalize_actions(actions))
 
-    async def check_new_emails(self) -> None:
-        """Check for new emails and process them"""
+    @staticmethod
+    def normalize_actions(actions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """email_rules.json actions in the form `apply_nl_rule_actions` expects"""
+        # Rules written by create_rule_from_prompt use snake_case and 'value' for forwards
+        normalized = []
+        for action in actions:
+            action = dict(action)
+            if action.get('type') == 'mark_read':
+                action['type'] = 'markRead'
+            if action.get('type') == 'forward' and 'to' not in action:
+                action['to'] = action.get('value')
+            normalized.append(action)
+        return normalized
+
+    async def check_new_emails(self) -> int:
+        """Check for new emails and process them, returning the number processed"""
+        processed = 0
         try:
-            # Run scheduled tasks first
-            await self.run_scheduled_tasks()
-
+            await self.restore_state()
+            if not self.owns_scheduled_tasks:
+                return await self._process_shard_listings()
             # Process new messages
             query = f'after:{self.last_check_time}'
-            messages = self.gmail.service.users().messages().list(
-                userId='me', q=query).execute()
+            messages = await self.gmail.execute(self.gmail.service.users().messages().list(
+                userId='me', q=query), 'messages.list')
 
             if 'messages' in messages:
-                for message in messages['messages']:
-                    full_message = self.gmail.service.users().messages().get(
-                        userId='me', id=message['id'], format='full').execute()
-                    await self.process_message(full_message)
+                message_ids = [message['id'] for message in messages['messages']]
+                if self.shard is not None:
+                    # The account's other shards read these instead of listing the mailbox
+                    await self.state.record_listing(self.account, message_ids)
+                processed = await self._process_message_ids(message_ids)
 
             self.last_check_time = datetime.now().isoformat()
+            await self.state.set_state(
+                self.account, self._state_key('last_check_time'), self.last_check_time)
 
         except Exception as e:
             logging.error(f"Error checking new emails: {str(e)}")
+        return processed
+
+    async def _process_shard_listings(self) -> int:
+        """Process the IDs the account's first shard listed since this shard last looked"""
+        key = self._state_key('listing_seq')
+        seq = int(await self.state.get_state(self.account, key) or 0)
+        listed = await self.state.listings_after(self.account, seq)
+        if not listed:
+            return 0
+        processed = await self._process_message_ids([message_id for _, message_id in listed])
+        await self.state.set_state(self.account, key, str(listed[-1][0]))
+        return processed
+
+    async def _plan_fetch(
+        self,
+        rules: Optional[List[EmailRule]] = None,
+        archive: Optional[bool] = None
+    ) -> Dict[str, Any]:
+        """messages.get arguments covering what process_message needs up front.
+
+        Messages are fetched with `format='metadata'` and only the headers the
+        rules and block patterns look at, unless a stage that always reads the
+        body is enabled. Stages that need the body of only some messages call
+        `_ensure_full()`. `rules` and `archive` default to the loaded rules and
+        `archive_on_arrival`.
+        """
+        if archive is None:
+            archive = self.archive_on_arrival
+        if archive or needs_body(await self.gmail.db.get_all_blocked_senders()):
+            return {'format': 'full'}
+        headers = {'From', 'Subject'}
+        for rule in self.rules if rules is None else rules:
+            headers.update(rule.conditions)
+        return {'format': 'metadata', 'metadataHeaders': sorted(headers)}
+
+    async def _ensure_full(self, message: GmailMessage) -> GmailMessage:
+        """Upgrade a metadata-only message to the full format in place"""
+        if message.full:
+            return message
+        METRICS.inc('fetch_escalations')
+        with METRICS.span('fetch', format='full'):
+            message.load(await self.gmail.execute(self.gmail.service.users().messages().get(
+                userId='me', id=message.id, format='full'), 'messages.get'))
+        return message
+
+    async def _process_message_ids(self, message_ids: List[str]) -> int:
+        """Fetch and process messages owned by this shard that aren't in the ledger"""
+        owned = [m for m in message_ids if owns_message(m, self.shard)]
+        unseen = await self.ledger.filter_unseen(owned)
+        if len(unseen) < len(owned):
+            METRICS.inc('cache_hits', len(owned) - len(unseen),
+                        cache='processed_ledger')
+        # Claim the batch before any side effects: a crash skips the rest of
+        # the batch rather than repeating forwards, replies and LLM calls.
+        # Messages another replica has locked are left to it.
+        claimed = await self.ledger.claim(unseen)
+        if len(claimed) < len(unseen):
+            METRICS.inc('lock_conflicts', len(unseen) - len(claimed))
+        unseen = claimed
+        fetch_args = await self._plan_fetch() if unseen else {}
+        processed = 0
+        try:
+            for message_id in unseen:
+                with METRICS.span('fetch', format=fetch_args['format']):
+                    # Only the compact record outlives this statement, not the response
+                    message = GmailMessage(await self.gmail.execute(
+                        self.gmail.service.users().messages().get(
+                            userId='me', id=message_id, **fetch_args), 'messages.get'))
+                await self.process_message(message)
+                METRICS.inc('messages_processed')
+                processed += 1
+        except Exception:
+            # Nothing has happened to the remaining messages yet; let the next tick retry them
+            await self.ledger.release(unseen[processed:])
+            raise
+        return processed
+
+    async def start_push(self, topic_name: Optional[str] = None) -> None:
+        """Record the mailbox's history baseline and (re)register a Gmail watch"""
+        profile = await self.gmail.execute(self.gmail.service.users().getProfile(userId='me'), 'getProfile')
+        self.email_address = profile['emailAddress']
+        await self.restore_state()
+        if self.last_history_id is None:
+            await self._save_history_id(int(profile['historyId']))
+        if topic_name:
+            watch = await self.gmail.execute(self.gmail.service.users().watch(
+                userId='me',
+                body={'topicName': topic_name, 'labelIds': ['INBOX']}
+            ), 'watch')
+            logging.info(
+                f"Registered Gmail watch for {self.email_address} until {watch.get('expiration')}")
+
+    async def process_history(self, history_id: int) -> int:
+        """Process messages added since the last seen history ID, up to `history_id`"""
+        await self.restore_state()
+        if self.last_history_id is None:
+            await self.start_push()
+        if history_id <= (self.last_history_id or 0):
+            return 0
+        message_ids: List[str] = []
+        page_token = None
+        try:
+            while True:
+                response = await self.gmail.execute(self.gmail.service.users().history().list(
+                    userId='me',
+                    startHistoryId=self.last_history_id,
+                    historyTypes=['messageAdded'],
+                    pageToken=page_token
+                ), 'history.list')
+                for record in response.get('history', []):
+                    for added in record.get('messagesAdded', []):
+                        message = added['message']
+                        if 'DRAFT' in message.get('labelIds', []) or message['id'] in message_ids:
+                            continue
+                        message_ids.append(message['id'])
+                page_token = response.get('nextPageToken')
+                if not page_token:
+                    break
+        except HttpError as error:
+            if error.resp.status != 404:
+                raise
+            # The baseline is too old for the history API; fall back to a search
+            logging.warning(
+                f"History {self.last_history_id} expired, falling back to polling")
+            processed = await self.check_new_emails()
+            await self._save_history_id(history_id)
+            return processed
+        processed = await self._process_message_ids(message_ids)
+        # Only move past these records once their messages are processed, so a
+        # failure replays them on the next notification or poll
+        await self._save_history_id(max(
+            history_id, int(response.get('historyId', history_id))))
+        return processed
+
+    async def _save_history_id(self, history_id: int) -> None:
+        # Overlapping notifications may finish out of order; never move backwards
+        if history_id <= (self.last_history_id or 0):
+            return
+        self.last_history_id = history_id
+        await self.state.set_state(self.account, self._state_key('last_history_id'), str(history_id))
 
-    def load_blocked_senders(self) -> Set[str]:
+    async def load_blocked_senders(self) -> Set[str]:
         """Load blocked senders from database"""
         blocked_senders = set()
         try:
-            db_patterns = self.gmail.db.get_all_blocked_senders()
+            db_patterns = await self.gmail.db.get_all_blocked_senders()
             for pattern in db_patterns:
                 blocked_senders.add(pattern['pattern'])
             return blocked_senders
@@ -1386,40 +1865,22 @@ class GmailRuleEngine:
             logging.error(f"Error loading blocked senders from database: {e}")
             return set()
 
-    async def check_blocked_sender(self, message: Dict[str, Any]) -> bool:
+    async def check_blocked_sender(self, message: GmailMessage) -> bool:
         """Check if sender is blocked using patterns from database"""
-        headers = {h['name']: h['value']
-                   for h in message['payload']['headers']}
-        from_email = headers.get('From', '')
-        body = self._get_message_body(message)
-
-        blocked_patterns = self.gmail.db.get_all_blocked_senders()
-
-        for pattern in blocked_patterns:
-            pattern_text = pattern['pattern']
-            pattern_type = pattern['type']
+        from_email = message.headers.get('From', '')
 
-            if pattern_type == 'email' and pattern_text.lower() in from_email.lower():
-                return True
-            elif pattern_type == 'pattern' and re.search(pattern_text, from_email, re.IGNORECASE):
-                return True
-            elif pattern_type == 'body_pattern' and body and re.search(pattern_text, body, re.IGNORECASE):
-                return True
-
-        return False
+        blocked_patterns = await self.gmail.db.get_all_blocked_senders()
+        if blocking_pattern(blocked_patterns, from_email) is not None:
+            return True
+        if not needs_body(blocked_patterns):
+            return False
+        # Only decode the body when a body pattern actually needs it
+        body = self._get_message_body(await self._ensure_full(message)) or ''
+        return blocking_pattern(blocked_patterns, from_email, body) is not None
 
-    def _get_message_body(self, message: Dict[str, Any]) -> Optional[str]:
+    def _get_message_body(self, message: GmailMessage) -> Optional[str]:
         """Extract message body"""
-        try:
-            if 'data' in message['payload']['body']:
-                return base64.urlsafe_b64decode(message['payload']['body']['data']).decode('utf-8')
-            elif 'parts' in message['payload']:
-                for part in message['payload']['parts']:
-                    if part.get('mimeType') == 'text/plain' and 'data' in part['body']:
-                        return base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
-        except Exception as e:
-            logging.error(f'Error getting message body: {e}')
-        return None
+        return self.gmail._get_message_body(message)
 
     async def create_rule_from_prompt(self, prompt: str) -> None:
         """Create a new Gmail rule from a user prompt using AI"""
@@ -1450,7 +1911,8 @@ class GmailRuleEngine:
             Only respond with the JSON, no other text."""
 
             # Get rule JSON from AI
-            completion = await self.gmail.ai_service.chat_completion(
+            completion = await self.gmail.chat_completion(
+                task='rule_from_prompt',
                 messages=[
                     ChatCompletionMessageInput(
                         role="system",
@@ -1552,31 +2014,351 @@ class GmailRuleEngine:
 # Test Users are published here: https://console.cloud.google.com/apis/credentials/consent?authuser=1&invt=AbiK0Q&project=gmail-daemon-442511
 
 
-async def main():
-    # Initialize database
-    db = GmailDatabase()
-
-    ai_service = AIService.get_instance(model_name="gpt-4")
-    gmail = GmailAutomation(
+async def main(args: Optional[argparse.Namespace] = None):
+    account = AccountConfig(
+        name='default',
         credentials_path='path/to/credentials.json',
         token_path='path/to/token.json',
-        ai_service=ai_service,
-        db=db
+        rules_file='email_rules.json',
+        transport=args.transport if args else TRANSPORT_DISCOVERY,
+        mirror=args.mirror if args else False,
+        archive_report_attachment=args.archive_report_attachment if args else None,
+        local_classifier=args.local_classifier if args else CLASSIFIER_SHADOW,
+        classifier_threshold=args.classifier_threshold if args else 0.95,
+        campaign_dedup=not args.no_campaign_dedup if args else True,
+        archive_on_arrival=not args.no_archive_on_arrival if args else True
+    )
+    await run_daemon(
+        [account],
+        push=push_config_from_args(args) if args else None,
+        metrics_port=args.metrics_port if args else None,
+        metrics_json=args.metrics_json if args else None,
+        profile=profile_config_from_args(args) if args else None,
+        model_routes=args.model_routes if args else None,
+        backfill=backfill_config_from_args(args) if args else None,
+        redis_url=args.redis_url if args else None,
+        state_dir=args.state_dir if args else Path('.')
     )
 
-    rule_engine = GmailRuleEngine(gmail, 'email_rules.json')
 
-    logging.info("Starting Gmail Rule Daemon...")
+async def run_daemon(
+    accounts: List[AccountConfig],
+    shard: Optional[Tuple[int, int]] = None,
+    on_tick: Optional[Callable[[str, int, float], None]] = None,
+    should_stop: Optional[Callable[[], bool]] = None,
+    push: Optional[PushConfig] = None,
+    metrics_port: Optional[int] = None,
+    metrics_json: Optional[Path] = None,
+    profile: Optional[ProfilerConfig] = None,
+    model_routes: Optional[Path] = None,
+    backfill: Optional[BackfillConfig] = None,
+    redis_url: Optional[str] = None,
+    state_dir: Path = Path('.')
+) -> None:
+    """Run the polling loop for one or more accounts in this process.
+
+    Each account is polled on its own adaptive interval and its heavy jobs run
+    as independent timed tasks. `on_tick(account_name, processed, seconds)` is
+    called after every poll and `should_stop()` is checked every second; both
+    are used by supervisor workers. With `push` set, Gmail watch notifications
+    drive processing and polling only runs as a slow safety net. Metrics are
+    collected only when `metrics_port` or `metrics_json` is given. With
+    `profile` set, SIGUSR1 profiles the next few polling ticks. AI tasks are
+    routed across the model tiers in the `model_routes` file if one is given;
+    otherwise every task goes to GPT-4. With `backfill` set, the rules are also applied to
+    existing mail, resuming from the last checkpoint and retrying every ten
+    minutes until the walk completes. Setup time and the latency of each
+    account's first poll are logged and recorded as `startup_seconds`.
+    With `redis_url`, label IDs, AI decisions and the blocked-sender version
+    are shared with every other daemon using that Redis server, and each
+    message is locked there so only one of them processes it. The state
+    database and the cached discovery document are kept in `state_dir`.
+    """
+    started = time.perf_counter()
+    # Caches shared by all accounts, and with other replicas when in Redis
+    shared = RedisSharedState.from_url(redis_url) if redis_url else SharedState()
+    if redis_url:
+        logging.info(f"Sharing caches and message locks through {redis_url}")
+    # Initialize database
+    db = AsyncGmailDatabase(factory=GmailDatabase, shared=shared if shared.distributed else None)
+    state_dir.mkdir(parents=True, exist_ok=True)
+    state = GmailStateDatabase(state_dir / DEFAULT_STATE_PATH)
+
+    ai_service = AIService.get_instance(model_name="gpt-4")
+    # One router for all accounts, since they share each model's limits
+    if model_routes:
+        ai_router = ModelRouter.build(
+            load_routing_config(model_routes),
+            lambda model: AIService.get_instance(model_name=model))
+        logging.info(f"Routing AI tasks with {model_routes}")
+    else:
+        ai_router = ModelRouter.single(ai_service)
+    scheduler = DaemonScheduler()
+    engines: List[GmailRuleEngine] = []
+    engines_by_address: Dict[str, GmailRuleEngine] = {}
+    first_polled: Set[str] = set()
+
+    def record_tick(name: str, processed: int, seconds: float) -> None:
+        if name not in first_polled:
+            first_polled.add(name)
+            latency = time.perf_counter() - started
+            METRICS.observe('startup_seconds', latency, phase='first_tick', account=name)
+            logging.info(
+                f"First poll of {name} finished {latency:.2f}s after startup ({seconds:.2f}s polling)")
+        if on_tick:
+            on_tick(name, processed, seconds)
+
+    # Message-shard workers of one mailbox split its per-user quota and send rate
+    shards = shard[1] if shard is not None else 1
+    for account in accounts:
+        gmail = GmailAutomation(
+            credentials_path=account.credentials_path,
+            token_path=account.token_path,
+            ai_service=ai_service,
+            db=db,
+            transport=account.transport,
+            state=state,
+            account=account.name,
+            ai_router=ai_router,
+            shared=shared,
+            discovery_cache=state_dir / DEFAULT_DISCOVERY_CACHE.name,
+            quota=GmailQuotaLimiter(units_per_second=GMAIL_UNITS_PER_SECOND / shards)
+        )
+        if shards > 1:
+            gmail.outbox = Outbox(gmail, OutboxConfig(
+                sends_per_minute=OutboxConfig.sends_per_minute / shards))
+        if account.mirror:
+            gmail.enable_mirror()
+        gmail.archive_report.attachment = account.archive_report_attachment
+        if account.local_classifier != CLASSIFIER_OFF:
+            gmail.enable_archive_model(ClassifierConfig(
+                threshold=account.classifier_threshold,
+                shadow=account.local_classifier == CLASSIFIER_SHADOW))
+        if not account.campaign_dedup:
+            gmail.campaigns = None
+        rule_engine = GmailRuleEngine(gmail, account.rules_file, shard=shard)
+        rule_engine.archive_on_arrival = account.archive_on_arrival
+        engines.append(rule_engine)
+        interval = AdaptiveInterval()
+        if push:
+            await rule_engine.start_push(push.topic_name)
+            engines_by_address[rule_engine.email_address] = rule_engine
+            interval = AdaptiveInterval(
+                initial_seconds=push.fallback_poll_seconds,
+                min_seconds=push.fallback_poll_seconds,
+                max_seconds=push.fallback_poll_seconds)
+            if push.topic_name:
+                # Gmail watches expire after 7 days; renew daily
+                scheduler.add_job(ScheduledJob(
+                    name=f"{account.name}:renew_watch",
+                    func=lambda engine=rule_engine: engine.start_push(
+                        push.topic_name),
+                    interval_seconds=timedelta(days=1).total_seconds()
+                ))
+        scheduler.add_poller(
+            account.name, PROFILER.wrap(rule_engine.check_new_emails), interval, record_tick)
+        for job in rule_engine.scheduled_jobs():
+            job.name = f"{account.name}:{job.name}"
+            job.func = PROFILER.wrap(job.func)
+            scheduler.add_job(job)
+        if backfill:
+            scheduler.add_job(ScheduledJob(
+                name=f"{account.name}:backfill",
+                func=PROFILER.wrap(Backfill(rule_engine, backfill).run),
+                interval_seconds=600,
+                catch_up='skip',
+                initial_delay=0
+            ))
+
+    async def handle_notification(notification: GmailNotification) -> None:
+        engine = engines_by_address.get(notification.email_address)
+        if engine is None:
+            logging.warning(
+                f"Push notification for unknown mailbox {notification.email_address}")
+            return
+        try:
+            processed = await PROFILER.wrap(engine.process_history)(notification.history_id)
+        except Exception as e:
+            # Poll now instead of waiting out the fallback interval
+            logging.error(f"Error processing push notification {notification}: {e}")
+            scheduler.wake(engine.account)
+            return
+        logging.debug(
+            f"Processed {processed} messages from push notification {notification}")
+
+    listener = PushListener(push, handle_notification) if push else None
+    if listener:
+        await listener.start()
+
+    metrics_server = MetricsServer(
+        METRICS, port=metrics_port) if metrics_port else None
+    if metrics_port or metrics_json:
+        METRICS.enable()
+    if metrics_server:
+        await metrics_server.start()
+    if metrics_json:
+        async def dump_metrics() -> None:
+            METRICS.write_json(metrics_json)
+        scheduler.add_job(ScheduledJob(
+            name='metrics_json', func=dump_metrics, interval_seconds=60, catch_up='skip'))
+
+    if profile:
+        PROFILER.config = profile
+        PROFILER.install_signal_handler()
+
+    async def watch_stop() -> None:
+        while not should_stop():
+            await asyncio.sleep(1)
+        scheduler.stop()
+
+    setup_seconds = time.perf_counter() - started
+    METRICS.observe('startup_seconds', setup_seconds, phase='setup')
+    logging.info(f"Starting Gmail Rule Daemon after {setup_seconds:.2f}s of setup...")
+    stop_watcher = asyncio.create_task(watch_stop()) if should_stop else None
     try:
-        while True:
-            await rule_engine.check_new_emails()
-            await asyncio.sleep(60)  # Check every minute
-    except KeyboardInterrupt:
+        await scheduler.run()
+    except (KeyboardInterrupt, asyncio.CancelledError):
         logging.info("Shutting down Gmail Rule Daemon...")
     finally:
-        db.close()
+        if stop_watcher:
+            stop_watcher.cancel()
+        if listener:
+            await listener.stop()
+        if metrics_server:
+            await metrics_server.stop()
+        if metrics_json:
+            METRICS.write_json(metrics_json)
+        for rule_engine in engines:
+            await rule_engine.gmail.close()
+        await ai_router.close()
+        await db.close()
+        state.close()
+        await shared.close()
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Gmail rule daemon")
+    parser.add_argument('--accounts', type=Path, default=None,
+                        help="JSON file listing accounts to process")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of worker processes; >1 enables supervisor mode")
+    parser.add_argument('--shard-by', choices=['account', 'message'], default='account',
+                        help="Shard accounts across workers, or message-ID hash ranges of a single account")
+    parser.add_argument('--transport', choices=TRANSPORTS, default=TRANSPORT_DISCOVERY,
+                        help="Gmail API transport for the default account")
+    parser.add_argument('--mirror', action='store_true',
+                        help="Mirror the default account's metadata locally for searches")
+    parser.add_argument('--archive-report-attachment', choices=REPORT_ATTACHMENTS, default=None,
+                        help="Attach every archived and kept email to archive reports in this format")
+    parser.add_argument('--local-classifier', choices=CLASSIFIER_MODES, default=CLASSIFIER_SHADOW,
+                        help="Local auto-archive classifier: off, shadow (learn and log agreement with "
+                             "the LLM only) or on (decide confident cases without the LLM)")
+    parser.add_argument('--classifier-threshold', type=float, default=0.95,
+                        help="Decide auto-archive locally when the classifier is at least this confident")
+    parser.add_argument('--no-campaign-dedup', action='store_true',
+                        help="Ask the LLM about every copy of a bulk campaign instead of reusing results")
+    parser.add_argument('--no-archive-on-arrival', action='store_true',
+                        help="Leave AI archiving to the scheduled sweep, so rules only need metadata fetches")
+    parser.add_argument('--model-routes', type=Path, default=None,
+                        help="Route AI tasks across local and hosted model tiers as this JSON file says "
+                             "(see scripts/model_routes.example.json); without it every task goes to GPT-4")
+    parser.add_argument('--backfill', nargs='?', const='', default=None, metavar='QUERY',
+                        help="Also apply the rules to existing mail matching this Gmail search (all mail if empty)")
+    parser.add_argument('--backfill-label', action='append', default=[],
+                        help="Only backfill messages with this label ID (repeatable)")
+    parser.add_argument('--backfill-rule', action='append', default=[],
+                        help="Only apply the rule with this name during the backfill (repeatable)")
+    parser.add_argument('--backfill-quota-share', type=float, default=0.25,
+                        help="Share of each account's Gmail quota the backfill may use")
+    parser.add_argument('--push-port', type=int, default=None,
+                        help="Accept Gmail push notifications on this local port")
+    parser.add_argument('--push-topic', default=None,
+                        help="Pub/Sub topic to register with users.watch")
+    parser.add_argument('--push-token', default=None,
+                        help="Verification token expected on push requests")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="Serve Prometheus metrics on this local port; with --workers, "
+                             "worker i uses this port + i")
+    parser.add_argument('--metrics-json', type=Path, default=None,
+                        help="Write a JSON metrics snapshot to this file every minute; with --workers, "
+                             "the supervisor's goes here and worker i's to NAME.worker-i.json")
+    parser.add_argument('--profile-dir', type=Path, default=None,
+                        help="Enable SIGUSR1 tick profiling, writing flamegraph stacks here")
+    parser.add_argument('--profile-mode', choices=PROFILE_MODES, default='wall',
+                        help="Profile wall-clock time or only time on CPU")
+    parser.add_argument('--profile-ticks', type=int, default=5,
+                        help="Number of polling ticks to profile per trigger")
+    parser.add_argument('--state-dir', type=Path, default=Path('.'),
+                        help="Directory for the daemon's state database and cached Gmail discovery document")
+    parser.add_argument('--redis-url', default=None,
+                        help="Share caches and per-message locks with other daemons through this Redis, "
+                             "e.g. redis://localhost:6379/0")
+    args = parser.parse_args(argv)
+    if args.workers > 1 and (args.push_port is not None or args.push_topic):
+        # Each worker would need its own listener and watch; poll instead
+        parser.error("--push-port and --push-topic can't be combined with --workers")
+    return args
+
+
+def push_config_from_args(args: argparse.Namespace) -> Optional[PushConfig]:
+    if args.push_port is None:
+        return None
+    return PushConfig(port=args.push_port, topic_name=args.push_topic,
+                      verification_token=args.push_token)
+
+
+def profile_config_from_args(args: argparse.Namespace) -> Optional[ProfilerConfig]:
+    if args.profile_dir is None:
+        return None
+    return ProfilerConfig(output_dir=args.profile_dir, mode=args.profile_mode,
+                          ticks=args.profile_ticks)
+
+
+def backfill_config_from_args(args: argparse.Namespace) -> Optional[BackfillConfig]:
+    if args.backfill is None and not args.backfill_label:
+        return None
+    return BackfillConfig(query=args.backfill or '', label_ids=args.backfill_label,
+                          rules=args.backfill_rule, quota_share=args.backfill_quota_share)
 
 
 if __name__ == "__main__":
-    import asyncio
-    asyncio.run(main())
+    cli_args = parse_args()
+    if cli_args.workers > 1:
+        supervisor = ShardSupervisor(
+            accounts=load_accounts(cli_args.accounts) if cli_args.accounts else [AccountConfig(
+                name='default',
+                credentials_path='path/to/credentials.json',
+                token_path='path/to/token.json',
+                transport=cli_args.transport,
+                mirror=cli_args.mirror,
+                archive_report_attachment=cli_args.archive_report_attachment,
+                local_classifier=cli_args.local_classifier,
+                classifier_threshold=cli_args.classifier_threshold,
+                campaign_dedup=not cli_args.no_campaign_dedup,
+                archive_on_arrival=not cli_args.no_archive_on_arrival
+            )],
+            num_workers=cli_args.workers,
+            shard_by=cli_args.shard_by,
+            profile_dir=str(cli_args.profile_dir) if cli_args.profile_dir else None,
+            profile_mode=cli_args.profile_mode,
+            profile_ticks=cli_args.profile_ticks,
+            model_routes=str(cli_args.model_routes) if cli_args.model_routes else None,
+            backfill=backfill_config_from_args(cli_args),
+            redis_url=cli_args.redis_url,
+            state_dir=str(cli_args.state_dir),
+            metrics_port=cli_args.metrics_port,
+            metrics_json=str(cli_args.metrics_json) if cli_args.metrics_json else None
+        )
+        supervisor.run()
+    elif cli_args.accounts:
+        asyncio.run(run_daemon(load_accounts(cli_args.accounts),
+                    push=push_config_from_args(cli_args),
+                    metrics_port=cli_args.metrics_port,
+                    metrics_json=cli_args.metrics_json,
+                    profile=profile_config_from_args(cli_args),
+                    model_routes=cli_args.model_routes,
+                    backfill=backfill_config_from_args(cli_args),
+                    redis_url=cli_args.redis_url,
+                    state_dir=cli_args.state_dir))
+    else:
+        asyncio.run(main(cli_args))
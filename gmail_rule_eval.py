@@ -0,0 +1,369 @@
+"""Offline what-if evaluation of rule and block-list changes.
+
+Runs the matching `GmailRuleEngine.process_message` does (block list first,
+then every rule whose header conditions match) over a local corpus: an mbox,
+a maildir or the metadata mirror in `GmailStateDatabase`. It never calls
+Gmail. Every message is matched against the current and the candidate rule
+sets. The report gives match counts and matching cost per rule under both,
+plus the messages whose outcome would change.
+
+The corpus is read in the main process and split into chunks. Parsing and
+matching run in worker processes.
+
+    python gmail_rule_eval.py --rules new_rules.json --mbox ~/Takeout/Mail/All\\ mail.mbox
+    python gmail_rule_eval.py --blocked new_blocked.json --mirror gmail_state.db --account default
+
+Mirror rows only hold the mirrored headers and no body. Body patterns are
+not evaluated against them, and rule conditions on other headers are listed
+in the report because they can never match there.
+"""
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from email.errors import HeaderParseError
+from email.header import decode_header, make_header
+from email.message import Message
+from email.parser import BytesParser
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+import argparse
+import asyncio
+import json
+import mailbox
+import multiprocessing
+import time
+
+from gmail_rules import EmailRule, blocking_pattern, needs_body, rule_matches
+
+CURRENT = 'current'
+CANDIDATE = 'candidate'
+# Pseudo-rule for messages the block list catches before any rule runs
+BLOCKED = 'Blocked'
+
+# (message ID, headers, body or None when the corpus has no bodies)
+CorpusMessage = Tuple[str, Dict[str, str], Optional[str]]
+# ('raw', [(fallback ID, RFC 822 bytes)]) or ('parsed', [CorpusMessage])
+Chunk = Tuple[str, List[Any]]
+
+
+@dataclass
+class RuleSet:
+    rules: List[EmailRule] = field(default_factory=list)
+    blocked: List[Dict[str, Any]] = field(default_factory=list)
+
+
+@dataclass
+class RuleSetStats:
+    matches: Counter = field(default_factory=Counter)
+    # Nanoseconds spent matching each rule, and the block list
+    nanoseconds: Counter = field(default_factory=Counter)
+    unmatched: int = 0
+
+    def merge(self, other: 'RuleSetStats') -> None:
+        self.matches.update(other.matches)
+        self.nanoseconds.update(other.nanoseconds)
+        self.unmatched += other.unmatched
+
+
+@dataclass
+class EvalResult:
+    messages: int = 0
+    # Messages that could not be parsed
+    errors: int = 0
+    stats: Dict[str, RuleSetStats] = field(
+        default_factory=lambda: {CURRENT: RuleSetStats(), CANDIDATE: RuleSetStats()})
+    changed: int = 0
+    # Messages each rule newly matches, or no longer matches, under the candidate
+    gained: Counter = field(default_factory=Counter)
+    lost: Counter = field(default_factory=Counter)
+    examples: List[Dict[str, Any]] = field(default_factory=list)
+
+    def merge(self, other: 'EvalResult', max_examples: int) -> None:
+        self.messages += other.messages
+        self.errors += other.errors
+        for name, stats in other.stats.items():
+            self.stats[name].merge(stats)
+        self.changed += other.changed
+        self.gained.update(other.gained)
+        self.lost.update(other.lost)
+        self.examples.extend(other.examples[:max_examples - len(self.examples)])
+
+
+def load_rules(path: Optional[Path]) -> List[EmailRule]:
+    """Rules from an email_rules.json file; a missing file has none, as in the daemon"""
+    if path is None or not path.exists():
+        return []
+    with open(path, 'r') as f:
+        return [EmailRule(**rule) for rule in json.load(f)]
+
+
+def load_blocked(path: Optional[Path]) -> List[Dict[str, Any]]:
+    """Blocked-sender rows ({'pattern': ..., 'type': ...}) from a JSON file"""
+    if path is None:
+        return []
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def decode_header_value(value: str) -> str:
+    """Unfolded header value with RFC 2047 encoded words decoded, as Gmail returns it"""
+    value = value.replace('\r\n', '').replace('\n', '')
+    if '=?' not in value:
+        return value
+    try:
+        return str(make_header(decode_header(value)))
+    except (HeaderParseError, LookupError, UnicodeDecodeError):
+        return value
+
+
+def _payload_text(part: Message) -> str:
+    data = part.get_payload(decode=True) or b''
+    try:
+        return data.decode(part.get_content_charset() or 'utf-8', errors='replace')
+    except LookupError:
+        return data.decode('utf-8', errors='replace')
+
+
+def parse_message(fallback_id: str, raw: bytes, with_body: bool = True) -> CorpusMessage:
+    """Headers and body of an RFC 822 message, read the way the daemon reads Gmail's.
+
+    Uses the compat32 parser: the modern header registry is several times
+    slower and its structured headers are not needed for regex matching.
+    """
+    message = _PARSER.parsebytes(raw, headersonly=not with_body)
+    # Like the daemon's dict of the header list, a repeated header keeps its last value
+    headers = {name: decode_header_value(str(value)) for name, value in message.items()}
+    body = None
+    if with_body:
+        # The daemon reads a single-part body, or the first top-level text/plain part
+        if not message.is_multipart():
+            body = _payload_text(message)
+        else:
+            part = next((p for p in message.get_payload() if p.get_content_type() == 'text/plain'), None)
+            body = _payload_text(part) if part is not None else ''
+    return headers.get('Message-ID') or fallback_id, headers, body
+
+
+def read_mailbox(box: mailbox.Mailbox, prefix: str, limit: Optional[int]) -> Iterator[Tuple[str, bytes]]:
+    for count, key in enumerate(box.iterkeys()):
+        if limit is not None and count >= limit:
+            return
+        yield f"{prefix}:{key}", box.get_bytes(key)
+
+
+def read_mirror(path: Path, account: str, limit: Optional[int]) -> Iterator[CorpusMessage]:
+    # Imported here so that mbox and maildir runs don't need the SQLite state layer
+    from gmail_state_db import GmailStateDatabase
+
+    state = GmailStateDatabase(path)
+    try:
+        rows = asyncio.run(state.search_mirror(account, include_spam_trash=True, limit=limit))
+    finally:
+        state.close()
+    for row in rows:
+        yield row['message_id'], row['headers'], None
+
+
+def chunked(kind: str, items: Iterator[Any], size: int) -> Iterator[Chunk]:
+    chunk: List[Any] = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield kind, chunk
+            chunk = []
+    if chunk:
+        yield kind, chunk
+
+
+_PARSER = BytesParser()
+_RULE_SETS: Dict[str, RuleSet] = {}
+_MAX_EXAMPLES = 0
+# Bodies are only decoded when a body pattern needs them
+_WITH_BODY = True
+
+
+def _init_worker(rule_sets: Dict[str, RuleSet], max_examples: int) -> None:
+    global _RULE_SETS, _MAX_EXAMPLES, _WITH_BODY
+    _RULE_SETS = rule_sets
+    _MAX_EXAMPLES = max_examples
+    _WITH_BODY = any(needs_body(rule_set.blocked) for rule_set in rule_sets.values())
+
+
+def _outcome(rule_set: RuleSet, stats: RuleSetStats, headers: Dict[str, str], body: Optional[str]) -> List[str]:
+    """Names of the rules `process_message` would apply, or just BLOCKED"""
+    started = time.perf_counter_ns()
+    blocked = blocking_pattern(rule_set.blocked, headers.get('From', ''), body)
+    stats.nanoseconds[BLOCKED] += time.perf_counter_ns() - started
+    if blocked is not None:
+        stats.matches[BLOCKED] += 1
+        return [BLOCKED]
+    matched = []
+    for rule in rule_set.rules:
+        started = time.perf_counter_ns()
+        hit = rule_matches(rule, headers)
+        stats.nanoseconds[rule.name] += time.perf_counter_ns() - started
+        if hit:
+            stats.matches[rule.name] += 1
+            matched.append(rule.name)
+    if not matched:
+        stats.unmatched += 1
+    return matched
+
+
+def evaluate_chunk(chunk: Chunk) -> EvalResult:
+    kind, items = chunk
+    result = EvalResult()
+    for item in items:
+        if kind == 'raw':
+            try:
+                message_id, headers, body = parse_message(*item, with_body=_WITH_BODY)
+            except Exception:
+                result.errors += 1
+                continue
+        else:
+            message_id, headers, body = item
+        result.messages += 1
+        current = _outcome(_RULE_SETS[CURRENT], result.stats[CURRENT], headers, body)
+        candidate = _outcome(_RULE_SETS[CANDIDATE], result.stats[CANDIDATE], headers, body)
+        if current == candidate:
+            continue
+        result.changed += 1
+        result.gained.update(set(candidate) - set(current))
+        result.lost.update(set(current) - set(candidate))
+        if len(result.examples) < _MAX_EXAMPLES:
+            result.examples.append({
+                'id': message_id, 'from': headers.get('From', ''), 'subject': headers.get('Subject', ''),
+                CURRENT: current, CANDIDATE: candidate})
+    return result
+
+
+def evaluate(
+    chunks: Iterator[Chunk],
+    rule_sets: Dict[str, RuleSet],
+    workers: int = 1,
+    max_examples: int = 20
+) -> EvalResult:
+    """Evaluate both rule sets over every chunk, in `workers` processes"""
+    result = EvalResult()
+    if workers <= 1:
+        _init_worker(rule_sets, max_examples)
+        for chunk in chunks:
+            result.merge(evaluate_chunk(chunk), max_examples)
+        return result
+    with multiprocessing.get_context('spawn').Pool(
+            workers, initializer=_init_worker, initargs=(rule_sets, max_examples)) as pool:
+        # Keep a few chunks per worker in flight so a large mbox is never all in memory
+        pending: Deque[Any] = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(evaluate_chunk, (chunk,)))
+            if len(pending) >= workers * 2:
+                result.merge(pending.popleft().get(), max_examples)
+        while pending:
+            result.merge(pending.popleft().get(), max_examples)
+    return result
+
+
+def rule_status(current: List[EmailRule], candidate: List[EmailRule]) -> Dict[str, str]:
+    """'added', 'removed', 'changed' or 'unchanged' for every rule name in either set"""
+    before = {rule.name: rule for rule in current}
+    after = {rule.name: rule for rule in candidate}
+    status = {}
+    for name in [*before, *(name for name in after if name not in before)]:
+        if name not in after:
+            status[name] = 'removed'
+        elif name not in before:
+            status[name] = 'added'
+        else:
+            same = (before[name].conditions, before[name].actions) == (after[name].conditions, after[name].actions)
+            status[name] = 'unchanged' if same else 'changed'
+    return status
+
+
+def build_report(result: EvalResult, rule_sets: Dict[str, RuleSet], seconds: float) -> Dict[str, Any]:
+    def rule_set_report(name: str) -> Dict[str, Any]:
+        stats = result.stats[name]
+        names = [BLOCKED, *dict.fromkeys(rule.name for rule in rule_sets[name].rules)]
+        return {
+            'unmatched': stats.unmatched,
+            'rules': {
+                rule: {
+                    'matches': stats.matches[rule],
+                    'match_pct': round(100 * stats.matches[rule] / result.messages, 2) if result.messages else 0.0,
+                    'us_per_message': round(stats.nanoseconds[rule] / result.messages / 1000, 3)
+                    if result.messages else 0.0,
+                } for rule in names
+            },
+        }
+
+    status = rule_status(rule_sets[CURRENT].rules, rule_sets[CANDIDATE].rules)
+    return {
+        'messages': result.messages,
+        'parse_errors': result.errors,
+        'seconds': round(seconds, 3),
+        'messages_per_sec': round(result.messages / seconds, 1) if seconds else None,
+        CURRENT: rule_set_report(CURRENT),
+        CANDIDATE: rule_set_report(CANDIDATE),
+        'diff': {
+            'messages_changed': result.changed,
+            'rules': {
+                name: {'status': status.get(name, 'unchanged'),
+                       'gained': result.gained[name], 'lost': result.lost[name]}
+                for name in [BLOCKED, *status]
+            },
+            'examples': result.examples,
+        },
+    }
+
+
+def main(args: argparse.Namespace) -> None:
+    current = RuleSet(load_rules(args.current_rules), load_blocked(args.current_blocked))
+    candidate = RuleSet(
+        load_rules(args.rules) if args.rules else current.rules,
+        load_blocked(args.blocked) if args.blocked else current.blocked)
+    rule_sets = {CURRENT: current, CANDIDATE: candidate}
+    if args.mirror:
+        chunks = chunked('parsed', read_mirror(args.mirror, args.account, args.limit), args.chunk_size)
+    elif args.maildir:
+        chunks = chunked('raw', read_mailbox(mailbox.Maildir(args.maildir, factory=None, create=False),
+                                             'maildir', args.limit), args.chunk_size)
+    else:
+        chunks = chunked('raw', read_mailbox(mailbox.mbox(args.mbox, create=False), 'mbox', args.limit),
+                         args.chunk_size)
+    started = time.perf_counter()
+    result = evaluate(chunks, rule_sets, args.workers, args.examples)
+    report = build_report(result, rule_sets, time.perf_counter() - started)
+    report['workers'] = args.workers
+    if args.mirror:
+        from gmail_mirror import MIRROR_HEADERS
+        # Conditions on headers the mirror doesn't keep can never match it
+        report['unavailable_headers'] = {
+            rule.name: missing for rule in [*current.rules, *candidate.rules]
+            if (missing := sorted(set(rule.conditions) - set(MIRROR_HEADERS)))}
+    print(json.dumps(report, indent=2))
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    corpus = parser.add_mutually_exclusive_group(required=True)
+    corpus.add_argument('--mbox', type=Path, help="Evaluate the messages of this mbox")
+    corpus.add_argument('--maildir', type=Path, help="Evaluate the messages of this maildir")
+    corpus.add_argument('--mirror', type=Path, help="Evaluate the metadata mirror in this state database")
+    parser.add_argument('--account', default='default', help="Mirrored account to read with --mirror")
+    parser.add_argument('--current-rules', type=Path, default=Path('email_rules.json'),
+                        help="Rules the daemon runs today")
+    parser.add_argument('--rules', type=Path, default=None,
+                        help="Candidate rules file; defaults to the current rules")
+    parser.add_argument('--current-blocked', type=Path, default=None,
+                        help="JSON list of the blocked-sender patterns in use today")
+    parser.add_argument('--blocked', type=Path, default=None,
+                        help="Candidate blocked-sender patterns; defaults to the current ones")
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                        help="Worker processes; 1 evaluates in this process")
+    parser.add_argument('--chunk-size', type=int, default=500, help="Messages per worker task")
+    parser.add_argument('--limit', type=int, default=None, help="Evaluate at most this many messages")
+    parser.add_argument('--examples', type=int, default=20,
+                        help="Changed messages to list in the diff")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    main(parse_args())
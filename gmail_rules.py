@@ -0,0 +1,58 @@
+"""Rule and block-list matching shared by the daemon and offline tools.
+
+These functions only look at header values and message bodies. They make
+no Gmail calls and import nothing heavy, so `gmail_rule_eval` worker
+processes can run them against a local corpus with exactly the semantics
+`GmailRuleEngine.process_message` and `check_blocked_sender` apply live.
+"""
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+import re
+
+
+@dataclass
+class EmailRule:
+    name: str
+    # e.g., {'from': 'example@gmail.com', 'subject': '.*invoice.*'}
+    conditions: Dict[str, str]
+    # e.g., [{'type': 'label', 'value': 'Invoices'}, {'type': 'save_attachment'}]
+    actions: List[Dict[str, Any]]
+
+
+def rule_matches(rule: EmailRule, headers: Dict[str, str]) -> bool:
+    """Whether every condition's pattern is found in its header; missing headers never match"""
+    for field, pattern in rule.conditions.items():
+        if field not in headers or not re.search(pattern, headers[field], re.IGNORECASE):
+            return False
+    return True
+
+
+def match_rules(rules: List[EmailRule], headers: Dict[str, str]) -> List[EmailRule]:
+    return [rule for rule in rules if rule_matches(rule, headers)]
+
+
+def blocking_pattern(
+    patterns: List[Dict[str, Any]],
+    from_email: str,
+    body: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    """First blocked-sender pattern matching the message, or None.
+
+    `patterns` are `GmailDatabase.get_all_blocked_senders()` rows. Body
+    patterns are only checked when `body` is given, so callers can try the
+    header patterns before paying for the body.
+    """
+    for pattern in patterns:
+        pattern_text = pattern['pattern']
+        pattern_type = pattern['type']
+        if pattern_type == 'email' and pattern_text.lower() in from_email.lower():
+            return pattern
+        elif pattern_type == 'pattern' and re.search(pattern_text, from_email, re.IGNORECASE):
+            return pattern
+        elif pattern_type == 'body_pattern' and body and re.search(pattern_text, body, re.IGNORECASE):
+            return pattern
+    return None
+
+
+def needs_body(patterns: List[Dict[str, Any]]) -> bool:
+    return any(pattern['type'] == 'body_pattern' for pattern in patterns)
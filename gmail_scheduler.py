@@ -0,0 +1,179 @@
+"""Adaptive polling and independent timed jobs for the Gmail rule daemon.
+
+Polling backs off on quiet mailboxes and tightens during bursts, while heavy
+mailbox-wide jobs (auto-archive, unread tracking) run as their own asyncio
+tasks so they never delay new-mail processing.
+"""
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import logging
+import random
+import time
+
+# Missed-run catch-up policies for ScheduledJob
+CATCH_UP_SKIP = 'skip'  # drop missed runs, wait for the next slot
+CATCH_UP_ONCE = 'once'  # run once immediately, however many were missed
+CATCH_UP_ALL = 'all'    # replay every missed run (up to max_catch_up)
+CATCH_UP_POLICIES = (CATCH_UP_SKIP, CATCH_UP_ONCE, CATCH_UP_ALL)
+
+
+def _jittered(seconds: float, jitter: float) -> float:
+    """Spread `seconds` by +/- `jitter` (a fraction) to avoid thundering herds"""
+    if jitter <= 0:
+        return seconds
+    return max(0.0, seconds * (1 + random.uniform(-jitter, jitter)))
+
+
+@dataclass
+class AdaptiveInterval:
+    """Poll interval that backs off while idle and tightens during bursts"""
+    min_seconds: float = 5.0
+    max_seconds: float = 600.0
+    initial_seconds: float = 60.0
+    # Multiplier applied after a tick with no new mail
+    backoff: float = 1.5
+    # Divisor applied after a tick with some new mail
+    tighten: float = 2.0
+    # A tick with at least this many messages jumps straight to min_seconds
+    burst_threshold: int = 10
+    jitter: float = 0.1
+    current: float = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.current = min(self.max_seconds, max(
+            self.min_seconds, self.initial_seconds))
+
+    def update(self, processed: int) -> float:
+        """Record a tick's message count and return the next delay in seconds"""
+        if processed >= self.burst_threshold:
+            self.current = self.min_seconds
+        elif processed > 0:
+            self.current = max(self.min_seconds, self.current / self.tighten)
+        else:
+            self.current = min(self.max_seconds, self.current * self.backoff)
+        return _jittered(self.current, self.jitter)
+
+
+@dataclass
+class ScheduledJob:
+    """A heavy job run on its own timer, independently of polling"""
+    name: str
+    func: Callable[[], Awaitable[Any]]
+    interval_seconds: float
+    jitter: float = 0.05
+    catch_up: str = CATCH_UP_ONCE
+    max_catch_up: int = 3
+    # Seconds before the first run; None waits one full interval
+    initial_delay: Optional[float] = None
+
+    def __post_init__(self) -> None:
+        if self.catch_up not in CATCH_UP_POLICIES:
+            raise ValueError(f"Unknown catch-up policy: {self.catch_up}")
+
+
+class DaemonScheduler:
+    """Run adaptive pollers and timed jobs as independent asyncio tasks"""
+
+    def __init__(self) -> None:
+        self._pollers: Dict[str, Any] = {}
+        self._jobs: List[ScheduledJob] = []
+        self._wake_events: Dict[str, asyncio.Event] = {}
+        self._stop = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    def add_poller(
+        self,
+        name: str,
+        poll: Callable[[], Awaitable[int]],
+        interval: Optional[AdaptiveInterval] = None,
+        on_tick: Optional[Callable[[str, int, float], None]] = None
+    ) -> None:
+        """Register a poll function that returns the number of messages it processed"""
+        self._pollers[name] = (poll, interval or AdaptiveInterval(), on_tick)
+        self._wake_events[name] = asyncio.Event()
+
+    def add_job(self, job: ScheduledJob) -> None:
+        self._jobs.append(job)
+
+    def wake(self, name: Optional[str] = None) -> None:
+        """Cut the current poll sleep short, e.g. when a push notification arrives"""
+        for poller_name, event in self._wake_events.items():
+            if name is None or poller_name == name:
+                event.set()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    async def _sleep(self, seconds: float, wake: Optional[asyncio.Event] = None) -> None:
+        """Sleep until the timeout, a stop request or (optionally) a wake-up"""
+        waiters = [asyncio.ensure_future(self._stop.wait())]
+        if wake is not None:
+            waiters.append(asyncio.ensure_future(wake.wait()))
+        try:
+            await asyncio.wait(waiters, timeout=seconds,
+                               return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+
+    async def _run_poller(self, name: str) -> None:
+        poll, interval, on_tick = self._pollers[name]
+        wake = self._wake_events[name]
+        while not self._stop.is_set():
+            wake.clear()
+            started = time.monotonic()
+            processed = 0
+            try:
+                processed = await poll()
+            except Exception as e:
+                logging.error(f"Error polling {name}: {e}")
+            elapsed = time.monotonic() - started
+            if on_tick:
+                on_tick(name, processed, elapsed)
+            delay = interval.update(processed)
+            logging.debug(
+                f"Polled {name}: {processed} messages in {elapsed:.2f}s, next poll in {delay:.1f}s")
+            await self._sleep(delay, wake)
+
+    async def _run_job(self, job: ScheduledJob) -> None:
+        # Wall-clock time so runs missed while the host was suspended are noticed
+        delay = job.interval_seconds if job.initial_delay is None else job.initial_delay
+        next_run = time.time() + _jittered(delay, job.jitter)
+        while not self._stop.is_set():
+            await self._sleep(max(0.0, next_run - time.time()))
+            if self._stop.is_set():
+                break
+            missed = int((time.time() - next_run) // job.interval_seconds)
+            if missed > 0:
+                logging.info(
+                    f"Job {job.name} missed {missed} run(s), catch-up policy: {job.catch_up}")
+            if missed > 0 and job.catch_up == CATCH_UP_SKIP:
+                runs = 0
+            elif missed > 0 and job.catch_up == CATCH_UP_ALL:
+                runs = 1 + min(missed, job.max_catch_up)
+            else:
+                runs = 1
+            for _ in range(runs):
+                try:
+                    logging.info(f"Running scheduled job {job.name}")
+                    await job.func()
+                except Exception as e:
+                    logging.error(f"Error in scheduled job {job.name}: {e}")
+            next_run = time.time() + _jittered(job.interval_seconds, job.jitter)
+
+    async def run(self) -> None:
+        """Run all pollers and jobs until stop() is called"""
+        self._tasks = [
+            asyncio.create_task(self._run_poller(name), name=f"poll:{name}")
+            for name in self._pollers
+        ] + [
+            asyncio.create_task(self._run_job(job), name=f"job:{job.name}")
+            for job in self._jobs
+        ]
+        try:
+            await self._stop.wait()
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,146 @@
+"""State shared between daemon replicas.
+
+Several daemons can poll the same mailboxes, for redundancy or to spread
+the load across hosts. On its own each replica keeps its caches in process
+memory and its processed-message ledger in a local SQLite file. It then
+warms its caches separately and happily processes a message another
+replica is already working on. `SharedState` gives them one store for:
+- the label name -> ID cache, so `labels.list` runs once per label;
+- the AI decision cache, so identical prompts are answered once;
+- the blocked-sender version counter, bumped on every new block pattern so
+  other replicas drop their cached pattern lists straight away;
+- per-message processing locks, claimed set-if-absent before a message's
+  side effects run, so only one replica ever acts on it.
+
+`SharedState` itself keeps everything in this process, which is enough for
+the caches of a single daemon. `RedisSharedState` keeps it in Redis and is
+enabled with `--redis-url`; the `redis` package is only needed then. Tests
+and benchmarks can pass `gmail_simulator.FakeRedis` in place of a client.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+import os
+import socket
+import time
+
+DEFAULT_KEY_PREFIX = 'gmail:'
+# How long label IDs and AI decisions stay cached, in seconds
+LABEL_TTL = 24 * 3600
+AI_DECISION_TTL = 7 * 24 * 3600
+
+
+class SharedState:
+    """In-process key-value store with expiry; the interface replicas share through"""
+
+    # Whether other processes see these keys; locks are only worth taking if so
+    distributed = False
+
+    def __init__(self) -> None:
+        self._values: Dict[str, Tuple[Optional[float], Any]] = {}
+
+    def _live(self, key: str) -> Optional[Tuple[Optional[float], Any]]:
+        entry = self._values.get(key)
+        if entry is not None and entry[0] is not None and entry[0] <= time.monotonic():
+            del self._values[key]
+            return None
+        return entry
+
+    def _expiry(self, ttl: Optional[float]) -> Optional[float]:
+        return time.monotonic() + ttl if ttl is not None else None
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._live(key)
+        return entry[1] if entry is not None else None
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        self._values[key] = (self._expiry(ttl), value)
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self._values.pop(key, None)
+
+    async def incr(self, key: str) -> int:
+        entry = self._live(key)
+        value = int(entry[1]) + 1 if entry is not None else 1
+        self._values[key] = (entry[0] if entry is not None else None, str(value))
+        return value
+
+    async def claim(self, keys: List[str], ttl: float) -> List[bool]:
+        """Set each key that doesn't exist yet; True for the keys this call set"""
+        won = []
+        for key in keys:
+            free = self._live(key) is None
+            if free:
+                self._values[key] = (self._expiry(ttl), 'claimed')
+            won.append(free)
+        return won
+
+    async def close(self) -> None:
+        self._values.clear()
+
+
+class RedisSharedState(SharedState):
+    """`SharedState` in Redis, visible to every replica using the same server.
+
+    A Redis outage degrades the caches to misses, logging each failure, but
+    a failed `claim` or `incr` raises: processing without the lock could
+    repeat a message's side effects on another replica.
+    """
+
+    distributed = True
+
+    def __init__(self, client: Any, prefix: str = DEFAULT_KEY_PREFIX):
+        super().__init__()
+        # A redis.asyncio.Redis created with decode_responses=True, or FakeRedis
+        self.client = client
+        self.prefix = prefix
+        # Stored in lock keys, to tell which replica holds a message
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    @classmethod
+    def from_url(cls, url: str, prefix: str = DEFAULT_KEY_PREFIX) -> 'RedisSharedState':
+        """Connect to e.g. redis://localhost:6379/0, as started by scripts/redis_start.sh"""
+        try:
+            import redis.asyncio
+        except ImportError as e:
+            raise RuntimeError("--redis-url needs the redis package: pip install redis") from e
+        return cls(redis.asyncio.Redis.from_url(url, decode_responses=True), prefix)
+
+    async def get(self, key: str) -> Optional[str]:
+        try:
+            return await self.client.get(self.prefix + key)
+        except Exception as e:
+            logging.warning(f"Redis get {key} failed: {e}")
+            return None
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        try:
+            await self.client.set(self.prefix + key, value,
+                                  px=int(ttl * 1000) if ttl is not None else None)
+        except Exception as e:
+            logging.warning(f"Redis set {key} failed: {e}")
+
+    async def delete(self, *keys: str) -> None:
+        if not keys:
+            return
+        try:
+            await self.client.delete(*(self.prefix + key for key in keys))
+        except Exception as e:
+            # Called from error paths, where raising would hide the original error;
+            # undeleted locks expire with their TTL
+            logging.warning(f"Redis delete of {len(keys)} keys failed: {e}")
+
+    async def incr(self, key: str) -> int:
+        return await self.client.incr(self.prefix + key)
+
+    async def claim(self, keys: List[str], ttl: float) -> List[bool]:
+        if not keys:
+            return []
+        # One round trip for the whole batch; each SET NX is atomic on its own
+        async with self.client.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.set(self.prefix + key, self.owner, nx=True, px=int(ttl * 1000))
+            return [bool(won) for won in await pipe.execute()]
+
+    async def close(self) -> None:
+        await self.client.aclose()
@@ -0,0 +1,612 @@
+"""In-process Gmail API simulator for local testing and benchmarks.
+
+`FakeGmailService` implements the `service.users()...` call chain the daemon
+uses over a synthetic mailbox, so `GmailAutomation` and `GmailRuleEngine` can
+run without network access. Requests support both `execute()` and
+`execute_async()`, with configurable latency and injected 429 rate-limit
+errors. `generate_mailbox` builds messages with realistic MIME trees
+(plain, alternative and mixed with attachments), threads and labels, and the
+mailbox keeps churning labels and receiving mail while it is being read.
+`FakeGmailDatabase` and `StubAIService` stand in for the database and the
+LLM with the same methods the daemon calls, and `FakeRedis` for the Redis
+client behind `RedisSharedState`; share one `FakeRedis` between several
+engines to simulate replicas.
+"""
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import base64
+import copy
+import inspect
+import itertools
+import json
+import random
+import re
+import time
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+SYSTEM_LABELS = ['INBOX', 'UNREAD', 'STARRED', 'IMPORTANT', 'SENT', 'DRAFT', 'TRASH', 'SPAM',
+                 'CATEGORY_PROMOTIONS', 'CATEGORY_SOCIAL', 'CATEGORY_UPDATES']
+
+_SENDERS = [
+    ('Promo Deals', 'deals@shop.example.com', 'promo'),
+    ('Weekly Digest', 'newsletter@news.example.org', 'newsletter'),
+    ('Social Network', 'notify@social.example.net', 'social'),
+    ('Alice Smith', 'alice@example.com', 'personal'),
+    ('Bob Jones', 'bob@corp.example.com', 'work'),
+    ('Billing', 'invoices@billing.example.com', 'invoice'),
+]
+_WORDS = ('account update meeting invoice offer sale project report weekly summary '
+          'please review attached schedule discount limited time reply thanks').split()
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode('ascii')
+
+
+def _rate_limit_error() -> HttpError:
+    return HttpError(
+        httplib2.Response({'status': 429}),
+        b'{"error": {"code": 429, "message": "rateLimitExceeded"}}')
+
+
+def _not_found(what: str) -> HttpError:
+    return HttpError(
+        httplib2.Response({'status': 404}),
+        json.dumps({'error': {'code': 404, 'message': f"{what} not found"}}).encode('utf-8'))
+
+
+@dataclass
+class SimulatorConfig:
+    num_messages: int = 1000
+    seed: int = 42
+    # Simulated per-request latency in seconds (mean and +/- jitter)
+    latency: float = 0.0
+    latency_jitter: float = 0.0
+    # Probability that any request fails with HTTP 429
+    rate_limit_probability: float = 0.0
+    attachment_probability: float = 0.15
+    thread_probability: float = 0.3
+    unread_probability: float = 0.4
+    # Label changes and new deliveries applied on every messages.list call
+    churn_per_list: int = 0
+    new_mail_per_list: int = 0
+    page_size: int = 100
+    # Share of bulk mail that is a personalized copy of one of a few campaigns per sender
+    campaign_probability: float = 0.0
+    campaigns_per_sender: int = 3
+
+
+@dataclass
+class _Stored:
+    message: Dict[str, Any]
+    attachments: Dict[str, bytes] = field(default_factory=dict)
+
+
+def _text_part(mime_type: str, text: str) -> Dict[str, Any]:
+    data = text.encode('utf-8')
+    return {'mimeType': mime_type, 'filename': '', 'headers': [
+        {'name': 'Content-Type', 'value': f"{mime_type}; charset=UTF-8"}],
+        'body': {'size': len(data), 'data': _b64(data)}}
+
+
+def _build_message(rng: random.Random, index: int, config: SimulatorConfig,
+                   thread_id: Optional[str], internal_ms: int) -> _Stored:
+    name, address, kind = rng.choice(_SENDERS)
+    message_id = f"{index:016x}"
+    if kind in ('promo', 'newsletter', 'social') and config.campaign_probability and \
+            rng.random() < config.campaign_probability:
+        # Same template for every copy; only the greeting and a reference number differ
+        template = random.Random(f"{address}:{rng.randrange(config.campaigns_per_sender)}")
+        greeting = rng.choice(['Alex', 'Sam', 'Jordan', 'Taylor', 'Morgan'])
+        words = f"Dear {greeting}, your reference {rng.randrange(10 ** 8)}. " + ' '.join(
+            template.choice(_WORDS) for _ in range(template.randint(40, 400)))
+        subject = f"{kind.title()}: {' '.join(template.choice(_WORDS) for _ in range(4))}"
+    else:
+        words = ' '.join(rng.choice(_WORDS) for _ in range(rng.randint(40, 400)))
+        subject = f"{kind.title()}: {' '.join(rng.choice(_WORDS) for _ in range(4))}"
+    unsubscribe = f"https://{address.split('@')[1]}/unsubscribe?u={index}"
+    text = f"Hi there,\n\n{words}\n\n-- \n{name}\n"
+    html = (f"<html><head><style>p {{color: #333}}</style></head><body><p>{words}</p>"
+            f"<img src=\"https://track.example.com/p.gif?id={index}\" width=1 height=1>"
+            f"<a href=\"{unsubscribe}\">Unsubscribe</a></body></html>")
+    headers = [
+        {'name': 'From', 'value': f"{name} <{address}>"},
+        {'name': 'To', 'value': 'me@example.com'},
+        {'name': 'Subject', 'value': subject},
+        {'name': 'Date', 'value': datetime.fromtimestamp(internal_ms / 1000).strftime(
+            '%a, %d %b %Y %H:%M:%S +0000')},
+        {'name': 'Message-ID', 'value': f"<{message_id}@{address.split('@')[1]}>"},
+    ]
+    if kind in ('promo', 'newsletter', 'social'):
+        headers.append({'name': 'List-Unsubscribe', 'value': f"<{unsubscribe}>"})
+
+    attachments: Dict[str, bytes] = {}
+    shape = rng.random()
+    if rng.random() < config.attachment_probability:
+        alternative = {'mimeType': 'multipart/alternative', 'filename': '', 'headers': [],
+                       'body': {'size': 0},
+                       'parts': [_text_part('text/plain', text), _text_part('text/html', html)]}
+        parts = [alternative]
+        for n in range(rng.randint(1, 3)):
+            attachment_id = f"att-{message_id}-{n}"
+            blob = rng.randbytes(rng.randint(2_000, 200_000))
+            attachments[attachment_id] = blob
+            parts.append({'mimeType': 'application/pdf', 'filename': f"document-{n}.pdf",
+                          'headers': [{'name': 'Content-Disposition', 'value': 'attachment'}],
+                          'body': {'attachmentId': attachment_id, 'size': len(blob)}})
+        payload = {'mimeType': 'multipart/mixed', 'body': {'size': 0}, 'parts': parts}
+    elif shape < 0.5:
+        payload = {'mimeType': 'multipart/alternative', 'body': {'size': 0},
+                   'parts': [_text_part('text/plain', text), _text_part('text/html', html)]}
+    elif shape < 0.8:
+        payload = _text_part('text/html', html)
+    else:
+        payload = _text_part('text/plain', text)
+    payload = {**payload, 'headers': headers}
+
+    labels = ['INBOX']
+    if rng.random() < config.unread_probability:
+        labels.append('UNREAD')
+    if kind == 'promo':
+        labels.append('CATEGORY_PROMOTIONS')
+    elif kind == 'social':
+        labels.append('CATEGORY_SOCIAL')
+    size = sum(len(b) for b in attachments.values()) + len(text) + len(html)
+    return _Stored(message={
+        'id': message_id,
+        'threadId': thread_id or message_id,
+        'labelIds': labels,
+        'snippet': words[:100],
+        'historyId': str(index + 1),
+        'internalDate': str(internal_ms),
+        'sizeEstimate': size,
+        'payload': payload,
+    }, attachments=attachments)
+
+
+def generate_mailbox(config: SimulatorConfig) -> Dict[str, _Stored]:
+    """Build a deterministic synthetic mailbox"""
+    rng = random.Random(config.seed)
+    now_ms = int(time.time() * 1000)
+    messages: Dict[str, _Stored] = {}
+    thread_ids: List[str] = []
+    for index in range(config.num_messages):
+        thread_id = rng.choice(thread_ids) if thread_ids and rng.random() < config.thread_probability else None
+        # Spread mail over the last ~90 days, oldest first
+        internal_ms = now_ms - (config.num_messages - index) * 90 * 86_400_000 // max(1, config.num_messages)
+        stored = _build_message(rng, index, config, thread_id, internal_ms)
+        messages[stored.message['id']] = stored
+        thread_ids.append(stored.message['threadId'])
+    return messages
+
+
+class FakeRequest:
+    """A deferred simulator call; run with `execute()` or `await execute_async()`"""
+
+    def __init__(self, service: 'FakeGmailService', method: str, handler: Any, *args: Any, **kwargs: Any):
+        self.service = service
+        self.method = method
+        self._call = (handler, args, kwargs)
+
+    def _run(self) -> Any:
+        service = self.service
+        service.calls[self.method] = service.calls.get(self.method, 0) + 1
+        if service.config.rate_limit_probability and service.rng.random() < service.config.rate_limit_probability:
+            service.rate_limited[self.method] = service.rate_limited.get(self.method, 0) + 1
+            raise _rate_limit_error()
+        handler, args, kwargs = self._call
+        # Callers get their own copy, as with a real API response
+        return copy.deepcopy(handler(*args, **kwargs))
+
+    def execute(self) -> Any:
+        time.sleep(self.service.next_latency())
+        return self._run()
+
+    async def execute_async(self) -> Any:
+        await asyncio.sleep(self.service.next_latency())
+        return self._run()
+
+
+class _Chain:
+    def __init__(self, service: 'FakeGmailService', prefix: str):
+        self._service = service
+        self._prefix = prefix
+
+    def __getattr__(self, name: str) -> Any:
+        service = self._service
+        method = f"{self._prefix}{name}"
+        handler = getattr(service, '_' + method.replace('.', '_'), None)
+        if handler is None:
+            # Sub-resource such as messages().attachments()
+            return lambda: _Chain(service, f"{method}.")
+
+        def build_request(**kwargs: Any) -> FakeRequest:
+            kwargs.pop('userId', None)
+            # The discovery client rejects unknown parameters when the request is built
+            try:
+                inspect.signature(handler).bind(**kwargs)
+            except TypeError as e:
+                raise TypeError(f"{method}: {e}") from None
+            return FakeRequest(service, method, handler, **kwargs)
+        return build_request
+
+
+class FakeGmailService:
+    """Simulated Gmail API with the `users()` resource chain the daemon uses"""
+
+    def __init__(self, config: Optional[SimulatorConfig] = None,
+                 messages: Optional[Dict[str, _Stored]] = None):
+        self.config = config or SimulatorConfig()
+        self.rng = random.Random(self.config.seed + 1)
+        self.messages = messages if messages is not None else generate_mailbox(self.config)
+        self.labels: Dict[str, Dict[str, Any]] = {
+            name: {'id': name, 'name': name, 'type': 'system'} for name in SYSTEM_LABELS}
+        self.history: List[Dict[str, Any]] = []
+        self.history_id = len(self.messages)
+        self.sent: List[Dict[str, Any]] = []
+        self.drafts: List[Dict[str, Any]] = []
+        self.calls: Dict[str, int] = {}
+        self.rate_limited: Dict[str, int] = {}
+        self._ids = itertools.count(len(self.messages))
+
+    def users(self) -> _Chain:
+        return _Chain(self, '')
+
+    def next_latency(self) -> float:
+        config = self.config
+        if not config.latency:
+            return 0.0
+        return max(0.0, config.latency + self.rng.uniform(-config.latency_jitter, config.latency_jitter))
+
+    def reset_counters(self) -> None:
+        self.calls.clear()
+        self.rate_limited.clear()
+
+    # -- mailbox mutation -------------------------------------------------
+
+    def deliver(self, count: int = 1) -> List[str]:
+        """Deliver new synthetic messages now and record them in the history"""
+        delivered = []
+        for _ in range(count):
+            index = next(self._ids)
+            stored = _build_message(self.rng, index, self.config, None, int(time.time() * 1000))
+            self.messages[stored.message['id']] = stored
+            self._record_history('messagesAdded', stored.message)
+            delivered.append(stored.message['id'])
+        return delivered
+
+    def churn_labels(self, count: int) -> None:
+        """Flip UNREAD/STARRED/INBOX on random messages, as a user would"""
+        if not self.messages:
+            return
+        ids = list(self.messages)
+        for _ in range(count):
+            message = self.messages[self.rng.choice(ids)].message
+            label = self.rng.choice(['UNREAD', 'STARRED', 'INBOX'])
+            if label in message['labelIds']:
+                message['labelIds'].remove(label)
+                self._record_history('labelsRemoved', message, [label])
+            else:
+                message['labelIds'].append(label)
+                self._record_history('labelsAdded', message, [label])
+
+    def _record_history(self, kind: str, message: Dict[str, Any],
+                        label_ids: Optional[List[str]] = None) -> None:
+        self.history_id += 1
+        message['historyId'] = str(self.history_id)
+        change: Dict[str, Any] = {'message': {
+            'id': message['id'], 'threadId': message['threadId'], 'labelIds': list(message['labelIds'])}}
+        if label_ids is not None:
+            change['labelIds'] = label_ids
+        self.history.append({'id': str(self.history_id), kind: [change]})
+
+    def _get_stored(self, message_id: str) -> _Stored:
+        stored = self.messages.get(message_id)
+        if stored is None:
+            raise _not_found(f"Message {message_id}")
+        return stored
+
+    def _matches(self, message: Dict[str, Any], query: str) -> bool:
+        headers = {h['name'].lower(): h['value'] for h in message['payload']['headers']}
+        labels = message['labelIds']
+        for term in re.findall(r'-?\w+:\([^)]*\)|-?\w+:\S+|\S+', query):
+            negate = term.startswith('-')
+            key, _, value = term.lstrip('-').partition(':')
+            value = value.strip('()').lower()
+            if key == 'after':
+                try:
+                    threshold = datetime.fromisoformat(value).timestamp()
+                except ValueError:
+                    threshold = float(value.replace('/', '') or 0)
+                result = int(message['internalDate']) / 1000 > threshold
+            elif key == 'is':
+                result = value.upper() in labels
+            elif key == 'in':
+                result = value.upper() in labels
+            elif key == 'label':
+                result = any(self.labels.get(label, {}).get('name', '').lower() == value for label in labels)
+            elif key in ('from', 'to', 'subject'):
+                result = value in headers.get(key, '').lower()
+            elif key == 'has':
+                result = value == 'attachment' and any(
+                    part.get('filename') for part in message['payload'].get('parts', []))
+            else:
+                result = term.lower() in message['snippet'].lower()
+            if result == negate:
+                return False
+        return True
+
+    # -- users ------------------------------------------------------------
+
+    def _getProfile(self) -> Dict[str, Any]:
+        return {'emailAddress': 'me@example.com', 'messagesTotal': len(self.messages),
+                'historyId': str(self.history_id)}
+
+    def _watch(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        return {'historyId': str(self.history_id),
+                'expiration': str(int((time.time() + 7 * 86_400) * 1000))}
+
+    # -- messages ---------------------------------------------------------
+
+    def _messages_list(self, q: str = '', labelIds: Optional[List[str]] = None,
+                       maxResults: Optional[int] = None, pageToken: Optional[str] = None,
+                       includeSpamTrash: bool = False) -> Dict[str, Any]:
+        if self.config.churn_per_list:
+            self.churn_labels(self.config.churn_per_list)
+        if self.config.new_mail_per_list:
+            self.deliver(self.config.new_mail_per_list)
+        matches = [
+            stored.message for stored in reversed(list(self.messages.values()))
+            if (includeSpamTrash or not {'TRASH', 'SPAM'} & set(stored.message['labelIds']))
+            and all(label in stored.message['labelIds'] for label in (labelIds or []))
+            and self._matches(stored.message, q or '')
+        ]
+        offset = int(pageToken or 0)
+        page_size = min(maxResults or self.config.page_size, 500)
+        page = matches[offset:offset + page_size]
+        response: Dict[str, Any] = {'resultSizeEstimate': len(matches)}
+        if page:
+            response['messages'] = [{'id': m['id'], 'threadId': m['threadId']} for m in page]
+        # Like Gmail, maxResults caps the page, not the whole result set
+        if offset + page_size < len(matches):
+            response['nextPageToken'] = str(offset + page_size)
+        return response
+
+    def _messages_get(self, id: str, format: str = 'full',
+                      metadataHeaders: Optional[List[str]] = None) -> Dict[str, Any]:
+        message = self._get_stored(id).message
+        if format == 'minimal':
+            return {k: v for k, v in message.items() if k != 'payload'}
+        if format == 'metadata':
+            wanted = {h.lower() for h in metadataHeaders or []}
+            headers = [h for h in message['payload']['headers']
+                       if not wanted or h['name'].lower() in wanted]
+            return {**message, 'payload': {'mimeType': message['payload']['mimeType'], 'headers': headers}}
+        return message
+
+    def _messages_modify(self, id: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        message = self._get_stored(id).message
+        removed = [label for label in body.get('removeLabelIds', [])
+                   if label in message['labelIds']]
+        added = [label for label in body.get('addLabelIds', [])
+                 if label not in message['labelIds']]
+        for label in removed:
+            message['labelIds'].remove(label)
+        message['labelIds'].extend(added)
+        if removed:
+            self._record_history('labelsRemoved', message, removed)
+        if added:
+            self._record_history('labelsAdded', message, added)
+        return {'id': id, 'threadId': message['threadId'], 'labelIds': message['labelIds']}
+
+    def _messages_batchModify(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        for message_id in body.get('ids', []):
+            self._messages_modify(message_id, body)
+        return {}
+
+    def _messages_trash(self, id: str) -> Dict[str, Any]:
+        return self._messages_modify(id, {'addLabelIds': ['TRASH'], 'removeLabelIds': ['INBOX']})
+
+    def _messages_send(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        sent_id = f"sent-{len(self.sent)}"
+        self.sent.append({'id': sent_id, **body})
+        return {'id': sent_id, 'threadId': body.get('threadId', sent_id), 'labelIds': ['SENT']}
+
+    def _messages_attachments_get(self, messageId: str, id: str) -> Dict[str, Any]:
+        blob = self._get_stored(messageId).attachments.get(id)
+        if blob is None:
+            raise _not_found(f"Attachment {id}")
+        return {'size': len(blob), 'data': _b64(blob)}
+
+    # -- labels, threads, drafts, history -----------------------------------
+
+    def _labels_list(self) -> Dict[str, Any]:
+        return {'labels': list(self.labels.values())}
+
+    def _labels_create(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        if any(label['name'].lower() == body['name'].lower() for label in self.labels.values()):
+            raise HttpError(httplib2.Response({'status': 409}), b'{"error": {"code": 409}}')
+        label_id = f"Label_{len(self.labels)}"
+        self.labels[label_id] = {'id': label_id, 'type': 'user', **body}
+        return self.labels[label_id]
+
+    def _threads_get(self, id: str, format: str = 'full') -> Dict[str, Any]:
+        messages = [s.message for s in self.messages.values() if s.message['threadId'] == id]
+        if not messages:
+            raise _not_found(f"Thread {id}")
+        return {'id': id, 'messages': messages}
+
+    def _drafts_create(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        draft = {'id': f"draft-{len(self.drafts)}", **body}
+        self.drafts.append(draft)
+        return draft
+
+    def _history_list(self, startHistoryId: Any, historyTypes: Optional[List[str]] = None,
+                      pageToken: Optional[str] = None, labelId: Optional[str] = None,
+                      maxResults: Optional[int] = None) -> Dict[str, Any]:
+        start = int(startHistoryId)
+        # historyTypes are singular ('messageAdded'), record keys plural ('messagesAdded')
+        kinds = [t.replace('message', 'messages').replace('label', 'labels')
+                 for t in historyTypes or []]
+        records = [r for r in self.history if int(r['id']) > start
+                   and (not kinds or any(k in r for k in kinds))]
+        return {'history': records, 'historyId': str(self.history_id)}
+
+
+class FakeGmailDatabase:
+    """In-memory stand-in for GmailDatabase with the methods the daemon calls"""
+
+    def __init__(self) -> None:
+        self.blocked: List[Dict[str, Any]] = []
+        self.nl_rules: List[Dict[str, Any]] = []
+        self.labels: Dict[str, Optional[str]] = {}
+
+    def create_blocked_sender(self, pattern: str, pattern_type: str) -> int:
+        self.blocked.append({'id': len(self.blocked) + 1, 'pattern': pattern, 'type': pattern_type})
+        return len(self.blocked)
+
+    def get_all_blocked_senders(self) -> List[Dict[str, Any]]:
+        return list(self.blocked)
+
+    def create_nl_rule(self, rule: str, actions: List[Dict[str, Any]]) -> int:
+        self.nl_rules.append({'id': len(self.nl_rules) + 1, 'rule': rule, 'actions': actions})
+        return len(self.nl_rules)
+
+    def get_all_nl_rules(self) -> List[Dict[str, Any]]:
+        return list(self.nl_rules)
+
+    def get_nl_rule(self, rule_id: int) -> Optional[Dict[str, Any]]:
+        return next((r for r in self.nl_rules if r['id'] == int(rule_id)), None)
+
+    def create_label_with_uri(self, label: str, uri: Optional[str]) -> int:
+        self.labels[label] = uri
+        return len(self.labels)
+
+    def close(self) -> None:
+        pass
+
+
+class _FakePipeline:
+    """Queues SET commands and runs them on `execute()`"""
+
+    def __init__(self, redis: 'FakeRedis'):
+        self.redis = redis
+        self.commands: List[Tuple[Tuple[Any, ...], Dict[str, Any]]] = []
+
+    async def __aenter__(self) -> '_FakePipeline':
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        self.commands.clear()
+
+    def set(self, *args: Any, **kwargs: Any) -> '_FakePipeline':
+        self.commands.append((args, kwargs))
+        return self
+
+    async def execute(self) -> List[Any]:
+        self.redis.round_trips += 1
+        results = [self.redis._set(*args, **kwargs) for args, kwargs in self.commands]
+        self.commands.clear()
+        return results
+
+
+class FakeRedis:
+    """In-memory stand-in for a `redis.asyncio.Redis` with decode_responses=True.
+
+    Covers the commands `RedisSharedState` sends, with millisecond expiry.
+    `round_trips` counts commands and pipeline executions.
+    """
+
+    def __init__(self) -> None:
+        self.values: Dict[str, Tuple[Optional[float], str]] = {}
+        self.round_trips = 0
+
+    def _live(self, key: str) -> Optional[str]:
+        entry = self.values.get(key)
+        if entry is None:
+            return None
+        if entry[0] is not None and entry[0] <= time.monotonic():
+            del self.values[key]
+            return None
+        return entry[1]
+
+    def _set(self, key: str, value: Any, ex: Optional[float] = None, px: Optional[int] = None,
+             nx: bool = False) -> Optional[bool]:
+        if nx and self._live(key) is not None:
+            return None
+        ttl = ex if ex is not None else px / 1000 if px is not None else None
+        self.values[key] = (time.monotonic() + ttl if ttl is not None else None, str(value))
+        return True
+
+    async def get(self, key: str) -> Optional[str]:
+        self.round_trips += 1
+        return self._live(key)
+
+    async def set(self, key: str, value: Any, ex: Optional[float] = None, px: Optional[int] = None,
+                  nx: bool = False) -> Optional[bool]:
+        self.round_trips += 1
+        return self._set(key, value, ex=ex, px=px, nx=nx)
+
+    async def incr(self, key: str) -> int:
+        self.round_trips += 1
+        expiry = self.values[key][0] if self._live(key) is not None else None
+        value = int(self._live(key) or 0) + 1
+        self.values[key] = (expiry, str(value))
+        return value
+
+    async def delete(self, *keys: str) -> int:
+        self.round_trips += 1
+        return sum(self.values.pop(key, None) is not None for key in keys)
+
+    def pipeline(self, transaction: bool = True) -> _FakePipeline:
+        return _FakePipeline(self)
+
+    async def aclose(self) -> None:
+        pass
+
+
+@dataclass
+class StubCompletion:
+    response: str
+
+
+class StubAIService:
+    """LLM stand-in with configurable latency and plausible canned answers"""
+
+    def __init__(self, latency: float = 0.0, seed: int = 7):
+        self.latency = latency
+        self.rng = random.Random(seed)
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.latencies: List[float] = []
+
+    async def chat_completion(self, messages: List[Any], **kwargs: Any) -> StubCompletion:
+        started = time.perf_counter()
+        self.calls += 1
+        system = messages[0].content if messages else ''
+        user = messages[-1].content if messages else ''
+        # Rough token estimate, good enough for relative comparisons
+        self.prompt_tokens += sum(len(m.content) for m in messages) // 4
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        response = self._answer(system, user)
+        self.latencies.append(time.perf_counter() - started)
+        return StubCompletion(response=response)
+
+    def _answer(self, system: str, user: str) -> str:
+        if 'unsubscribe link detector' in system:
+            link = re.search(r'https?://[^\s"\'<>]+unsubscribe[^\s"\'<>]*', user)
+            return json.dumps({'link': link.group(0) if link else None, 'location': 'header',
+                               'confidence': 0.9 if link else 0.0, 'reason': 'stub'})
+        if 'importance analyzer' in system:
+            promotional = bool(re.search(r'promo|newsletter|social|offer|sale', user, re.IGNORECASE))
+            return json.dumps({'can_archive': promotional, 'confidence': 0.9 if promotional else 0.6,
+                               'reason': 'stub', 'importance_score': 0.2 if promotional else 0.7,
+                               'summary': None if promotional else 'stub summary'})
+        if 'rule matching' in system:
+            return '```json\n{"id": [], "name": ""}\n```'
+        return 'stub completion'
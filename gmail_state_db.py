@@ -0,0 +1,755 @@
+"""Daemon-local SQLite state for the Gmail rule daemon.
+
+`GmailDatabase` (from `auto_file_sorter`) owns user-facing data such as
+blocked senders, labels and natural-language rules. This module holds the
+daemon's own bookkeeping, which is written on every tick and must survive
+restarts: the processed-message ledger, the unread tracker, the mailbox
+metadata mirror, the outbound send queue, archive-classifier training data,
+bulk-mail campaign fingerprints and per-account cursors like
+`last_check_time` and `last_history_id`.
+"""
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+import hashlib
+import json
+import logging
+import math
+import re
+import sqlite3
+import time
+
+from gmail_db_pool import SQLitePool
+from gmail_shared_state import SharedState
+
+DEFAULT_STATE_PATH = 'gmail_daemon_state.db'
+
+_UINT64 = (1 << 64) - 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed_messages (
+    account TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    rules_version TEXT NOT NULL,
+    processed_at REAL NOT NULL,
+    PRIMARY KEY (account, rules_version, message_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_processed_messages_processed_at
+    ON processed_messages (processed_at);
+
+CREATE TABLE IF NOT EXISTS daemon_state (
+    account TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (account, key)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS unread_messages (
+    account TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    -- Gmail internalDate in epoch seconds
+    received_at REAL NOT NULL,
+    first_seen_at REAL NOT NULL,
+    PRIMARY KEY (account, message_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_unread_messages_sender
+    ON unread_messages (account, sender);
+
+CREATE TABLE IF NOT EXISTS mirror_messages (
+    account TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    thread_id TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    snippet TEXT NOT NULL,
+    -- JSON object of the mirrored headers
+    headers TEXT NOT NULL,
+    internal_date REAL NOT NULL,
+    size_estimate INTEGER NOT NULL,
+    has_attachments INTEGER NOT NULL,
+    UNIQUE (account, message_id)
+);
+CREATE INDEX IF NOT EXISTS idx_mirror_messages_sender
+    ON mirror_messages (account, sender);
+CREATE INDEX IF NOT EXISTS idx_mirror_messages_date
+    ON mirror_messages (account, internal_date);
+CREATE INDEX IF NOT EXISTS idx_mirror_messages_thread
+    ON mirror_messages (account, thread_id);
+
+CREATE TABLE IF NOT EXISTS mirror_labels (
+    account TEXT NOT NULL,
+    label_id TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    PRIMARY KEY (account, label_id, message_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_mirror_labels_message
+    ON mirror_labels (account, message_id);
+
+CREATE TABLE IF NOT EXISTS outbox (
+    account TEXT NOT NULL,
+    -- Identifies the logical send, e.g. 'forward:<message id>:<address>'
+    dedup_key TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    -- base64url-encoded RFC 2822 message
+    raw TEXT NOT NULL,
+    thread_id TEXT,
+    draft INTEGER NOT NULL,
+    -- pending, sending, sent or failed
+    status TEXT NOT NULL,
+    -- Process that claimed the row for sending, as 'host:pid'
+    owner TEXT,
+    attempts INTEGER NOT NULL,
+    next_attempt_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    finished_at REAL,
+    gmail_id TEXT,
+    last_error TEXT,
+    PRIMARY KEY (account, dedup_key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_outbox_due
+    ON outbox (account, status, next_attempt_at);
+
+CREATE TABLE IF NOT EXISTS archive_examples (
+    account TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    -- Lower-cased sender address
+    sender TEXT NOT NULL,
+    -- JSON of the fields sent to the LLM
+    email_data TEXT NOT NULL,
+    can_archive INTEGER NOT NULL,
+    confidence REAL NOT NULL,
+    decided_at REAL NOT NULL,
+    PRIMARY KEY (account, message_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_archive_examples_decided_at
+    ON archive_examples (account, decided_at);
+
+CREATE TABLE IF NOT EXISTS archive_models (
+    account TEXT PRIMARY KEY,
+    model BLOB NOT NULL,
+    saved_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS campaigns (
+    account TEXT NOT NULL,
+    -- Lower-cased sender address
+    sender TEXT NOT NULL,
+    -- SimHash of the first member, as a signed 64-bit integer
+    fingerprint INTEGER NOT NULL,
+    members INTEGER NOT NULL,
+    -- JSON of the LLM archive decision
+    archive_decision TEXT,
+    decided_at REAL,
+    unsubscribe_checked INTEGER NOT NULL DEFAULT 0,
+    unsubscribe_link TEXT,
+    unsubscribe_location TEXT,
+    unsubscribed INTEGER NOT NULL DEFAULT 0,
+    last_seen REAL NOT NULL,
+    PRIMARY KEY (account, sender, fingerprint)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_campaigns_last_seen
+    ON campaigns (last_seen);
+
+-- New mail listed by the first message-shard worker of an account, read by the others
+CREATE TABLE IF NOT EXISTS shard_listings (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    account TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    listed_at REAL NOT NULL,
+    UNIQUE (account, message_id)
+);
+CREATE INDEX IF NOT EXISTS idx_shard_listings_listed_at
+    ON shard_listings (listed_at);
+"""
+
+# Columns added to tables after their first release; each fails once applied
+MIGRATIONS = [
+    "ALTER TABLE outbox ADD COLUMN owner TEXT",
+]
+
+# Full-text index over subject and snippet, kept in step with mirror_messages
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS mirror_fts USING fts5(
+    subject, snippet, content='mirror_messages', content_rowid='rowid');
+CREATE TRIGGER IF NOT EXISTS mirror_fts_insert AFTER INSERT ON mirror_messages BEGIN
+    INSERT INTO mirror_fts (rowid, subject, snippet) VALUES (new.rowid, new.subject, new.snippet);
+END;
+CREATE TRIGGER IF NOT EXISTS mirror_fts_delete AFTER DELETE ON mirror_messages BEGIN
+    INSERT INTO mirror_fts (mirror_fts, rowid, subject, snippet)
+    VALUES ('delete', old.rowid, old.subject, old.snippet);
+END;
+CREATE TRIGGER IF NOT EXISTS mirror_fts_update AFTER UPDATE ON mirror_messages BEGIN
+    INSERT INTO mirror_fts (mirror_fts, rowid, subject, snippet)
+    VALUES ('delete', old.rowid, old.subject, old.snippet);
+    INSERT INTO mirror_fts (rowid, subject, snippet) VALUES (new.rowid, new.subject, new.snippet);
+END;
+"""
+
+# days_unread is derived at query time so stored rows never go stale
+_DAYS_UNREAD = "CAST((CAST(strftime('%s', 'now') AS REAL) - received_at) / 86400 AS INTEGER)"
+
+# (label, upper bound in days exclusive) for unread age reports
+UNREAD_AGE_BUCKETS: List[Tuple[str, Optional[int]]] = [
+    ('<1d', 1),
+    ('1-7d', 7),
+    ('7-30d', 30),
+    ('30-90d', 90),
+    ('90d+', None),
+]
+
+
+def _one_column(rows: Iterable[sqlite3.Row]) -> List[Any]:
+    return [row[0] for row in rows]
+
+
+class GmailStateDatabase:
+    """SQLite store for daemon state shared by all accounts in a process.
+
+    All access goes through `SQLitePool`, so methods are coroutines: writes
+    are batched on the pool's writer thread and reads run on its reader
+    threads. SQL strings are constants, so the statement cache reuses them.
+    """
+
+    def __init__(self, db_path: Union[str, Path] = DEFAULT_STATE_PATH, readers: int = 4):
+        self.db_path = str(db_path)
+        self.pool = SQLitePool(self.db_path, readers=readers)
+        self.pool.execute_script(SCHEMA)
+        for migration in MIGRATIONS:
+            try:
+                self.pool.execute_script(migration)
+            except sqlite3.OperationalError as e:
+                if 'duplicate column' not in str(e):
+                    raise
+        try:
+            self.pool.execute_script(FTS_SCHEMA)
+            self.has_fts = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5; subject searches fall back to LIKE
+            logging.warning("SQLite FTS5 unavailable, mirror text search will be slower")
+            self.has_fts = False
+
+    def close(self) -> None:
+        self.pool.close()
+
+    async def get_state(self, account: str, key: str) -> Optional[str]:
+        row = await self.pool.read(lambda conn: conn.execute(
+            "SELECT value FROM daemon_state WHERE account = ? AND key = ?",
+            (account, key)).fetchone())
+        return row['value'] if row else None
+
+    async def set_state(self, account: str, key: str, value: str) -> None:
+        await self.pool.write(lambda conn: conn.execute(
+            "INSERT INTO daemon_state (account, key, value) VALUES (?, ?, ?) "
+            "ON CONFLICT (account, key) DO UPDATE SET value = excluded.value",
+            (account, key, value)))
+
+    async def processed_ids(self, account: str, rules_version: str) -> List[str]:
+        return await self.pool.read(lambda conn: _one_column(conn.execute(
+            "SELECT message_id FROM processed_messages WHERE account = ? AND rules_version = ?",
+            (account, rules_version))))
+
+    async def find_processed(self, account: str, rules_version: str, message_ids: List[str]) -> List[str]:
+        """Return the subset of `message_ids` already in the ledger"""
+        # Passing the IDs as one JSON array keeps the statement text constant
+        return await self.pool.read(lambda conn: _one_column(conn.execute(
+            "SELECT message_id FROM processed_messages WHERE account = ? AND rules_version = ? "
+            "AND message_id IN (SELECT value FROM json_each(?))",
+            (account, rules_version, json.dumps(message_ids)))))
+
+    async def insert_processed(self, account: str, rules_version: str, message_ids: List[str]) -> List[str]:
+        """Insert ledger entries, returning the IDs that were not already present"""
+        now = time.time()
+
+        def insert(conn: sqlite3.Connection) -> List[str]:
+            # One row at a time, so rowcount tells which IDs this call inserted
+            return [message_id for message_id in message_ids if conn.execute(
+                "INSERT OR IGNORE INTO processed_messages "
+                "(account, message_id, rules_version, processed_at) VALUES (?, ?, ?, ?)",
+                (account, message_id, rules_version, now)).rowcount]
+        return await self.pool.write(insert)
+
+    async def delete_processed(self, account: str, rules_version: str, message_ids: List[str]) -> None:
+        await self.pool.write(lambda conn: conn.executemany(
+            "DELETE FROM processed_messages "
+            "WHERE account = ? AND rules_version = ? AND message_id = ?",
+            [(account, rules_version, message_id) for message_id in message_ids]))
+
+    async def prune_processed(self, older_than_seconds: float) -> int:
+        """Delete ledger entries older than the TTL, returning the number removed"""
+        cursor = await self.pool.write(lambda conn: conn.execute(
+            "DELETE FROM processed_messages WHERE processed_at < ?",
+            (time.time() - older_than_seconds,)))
+        return cursor.rowcount
+
+    async def unread_ids(self, account: str) -> List[str]:
+        return await self.pool.read(lambda conn: _one_column(conn.execute(
+            "SELECT message_id FROM unread_messages WHERE account = ?", (account,))))
+
+    async def insert_unread(self, account: str, rows: List[Tuple[str, str, str, float]]) -> None:
+        """Insert (message_id, sender, subject, received_at) rows"""
+        now = time.time()
+        await self.pool.write(lambda conn: conn.executemany(
+            "INSERT OR IGNORE INTO unread_messages "
+            "(account, message_id, sender, subject, received_at, first_seen_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(account, *row, now) for row in rows]))
+
+    async def delete_unread(self, account: str, message_ids: List[str]) -> None:
+        await self.pool.write(lambda conn: conn.executemany(
+            "DELETE FROM unread_messages WHERE account = ? AND message_id = ?",
+            [(account, message_id) for message_id in message_ids]))
+
+    async def get_unread(self, account: str, min_days: int = 0) -> List[Dict[str, Any]]:
+        """Unread messages at least `min_days` old, oldest first"""
+        return await self.pool.read(lambda conn: [dict(row) for row in conn.execute(
+            f"SELECT message_id, sender, subject, received_at, {_DAYS_UNREAD} AS days_unread "
+            f"FROM unread_messages WHERE account = ? AND {_DAYS_UNREAD} >= ? "
+            f"ORDER BY received_at",
+            (account, min_days))])
+
+    async def unread_by_sender(self, account: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """Senders with the most unread messages"""
+        return await self.pool.read(lambda conn: [dict(row) for row in conn.execute(
+            f"SELECT sender, COUNT(*) AS unread, MAX({_DAYS_UNREAD}) AS oldest_days "
+            f"FROM unread_messages WHERE account = ? "
+            f"GROUP BY sender ORDER BY unread DESC, sender LIMIT ?",
+            (account, limit))])
+
+    async def unread_by_age(self, account: str) -> Dict[str, int]:
+        """Unread message counts per `UNREAD_AGE_BUCKETS` bucket"""
+        cases = ' '.join(
+            f"WHEN {_DAYS_UNREAD} < {upper} THEN '{label}'"
+            for label, upper in UNREAD_AGE_BUCKETS if upper is not None)
+        last_label = UNREAD_AGE_BUCKETS[-1][0]
+        rows = await self.pool.read(lambda conn: conn.execute(
+            f"SELECT CASE {cases} ELSE '{last_label}' END AS bucket, COUNT(*) AS unread "
+            f"FROM unread_messages WHERE account = ? GROUP BY bucket",
+            (account,)).fetchall())
+        counts = {label: 0 for label, _ in UNREAD_AGE_BUCKETS}
+        counts.update({row['bucket']: row['unread'] for row in rows})
+        return counts
+
+    async def upsert_mirror(self, account: str, messages: List[Dict[str, Any]]) -> None:
+        """Insert or refresh mirrored messages and their labels in one transaction"""
+        def upsert(conn: sqlite3.Connection) -> None:
+            conn.executemany(
+                "INSERT INTO mirror_messages (account, message_id, thread_id, sender, subject, snippet, "
+                "headers, internal_date, size_estimate, has_attachments) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (account, message_id) DO UPDATE SET "
+                "thread_id = excluded.thread_id, sender = excluded.sender, subject = excluded.subject, "
+                "snippet = excluded.snippet, headers = excluded.headers, "
+                "internal_date = excluded.internal_date, size_estimate = excluded.size_estimate, "
+                "has_attachments = excluded.has_attachments",
+                [(account, m['message_id'], m['thread_id'], m['sender'], m['subject'], m['snippet'],
+                  json.dumps(m['headers']), m['internal_date'], m['size_estimate'],
+                  int(m['has_attachments']))
+                 for m in messages])
+            _replace_labels(
+                conn, account, {m['message_id']: m['label_ids'] for m in messages})
+        await self.pool.write(upsert)
+
+    async def set_mirror_labels(self, account: str, labels: Dict[str, List[str]]) -> None:
+        """Replace the label sets of already mirrored messages"""
+        await self.pool.write(lambda conn: _replace_labels(conn, account, labels))
+
+    async def delete_mirror(self, account: str, message_ids: Optional[List[str]] = None) -> None:
+        """Drop messages from the mirror, or the whole account when `message_ids` is None"""
+        def delete(conn: sqlite3.Connection) -> None:
+            if message_ids is None:
+                conn.execute("DELETE FROM mirror_messages WHERE account = ?", (account,))
+                conn.execute("DELETE FROM mirror_labels WHERE account = ?", (account,))
+                return
+            params = [(account, message_id) for message_id in message_ids]
+            conn.executemany(
+                "DELETE FROM mirror_messages WHERE account = ? AND message_id = ?", params)
+            conn.executemany(
+                "DELETE FROM mirror_labels WHERE account = ? AND message_id = ?", params)
+        await self.pool.write(delete)
+
+    async def mirrored_ids(self, account: str) -> List[str]:
+        return await self.pool.read(lambda conn: _one_column(conn.execute(
+            "SELECT message_id FROM mirror_messages WHERE account = ?", (account,))))
+
+    async def search_mirror(
+        self,
+        account: str,
+        sender: Optional[str] = None,
+        subject: Optional[str] = None,
+        label_ids: Optional[List[str]] = None,
+        exclude_label_ids: Optional[List[str]] = None,
+        has_attachments: Optional[bool] = None,
+        after: Optional[float] = None,
+        include_spam_trash: bool = False,
+        limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Query mirrored messages, newest first.
+
+        `sender` is a case-insensitive substring of From, and `subject` must
+        contain every word given (like Gmail's `subject:(...)`). As in Gmail,
+        spam and trash are excluded unless `include_spam_trash` is set.
+        """
+        if not include_spam_trash:
+            exclude_label_ids = [*(exclude_label_ids or []), 'SPAM', 'TRASH']
+        clauses = ["m.account = ?"]
+        params: List[Any] = [account]
+        joins = ""
+        if sender:
+            clauses.append("m.sender LIKE ?")
+            params.append(f"%{sender}%")
+        if subject:
+            words = re.findall(r'\w+', subject)
+            if self.has_fts and words:
+                joins = "JOIN mirror_fts ON mirror_fts.rowid = m.rowid"
+                clauses.append("mirror_fts MATCH ?")
+                params.append(
+                    'subject : (' + ' '.join(f'"{word}"' for word in words) + ')')
+            else:
+                for word in words:
+                    clauses.append("m.subject LIKE ?")
+                    params.append(f"%{word}%")
+        for label_id in label_ids or []:
+            clauses.append(
+                "EXISTS (SELECT 1 FROM mirror_labels l WHERE l.account = m.account "
+                "AND l.message_id = m.message_id AND l.label_id = ?)")
+            params.append(label_id)
+        for label_id in exclude_label_ids or []:
+            clauses.append(
+                "NOT EXISTS (SELECT 1 FROM mirror_labels l WHERE l.account = m.account "
+                "AND l.message_id = m.message_id AND l.label_id = ?)")
+            params.append(label_id)
+        if has_attachments is not None:
+            clauses.append("m.has_attachments = ?")
+            params.append(int(has_attachments))
+        if after is not None:
+            clauses.append("m.internal_date > ?")
+            params.append(after)
+        sql = (f"SELECT m.message_id, m.thread_id, m.sender, m.subject, m.snippet, m.headers, "
+               f"m.internal_date, m.size_estimate, m.has_attachments "
+               f"FROM mirror_messages m {joins} WHERE {' AND '.join(clauses)} "
+               f"ORDER BY m.internal_date DESC")
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        rows = await self.pool.read(lambda conn: conn.execute(sql, params).fetchall())
+        results = []
+        for row in rows:
+            result = dict(row)
+            result['headers'] = json.loads(result['headers'])
+            results.append(result)
+        return results
+
+    async def mirror_sender_stats(self, account: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """Message count and total size per sender, largest senders first"""
+        return await self.pool.read(lambda conn: [dict(row) for row in conn.execute(
+            "SELECT sender, COUNT(*) AS messages, SUM(size_estimate) AS total_bytes, "
+            "MAX(internal_date) AS latest FROM mirror_messages WHERE account = ? "
+            "GROUP BY sender ORDER BY messages DESC, sender LIMIT ?",
+            (account, limit))])
+
+    async def enqueue_outbound(
+        self,
+        account: str,
+        dedup_key: str,
+        kind: str,
+        raw: str,
+        thread_id: Optional[str] = None,
+        draft: bool = False
+    ) -> bool:
+        """Queue a message; returns False if `dedup_key` was queued before"""
+        now = time.time()
+        cursor = await self.pool.write(lambda conn: conn.execute(
+            "INSERT OR IGNORE INTO outbox (account, dedup_key, kind, raw, thread_id, draft, "
+            "status, attempts, next_attempt_at, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, 'pending', 0, ?, ?)",
+            (account, dedup_key, kind, raw, thread_id, int(draft), now, now)))
+        return cursor.rowcount == 1
+
+    async def claim_outbound(self, account: str, limit: int, owner: str) -> List[Dict[str, Any]]:
+        """Move up to `limit` due messages to 'sending' for `owner` and return them"""
+        def claim(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+            rows = [dict(row) for row in conn.execute(
+                "SELECT dedup_key, kind, raw, thread_id, draft, attempts FROM outbox "
+                "WHERE account = ? AND status = 'pending' AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT ?",
+                (account, time.time(), limit))]
+            conn.executemany(
+                "UPDATE outbox SET status = 'sending', owner = ?, attempts = attempts + 1 "
+                "WHERE account = ? AND dedup_key = ?",
+                [(owner, account, row['dedup_key']) for row in rows])
+            return rows
+        return await self.pool.write(claim)
+
+    async def finish_outbound(
+        self,
+        account: str,
+        sent: Dict[str, str],
+        retry: Dict[str, Tuple[float, str]],
+        failed: Dict[str, str]
+    ) -> None:
+        """Record a send round: {key: gmail_id}, {key: (next_attempt_at, error)}, {key: error}"""
+        now = time.time()
+
+        def finish(conn: sqlite3.Connection) -> None:
+            conn.executemany(
+                "UPDATE outbox SET status = 'sent', finished_at = ?, gmail_id = ?, raw = '' "
+                "WHERE account = ? AND dedup_key = ?",
+                [(now, gmail_id, account, key) for key, gmail_id in sent.items()])
+            conn.executemany(
+                "UPDATE outbox SET status = 'pending', next_attempt_at = ?, last_error = ? "
+                "WHERE account = ? AND dedup_key = ?",
+                [(at, error, account, key) for key, (at, error) in retry.items()])
+            conn.executemany(
+                "UPDATE outbox SET status = 'failed', finished_at = ?, last_error = ? "
+                "WHERE account = ? AND dedup_key = ?",
+                [(now, error, account, key) for key, error in failed.items()])
+        await self.pool.write(finish)
+
+    async def sending_owners(self, account: str) -> List[Optional[str]]:
+        """Owners of the messages being sent; None for rows claimed before owners were recorded"""
+        return await self.pool.read(lambda conn: _one_column(conn.execute(
+            "SELECT DISTINCT owner FROM outbox WHERE account = ? AND status = 'sending'",
+            (account,))))
+
+    async def fail_interrupted_outbound(self, account: str, owners: List[Optional[str]]) -> int:
+        """Fail sends left in flight by `owners`, processes that are gone; they may have been delivered"""
+        now = time.time()
+        cursor = await self.pool.write(lambda conn: conn.execute(
+            "UPDATE outbox SET status = 'failed', finished_at = ?, last_error = 'interrupted' "
+            "WHERE account = ? AND status = 'sending' "
+            "AND (owner IN (SELECT value FROM json_each(?)) OR (owner IS NULL AND ?))",
+            (now, account, json.dumps([o for o in owners if o is not None]), None in owners)))
+        return cursor.rowcount
+
+    async def next_outbound_at(self, account: str) -> Optional[float]:
+        row = await self.pool.read(lambda conn: conn.execute(
+            "SELECT MIN(next_attempt_at) FROM outbox WHERE account = ? AND status = 'pending'",
+            (account,)).fetchone())
+        return row[0]
+
+    async def outbound_counts(self, account: str) -> Dict[str, int]:
+        rows = await self.pool.read(lambda conn: conn.execute(
+            "SELECT status, COUNT(*) FROM outbox WHERE account = ? GROUP BY status",
+            (account,)).fetchall())
+        return {row[0]: row[1] for row in rows}
+
+    async def prune_outbound(self, older_than_seconds: float) -> int:
+        """Delete finished sends older than the TTL; their dedup keys are forgotten"""
+        cursor = await self.pool.write(lambda conn: conn.execute(
+            "DELETE FROM outbox WHERE status IN ('sent', 'failed') AND finished_at < ?",
+            (time.time() - older_than_seconds,)))
+        return cursor.rowcount
+
+    async def insert_archive_example(
+        self,
+        account: str,
+        message_id: str,
+        sender: str,
+        email_data: Dict[str, Any],
+        can_archive: bool,
+        confidence: float
+    ) -> None:
+        await self.pool.write(lambda conn: conn.execute(
+            "INSERT OR REPLACE INTO archive_examples "
+            "(account, message_id, sender, email_data, can_archive, confidence, decided_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (account, message_id, sender, json.dumps(email_data), int(can_archive),
+             confidence, time.time())))
+
+    async def archive_examples(self, account: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Stored LLM archive decisions, oldest first"""
+        rows = await self.pool.read(lambda conn: conn.execute(
+            "SELECT message_id, sender, email_data, can_archive, confidence, decided_at "
+            "FROM archive_examples WHERE account = ? ORDER BY decided_at LIMIT ?",
+            (account, -1 if limit is None else limit)).fetchall())
+        return [{**dict(row), 'email_data': json.loads(row['email_data']),
+                 'can_archive': bool(row['can_archive'])} for row in rows]
+
+    async def archive_sender_counts(self, account: str) -> List[Tuple[str, int, int]]:
+        """(sender, archived, kept) decision counts"""
+        rows = await self.pool.read(lambda conn: conn.execute(
+            "SELECT sender, SUM(can_archive), SUM(1 - can_archive) FROM archive_examples "
+            "WHERE account = ? GROUP BY sender",
+            (account,)).fetchall())
+        return [(row[0], row[1], row[2]) for row in rows]
+
+    async def prune_archive_examples(self, account: str, keep: int) -> int:
+        """Delete all but the newest `keep` examples"""
+        cursor = await self.pool.write(lambda conn: conn.execute(
+            "DELETE FROM archive_examples WHERE account = ? AND decided_at < ("
+            "SELECT decided_at FROM archive_examples WHERE account = ? "
+            "ORDER BY decided_at DESC LIMIT 1 OFFSET ?)",
+            (account, account, keep - 1)))
+        return cursor.rowcount
+
+    async def get_archive_model(self, account: str) -> Optional[bytes]:
+        row = await self.pool.read(lambda conn: conn.execute(
+            "SELECT model FROM archive_models WHERE account = ?", (account,)).fetchone())
+        return row['model'] if row else None
+
+    async def save_archive_model(self, account: str, model: bytes) -> None:
+        await self.pool.write(lambda conn: conn.execute(
+            "INSERT INTO archive_models (account, model, saved_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (account) DO UPDATE SET model = excluded.model, saved_at = excluded.saved_at",
+            (account, model, time.time())))
+
+    async def sender_campaigns(self, account: str, sender: str) -> List[Dict[str, Any]]:
+        rows = await self.pool.read(lambda conn: conn.execute(
+            "SELECT sender, fingerprint, members, archive_decision, decided_at, unsubscribe_checked, "
+            "unsubscribe_link, unsubscribe_location, unsubscribed, last_seen "
+            "FROM campaigns WHERE account = ? AND sender = ?",
+            (account, sender)).fetchall())
+        return [{**dict(row), 'fingerprint': row['fingerprint'] & _UINT64,
+                 'unsubscribe_checked': bool(row['unsubscribe_checked']),
+                 'unsubscribed': bool(row['unsubscribed'])} for row in rows]
+
+    async def save_campaign(self, account: str, campaign: Dict[str, Any]) -> None:
+        fingerprint = campaign['fingerprint']
+        # SQLite integers are signed
+        signed = fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+        await self.pool.write(lambda conn: conn.execute(
+            "INSERT OR REPLACE INTO campaigns (account, sender, fingerprint, members, archive_decision, "
+            "decided_at, unsubscribe_checked, unsubscribe_link, unsubscribe_location, unsubscribed, last_seen) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (account, campaign['sender'], signed, campaign['members'], campaign['archive_decision'],
+             campaign['decided_at'], int(campaign['unsubscribe_checked']), campaign['unsubscribe_link'],
+             campaign['unsubscribe_location'], int(campaign['unsubscribed']), campaign['last_seen'])))
+
+    async def prune_campaigns(self, older_than_seconds: float) -> int:
+        """Delete campaigns with no member seen recently"""
+        cutoff = time.time() - older_than_seconds
+        cursor = await self.pool.write(lambda conn: conn.execute(
+            "DELETE FROM campaigns WHERE last_seen < ?", (cutoff,)))
+        return cursor.rowcount
+
+    async def record_listing(self, account: str, message_ids: List[str]) -> None:
+        """Publish listed message IDs to the account's other shards; repeats are ignored"""
+        now = time.time()
+        await self.pool.write(lambda conn: conn.executemany(
+            "INSERT OR IGNORE INTO shard_listings (account, message_id, listed_at) VALUES (?, ?, ?)",
+            [(account, message_id, now) for message_id in message_ids]))
+
+    async def listings_after(self, account: str, seq: int) -> List[Tuple[int, str]]:
+        """(seq, message ID) of the IDs published after `seq`, oldest first"""
+        return await self.pool.read(lambda conn: [tuple(row) for row in conn.execute(
+            "SELECT seq, message_id FROM shard_listings WHERE account = ? AND seq > ? ORDER BY seq",
+            (account, seq))])
+
+    async def prune_listings(self, older_than_seconds: float) -> int:
+        cutoff = time.time() - older_than_seconds
+        cursor = await self.pool.write(lambda conn: conn.execute(
+            "DELETE FROM shard_listings WHERE listed_at < ?", (cutoff,)))
+        return cursor.rowcount
+
+
+def _replace_labels(conn: sqlite3.Connection, account: str, labels: Dict[str, List[str]]) -> None:
+    conn.executemany(
+        "DELETE FROM mirror_labels WHERE account = ? AND message_id = ?",
+        [(account, message_id) for message_id in labels])
+    conn.executemany(
+        "INSERT OR IGNORE INTO mirror_labels (account, label_id, message_id) VALUES (?, ?, ?)",
+        [(account, label_id, message_id)
+         for message_id, label_ids in labels.items() for label_id in label_ids])
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings"""
+
+    def __init__(self, capacity: int = 100_000, error_rate: float = 0.01):
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, item: str) -> Iterable[int]:
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(item))
+
+
+class ProcessedLedger:
+    """At-most-once record of message IDs processed under a rule-set version.
+
+    IDs are claimed in a single transaction *before* their side effects run,
+    so a crash mid-batch skips the rest of that batch instead of re-sending
+    forwards, auto-replies and LLM calls. `claim` returns only the IDs it
+    inserted, so of two claimers racing for a message, e.g. the poller and
+    a push notification, only one acts on it. A Bloom filter answers most
+    lookups for new mail without touching SQLite.
+
+    With `locks`, claims also take a per-message lock in that shared state,
+    held for the ledger's TTL, and IDs already locked by another replica
+    are left to it.
+    """
+
+    def __init__(
+        self,
+        store: GmailStateDatabase,
+        account: str,
+        rules_version: str,
+        ttl_days: float = 30,
+        bloom_capacity: int = 100_000,
+        locks: Optional[SharedState] = None
+    ):
+        self.store = store
+        self.account = account
+        self.rules_version = rules_version
+        self.ttl_seconds = ttl_days * 86400
+        self.bloom = BloomFilter(bloom_capacity)
+        self._bloom_loaded = False
+        self.locks = locks
+
+    async def _load_bloom(self) -> None:
+        if not self._bloom_loaded:
+            for message_id in await self.store.processed_ids(self.account, self.rules_version):
+                self.bloom.add(message_id)
+            self._bloom_loaded = True
+
+    async def filter_unseen(self, message_ids: List[str]) -> List[str]:
+        """Return the IDs not yet processed, preserving order"""
+        await self._load_bloom()
+        maybe_seen = [m for m in message_ids if m in self.bloom]
+        seen = set(await self.store.find_processed(
+            self.account, self.rules_version, maybe_seen)) if maybe_seen else set()
+        return [m for m in message_ids if m not in seen]
+
+    def _lock_key(self, message_id: str) -> str:
+        return f"lock:{self.account}:{self.rules_version}:{message_id}"
+
+    async def claim(self, message_ids: List[str]) -> List[str]:
+        """Mark IDs as processed before acting on them; returns the IDs this process may act on"""
+        if not message_ids:
+            return []
+        if self.locks is not None:
+            won = await self.locks.claim([self._lock_key(m) for m in message_ids], self.ttl_seconds)
+            message_ids = [m for m, ok in zip(message_ids, won) if ok]
+            if not message_ids:
+                return []
+        # Another claimer in this process, e.g. push racing a poll, may have inserted some first
+        message_ids = await self.store.insert_processed(self.account, self.rules_version, message_ids)
+        for message_id in message_ids:
+            self.bloom.add(message_id)
+        return message_ids
+
+    async def release(self, message_ids: List[str]) -> None:
+        """Undo a claim for IDs whose processing never started"""
+        if message_ids:
+            await self.store.delete_processed(
+                self.account, self.rules_version, message_ids)
+            if self.locks is not None:
+                await self.locks.delete(*(self._lock_key(m) for m in message_ids))
+
+    async def prune(self) -> int:
+        removed = await self.store.prune_processed(self.ttl_seconds)
+        if removed:
+            logging.info(f"Pruned {removed} processed-message ledger entries")
+        return removed
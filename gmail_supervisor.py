@@ -0,0 +1,455 @@
+"""Supervisor mode for the Gmail rule daemon.
+
+Rule matching, MIME decoding and HTML parsing are CPU bound, so a single
+process is capped by the GIL. The supervisor shards work across worker
+processes, either by account or, for one large mailbox, by message-ID hash
+range. Each worker talks to the supervisor over a duplex `multiprocessing`
+pipe: the supervisor sends control commands and the worker reports metrics.
+With metrics enabled, worker `i` serves its own Prometheus metrics on
+`metrics_port + i` and writes them next to the supervisor's JSON snapshot.
+"""
+from dataclasses import dataclass, asdict
+from multiprocessing.connection import Connection
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import time
+import zlib
+
+if TYPE_CHECKING:
+    from gmail_backfill import BackfillConfig
+
+
+@dataclass
+class AccountConfig:
+    name: str
+    credentials_path: str
+    token_path: str
+    rules_file: str = 'email_rules.json'
+    # Gmail transport: 'discovery' (googleapiclient) or 'httpx' (async)
+    transport: str = 'discovery'
+    # Keep a local metadata mirror and answer searches from it
+    mirror: bool = False
+    # Attach every archived and kept email to archive reports: 'csv', 'html' or None
+    archive_report_attachment: Optional[str] = None
+    # Local auto-archive classifier: 'off', 'shadow' (learns and logs agreement with the LLM) or 'on'
+    local_classifier: str = 'shadow'
+    # Confidence at which the classifier decides auto-archive locally
+    classifier_threshold: float = 0.95
+    # Reuse LLM results across near-identical bulk emails
+    campaign_dedup: bool = True
+    # Ask the AI whether each new message can be archived; off lets header-only
+    # rule sets fetch metadata instead of full messages
+    archive_on_arrival: bool = True
+
+
+@dataclass
+class WorkerState:
+    worker_id: int
+    accounts: List[AccountConfig]
+    shard: Optional[Tuple[int, int]] = None
+    process: Optional[multiprocessing.Process] = None
+    conn: Optional[Connection] = None
+    restarts: int = 0
+    next_restart_at: float = 0.0
+    started_at: float = 0.0
+    last_heartbeat: float = 0.0
+    processed: int = 0
+
+
+@dataclass
+class AccountLoad:
+    # Exponentially weighted CPU seconds per tick
+    cpu_seconds: float = 0.0
+    processed: int = 0
+    ticks: int = 0
+
+
+def load_accounts(path: Path) -> List[AccountConfig]:
+    """Load the account list from a JSON file"""
+    with open(path, 'r') as f:
+        return [AccountConfig(**account) for account in json.load(f)]
+
+
+def shard_of(message_id: str, count: int) -> int:
+    """Stable shard index for a message ID (independent of PYTHONHASHSEED)"""
+    return zlib.crc32(message_id.encode('utf-8')) % count
+
+
+def owns_message(message_id: str, shard: Optional[Tuple[int, int]]) -> bool:
+    """Check whether a message falls in the given (index, count) hash range"""
+    if shard is None:
+        return True
+    index, count = shard
+    return shard_of(message_id, count) == index
+
+
+def plan_account_shards(
+    accounts: List[AccountConfig],
+    num_workers: int,
+    loads: Optional[Dict[str, AccountLoad]] = None
+) -> List[List[AccountConfig]]:
+    """Spread accounts over workers, heaviest first onto the least loaded worker"""
+    loads = loads or {}
+    buckets: List[List[AccountConfig]] = [[] for _ in range(num_workers)]
+    totals = [0.0] * num_workers
+    ordered = sorted(
+        accounts,
+        key=lambda a: (-loads.get(a.name, AccountLoad()).cpu_seconds, a.name))
+    for account in ordered:
+        target = totals.index(min(totals))
+        buckets[target].append(account)
+        # Unknown accounts count as one unit so they still spread out evenly
+        totals[target] += loads.get(account.name,
+                                    AccountLoad()).cpu_seconds or 1.0
+    return buckets
+
+
+def _worker_entry(
+    worker_id: int,
+    accounts: List[Dict[str, Any]],
+    shard: Optional[Tuple[int, int]],
+    conn: Connection,
+    profile_dir: Optional[str] = None,
+    model_routes: Optional[str] = None,
+    backfill: Optional[Dict[str, Any]] = None,
+    redis_url: Optional[str] = None,
+    profile_mode: str = 'wall',
+    profile_ticks: int = 5,
+    state_dir: str = '.',
+    metrics_port: Optional[int] = None,
+    metrics_json: Optional[str] = None
+) -> None:
+    """Worker process body: run the daemon loop for the assigned shard"""
+    import asyncio
+    # Imported here so that spawned workers load the daemon in their own process
+    from gmail_rule_daemon import run_daemon
+    from gmail_backfill import BackfillConfig
+    from gmail_profiler import PROFILER, ProfilerConfig
+
+    stopping = False
+    cpu_mark = time.process_time()
+
+    def on_tick(account_name: str, processed: int, seconds: float) -> None:
+        nonlocal cpu_mark
+        cpu_now = time.process_time()
+        conn.send({
+            'type': 'metrics',
+            'worker_id': worker_id,
+            'account': account_name,
+            'processed': processed,
+            'seconds': seconds,
+            'cpu_seconds': cpu_now - cpu_mark,
+        })
+        cpu_mark = cpu_now
+
+    def should_stop() -> bool:
+        nonlocal stopping
+        while conn.poll():
+            command = conn.recv()
+            if command.get('type') == 'stop':
+                stopping = True
+            elif command.get('type') == 'ping':
+                conn.send({'type': 'pong', 'worker_id': worker_id})
+            elif command.get('type') == 'profile':
+                PROFILER.arm(command.get('ticks'), command.get('mode'))
+        return stopping
+
+    # The supervisor owns shutdown; ignore the terminal's Ctrl-C in workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    conn.send({'type': 'started', 'worker_id': worker_id})
+    asyncio.run(run_daemon(
+        [AccountConfig(**a) for a in accounts],
+        shard=shard,
+        on_tick=on_tick,
+        should_stop=should_stop,
+        profile=ProfilerConfig(output_dir=Path(profile_dir) / f"worker-{worker_id}",
+                               mode=profile_mode, ticks=profile_ticks)
+        if profile_dir else None,
+        model_routes=Path(model_routes) if model_routes else None,
+        backfill=BackfillConfig(**backfill) if backfill else None,
+        redis_url=redis_url,
+        state_dir=Path(state_dir),
+        metrics_port=metrics_port,
+        metrics_json=Path(metrics_json) if metrics_json else None
+    ))
+    conn.send({'type': 'stopped', 'worker_id': worker_id})
+
+
+class ShardSupervisor:
+    """Start, monitor, restart and rebalance daemon worker processes"""
+
+    def __init__(
+        self,
+        accounts: List[AccountConfig],
+        num_workers: int,
+        shard_by: str = 'account',
+        poll_interval: float = 1.0,
+        rebalance_interval: float = 600.0,
+        rebalance_threshold: float = 0.2,
+        max_restart_backoff: float = 300.0,
+        healthy_after: float = 300.0,
+        profile_dir: Optional[str] = None,
+        model_routes: Optional[str] = None,
+        backfill: Optional['BackfillConfig'] = None,
+        redis_url: Optional[str] = None,
+        profile_mode: str = 'wall',
+        profile_ticks: int = 5,
+        state_dir: str = '.',
+        metrics_port: Optional[int] = None,
+        metrics_json: Optional[str] = None,
+        metrics_interval: float = 60.0
+    ):
+        if shard_by not in ('account', 'message'):
+            raise ValueError(f"Unknown shard mode: {shard_by}")
+        if shard_by == 'message' and len(accounts) != 1:
+            raise ValueError("Message sharding requires exactly one account")
+        self.accounts = accounts
+        self.shard_by = shard_by
+        # No point running more account workers than there are accounts
+        self.num_workers = num_workers if shard_by == 'message' else max(
+            1, min(num_workers, len(accounts)))
+        self.poll_interval = poll_interval
+        self.rebalance_interval = rebalance_interval
+        self.rebalance_threshold = rebalance_threshold
+        self.max_restart_backoff = max_restart_backoff
+        self.healthy_after = healthy_after
+        self.profile_dir = profile_dir
+        # Workers profile this many ticks in this mode when SIGUSR1 arrives
+        self.profile_mode = profile_mode
+        self.profile_ticks = profile_ticks
+        # Where workers keep the state database and discovery cache
+        self.state_dir = state_dir
+        self.model_routes = model_routes
+        # Passed to workers as a dict; restarted workers resume from the checkpoint
+        self.backfill = asdict(backfill) if backfill else None
+        # Workers share caches and message locks through this Redis, if set
+        self.redis_url = redis_url
+        # Worker i serves Prometheus metrics on metrics_port + i
+        self.metrics_port = metrics_port
+        # The supervisor snapshot goes here and each worker's beside it
+        self.metrics_json = metrics_json
+        self.metrics_interval = metrics_interval
+        self.loads: Dict[str, AccountLoad] = {}
+        self.workers: List[WorkerState] = []
+        self._ctx = multiprocessing.get_context('spawn')
+        self._stopping = False
+        self._profile_requested = False
+        self._last_rebalance = time.monotonic()
+        self._last_metrics = time.monotonic()
+
+    def _plan(self) -> List[WorkerState]:
+        if self.shard_by == 'message':
+            return [
+                WorkerState(worker_id=i, accounts=list(self.accounts),
+                            shard=(i, self.num_workers))
+                for i in range(self.num_workers)
+            ]
+        return [
+            WorkerState(worker_id=i, accounts=bucket)
+            for i, bucket in enumerate(
+                plan_account_shards(self.accounts, self.num_workers, self.loads))
+        ]
+
+    def _worker_metrics_port(self, worker: WorkerState) -> Optional[int]:
+        return self.metrics_port + worker.worker_id if self.metrics_port else None
+
+    def _worker_metrics_json(self, worker: WorkerState) -> Optional[str]:
+        if not self.metrics_json:
+            return None
+        path = Path(self.metrics_json)
+        return str(path.with_name(f"{path.stem}.worker-{worker.worker_id}{path.suffix}"))
+
+    def _start(self, worker: WorkerState) -> None:
+        parent_conn, child_conn = self._ctx.Pipe(duplex=True)
+        process = self._ctx.Process(
+            target=_worker_entry,
+            args=(worker.worker_id, [asdict(a) for a in worker.accounts],
+                  worker.shard, child_conn, self.profile_dir, self.model_routes, self.backfill,
+                  self.redis_url, self.profile_mode, self.profile_ticks, self.state_dir,
+                  self._worker_metrics_port(worker), self._worker_metrics_json(worker)),
+            name=f"gmail-rule-worker-{worker.worker_id}",
+            daemon=False
+        )
+        process.start()
+        child_conn.close()
+        worker.process = process
+        worker.conn = parent_conn
+        worker.started_at = worker.last_heartbeat = time.monotonic()
+        logging.info(
+            f"Started worker {worker.worker_id} (pid {process.pid}) for "
+            f"{[a.name for a in worker.accounts]} shard={worker.shard}")
+
+    def _stop(self, worker: WorkerState, timeout: float = 90.0) -> None:
+        if worker.process is None:
+            return
+        if worker.process.is_alive() and worker.conn is not None:
+            try:
+                worker.conn.send({'type': 'stop'})
+            except (BrokenPipeError, OSError):
+                pass
+            worker.process.join(timeout)
+        if worker.process.is_alive():
+            logging.warning(
+                f"Worker {worker.worker_id} did not stop in time, terminating")
+            worker.process.terminate()
+            worker.process.join(5)
+        if worker.conn is not None:
+            worker.conn.close()
+        worker.process = None
+        worker.conn = None
+
+    def _drain(self, worker: WorkerState) -> None:
+        """Read all pending messages from a worker"""
+        if worker.conn is None:
+            return
+        try:
+            while worker.conn.poll():
+                self._handle(worker, worker.conn.recv())
+        except (EOFError, OSError):
+            # Pipe closed by a dying worker; the liveness check restarts it
+            pass
+
+    def _handle(self, worker: WorkerState, message: Dict[str, Any]) -> None:
+        worker.last_heartbeat = time.monotonic()
+        if message.get('type') != 'metrics':
+            return
+        worker.processed += message['processed']
+        load = self.loads.setdefault(message['account'], AccountLoad())
+        if load.ticks:
+            load.cpu_seconds = 0.8 * load.cpu_seconds + 0.2 * message['cpu_seconds']
+        else:
+            load.cpu_seconds = message['cpu_seconds']
+        load.processed += message['processed']
+        load.ticks += 1
+        # A worker that has stayed up for a while resets the crash backoff
+        if worker.last_heartbeat - worker.started_at > self.healthy_after:
+            worker.restarts = 0
+
+    def _check_alive(self, worker: WorkerState) -> None:
+        if worker.process is None or worker.process.is_alive():
+            return
+        now = time.monotonic()
+        if worker.next_restart_at == 0.0:
+            exit_code = worker.process.exitcode
+            backoff = min(self.max_restart_backoff, 2 ** worker.restarts)
+            worker.next_restart_at = now + backoff
+            logging.error(
+                f"Worker {worker.worker_id} exited with code {exit_code}; "
+                f"restarting in {backoff:.0f}s")
+            return
+        if now >= worker.next_restart_at:
+            self._stop(worker)
+            worker.restarts += 1
+            worker.next_restart_at = 0.0
+            self._start(worker)
+
+    def _imbalance(self, plan: List[WorkerState]) -> float:
+        """Return max worker load relative to the mean (0.0 is perfectly balanced)"""
+        totals = [
+            sum(self.loads.get(a.name, AccountLoad()).cpu_seconds for a in w.accounts)
+            for w in plan
+        ]
+        mean = sum(totals) / len(totals) if totals else 0.0
+        return (max(totals) - mean) / mean if mean else 0.0
+
+    def rebalance(self) -> bool:
+        """Reassign accounts if the measured load is skewed. Returns True if shards moved"""
+        if self.shard_by != 'account' or self.num_workers < 2:
+            return False
+        current = self._imbalance(self.workers)
+        plan = self._plan()
+        proposed = self._imbalance(plan)
+        if current <= self.rebalance_threshold or proposed >= current:
+            return False
+        logging.info(
+            f"Rebalancing shards: imbalance {current:.2f} -> {proposed:.2f}")
+        for worker, new in zip(self.workers, plan):
+            if [a.name for a in worker.accounts] == [a.name for a in new.accounts]:
+                continue
+            self._stop(worker)
+            worker.accounts = new.accounts
+            self._start(worker)
+        return True
+
+    def metrics(self) -> Dict[str, Any]:
+        """Snapshot of worker and per-account metrics"""
+        return {
+            'workers': [
+                {
+                    'worker_id': w.worker_id,
+                    'pid': w.process.pid if w.process else None,
+                    'alive': bool(w.process and w.process.is_alive()),
+                    'accounts': [a.name for a in w.accounts],
+                    'shard': w.shard,
+                    'processed': w.processed,
+                    'restarts': w.restarts,
+                    'metrics_port': self._worker_metrics_port(w),
+                    'metrics_json': self._worker_metrics_json(w),
+                }
+                for w in self.workers
+            ],
+            'accounts': {name: asdict(load) for name, load in self.loads.items()},
+        }
+
+    def write_metrics(self) -> None:
+        """Atomically write the `metrics()` snapshot to `metrics_json`"""
+        if not self.metrics_json:
+            return
+        tmp_path = f"{self.metrics_json}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.metrics(), f, indent=2)
+        os.replace(tmp_path, self.metrics_json)
+
+    def request_stop(self, *_: Any) -> None:
+        self._stopping = True
+
+    def request_profile(self, *_: Any) -> None:
+        """Ask every worker to profile its next ticks (used as the SIGUSR1 handler)"""
+        self._profile_requested = True
+
+    def _send_profile(self, ticks: Optional[int] = None, mode: Optional[str] = None) -> None:
+        for worker in self.workers:
+            if worker.conn is None:
+                continue
+            try:
+                worker.conn.send({'type': 'profile', 'ticks': ticks or self.profile_ticks,
+                                  'mode': mode or self.profile_mode})
+            except (BrokenPipeError, OSError):
+                pass
+
+    def run(self) -> None:
+        """Run the supervisor until SIGINT/SIGTERM"""
+        signal.signal(signal.SIGINT, self.request_stop)
+        signal.signal(signal.SIGTERM, self.request_stop)
+        if self.profile_dir:
+            signal.signal(signal.SIGUSR1, self.request_profile)
+        self.workers = self._plan()
+        for worker in self.workers:
+            self._start(worker)
+        logging.info(
+            f"Supervisor running {len(self.workers)} workers sharded by {self.shard_by}")
+        try:
+            while not self._stopping:
+                for worker in self.workers:
+                    self._drain(worker)
+                    self._check_alive(worker)
+                if self._profile_requested:
+                    self._profile_requested = False
+                    self._send_profile()
+                if time.monotonic() - self._last_rebalance >= self.rebalance_interval:
+                    self.rebalance()
+                    self._last_rebalance = time.monotonic()
+                if time.monotonic() - self._last_metrics >= self.metrics_interval:
+                    self.write_metrics()
+                    self._last_metrics = time.monotonic()
+                time.sleep(self.poll_interval)
+        finally:
+            logging.info("Supervisor shutting down workers...")
+            for worker in self.workers:
+                self._stop(worker)
+            self.write_metrics()
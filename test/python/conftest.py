@@ -0,0 +1,56 @@
+"""Fixtures running the Gmail daemon against the local simulator.
+
+    python -m pytest test/python
+"""
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+import json
+import sys
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from gmail_quota import GmailQuotaLimiter  # noqa: E402
+from gmail_rule_daemon import GmailAutomation, GmailRuleEngine  # noqa: E402
+from gmail_simulator import FakeGmailDatabase, FakeGmailService, SimulatorConfig, StubAIService  # noqa: E402
+from gmail_state_db import GmailStateDatabase  # noqa: E402
+
+
+@pytest.fixture
+def make_service() -> Callable[..., FakeGmailService]:
+    """Small simulated mailbox without attachments, so tests build it quickly"""
+    def make(num_messages: int = 50, **config: Any) -> FakeGmailService:
+        return FakeGmailService(SimulatorConfig(
+            num_messages=num_messages, attachment_probability=0.0, **config))
+    return make
+
+
+@pytest.fixture
+def rules_file(tmp_path: Path) -> Callable[[List[Dict[str, Any]]], str]:
+    def write(rules: List[Dict[str, Any]]) -> str:
+        path = tmp_path / 'email_rules.json'
+        path.write_text(json.dumps(rules))
+        return str(path)
+    return write
+
+
+@pytest.fixture
+def make_engine() -> Callable[..., GmailRuleEngine]:
+    """Build a rule engine over a simulated mailbox; call it inside the test's event loop"""
+    def make(
+        service: FakeGmailService,
+        state: GmailStateDatabase,
+        rules_file: str = 'missing_rules.json',
+        max_retries: int = 5,
+        shard: Optional[Any] = None
+    ) -> GmailRuleEngine:
+        gmail = GmailAutomation(
+            credentials_path='', token_path='', ai_service=StubAIService(), db=FakeGmailDatabase(),
+            service=service, state=state,
+            # No waiting on the quota or between retries
+            quota=GmailQuotaLimiter(units_per_second=1_000_000.0, base_delay=0.0, max_retries=max_retries))
+        engine = GmailRuleEngine(gmail, rules_file, shard=shard)
+        engine.archive_on_arrival = False
+        return engine
+    return make
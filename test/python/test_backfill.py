@@ -0,0 +1,144 @@
+"""Backfill walks, checkpoint resume and retries of failed actions."""
+from typing import Any, Dict, List
+import asyncio
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from gmail_backfill import Backfill, BackfillConfig
+from gmail_simulator import FakeGmailService
+from gmail_state_db import GmailStateDatabase
+
+RULES = [
+    {'name': 'Promotions', 'conditions': {'From': r'deals@'},
+     'actions': [{'type': 'label', 'value': 'Promotions'}, {'type': 'archive'}]},
+    {'name': 'Digest', 'conditions': {'From': r'newsletter@'},
+     'actions': [{'type': 'mark_read'}]},
+]
+DELETE_RULES = [
+    {'name': 'Promotions', 'conditions': {'From': r'deals@'}, 'actions': [{'type': 'delete'}]},
+]
+
+
+def from_address(service: FakeGmailService, address: str) -> List[str]:
+    """IDs of the simulated messages sent by `address`"""
+    return [
+        message_id for message_id, stored in service.messages.items()
+        if any(header['name'] == 'From' and address in header['value']
+               for header in stored.message['payload']['headers'])]
+
+
+def labels(service: FakeGmailService, message_id: str) -> List[str]:
+    return service.messages[message_id].message['labelIds']
+
+
+def failing(status: int) -> Any:
+    def handler(**kwargs: Any) -> Dict[str, Any]:
+        raise HttpError(httplib2.Response({'status': status}), b'{"error": {"code": %d}}' % status)
+    return handler
+
+
+def test_backfill_applies_rules_to_every_page(make_service, make_engine, rules_file) -> None:
+    async def scenario() -> None:
+        service = make_service(60)
+        state = GmailStateDatabase(':memory:')
+        engine = make_engine(service, state, rules_file(RULES))
+        progress = await Backfill(engine, BackfillConfig(page_size=20)).run()
+        assert progress.done
+        assert (progress.pages, progress.listed, progress.processed) == (3, 60, 60)
+
+        label_id = next(label['id'] for label in service.labels.values() if label['name'] == 'Promotions')
+        for message_id in from_address(service, 'deals@'):
+            assert label_id in labels(service, message_id)
+            assert 'INBOX' not in labels(service, message_id)
+        for message_id in from_address(service, 'newsletter@'):
+            assert 'UNREAD' not in labels(service, message_id)
+
+        # A completed walk isn't repeated
+        listed = service.calls['messages.list']
+        await Backfill(engine, BackfillConfig(page_size=20)).run()
+        assert service.calls['messages.list'] == listed
+        await engine.gmail.close()
+        state.close()
+    asyncio.run(scenario())
+
+
+def test_backfill_resumes_from_the_last_checkpoint(make_service, make_engine, rules_file) -> None:
+    async def scenario() -> None:
+        service = make_service(50)
+        state = GmailStateDatabase(':memory:')
+        config = BackfillConfig(page_size=10)
+        list_messages = service._messages_list
+
+        def crash_on_third_page(**kwargs: Any) -> Dict[str, Any]:
+            if service.calls['messages.list'] == 3:
+                raise RuntimeError("process stopped")
+            return list_messages(**kwargs)
+        service._messages_list = crash_on_third_page
+
+        engine = make_engine(service, state, rules_file(RULES))
+        first = Backfill(engine, config)
+        try:
+            await first.run()
+        except RuntimeError:
+            pass
+        assert (first.progress.pages, first.progress.done) == (2, False)
+        await engine.gmail.close()
+
+        # A new process: fresh engine and ledger over the same state database
+        service._messages_list = list_messages
+        service.reset_counters()
+        engine = make_engine(service, state, rules_file(RULES))
+        progress = await Backfill(engine, config).run()
+        assert progress.done
+        assert (progress.pages, progress.listed, progress.processed, progress.skipped) == (5, 50, 50, 0)
+        # Listing continued from the saved page token
+        assert service.calls['messages.list'] == 3
+        await engine.gmail.close()
+        state.close()
+    asyncio.run(scenario())
+
+
+def test_backfill_retries_failed_deletes_on_the_next_run(make_service, make_engine, rules_file) -> None:
+    async def scenario() -> None:
+        service = make_service(40)
+        state = GmailStateDatabase(':memory:')
+        promotions = from_address(service, 'deals@')
+        assert promotions
+
+        service._messages_trash = failing(503)
+        engine = make_engine(service, state, rules_file(DELETE_RULES), max_retries=0)
+        progress = await Backfill(engine).run()
+        assert progress.done
+        assert sorted(progress.failed) == sorted(promotions)
+        assert all(entry['attempts'] == 1 for entry in progress.failed.values())
+        await engine.gmail.close()
+
+        del service._messages_trash
+        service.reset_counters()
+        engine = make_engine(service, state, rules_file(DELETE_RULES), max_retries=0)
+        progress = await Backfill(engine).run()
+        assert progress.failed == {}
+        assert all('TRASH' in labels(service, message_id) for message_id in promotions)
+        # Only the failed actions ran again, without walking the mailbox
+        assert 'messages.list' not in service.calls
+        await engine.gmail.close()
+        state.close()
+    asyncio.run(scenario())
+
+
+def test_backfill_gives_up_after_action_attempts(make_service, make_engine, rules_file) -> None:
+    async def scenario() -> None:
+        service = make_service(40)
+        state = GmailStateDatabase(':memory:')
+        promotions = from_address(service, 'deals@')
+        service._messages_trash = failing(503)
+        config = BackfillConfig(action_attempts=2)
+        for _ in range(3):
+            engine = make_engine(service, state, rules_file(DELETE_RULES), max_retries=0)
+            progress = await Backfill(engine, config).run()
+            await engine.gmail.close()
+        assert progress.failed == {}
+        assert service.calls['messages.trash'] == 2 * len(promotions)
+        state.close()
+    asyncio.run(scenario())
@@ -0,0 +1,65 @@
+"""Shape of messages.batchModify requests, checked against the real discovery client."""
+from typing import Any, List
+import asyncio
+import json
+
+import pytest
+from googleapiclient.discovery import build
+from googleapiclient.http import HttpRequest
+
+from gmail_rule_daemon import BATCH_MODIFY_LIMIT
+from gmail_state_db import GmailStateDatabase
+
+
+def recording_service(sent: List[HttpRequest]) -> Any:
+    """Gmail discovery client that records requests instead of sending them"""
+    class RecordedRequest(HttpRequest):
+        def execute(self, http: Any = None, num_retries: int = 0) -> Any:
+            sent.append(self)
+            return {}
+    return build('gmail', 'v1', developerKey='test', static_discovery=True, requestBuilder=RecordedRequest)
+
+
+def test_discovery_client_takes_ids_in_the_body_only() -> None:
+    service = recording_service([])
+    with pytest.raises(TypeError):
+        service.users().messages().batchModify(userId='me', ids=['a'], body={})
+
+
+def test_batch_modify_sends_ids_in_the_request_body(make_engine) -> None:
+    async def scenario() -> None:
+        sent: List[HttpRequest] = []
+        state = GmailStateDatabase(':memory:')
+        gmail = make_engine(recording_service(sent), state).gmail
+        ids = [f"{i:016x}" for i in range(2 * BATCH_MODIFY_LIMIT + 1)]
+        await gmail.batch_modify(ids, ['Label_1'], ['INBOX'])
+
+        assert len(sent) == 3
+        bodies = [json.loads(request.body) for request in sent]
+        assert [len(body['ids']) for body in bodies] == [BATCH_MODIFY_LIMIT, BATCH_MODIFY_LIMIT, 1]
+        assert [message_id for body in bodies for message_id in body['ids']] == ids
+        for request, body in zip(sent, bodies):
+            assert request.method == 'POST'
+            assert request.uri.split('?')[0].endswith('/users/me/messages/batchModify')
+            assert 'ids=' not in request.uri
+            assert (body['addLabelIds'], body['removeLabelIds']) == (['Label_1'], ['INBOX'])
+        state.close()
+    asyncio.run(scenario())
+
+
+def test_simulator_matches_the_discovery_client(make_service, make_engine) -> None:
+    async def scenario() -> None:
+        service = make_service(20)
+        with pytest.raises(TypeError):
+            service.users().messages().batchModify(userId='me', ids=['a'], body={})
+
+        state = GmailStateDatabase(':memory:')
+        gmail = make_engine(service, state).gmail
+        ids = list(service.messages)[:10]
+        await gmail.batch_modify(ids, ['STARRED'], ['INBOX'])
+        assert service.calls['messages.batchModify'] == 1
+        for message_id in ids:
+            labels = service.messages[message_id].message['labelIds']
+            assert 'STARRED' in labels and 'INBOX' not in labels
+        state.close()
+    asyncio.run(scenario())
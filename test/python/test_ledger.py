@@ -0,0 +1,71 @@
+"""ProcessedLedger claims, releases and cross-replica locks."""
+import asyncio
+
+from gmail_shared_state import RedisSharedState
+from gmail_simulator import FakeRedis
+from gmail_state_db import GmailStateDatabase, ProcessedLedger
+
+
+def test_claim_returns_only_unclaimed_ids() -> None:
+    async def scenario() -> None:
+        state = GmailStateDatabase(':memory:')
+        ledger = ProcessedLedger(state, 'default', 'v1')
+        assert await ledger.claim(['a', 'b']) == ['a', 'b']
+        assert await ledger.claim(['a', 'b', 'c']) == ['c']
+        assert await ledger.filter_unseen(['a', 'b', 'c', 'd']) == ['d']
+        # A restarted process sees the claims from the database, not only its Bloom filter
+        restarted = ProcessedLedger(state, 'default', 'v1')
+        assert await restarted.filter_unseen(['a', 'd']) == ['d']
+        assert await restarted.claim(['a']) == []
+        state.close()
+    asyncio.run(scenario())
+
+
+def test_concurrent_claims_do_not_overlap() -> None:
+    async def scenario() -> None:
+        state = GmailStateDatabase(':memory:')
+        poller = ProcessedLedger(state, 'default', 'v1')
+        push = ProcessedLedger(state, 'default', 'v1')
+        ids = [f"m{i}" for i in range(50)]
+        first, second = await asyncio.gather(poller.claim(ids), push.claim(ids))
+        assert sorted(first + second) == sorted(ids)
+        state.close()
+    asyncio.run(scenario())
+
+
+def test_release_makes_ids_claimable_again() -> None:
+    async def scenario() -> None:
+        state = GmailStateDatabase(':memory:')
+        ledger = ProcessedLedger(state, 'default', 'v1')
+        await ledger.claim(['a', 'b'])
+        await ledger.release(['a'])
+        assert await ledger.filter_unseen(['a', 'b']) == ['a']
+        assert await ledger.claim(['a', 'b']) == ['a']
+        state.close()
+    asyncio.run(scenario())
+
+
+def test_new_rules_version_and_other_accounts_start_empty() -> None:
+    async def scenario() -> None:
+        state = GmailStateDatabase(':memory:')
+        await ProcessedLedger(state, 'default', 'v1').claim(['a'])
+        assert await ProcessedLedger(state, 'default', 'v2').claim(['a']) == ['a']
+        assert await ProcessedLedger(state, 'other', 'v1').claim(['a']) == ['a']
+        state.close()
+    asyncio.run(scenario())
+
+
+def test_replica_locks_leave_messages_to_the_claiming_replica() -> None:
+    async def scenario() -> None:
+        redis = FakeRedis()
+        # Two replicas with their own state databases, sharing one Redis
+        states = [GmailStateDatabase(':memory:'), GmailStateDatabase(':memory:')]
+        first, second = (ProcessedLedger(state, 'default', 'v1', locks=RedisSharedState(redis))
+                         for state in states)
+        assert await first.claim(['a', 'b']) == ['a', 'b']
+        assert await second.claim(['a', 'b', 'c']) == ['c']
+        await first.release(['b'])
+        assert await second.claim(['b']) == ['b']
+        for state in states:
+            state.close()
+    asyncio.run(scenario())
@@ -0,0 +1,177 @@
+"""Outbox deduplication, retries and recovery of sends interrupted by a restart."""
+from typing import Any, Dict
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from gmail_outbox import Outbox, OutboxConfig, build_message, encode_message, owner_running
+from gmail_state_db import GmailStateDatabase
+
+# No rate limiting or waiting between attempts
+FAST = OutboxConfig(sends_per_minute=60_000.0, burst=100, retry_base_seconds=0.0, retry_max_seconds=0.0)
+
+
+def reply(index: int = 0) -> Any:
+    return build_message('someone@example.com', f"Re: {index}", 'Thanks')
+
+
+async def statuses(state: GmailStateDatabase) -> Dict[str, str]:
+    return await state.pool.read(lambda conn: {
+        row['dedup_key']: row['status'] for row in conn.execute("SELECT dedup_key, status FROM outbox")})
+
+
+async def drained(state: GmailStateDatabase, timeout: float = 10.0) -> Dict[str, int]:
+    deadline = time.monotonic() + timeout
+    while True:
+        counts = await state.outbound_counts('default')
+        if not counts.get('pending') and not counts.get('sending') or time.monotonic() > deadline:
+            return counts
+        await asyncio.sleep(0.01)
+
+
+def send_errors(service: Any, *codes: int) -> None:
+    """Fail the next messages.send calls with these HTTP statuses, then send normally"""
+    send = service._messages_send
+    pending = list(codes)
+
+    def handler(body: Dict[str, Any]) -> Dict[str, Any]:
+        if pending:
+            status = pending.pop(0)
+            raise HttpError(httplib2.Response({'status': status}), b'{"error": {"code": %d}}' % status)
+        return send(body)
+    service._messages_send = handler
+
+
+def test_duplicate_dedup_keys_are_sent_once(make_service, make_engine) -> None:
+    async def scenario() -> None:
+        service = make_service(0)
+        state = GmailStateDatabase(':memory:')
+        gmail = make_engine(service, state).gmail
+        gmail.outbox = Outbox(gmail, FAST)
+        assert await gmail.outbox.enqueue('reply', 'reply:m1', reply())
+        assert not await gmail.outbox.enqueue('reply', 'reply:m1', reply())
+        assert await drained(state) == {'sent': 1}
+        # Still a duplicate once sent, until the row is pruned
+        assert not await gmail.outbox.enqueue('reply', 'reply:m1', reply())
+        assert len(service.sent) == 1
+        await gmail.close()
+        state.close()
+    asyncio.run(scenario())
+
+
+def test_transient_send_failures_are_retried(make_service, make_engine) -> None:
+    async def scenario() -> None:
+        service = make_service(0)
+        state = GmailStateDatabase(':memory:')
+        gmail = make_engine(service, state, max_retries=0).gmail
+        outbox = Outbox(gmail, FAST)
+        send_errors(service, 503, 429)
+        await state.enqueue_outbound('default', 'reply:m1', 'reply', encode_message(reply()))
+        for _ in range(2):
+            assert await outbox.flush() == 1
+            assert await statuses(state) == {'reply:m1': 'pending'}
+        assert await outbox.flush() == 1
+        assert await statuses(state) == {'reply:m1': 'sent'}
+        assert len(service.sent) == 1
+        state.close()
+    asyncio.run(scenario())
+
+
+def test_network_errors_and_server_errors_are_retried_under_the_dedup_key(make_service, make_engine) -> None:
+    async def scenario() -> None:
+        service = make_service(0)
+        state = GmailStateDatabase(':memory:')
+        # The limiter would retry other calls; sends are left to the outbox
+        gmail = make_engine(service, state).gmail
+        outbox = Outbox(gmail, FAST)
+        send = service._messages_send
+        errors = [ConnectionResetError('reset by peer'), TimeoutError('timed out')]
+
+        def handler(body: Dict[str, Any]) -> Dict[str, Any]:
+            if errors:
+                raise errors.pop(0)
+            return send(body)
+        service._messages_send = handler
+        send_errors(service, 503)
+        await state.enqueue_outbound('default', 'reply:m1', 'reply', encode_message(reply()))
+        for _ in range(3):
+            await outbox.flush()
+            assert await statuses(state) == {'reply:m1': 'pending'}
+        await outbox.flush()
+        assert await statuses(state) == {'reply:m1': 'sent'}
+        assert service.calls['messages.send'] == 4
+        state.close()
+    asyncio.run(scenario())
+
+
+def test_permanent_failures_and_exhausted_retries_fail(make_service, make_engine) -> None:
+    async def scenario() -> None:
+        service = make_service(0)
+        state = GmailStateDatabase(':memory:')
+        gmail = make_engine(service, state, max_retries=0).gmail
+        outbox = Outbox(gmail, OutboxConfig(
+            sends_per_minute=60_000.0, burst=100, retry_base_seconds=0.0, retry_max_seconds=0.0,
+            max_attempts=2))
+        send_errors(service, 400)
+        await state.enqueue_outbound('default', 'reply:bad', 'reply', encode_message(reply()))
+        await outbox.flush()
+        assert await statuses(state) == {'reply:bad': 'failed'}
+
+        send_errors(service, 503, 503)
+        await state.enqueue_outbound('default', 'reply:down', 'reply', encode_message(reply()))
+        await outbox.flush()
+        await outbox.flush()
+        assert (await statuses(state))['reply:down'] == 'failed'
+        assert service.sent == []
+        state.close()
+    asyncio.run(scenario())
+
+
+def test_recovery_fails_only_sends_of_processes_that_are_gone(make_service, make_engine) -> None:
+    async def scenario() -> None:
+        host = socket.gethostname()
+        exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+        exited.wait()
+        owners = {
+            'reply:exited': f"{host}:{exited.pid}",
+            # An earlier process with this PID, e.g. in a restarted container
+            'reply:earlier': f"{host}:{os.getpid()}",
+            # Claimed before owners were recorded
+            'reply:unowned': None,
+            'reply:running': f"{host}:{os.getppid()}",
+            'reply:remote': 'elsewhere.example.com:1',
+        }
+        service = make_service(0)
+        state = GmailStateDatabase(':memory:')
+        for key in [*owners, 'reply:queued']:
+            await state.enqueue_outbound('default', key, 'reply', encode_message(reply()))
+        await state.pool.write(lambda conn: conn.executemany(
+            "UPDATE outbox SET status = 'sending', owner = ? WHERE dedup_key = ?",
+            [(owner, key) for key, owner in owners.items()]))
+
+        gmail = make_engine(service, state).gmail
+        await Outbox(gmail, FAST).flush()
+        assert await statuses(state) == {
+            'reply:exited': 'failed',
+            'reply:earlier': 'failed',
+            'reply:unowned': 'failed',
+            'reply:running': 'sending',
+            'reply:remote': 'sending',
+            'reply:queued': 'sent',
+        }
+        assert len(service.sent) == 1
+        state.close()
+    asyncio.run(scenario())
+
+
+def test_owner_running() -> None:
+    host = socket.gethostname()
+    assert owner_running(f"{host}:{os.getppid()}")
+    assert not owner_running(f"{host}:{os.getpid()}")
+    assert owner_running('elsewhere.example.com:1')
@@ -0,0 +1,115 @@
+"""GmailQuotaLimiter retries of rate limits, transient server errors and network errors."""
+from typing import Any, List, Optional
+import asyncio
+import socket
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from gmail_quota import GmailQuotaLimiter, is_retryable
+
+
+def http_error(status: int, reason: str = '') -> HttpError:
+    return HttpError(httplib2.Response({'status': status}),
+                     b'{"error": {"code": %d, "message": "%s"}}' % (status, reason.encode()))
+
+
+class ScriptedRequest:
+    """Request failing with `errors` in turn before it succeeds"""
+
+    def __init__(self, *errors: Exception):
+        self.errors: List[Exception] = list(errors)
+        self.attempts = 0
+
+    def execute(self) -> Any:
+        self.attempts += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return {'id': 'ok'}
+
+
+def limiter(max_retries: int = 5) -> GmailQuotaLimiter:
+    return GmailQuotaLimiter(units_per_second=1_000_000.0, base_delay=0.0, max_retries=max_retries)
+
+
+def run(quota: GmailQuotaLimiter, request: ScriptedRequest, method: str = 'messages.get') -> Optional[Any]:
+    return asyncio.run(quota.execute(request, method))
+
+
+@pytest.mark.parametrize('status', [429, 500, 502, 503, 504])
+def test_rate_limits_and_server_errors_are_retried(status: int) -> None:
+    quota = limiter()
+    request = ScriptedRequest(http_error(status), http_error(status))
+    assert run(quota, request) == {'id': 'ok'}
+    assert request.attempts == 3
+    assert quota.retries == {'messages.get': 2}
+    # Every attempt is paid for
+    assert quota.calls == {'messages.get': 3}
+
+
+def test_rate_limit_drains_the_bucket() -> None:
+    quota = GmailQuotaLimiter(units_per_second=250.0, base_delay=0.0)
+    assert run(quota, ScriptedRequest(http_error(429))) == {'id': 'ok'}
+    # Drained to zero, then paid for the retry while refilling
+    assert quota.headroom() < 0.5
+
+
+def test_client_errors_are_not_retried() -> None:
+    quota = limiter()
+    request = ScriptedRequest(http_error(404))
+    with pytest.raises(HttpError):
+        run(quota, request)
+    assert request.attempts == 1
+    assert quota.retries == {}
+
+
+def test_retries_give_up_after_max_retries() -> None:
+    quota = limiter(max_retries=2)
+    request = ScriptedRequest(*(http_error(503) for _ in range(5)))
+    with pytest.raises(HttpError):
+        run(quota, request)
+    assert request.attempts == 3
+
+
+@pytest.mark.parametrize('error', [
+    ConnectionResetError('reset by peer'), ConnectionRefusedError('refused'),
+    TimeoutError('timed out'), socket.timeout('timed out')])
+def test_network_errors_are_retried(error: Exception) -> None:
+    quota = limiter()
+    request = ScriptedRequest(error)
+    assert run(quota, request) == {'id': 'ok'}
+    assert request.attempts == 2
+
+
+def test_httpx_transport_errors_are_retried() -> None:
+    httpx = pytest.importorskip('httpx')
+    request = ScriptedRequest(httpx.ConnectError('refused'), httpx.ReadTimeout('timed out'))
+    assert run(limiter(), request) == {'id': 'ok'}
+    assert request.attempts == 3
+
+
+@pytest.mark.parametrize('method', ['messages.send', 'drafts.create'])
+@pytest.mark.parametrize('error', [http_error(500), http_error(503), ConnectionResetError(), TimeoutError()])
+def test_sends_are_not_retried_when_they_may_have_been_delivered(method: str, error: Exception) -> None:
+    request = ScriptedRequest(error)
+    with pytest.raises(type(error)):
+        run(limiter(), request, method)
+    assert request.attempts == 1
+
+
+def test_sends_are_retried_after_rate_limits() -> None:
+    request = ScriptedRequest(http_error(429), http_error(403, 'rateLimitExceeded'))
+    assert run(limiter(), request, 'messages.send') == {'id': 'ok'}
+    assert request.attempts == 3
+
+
+def test_is_retryable() -> None:
+    assert is_retryable(http_error(429))
+    assert is_retryable(http_error(503))
+    assert is_retryable(http_error(403, 'userRateLimitExceeded'))
+    assert is_retryable(ConnectionResetError())
+    assert is_retryable(socket.timeout())
+    assert not is_retryable(http_error(403, 'insufficientPermissions'))
+    assert not is_retryable(http_error(400))
+    assert not is_retryable(ValueError('bad'))
@@ -0,0 +1,47 @@
+"""Message-shard workers of one mailbox sharing a single lister."""
+import asyncio
+
+from gmail_state_db import GmailStateDatabase
+from gmail_supervisor import owns_message
+
+
+def test_only_the_first_shard_lists_new_mail(make_service, make_engine) -> None:
+    async def scenario() -> None:
+        service = make_service(40)
+        state = GmailStateDatabase(':memory:')
+        leader, follower = (make_engine(service, state, shard=(i, 2)) for i in range(2))
+        for engine in (leader, follower):
+            engine.last_check_time = '1970-01-01T00:00:00'
+
+        # Nothing listed yet
+        assert await follower.check_new_emails() == 0
+        leader_processed = await leader.check_new_emails()
+        follower_processed = await follower.check_new_emails()
+        assert service.calls['messages.list'] == 1
+        assert leader_processed + follower_processed == 40
+        assert follower_processed == sum(owns_message(m, (1, 2)) for m in service.messages)
+
+        # The follower's cursor moved past what it processed
+        assert await follower.check_new_emails() == 0
+        service.deliver(4)
+        leader.last_check_time = '1970-01-01T00:00:00'
+        await leader.check_new_emails()
+        assert await follower.check_new_emails() == sum(
+            owns_message(m, (1, 2)) for m in list(service.messages)[-4:])
+        assert service.calls['messages.list'] == 2
+        for engine in (leader, follower):
+            await engine.gmail.close()
+        state.close()
+    asyncio.run(scenario())
+
+
+def test_listings_are_pruned() -> None:
+    async def scenario() -> None:
+        state = GmailStateDatabase(':memory:')
+        await state.record_listing('default', ['a', 'b'])
+        await state.record_listing('default', ['b', 'c'])
+        assert [message_id for _, message_id in await state.listings_after('default', 0)] == ['a', 'b', 'c']
+        assert await state.prune_listings(3600) == 0
+        assert await state.prune_listings(-1) == 3
+        state.close()
+    asyncio.run(scenario())